@@ -0,0 +1,53 @@
+"""
+Benchmark of the Parquet analytics snapshots.
+Seeds 1M crime reports over 24 months, times the first snapshot and an incremental one after 10k new rows,
+then compares the crimes per location and hour report computed from the snapshot and from the live database.
+Run from the repository root: python benchmarks/analytics_snapshot.py
+"""
+import random
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from bench_setup import load_app, measure
+
+ROWS = 1_000_000
+NEW_ROWS = 10_000
+
+app = load_app()
+
+
+def seed(count, start):
+    """
+    Function to bulk insert crime reports with Core inserts, spread over 24 months
+    :param count: number of reports to insert
+    :param start: date of the first report
+    :return:
+    """
+    random.seed(count)
+    locations = app.get_location_cache()['names']
+    step = timedelta(days=730) / ROWS
+    with app.db.begin() as conn:
+        conn.execute(app.CrimeReport.__table__.insert(), [
+            {'user_id': 2, 'title': f'Stolen bike {i}', 'category': 'Theft', 'location': random.choice(locations),
+             'description': 'Bike taken from the rack overnight', 'date_time': start + step * i,
+             'is_emergency': i % 10 == 0, 'status': 'Pending'}
+            for i in range(count)])
+
+
+def live_database_report():
+    with app.db.connect() as conn:
+        crimes = pd.read_sql(app.sa.select(app.CrimeReport.location, app.CrimeReport.date_time), conn)
+    return (crimes.assign(hour=pd.to_datetime(crimes['date_time']).dt.hour)
+            .pivot_table(index='location', columns='hour', values='date_time', aggfunc='count', fill_value=0))
+
+
+if __name__ == '__main__':
+    seed(ROWS, datetime(2023, 1, 1))
+    print(f'{"step (1M crime reports)":<48} {"best time":>13} {"memory":>15}')
+    measure('first snapshot', lambda: app.run_snapshot(['crime_reports']), repeat=1)
+    seed(NEW_ROWS, datetime(2024, 12, 31))
+    measure('incremental snapshot, 10k new rows', lambda: app.run_snapshot(['crime_reports']), repeat=1)
+    measure('report from the live database', live_database_report)
+    measure('report from the snapshot', app.crimes_per_location_hour)
+    measure('report from the snapshot, one month', lambda: app.crimes_per_location_hour(['2024-06']))
@@ -0,0 +1,113 @@
+"""
+Benchmark of the announcement scheduler.
+Seeds 100k notifications of which 10k are scheduled and 10k expire, then times loading the heap from the indexes
+against one tick of polling the table, batched transitions against one transaction per announcement, and how late
+announcements due over a few seconds are published by the running scheduler.
+Run from the repository root: python benchmarks/announcement_scheduler.py
+"""
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bench_setup import load_app, measure
+
+ROWS = 100_000
+SCHEDULED = 10_000
+DUE_SOON = 1000
+
+app = load_app()
+
+
+def seed():
+    """
+    Function to bulk insert the notifications with Core inserts
+    :return:
+    """
+    now = datetime.now()
+    with app.db.begin() as conn:
+        conn.execute(app.Notification.__table__.insert(), [
+            {'user_id': 4, 'by_role_id': 4, 'title': f'Update {i}', 'content': 'New racks at the station',
+             'category': 'New Facilities', 'date_time': now - timedelta(minutes=i),
+             'status': 'Scheduled' if i < SCHEDULED else 'Active' if i % 2 else 'Archived',
+             'publish_at': now + timedelta(days=1, minutes=i) if i < SCHEDULED else None,
+             'expire_at': now + timedelta(days=2, minutes=i) if i < 2 * SCHEDULED else None}
+            for i in range(ROWS)])
+
+
+def poll_due():
+    """
+    Function for one tick of a polling scheduler, which looks for due announcements in the whole table
+    """
+    return app.read_rows(app.sa.text("SELECT id FROM notifications NOT INDEXED WHERE "
+                                     "(status = 'Scheduled' AND publish_at <= :now) OR "
+                                     "(status = 'Active' AND expire_at <= :now)").bindparams(now=datetime.now()))
+
+
+def make_due(count):
+    """
+    Function to move the publishing time of some scheduled announcements into the past
+    :return: the heap entries of those announcements
+    """
+    past = datetime.now() - timedelta(seconds=1)
+    ids = [row.id for row in app.read_rows(app.sa.select(app.Notification.id)
+                                           .where(app.Notification.status == 'Scheduled').limit(count))]
+    with app.db.begin() as conn:
+        conn.execute(app.sa.update(app.Notification).where(app.Notification.id.in_(ids)).values(publish_at=past))
+    return [(past, notification_id, 'publish') for notification_id in ids]
+
+
+def per_row_transitions(due):
+    """
+    Function to publish announcements in one transaction each, to compare with the batches
+    """
+    for entry in due:
+        app.apply_announcement_transitions([entry])
+
+
+def lateness():
+    """
+    Function to schedule announcements due over the next two seconds and record how late the running scheduler
+    publishes them
+    :return: a list of seconds late
+    """
+    late = []
+    apply = app.apply_announcement_transitions
+
+    def recording_apply(due):
+        applied_at = datetime.now()
+        late.extend((applied_at - due_at).total_seconds() for due_at, _, _ in due)
+        return apply(due)
+
+    app.apply_announcement_transitions = recording_apply
+    threading.Thread(target=app.run_announcement_scheduler, daemon=True).start()
+    time.sleep(1)  # lets the scheduler load the heap first
+    late.clear()
+    start = datetime.now() + timedelta(seconds=0.5)
+    ids = [row.id for row in app.read_rows(app.sa.select(app.Notification.id)
+                                           .where(app.Notification.status == 'Scheduled').limit(DUE_SOON))]
+    schedule = [(notification_id, start + timedelta(seconds=2 * number / DUE_SOON))
+                for number, notification_id in enumerate(ids)]
+    with app.db.begin() as conn:
+        conn.execute(app.sa.update(app.Notification).where(app.Notification.id == app.sa.bindparam('notification_id'))
+                     .values(publish_at=app.sa.bindparam('due_at')),
+                     [{'notification_id': notification_id, 'due_at': due_at} for notification_id, due_at in schedule])
+    for notification_id, due_at in schedule:
+        app.schedule_announcement(notification_id, publish_at=due_at)
+    deadline = time.time() + 10
+    while len(late) < DUE_SOON and time.time() < deadline:
+        time.sleep(0.1)
+    return late
+
+
+if __name__ == '__main__':
+    seed()
+    print(f'{"100k notifications, 10k scheduled":<48} {"best time":>13} {"memory":>15}')
+    measure('load heap from (status, time) indexes', app.load_announcement_schedule)
+    measure('one polling tick over the table', poll_due)
+    measure('500 due announcements, one transaction', lambda: app.apply_announcement_transitions(make_due(500)),
+            repeat=1)
+    measure('500 due announcements, one transaction each', lambda: per_row_transitions(make_due(500)), repeat=1)
+    late = sorted(lateness())
+    print(f'{len(late)} announcements due over 2 s published {statistics.median(late) * 1000:.1f} ms late at the '
+          f'median, {late[-1] * 1000:.1f} ms at most')
@@ -0,0 +1,102 @@
+"""
+Benchmark of the archival of cold data.
+Seeds 50k crime reports of which most are closed, and 20k forum threads with three comments each of which most have
+been quiet for over a year. It prints the size of the hot tables and times the registry, statistics and forum reads
+before and after the archival, and how long the archival takes in batches of ARCHIVE_BATCH_SIZE rows.
+Run from the repository root: python benchmarks/archival.py
+"""
+import time
+from datetime import datetime, timedelta
+
+from bench_setup import load_app, measure
+
+CRIME_REPORTS = 50_000
+THREADS = 20_000
+COMMENTS = 3
+STATUSES = ['Closed'] * 8 + ['Pending', 'Under Investigation']
+
+app = load_app()
+
+
+def seed():
+    """
+    Function to bulk insert the crime reports and the threads with Core inserts
+    :return:
+    """
+    now = datetime.now()
+    locations = [row.name for row in app.read_rows(app.sa.select(app.Location.name))]
+    with app.db.begin() as conn:
+        conn.execute(app.CrimeReport.__table__.insert(), [
+            {'user_id': 2, 'title': f'Bike stolen {i}', 'category': 'Theft', 'location': locations[i % len(locations)],
+             'description': 'Lock cut overnight', 'date_time': now - timedelta(hours=i), 'is_emergency': i % 50 == 0,
+             'status': STATUSES[i % len(STATUSES)]} for i in range(CRIME_REPORTS)])
+        first_id = (conn.execute(app.sa.select(app.func.max(app.Thread.id))).scalar() or 0) + 1
+        threads, comments = [], []
+        for number in range(THREADS):
+            thread_id = first_id + number * (COMMENTS + 1)
+            posted = now - timedelta(days=2 * 365 if number % 10 else 30, minutes=number)
+            threads.append({'id': thread_id, 'user_id': 1, 'title': f'Route {number}', 'content': 'Any tips?',
+                            'parent_id': None, 'date_time': posted, 'up_votes': 1, 'down_votes': 0, 'flags': 0})
+            comments += [{'id': thread_id + reply, 'user_id': 2, 'title': '', 'content': 'Try the quayside',
+                          'parent_id': thread_id, 'date_time': posted + timedelta(days=reply), 'up_votes': 0,
+                          'down_votes': 0, 'flags': 0} for reply in range(1, COMMENTS + 1)]
+        conn.execute(app.Thread.__table__.insert(), threads + comments)
+
+
+def statistics():
+    """
+    Function to run the two grouped counts of the crime statistics page, with the archived closed cases
+    """
+    for column_name in ['location', 'category']:
+        column = getattr(app.CrimeReport, column_name)
+        app.read_rows(app.sa.select(column, app.func.count(), app.func.count().filter(
+            app.CrimeReport.status == 'Closed')).group_by(column))
+        app.read_archived_crime_counts(column_name)
+
+
+def reads(label):
+    """
+    Function to time the pages which read the hot tables
+    :param label: 'before' or 'after'
+    """
+    measure(f'registry, open cases filter ({label})', lambda: app.read_crime_reports(filters={'status': 'Pending'}))
+    measure(f'registry, reports of one user ({label})', lambda: app.read_crime_reports(user_id=2))
+    measure(f'crime statistics counts ({label})', statistics)
+    measure(f'forum page with comments ({label})',
+            lambda: app.read_thread_comments([thread.id for thread in app.read_thread_cards()]))
+
+
+def print_sizes(sizes):
+    """
+    Function to print table sizes
+    :param sizes: table sizes from table_sizes()
+    """
+    for table_name, size in sizes.items():
+        print(f'  {table_name:<24} {size["rows"]:>8} rows {size["bytes"] / 1024:>10.0f} KiB')
+
+
+if __name__ == '__main__':
+    seed()
+    print(f'{"50k crime reports, 80k threads and comments":<48} {"best time":>13} {"memory":>15}')
+    reads('before')
+    start = time.perf_counter()
+    archived, before, after = app.run_archival()
+    elapsed = time.perf_counter() - start
+    moved = archived['crime_reports'] + archived['threads'] + archived['comments']
+    print(f'archival: {archived["crime_reports"]} crime reports, {archived["threads"]} threads and '
+          f'{archived["comments"]} comments in {elapsed * 1000:.0f} ms '
+          f'({moved // app.ARCHIVE_BATCH_SIZE + 1} or more transactions, snapshot included)')
+    reads('after')
+    print('hot tables before:')
+    print_sizes(before)
+    print('hot tables after:')
+    print_sizes(after)
+    print('archive tables:')
+    print_sizes(app.table_sizes(['crime_reports_archive', 'threads_archive']))
+    page, _ = app.read_archived_crime_reports()
+    threads, comments, _ = app.read_archived_threads()
+    print(f'archive pages: {len(page)} crime reports, {len(threads)} threads with '
+          f'{sum(map(len, comments.values()))} comments')
+    start = time.perf_counter()
+    again, _, _ = app.run_archival()
+    print(f'second run with nothing to move: {(time.perf_counter() - start) * 1000:.1f} ms, moved {again}')
@@ -0,0 +1,69 @@
+"""
+Benchmark of the hour-of-week availability profiles.
+Seeds 3 years of history for 1000 locations (1M parking posts and 1M minutes of occupancy readings), then times
+building every profile from scratch, an incremental update after 10k new posts, and a card lookup.
+Run from the repository root: python benchmarks/availability_profiles.py
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from bench_setup import load_app, measure
+
+LOCATIONS = 1000
+POSTS = 1_000_000
+READINGS = 1_000_000
+
+app = load_app()
+
+
+def seed_posts(count, start, end):
+    """
+    Function to bulk insert parking posts at random times between two dates
+    :return:
+    """
+    rng = np.random.default_rng(count)
+    seconds = rng.integers(0, int((end - start).total_seconds()), count)
+    sites = rng.integers(0, LOCATIONS, count)
+    slots = rng.integers(0, 30, count)
+    with app.db.begin() as conn:
+        for batch in range(0, count, 100_000):
+            conn.execute(app.ParkingPost.__table__.insert(), [
+                {'date_time': start + timedelta(seconds=int(seconds[i])), 'user_id': 1, 'type': 'Rack',
+                 'location': f'Site {sites[i]}', 'content': '', 'amt_slots': int(slots[i])}
+                for i in range(batch, min(batch + 100_000, count))])
+
+
+def seed():
+    """
+    Function to bulk insert the benchmark locations, posts and occupancy readings
+    :return:
+    """
+    end = datetime.now() - timedelta(days=1)
+    with app.db.begin() as conn:
+        conn.execute(app.Location.__table__.insert(), [{'name': f'Site {i}'} for i in range(LOCATIONS)])
+        location_ids = [row.id for row in conn.execute(app.sa.select(app.Location.id).where(
+            app.Location.name.like('Site %')))]
+        rng = np.random.default_rng(2)
+        minutes = rng.choice(3 * 365 * 24 * 60, READINGS, replace=False)
+        conn.execute(app.OccupancyReading.__table__.insert(), [
+            {'location_id': location_ids[i % LOCATIONS], 'date_time': end - timedelta(minutes=int(minutes[i])),
+             'samples': 6, 'occupied_sum': 6 * int(i % 25), 'min_occupied': 0, 'max_occupied': 25, 'capacity': 30}
+            for i in range(READINGS)])
+    seed_posts(POSTS, end - timedelta(days=3 * 365), end)
+
+
+def rebuild():
+    app.availability_profiles = {'post_id': 0, 'reading_id': 0, 'locations': {},
+                                 'sums': np.zeros((0, 168)), 'counts': np.zeros((0, 168))}
+    return app.update_availability_profiles()
+
+
+if __name__ == '__main__':
+    seed()
+    print(f'{"step (1000 locations, 3 years)":<48} {"best time":>13} {"memory":>15}')
+    measure('all profiles from scratch (2M observations)', rebuild, repeat=1)
+    seed_posts(10_000, datetime.now() - timedelta(days=1), datetime.now())
+    measure('incremental update, 10k new posts', app.update_availability_profiles, repeat=1)
+    measure('card lookup', lambda: app.expected_availability('Site 7'))
+    print('Site 7 on Mondays at 8am:', app.expected_availability('Site 7', datetime(2026, 10, 19, 8)))
@@ -0,0 +1,126 @@
+"""
+Benchmark of the online backups.
+Seeds 200k crime reports, then reads registry pages and commits votes from a few threads, as sessions do, while
+nothing else runs, while the whole database is backed up in one step, and while it is backed up in small steps with
+pauses (the defaults). It prints how long the reads and writes took in each case, and how long each backup took.
+It then checks the retention on a year of daily backups.
+Run from the repository root: python benchmarks/backup.py
+"""
+import os
+import random
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bench_setup import load_app
+
+CRIME_REPORTS = 200_000
+READERS = 3
+SECONDS = 4
+
+app = load_app()
+
+
+def seed():
+    """
+    Function to bulk insert the crime reports with Core inserts
+    :return: a list of the thread IDs to vote on
+    """
+    now = datetime.now()
+    locations = [row.name for row in app.read_rows(app.sa.select(app.Location.name))]
+    with app.db.begin() as conn:
+        conn.execute(app.CrimeReport.__table__.insert(), [
+            {'user_id': 2, 'title': f'Bike stolen {i}', 'category': 'Theft', 'location': locations[i % len(locations)],
+             'description': 'Lock cut overnight outside the station, the frame was chained to the rack. ' * 4,
+             'date_time': now - timedelta(minutes=i), 'is_emergency': False, 'status': 'Pending'}
+            for i in range(CRIME_REPORTS)])
+    return [row.id for row in app.read_rows(app.sa.select(app.Thread.id))]
+
+
+def foreground(thread_ids, background=None):
+    """
+    Function to read registry pages in READERS threads and commit votes in another, for SECONDS or until the
+    background work is done, whichever is longer
+    :param thread_ids: IDs of the threads to vote on
+    :param background: callable run at the same time in a thread of its own, default is None
+    :return: a tuple of (read latencies, write latencies, seconds the background work took)
+    """
+    stop = threading.Event()
+    reads, writes, took = [], [], [None]
+
+    def reader():
+        while not stop.is_set():
+            start = time.perf_counter()
+            app.read_crime_reports(filters={'location': random.choice(['Gateshead', 'Saltwell Park'])})
+            reads.append(time.perf_counter() - start)
+
+    def writer():
+        while not stop.is_set():
+            start = time.perf_counter()
+            with app.db.begin() as conn:
+                conn.execute(app.sa.update(app.Thread).where(app.Thread.id == random.choice(thread_ids))
+                             .values(up_votes=app.Thread.up_votes + 1))
+            writes.append(time.perf_counter() - start)
+            time.sleep(0.005)
+
+    def timed():
+        start = time.perf_counter()
+        background()
+        took[0] = time.perf_counter() - start
+
+    workers = [threading.Thread(target=reader) for _ in range(READERS)] + [threading.Thread(target=writer)]
+    if background is not None:
+        workers.append(threading.Thread(target=timed))
+    for worker in workers:
+        worker.start()
+    time.sleep(SECONDS)
+    if background is not None:
+        workers[-1].join()
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return reads, writes, took[0]
+
+
+def report(label, reads, writes, took):
+    """
+    Function to print the latency percentiles of the reads and writes
+    """
+    def percentiles(latencies):
+        latencies = sorted(latencies)
+        return (f'{statistics.median(latencies) * 1000:>7.2f} {latencies[int(len(latencies) * 0.99)] * 1000:>7.2f} '
+                f'{latencies[-1] * 1000:>7.1f}')
+
+    print(f'{label:<34} {percentiles(reads)}   {percentiles(writes)}   '
+          f'{f"{took:.2f} s" if took is not None else "-":>8}')
+
+
+def retention():
+    """
+    Function to make a year of daily backups and prune them with BACKUP_RETENTION
+    """
+    os.makedirs(app.BACKUP_DIRECTORY, exist_ok=True)
+    for path in os.listdir(app.BACKUP_DIRECTORY):
+        os.remove(os.path.join(app.BACKUP_DIRECTORY, path))
+    newest = datetime(2026, 10, 19, 4)
+    for day in range(365):
+        open(os.path.join(app.BACKUP_DIRECTORY, f'gbb-eli-{newest - timedelta(days=day):%Y%m%d-%H%M%S}.db'), 'w').close()
+    deleted = app.prune_backups()
+    kept = ', '.join(f'{taken_at:%d %b}' for taken_at, _ in app.list_backups())
+    print(f'retention {app.BACKUP_RETENTION} on 365 daily backups: {len(deleted)} deleted, kept {kept}')
+
+
+if __name__ == '__main__':
+    thread_ids = seed()
+    megabytes = os.path.getsize(app.sqlite_file_name) / 1024 / 1024
+    print(f'{f"database of {megabytes:.0f} MiB":<34} {"registry page ms":>23}   {"vote commit ms":>23}   {"backup":>8}')
+    print(f'{"":<34} {"p50":>7} {"p99":>7} {"max":>7}   {"p50":>7} {"p99":>7} {"max":>7}')
+    report('nothing else running', *foreground(thread_ids))
+    report('backup in one step', *foreground(thread_ids, lambda: app.run_backup(pages=-1)))
+    report(f'backup in steps of {app.BACKUP_PAGES_PER_STEP} pages, '
+           f'{app.BACKUP_STEP_SECONDS * 1000:.0f} ms', *foreground(thread_ids, app.run_backup))
+    backup = app.run_backup()
+    print(f'last backup: {backup["pages"]} pages in {backup["steps"]} steps, integrity check ok, '
+          f'{len(app.list_backups())} kept')
+    retention()
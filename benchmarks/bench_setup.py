@@ -0,0 +1,55 @@
+"""
+Shared set-up for the benchmark scripts.
+The app in main.py creates 'gbb-eli.db' and reads 'db/*.csv' from the working directory when it is imported,
+so every benchmark imports it from a scratch copy of the seed data to keep the real database untouched.
+"""
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app():
+    """
+    Function to import main.py inside a scratch working directory with SQL echo of both engines turned off
+    :return: the imported main module
+    """
+    work_dir = tempfile.mkdtemp(prefix='gbb-bench-')
+    os.makedirs(os.path.join(work_dir, 'db'))
+    for file_name in os.listdir(os.path.join(REPO_DIR, 'db')):
+        if file_name.endswith('.csv'):
+            shutil.copy(os.path.join(REPO_DIR, 'db', file_name), os.path.join(work_dir, 'db'))
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_DIR)
+    with contextlib.redirect_stdout(io.StringIO()):  # the engine is created with echo=True
+        import main
+    main.db.echo = main.read_db.echo = False
+    return main
+
+
+def measure(label, function, repeat=3):
+    """
+    Function to time a callable and record its peak Python memory allocation
+    :param label: label printed with the results
+    :param function: callable to measure
+    :param repeat: number of timed runs, the best one is reported
+    :return: a tuple of (best seconds, peak bytes)
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{label:<48} {best * 1000:>10.1f} ms {peak / 1024 / 1024:>10.2f} MiB peak')
+    return best, peak
@@ -0,0 +1,81 @@
+"""
+Benchmark of the bulk moderation actions on 10k-item batches.
+Each thread has 2 comments and 3 content reports. The old one-at-a-time deletion (fetch, delete, commit,
+delete comments, commit) is timed on a smaller sample and scaled to 10k items for comparison.
+Run from the repository root: python benchmarks/bulk_moderation.py
+"""
+import time
+from datetime import datetime
+
+import sqlalchemy as sa
+
+from bench_setup import load_app
+
+BATCH = 10_000
+OLD_WAY_SAMPLE = 500
+
+app = load_app()
+
+
+def seed(count):
+    """
+    Function to insert flagged threads with their comments and content reports
+    :param count: number of threads to insert
+    :return: a tuple of (thread IDs, content report IDs)
+    """
+    now = datetime.now()
+    with app.db.begin() as conn:
+        first_id = (conn.execute(sa.select(sa.func.max(app.Thread.id))).scalar() or 0) + 1
+        thread_ids = list(range(first_id, first_id + count))
+        conn.execute(app.Thread.__table__.insert(), [
+            {'id': thread_id, 'user_id': 1, 'title': 'Spam', 'content': 'Spam', 'parent_id': None, 'date_time': now,
+             'up_votes': 0, 'down_votes': 0, 'flags': 3} for thread_id in thread_ids])
+        conn.execute(app.Thread.__table__.insert(), [
+            {'user_id': 2, 'title': 'Comment', 'content': 'Reply', 'parent_id': thread_id, 'date_time': now,
+             'up_votes': 0, 'down_votes': 0, 'flags': 0} for thread_id in thread_ids for _ in range(2)])
+        first_report = (conn.execute(sa.select(sa.func.max(app.ContentReport.id))).scalar() or 0) + 1
+        conn.execute(app.ContentReport.__table__.insert(), [
+            {'user_id': 1 + n % 4, 'thread_id': thread_id, 'comment': 'Spam', 'date_time': now}
+            for thread_id in thread_ids for n in range(3)])
+    return thread_ids, list(range(first_report, first_report + count * 3))
+
+
+def old_delete_thread(thread_id):
+    """
+    Function doing what delete_thread() used to do for one thread: two transactions per thread
+    """
+    with app.Session() as sesh:
+        thread = sesh.query(app.Thread).filter_by(id=thread_id).first()
+        sesh.delete(thread)
+        sesh.commit()
+        sesh.query(app.Thread).filter_by(parent_id=thread_id).delete()
+        sesh.commit()
+
+
+def timed(label, function, *args, items=BATCH):
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    print(f'{label:<44} {elapsed * 1000:>10.1f} ms  ({elapsed / items * 1e6:>7.1f} µs per item)')
+    return result
+
+
+if __name__ == '__main__':
+    sample_ids, _ = seed(OLD_WAY_SAMPLE)
+    start = time.perf_counter()
+    for thread_id in sample_ids:
+        old_delete_thread(thread_id)
+    per_item = (time.perf_counter() - start) / OLD_WAY_SAMPLE
+    print(f'{"one-at-a-time delete (scaled to 10k)":<44} {per_item * BATCH * 1000:>10.1f} ms  '
+          f'({per_item * 1e6:>7.1f} µs per item)')
+
+    thread_ids, report_ids = seed(BATCH)
+    timed('bulk hide, 10k threads', app.hide_threads, thread_ids)
+    timed('bulk dismiss reports, 10k reports', app.dismiss_reports, report_ids[::3])
+    timed('bulk clear flags, 10k threads', app.clear_thread_flags, thread_ids)
+    thread_ids, report_ids = seed(BATCH)
+    timed('bulk delete, 10k threads + comments + reports', app.delete_threads, thread_ids)
+    with app.db.connect() as conn:
+        left = conn.execute(sa.select(sa.func.count()).select_from(app.Thread).where(
+            sa.or_(app.Thread.id.in_(thread_ids), app.Thread.parent_id.in_(thread_ids)))).scalar()
+    print(f'rows left after bulk delete: {left}')
@@ -0,0 +1,124 @@
+"""
+Benchmark of the change versions which tell caches their tables have changed, in this process or any other.
+Times a version check with PRAGMA data_version against the indexed read of the version row it replaces, and a
+check just after a commit. A second process renames a user, and this one times how long it takes to see the change
+and checks the cached user lookup returns the new name straight away. It also times the cached user lookups against
+reading the user every time, and what the version triggers add to a bulk insert.
+Run from the repository root: python benchmarks/change_versions.py
+"""
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from bench_setup import load_app
+
+CHECKS = 10_000
+LOOKUPS = 10_000
+INSERTS = 20_000
+
+
+def rename(work_dir):
+    """
+    Function run in a second process: renames user 1, and prints when the rename was committed
+    :param work_dir: working directory of the shared database
+    """
+    connection = sqlite3.connect(os.path.join(work_dir, 'gbb-eli.db'))
+    with connection:
+        connection.execute("UPDATE users SET display_name = 'Renamed elsewhere' WHERE id = 1")
+    print(time.time())
+
+
+def per_call(function, count):
+    """
+    Function to time a callable
+    :return: microseconds per call
+    """
+    start = time.perf_counter()
+    for _ in range(count):
+        function()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def checks(app):
+    """
+    Function to time the version checks
+    """
+    indexed_read = lambda: app.read_rows(app.sa.select(app.ChangeVersion.version)
+                                         .where(app.ChangeVersion.table_name == 'users'))
+    print(f'version check, indexed read of the row (before):   {per_call(indexed_read, CHECKS):>8.1f} us')
+    print(f'version check, PRAGMA data_version (after):        '
+          f'{per_call(lambda: app.table_version("users"), CHECKS):>8.1f} us')
+
+    def after_commit():
+        with app.db.begin() as conn:
+            conn.execute(app.sa.update(app.Role).where(app.Role.id == 1).values(color=app.Role.color))
+        start = time.perf_counter()
+        app.table_version('users')
+        return time.perf_counter() - start
+
+    print(f'version check just after a commit (stamps re-read): '
+          f'{min(after_commit() for _ in range(100)) * 1e6:>7.1f} us')
+
+
+def other_process(app):
+    """
+    Function to rename a user in a second process and time how long this one takes to see it
+    """
+    app.get_username(1)  # cached
+    version = app.table_version('users')
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--rename', os.getcwd()],
+                             stdout=subprocess.PIPE, text=True)
+    while app.table_version('users') == version:
+        pass
+    seen = time.time()
+    committed = float(child.communicate()[0])
+    print(f'rename committed in another process seen after {(seen - committed) * 1000:.2f} ms, '
+          f'cached lookup now returns "{app.get_username(1)["display_name"]}"')
+
+
+def lookups(app):
+    """
+    Function to time the author lookups made for every card, cached and read every time
+    """
+    user_ids = [row.id for row in app.read_rows(app.sa.select(app.User.id))]
+    uncached = app.read_user_card.__wrapped__
+    print(f'user lookup, read every time:  {per_call(lambda: uncached(user_ids[0]), LOOKUPS):>8.1f} us')
+    print(f'user lookup, cached:           {per_call(lambda: app.read_user_card(user_ids[0]), LOOKUPS):>8.1f} us')
+
+
+def trigger_cost(app):
+    """
+    Function to time a bulk insert of threads on copies of the database with and without the version triggers
+    """
+    with app.db.connect() as conn:
+        conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+    rows = [(1, f'Route {number}', 'Any tips?', str(datetime.now()), 0, 0, 0) for number in range(INSERTS)]
+    for label, drop in [('with version triggers', False), ('without', True)]:
+        shutil.copy(app.sqlite_file_name, 'trigger-cost.db')
+        connection = sqlite3.connect('trigger-cost.db')
+        if drop:
+            for event in ['insert', 'update', 'delete']:
+                connection.execute(f'DROP TRIGGER threads_version_{event}')
+        start = time.perf_counter()
+        with connection:
+            connection.executemany('INSERT INTO threads (user_id, title, content, date_time, up_votes, down_votes, '
+                                   'flags) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        print(f'{INSERTS} threads in one transaction, {label}: {(time.perf_counter() - start) * 1000:.1f} ms')
+        connection.close()
+        os.remove('trigger-cost.db')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--rename']:
+        rename(sys.argv[2])
+    else:
+        app = load_app()
+        print(f'{len(app.versioned_tables)} versioned tables: {", ".join(app.versioned_tables)}')
+        checks(app)
+        other_process(app)
+        lookups(app)
+        trigger_cost(app)
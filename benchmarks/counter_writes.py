@@ -0,0 +1,194 @@
+"""
+Benchmark of the write-behind queue for votes, report flags and ratings.
+Seeds 1000 forum threads, then votes on them and rates posts from several threads at once as sessions do, with each
+COUNTER_WRITES mode: 'immediate' (a commit per change, as before), 'logged' and 'memory'. It prints the changes and
+commits per second and how long a change keeps the user waiting, and checks every vote was saved. It also checks a
+vote shows before it is written, that logged votes survive the app stopping without a flush, and that a process
+starting while another runs leaves the running one's log alone.
+Run from the repository root: python benchmarks/counter_writes.py
+"""
+import contextlib
+import io
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+THREADS = 1000
+SESSIONS = 8
+CHANGES = 500  # per session
+CRASH_VOTES = 1000
+
+
+def load_in(work_dir):
+    """
+    Function to import main.py in the working directory of the shared database, for the child processes
+    :param work_dir: working directory of the database
+    :return: the imported main module
+    """
+    os.chdir(work_dir)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    with contextlib.redirect_stdout(io.StringIO()):
+        import main
+    main.db.echo = main.read_db.echo = False
+    return main
+
+
+def seed(app):
+    """
+    Function to bulk insert the threads with Core inserts
+    :param app: imported main module
+    :return: a list of the new thread IDs
+    """
+    first_id = app.read_rows(app.sa.select(app.func.max(app.Thread.id)))[0][0] + 1
+    thread_ids = list(range(first_id, first_id + THREADS))
+    with app.db.begin() as conn:
+        conn.execute(app.Thread.__table__.insert(), [
+            {'id': thread_id, 'user_id': 1, 'title': f'Route {thread_id}', 'content': 'Any tips?', 'parent_id': None,
+             'date_time': datetime.now(), 'up_votes': 0, 'down_votes': 0, 'flags': 0} for thread_id in thread_ids])
+    return thread_ids
+
+
+def total_votes(app):
+    """
+    Function to read the number of up votes saved on all threads
+    """
+    return app.read_rows(app.sa.select(app.func.sum(app.Thread.up_votes)))[0][0]
+
+
+def busy_period(app, thread_ids, post_ids):
+    """
+    Function to vote from SESSIONS threads at once, with a rating every tenth change, then flush what is queued
+    :return: a tuple of (seconds, list of seconds each change kept its session waiting)
+    """
+    waits = []
+
+    def session():
+        for number in range(CHANGES):
+            start = time.perf_counter()
+            if number % 10:
+                app.queue_counter_writes(deltas=[('threads', random.choice(thread_ids), 'up_votes', 1)])
+            else:
+                app.queue_counter_writes(rows=[('ratings', {'post_id': random.choice(post_ids), 'user_id': 1,
+                                                            'rating': 4, 'comment': None,
+                                                            'date_time': datetime.now()})])
+            waits.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    sessions = [threading.Thread(target=session) for _ in range(SESSIONS)]
+    for thread in sessions:
+        thread.start()
+    for thread in sessions:
+        thread.join()
+    app.flush_counter_writes()
+    return time.perf_counter() - start, waits
+
+
+def modes(app, thread_ids):
+    """
+    Function to run the busy period with each mode and print the results
+    """
+    post_ids = [row.id for row in app.read_rows(app.sa.select(app.ParkingPost.id))]
+    commits = [0]
+    app.sa.event.listen(app.db, 'commit', lambda conn: commits.__setitem__(0, commits[0] + 1))
+    print(f'{f"{SESSIONS} sessions, {SESSIONS * CHANGES} changes":<28} {"changes/s":>10} {"commits":>8} '
+          f'{"commits/s":>10} {"wait p50":>11} {"wait p99":>11} {"saved":>6}')
+    for mode in ['immediate', 'logged', 'memory']:
+        app.COUNTER_WRITES = mode
+        votes, commits[0] = total_votes(app), 0
+        elapsed, waits = busy_period(app, thread_ids, post_ids)
+        waits.sort()
+        saved = total_votes(app) - votes == SESSIONS * CHANGES * 9 // 10
+        print(f'{mode:<28} {len(waits) / elapsed:>10.0f} {commits[0]:>8} {commits[0] / elapsed:>10.1f} '
+              f'{statistics.median(waits) * 1000:>8.3f} ms {waits[int(len(waits) * 0.99)] * 1000:>8.3f} ms '
+              f'{"yes" if saved else "NO":>6}')
+
+
+def read_merge(app, thread_ids):
+    """
+    Function to check a vote shows on the forum before the background flush writes it
+    """
+    thread_id = thread_ids[0]
+    saved = app.read_rows(app.sa.select(app.Thread.up_votes).where(app.Thread.id == thread_id))[0][0]
+    app.queue_counter_writes(deltas=[('threads', thread_id, 'up_votes', 1)])
+    shown = saved + app.pending_count('threads', thread_id, 'up_votes')
+    print(f'vote shown before it is written: saved {saved}, shown {shown}')
+    app.flush_counter_writes()
+
+
+def crash(work_dir, thread_id):
+    """
+    Function run in a child process: queues CRASH_VOTES logged votes and stops without flushing them
+    """
+    app = load_in(work_dir)
+    app.COUNTER_WRITES = 'logged'
+    for _ in range(CRASH_VOTES):
+        app.queue_counter_writes(deltas=[('threads', thread_id, 'up_votes', 1)])
+    os._exit(0)
+
+
+def live(work_dir, thread_id):
+    """
+    Function run in a child process: queues CRASH_VOTES logged votes, waits for a line on its input while another
+    process starts, then flushes them
+    """
+    app = load_in(work_dir)
+    app.COUNTER_WRITES = 'logged'
+    for _ in range(CRASH_VOTES):
+        app.queue_counter_writes(deltas=[('threads', thread_id, 'up_votes', 1)])
+    print('queued', flush=True)
+    sys.stdin.readline()
+    app.flush_counter_writes()
+
+
+def restart(work_dir):
+    """
+    Function run in a child process: saves what the log files hold, as the server does when it starts
+    """
+    app = load_in(work_dir)
+    print(app.replay_counter_log())
+
+
+def recovery(app, thread_ids):
+    """
+    Function to stop a process with logged votes queued, and check they are saved once by the next two starts
+    """
+    thread_id = thread_ids[1]
+    before = app.read_rows(app.sa.select(app.Thread.up_votes).where(app.Thread.id == thread_id))[0][0]
+    subprocess.run([sys.executable, os.path.abspath(__file__), '--crash', os.getcwd(), str(thread_id)], check=True)
+    replays = [subprocess.run([sys.executable, os.path.abspath(__file__), '--restart', os.getcwd()], check=True,
+                              capture_output=True, text=True).stdout.strip() for _ in range(2)]
+    after = app.read_rows(app.sa.select(app.Thread.up_votes).where(app.Thread.id == thread_id))[0][0]
+    print(f'{CRASH_VOTES} logged votes, app stopped before the flush: saved as {replays[0]} counter update on the '
+          f'next start, {replays[1]} on the start after, votes {before} -> {after}')
+    running = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--live', os.getcwd(), str(thread_id)],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    running.stdout.readline()
+    started = subprocess.run([sys.executable, os.path.abspath(__file__), '--restart', os.getcwd()], check=True,
+                             capture_output=True, text=True).stdout.strip()
+    running.communicate('\n')
+    flushed = app.read_rows(app.sa.select(app.Thread.up_votes).where(app.Thread.id == thread_id))[0][0]
+    print(f'{CRASH_VOTES} logged votes queued in a running process: {started} saved by a process starting meanwhile, '
+          f'votes {after} -> {flushed} once the running one flushes')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--crash']:
+        crash(sys.argv[2], int(sys.argv[3]))
+    elif sys.argv[1:2] == ['--live']:
+        live(sys.argv[2], int(sys.argv[3]))
+    elif sys.argv[1:2] == ['--restart']:
+        restart(sys.argv[2])
+    else:
+        from bench_setup import load_app
+        app = load_app()
+        thread_ids = seed(app)
+        app.replay_counter_log()
+        threading.Thread(target=app.write_counters_forever, daemon=True).start()
+        modes(app, thread_ids)
+        read_merge(app, thread_ids)
+        recovery(app, thread_ids)
@@ -0,0 +1,73 @@
+"""
+Benchmark of the crime report conversations.
+Seeds a page of 20 crime reports with 5k messages each, then times opening a conversation, reading earlier pages by
+keyset against OFFSET, counting the unread messages of the page, and pushing a new message to open conversations.
+Run from the repository root: python benchmarks/crime_messages.py
+"""
+import time
+from datetime import datetime, timedelta
+
+from bench_setup import load_app, measure
+
+CRIMES = 20
+MESSAGES = 5_000
+LISTENERS = 50
+
+app = load_app()
+
+
+def seed():
+    """
+    Function to bulk insert the crime reports and their conversations with Core inserts
+    :return: a list of the crime report IDs
+    """
+    now = datetime.now()
+    with app.db.begin() as conn:
+        crime_ids = [conn.execute(app.sa.insert(app.CrimeReport).values(
+            user_id=2, title=f'Stolen bike {i}', category='Theft', location='Bus Station', description='Taken',
+            date_time=now, is_emergency=False, status='Pending')).inserted_primary_key[0] for i in range(CRIMES)]
+        conn.execute(app.sa.insert(app.CrimeMessage), [
+            {'crime_id': crime_id, 'user_id': 2 if i % 2 else 3, 'content': f'Update number {i} on the case',
+             'date_time': now - timedelta(minutes=MESSAGES - i)}
+            for i in range(MESSAGES) for crime_id in crime_ids])
+    return crime_ids
+
+
+def offset_page(crime_id, page):
+    """
+    Function to read a page of a conversation with OFFSET, to compare with the keyset pages
+    """
+    return app.read_rows(app.sa.select(app.CrimeMessage.id, app.CrimeMessage.content)
+                         .where(app.CrimeMessage.crime_id == crime_id).order_by(app.CrimeMessage.id.desc())
+                         .offset(page * app.CHAT_PAGE_SIZE).limit(app.CHAT_PAGE_SIZE))
+
+
+def push_latency():
+    """
+    Function to time a new message from sending until every open conversation has received it
+    :return: the seconds taken
+    """
+    listeners = [app.subscribe_to_chat(crime_ids[0]) for _ in range(LISTENERS)]
+    start = time.perf_counter()
+    app.send_crime_message(crime_ids[0], 2, 'Any news?')
+    for listener in listeners:
+        listener.get()
+    elapsed = time.perf_counter() - start
+    for listener in listeners:
+        app.unsubscribe_from_chat(crime_ids[0], listener)
+    return elapsed
+
+
+if __name__ == '__main__':
+    crime_ids = seed()
+    before = app.read_crime_messages(crime_ids[0], limit=MESSAGES - 100)[0].id  # 100 messages from the start
+    print(f'{"conversation of 5k messages":<48} {"best time":>13} {"memory":>15}')
+    measure('open conversation, newest page', lambda: app.read_crime_messages(crime_ids[0]))
+    measure('earliest page, keyset', lambda: app.read_crime_messages(crime_ids[0], before))
+    measure('earliest page, OFFSET', lambda: offset_page(crime_ids[0], (MESSAGES - 100) // app.CHAT_PAGE_SIZE))
+    measure('unread counts of 20 reports, none read', lambda: app.unread_message_counts(crime_ids, 4))
+    for crime_id in crime_ids:
+        app.mark_messages_read(crime_id, 3, app.read_crime_messages(crime_id, limit=3)[0].id)
+    measure('unread counts of 20 reports, 3 unread each', lambda: app.unread_message_counts(crime_ids, 3))
+    measure('mark conversation read', lambda: app.mark_messages_read(crime_ids[0], 3, before))
+    print(f'send and push to {LISTENERS} open conversations: {min(push_latency() for _ in range(5)) * 1000:.2f} ms')
@@ -0,0 +1,57 @@
+"""
+Benchmark of the crime registry pages as the number of crime reports grows from 10k to 1M.
+The same first pages, deep pages and filtered pages are timed at every size to show page latency stays flat.
+Run from the repository root: python benchmarks/crime_registry.py
+"""
+import random
+from datetime import datetime, timedelta
+
+from bench_setup import load_app, measure
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+app = load_app()
+
+
+def seed(count, offset):
+    """
+    Function to insert crime reports spread over the last few years
+    :param count: number of reports to insert
+    :param offset: number of reports inserted before, so dates keep going back in time
+    :return:
+    """
+    random.seed(offset)
+    now = datetime.now()
+    statuses = ['Pending', 'Under Investigation', 'Action Taken', 'Closed']
+    locations = app.get_location_cache()['names']
+    with app.db.begin() as conn:
+        for start in range(0, count, 50_000):
+            conn.execute(app.CrimeReport.__table__.insert(), [
+                {'user_id': random.choice([2, 5]), 'title': 'Stolen bike', 'category': random.choice(
+                    ['Theft', 'Assault', 'Vandalism', 'Other']), 'location': random.choice(locations),
+                 'description': 'Bike taken from the rack', 'is_emergency': random.random() < 0.05,
+                 'date_time': now - timedelta(minutes=offset + i), 'status': random.choice(statuses)}
+                for i in range(start, min(start + 50_000, count))])
+
+
+if __name__ == '__main__':
+    size = app.CRIME_PAGE_SIZE
+    week_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
+    seeded = 0
+    for total in SIZES:
+        seed(total - seeded, seeded)
+        seeded = total
+        deep_cursor = None
+        for _ in range(50):  # 1,000 rows deep
+            deep_cursor = app.read_crime_reports(limit=size, after=deep_cursor)[1]
+        print(f'\n{f"crime registry page ({total:,} reports)":<48} {"best time":>13} {"memory":>15}')
+        measure('newest first', lambda: app.read_crime_reports(limit=size))
+        measure('newest first, 1,000 rows deep', lambda: app.read_crime_reports(limit=size, after=deep_cursor))
+        measure('status = Closed', lambda: app.read_crime_reports(filters={'status': 'Closed'}, limit=size))
+        measure('location + category', lambda: app.read_crime_reports(filters={
+            'location': 'Bus Station', 'category': 'Assault'}, limit=size))
+        measure('emergencies only', lambda: app.read_crime_reports(filters={'emergency': 'yes'}, limit=size))
+        measure('emergencies first', lambda: app.read_crime_reports(filters={'sort': 'emergency'}, limit=size))
+        measure('last 7 days, oldest first', lambda: app.read_crime_reports(
+            filters={'date_from': week_ago, 'sort': 'oldest'}, limit=size))
+        measure('power user\'s own reports', lambda: app.read_crime_reports(user_id=2, limit=size))
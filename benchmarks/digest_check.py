@@ -0,0 +1,122 @@
+"""
+Check of the email digest job against a local aiosmtpd server (pip install aiosmtpd).
+Seeds a handful of users, some subscribed with an email address and some without one or without a subscription, stops
+a digest run part way as if the server crashed, carries it on, and checks that every subscribed user with an email got
+exactly one digest, the run was recorded as finished and the users' last_digest_at was moved on.
+Run from the repository root: python benchmarks/digest_check.py
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+
+from aiosmtpd.controller import Controller
+
+from bench_setup import load_app
+
+SMTP_PORT = 8026
+SUBSCRIBED = 6
+BATCH = 2
+
+app = load_app()
+app.DIGEST_SMTP_PORT = SMTP_PORT
+app.DIGEST_USER_BATCH = BATCH
+
+
+class CountingHandler:
+    """
+    aiosmtpd handler which only counts the emails received per recipient
+    """
+    def __init__(self):
+        self.recipients = Counter()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.recipients.update(envelope.rcpt_tos)
+        return '250 OK'
+
+
+def seed():
+    """
+    Function to insert SUBSCRIBED users with an email and a subscription, one subscribed user without an email and one
+    user with an email but no subscription, then deliver an alert to the subscribers
+    :return: a tuple of (IDs of the users who get digests, IDs of the users who do not)
+    """
+    first_id = app.read_rows(app.sa.select(app.func.max(app.User.id)))[0][0] + 1
+    user_ids = list(range(first_id, first_id + SUBSCRIBED + 2))
+    with app.db.begin() as conn:
+        conn.execute(app.User.__table__.insert(), [
+            {'id': user_id, 'username': f'rider{user_id}', 'display_name': f'Rider {user_id}', 'password': 'x',
+             'role_id': 1, 'email': None if user_id == user_ids[SUBSCRIBED] else f'rider{user_id}@example.com'}
+            for user_id in user_ids])
+        conn.execute(app.Subscription.__table__.insert(), [
+            {'user_id': user_id, 'location': None, 'category': 'Crime Alert'} for user_id in user_ids[:SUBSCRIBED + 1]])
+    with app.Session() as sesh:
+        notification = app.Notification(user_id=3, by_role_id=3, title='Bikes taken from the station',
+                                        content='Lock both wheels', category='Crime Alert', location='Bus Station',
+                                        date_time=datetime.now() - timedelta(hours=1))
+        sesh.add(notification)
+        sesh.commit()
+        app.deliver_to_subscribers(notification.location, notification.category, notification.date_time,
+                                   notification_id=notification.id)
+    return user_ids[:SUBSCRIBED], user_ids[SUBSCRIBED:]
+
+
+def crash_after(batches):
+    """
+    Function to make the digest job fail while sending, after a number of batches, like a crash of the server
+    :param batches: number of batches sent before the failure
+    :return: a function undoing the change
+    """
+    send_messages = app.send_messages
+    sent = [0]
+
+    def failing_send(messages):
+        if sent[0] == batches:
+            raise OSError('simulated crash')
+        sent[0] += 1
+        send_messages(messages)
+
+    app.send_messages = failing_send
+    return lambda: setattr(app, 'send_messages', send_messages)
+
+
+def digest_users(user_ids):
+    """
+    Function to read the email and last_digest_at of users
+    :return: a dictionary of User ID to the row
+    """
+    return {row.id: row for row in app.read_rows(app.sa.select(app.User.id, app.User.email, app.User.last_digest_at)
+                                                 .where(app.User.id.in_(user_ids)))}
+
+
+if __name__ == '__main__':
+    handler = CountingHandler()
+    controller = Controller(handler, hostname=app.DIGEST_SMTP_HOST, port=SMTP_PORT)
+    controller.start()
+    try:
+        subscribed_ids, other_ids = seed()
+        until = datetime.now()
+
+        restore = crash_after(1)
+        try:
+            app.run_digests(until)
+            raise AssertionError('the run was expected to stop part way')
+        except OSError:
+            pass
+        restore()
+        assert sum(handler.recipients.values()) == BATCH, handler.recipients
+        runs = app.read_rows(app.sa.select(app.DigestRun.__table__))
+        assert len(runs) == 1 and runs[0].finished_at is None and runs[0].sent_count == BATCH, runs
+
+        resumed_until, sentCount = app.run_digests()
+        users = digest_users(subscribed_ids + other_ids)
+        expected = Counter({users[user_id].email: 1 for user_id in subscribed_ids})
+        assert handler.recipients == expected, f'digests received {handler.recipients}, expected {expected}'
+        runs = app.read_rows(app.sa.select(app.DigestRun.__table__))
+        assert len(runs) == 1 and runs[0].finished_at is not None, runs
+        assert resumed_until == until and sentCount == runs[0].sent_count == SUBSCRIBED, (resumed_until, sentCount)
+        assert all(users[user_id].last_digest_at == until for user_id in subscribed_ids), users
+        assert all(users[user_id].last_digest_at is None for user_id in other_ids), users
+    finally:
+        app.close_smtp_pool()
+        controller.stop()
+    print(f'digest checks passed: run stopped after {BATCH} digests and carried on, {SUBSCRIBED} subscribed users got '
+          f'one digest each, the run finished and last_digest_at moved on')
@@ -0,0 +1,183 @@
+"""
+Benchmark of the email digest job against a local aiosmtpd server (pip install aiosmtpd).
+Seeds 100k subscribed users with alerts in their feeds, comments on their threads and ratings of their posts, then
+stops a run part way as if the server crashed, carries it on, and checks every user got exactly one digest.
+It also compares the peak memory of two batch sizes and the pooled SMTP connections with one connection per email.
+Run from the repository root: python benchmarks/email_digest.py
+"""
+import random
+import smtplib
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta
+
+from aiosmtpd.controller import Controller
+
+from bench_setup import load_app
+
+USERS = 100_000
+SMTP_PORT = 8025
+
+app = load_app()
+app.DIGEST_SMTP_PORT = SMTP_PORT
+
+
+class CountingHandler:
+    """
+    aiosmtpd handler which only counts the emails received per recipient
+    """
+    def __init__(self):
+        self.recipients = Counter()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.recipients.update(envelope.rcpt_tos)
+        return '250 OK'
+
+
+def seed():
+    """
+    Function to bulk insert the users, their subscriptions and the activity of the last day with Core inserts
+    :return: a list of the new user IDs
+    """
+    random.seed(1)
+    now = datetime.now()
+    first_id = app.read_rows(app.sa.select(app.func.max(app.User.id)))[0][0] + 1
+    user_ids = list(range(first_id, first_id + USERS))
+    categories = app.NOTIFICATION_CATEGORIES
+    with app.db.begin() as conn:
+        conn.execute(app.User.__table__.insert(), [
+            {'id': user_id, 'username': f'rider{user_id}', 'display_name': f'Rider {user_id}', 'password': 'x',
+             'role_id': 1, 'email': f'rider{user_id}@example.com'} for user_id in user_ids])
+        conn.execute(app.Subscription.__table__.insert(), [
+            {'user_id': user_id, 'location': None, 'category': categories[user_id % len(categories)]}
+            for user_id in user_ids])
+    for number in range(2 * len(categories)):  # two notifications in each category, delivered like the form does
+        with app.Session() as sesh:
+            notification = app.Notification(user_id=3, by_role_id=3, title=f'Alert {number}', content='Stay safe',
+                                            category=categories[number % len(categories)], location='Bus Station',
+                                            date_time=now - timedelta(hours=number + 1))
+            sesh.add(notification)
+            sesh.commit()
+            app.deliver_to_subscribers(notification.location, notification.category, notification.date_time,
+                                       notification_id=notification.id)
+    first_thread = app.read_rows(app.sa.select(app.func.max(app.Thread.id)))[0][0] + 1
+    first_post = app.read_rows(app.sa.select(app.func.max(app.ParkingPost.id)))[0][0] + 1
+    with app.db.begin() as conn:
+        conn.execute(app.Thread.__table__.insert(), [
+            {'id': first_thread + i, 'user_id': random.choice(user_ids), 'title': f'Thread {i}',
+             'content': 'Where do you lock up in town?', 'parent_id': None, 'date_time': now - timedelta(days=3),
+             'up_votes': 0, 'down_votes': 0, 'flags': 0} for i in range(USERS // 2)])
+        conn.execute(app.Thread.__table__.insert(), [
+            {'user_id': random.choice(user_ids), 'title': '', 'content': 'The racks by the library are free ' * 3,
+             'parent_id': first_thread + random.randrange(USERS // 2), 'date_time': now - timedelta(minutes=i % 1000),
+             'up_votes': 0, 'down_votes': 0, 'flags': 0} for i in range(USERS)])
+        conn.execute(app.ParkingPost.__table__.insert(), [
+            {'id': first_post + i, 'date_time': now - timedelta(days=3), 'user_id': random.choice(user_ids),
+             'location': 'Bus Station', 'type': 'Rack', 'content': 'Plenty of space', 'amt_slots': 5}
+            for i in range(USERS // 2)])
+        conn.execute(app.ParkingRating.__table__.insert(), [
+            {'post_id': first_post + random.randrange(USERS // 2), 'user_id': None, 'rating': 1 + i % 5,
+             'comment': 'Handy', 'date_time': now - timedelta(minutes=i % 1000)} for i in range(USERS)])
+    return user_ids
+
+
+def reset_digests():
+    """
+    Function to forget the digests sent, so the next run covers the same period again
+    :return:
+    """
+    with app.db.begin() as conn:
+        conn.execute(app.sa.update(app.User).values(last_digest_at=None))
+        conn.execute(app.sa.delete(app.DigestRun))
+
+
+def crash_after(batches):
+    """
+    Function to make the digest job fail while sending, after a number of batches, like a crash of the server
+    :param batches: number of batches sent before the failure
+    :return: a function undoing the change
+    """
+    send_messages = app.send_messages
+    sent = [0]
+
+    def failing_send(messages):
+        if sent[0] == batches:
+            raise OSError('simulated crash')
+        sent[0] += 1
+        send_messages(messages)
+
+    app.send_messages = failing_send
+    return lambda: setattr(app, 'send_messages', send_messages)
+
+
+def timed_run(until):
+    """
+    Function to time one digest run with its peak Python memory allocation (tracing slows the run down)
+    :param until: end of the period the digests cover
+    :return: a tuple of (seconds, peak bytes, digests sent)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    sentCount = app.run_digests(until)[1]
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, sentCount
+
+
+def per_email_connections(messages):
+    """
+    Function to send emails opening a new SMTP connection for each one, to compare with the pool
+    :param messages: list of MIMEText messages
+    :return:
+    """
+    for message in messages:
+        with smtplib.SMTP(app.DIGEST_SMTP_HOST, SMTP_PORT) as connection:
+            connection.send_message(message)
+
+
+if __name__ == '__main__':
+    handler = CountingHandler()
+    controller = Controller(handler, hostname=app.DIGEST_SMTP_HOST, port=SMTP_PORT)
+    controller.start()
+    seed()
+    until = datetime.now()
+
+    restore = crash_after(USERS // app.DIGEST_USER_BATCH // 2)
+    try:
+        app.run_digests(until)
+    except OSError as error:
+        print(f'first run stopped: {error}, {sum(handler.recipients.values())} digests sent before it')
+    restore()
+    start = time.perf_counter()
+    sentCount = app.run_digests()[1]
+    print(f'carried on: the run finished with {sentCount} digests in total, resumed part took '
+          f'{time.perf_counter() - start:.1f} s')
+    print(f'{len(handler.recipients)} users got a digest, '
+          f'{sum(count > 1 for count in handler.recipients.values())} of them more than one')
+    assert len(handler.recipients) == USERS and set(handler.recipients.values()) == {1}, 'digests missed or repeated'
+
+    reset_digests()
+    start = time.perf_counter()
+    sentCount = app.run_digests(until)[1]
+    elapsed = time.perf_counter() - start
+    print(f'full run: {sentCount} digests in {elapsed:.1f} s, {sentCount / elapsed:.0f} digests/s')
+
+    print(f'{"digest run over 100k users (traced)":<40} {"time":>9} {"peak memory":>14}')
+    for batch_size in [app.DIGEST_USER_BATCH, app.DIGEST_USER_BATCH * 10]:
+        reset_digests()
+        app.DIGEST_USER_BATCH = batch_size
+        elapsed, peak, sentCount = timed_run(until)
+        print(f'{f"batches of {batch_size} users":<40} {elapsed:>7.1f} s {peak / 1024 / 1024:>10.1f} MiB')
+
+    reset_digests()
+    users = app.read_digest_users(0, until, 2000)
+    items = app.read_digest_items([user.id for user in users], until)
+    messages = [message for message in (app.render_digest(user, items.get(user.id)) for user in users) if message]
+    for label, send in [('pooled connections', app.send_messages), ('one connection per email', per_email_connections)]:
+        start = time.perf_counter()
+        send(messages)
+        print(f'{f"2000 emails, {label}":<40} {time.perf_counter() - start:>7.2f} s')
+    app.close_smtp_pool()
+    controller.stop()
@@ -0,0 +1,79 @@
+"""
+Benchmark of the streaming export with 10M content reports.
+Resident memory is sampled while the export runs, to show it stays flat as the row count grows.
+Pass a smaller row count as the first argument for a quicker run: python benchmarks/export_stream.py 1000000
+Run from the repository root: python benchmarks/export_stream.py
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bench_setup import load_app
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+
+app = load_app()
+
+
+def current_rss():
+    """
+    Function to read the current resident memory of this process from /proc (Linux)
+    :return: resident memory in MiB
+    """
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+def seed():
+    """
+    Function to insert the content reports straight through the DB-API with a generator, so seeding is not held in memory
+    :return:
+    """
+    start = datetime(2020, 1, 1)
+    raw = app.db.raw_connection()
+    raw.execute('PRAGMA journal_mode = OFF')
+    raw.executemany('INSERT INTO content_reports (user_id, thread_id, comment, date_time) VALUES (?, ?, ?, ?)',
+                    ((1 + i % 4, 1 + i % 25, 'Spam, advertising a shop',
+                      (start + timedelta(seconds=15 * i)).strftime('%Y-%m-%d %H:%M:%S.%f')) for i in range(ROWS)))
+    raw.commit()
+    raw.close()
+
+
+def run_export(file_format):
+    """
+    Function to export every content report into a temporary file while sampling memory
+    :param file_format: 'csv' or 'ndjson'
+    :return:
+    """
+    samples = []
+    exporting = threading.Event()
+    exporting.set()
+
+    def sample_memory():
+        while exporting.is_set():
+            samples.append(current_rss())
+            time.sleep(0.25)
+
+    baseline = current_rss()
+    sampler = threading.Thread(target=sample_memory)
+    sampler.start()
+    start = time.perf_counter()
+    with tempfile.TemporaryFile('w+', newline='', encoding='utf-8') as export_file:
+        rowCount = app.write_export('content_reports', export_file, file_format)
+        size = export_file.tell()
+    elapsed = time.perf_counter() - start
+    exporting.clear()
+    sampler.join()
+    quarter = max(1, len(samples) // 4)
+    print(f'{file_format:<7} {rowCount:>11,} rows {elapsed:>7.1f} s {rowCount / elapsed:>10,.0f} rows/s '
+          f'{size / 1024 / 1024:>8,.0f} MiB written | RSS before {baseline:.0f} MiB, '
+          f'max in each quarter of the run: {", ".join(f"{max(samples[i:i + quarter]):.0f}" for i in range(0, len(samples), quarter))} MiB')
+
+
+if __name__ == '__main__':
+    seed()
+    run_export('csv')
+    run_export('ndjson')
@@ -0,0 +1,167 @@
+"""
+Check and benchmark of the font size buttons without a browser, run in node (needs node on the PATH).
+The JavaScript from display_script runs against a small stand-in for the DOM. It checks that Aa+ and Aa- set one
+CSS variable on the root element within the limits, that the size survives a page being rendered again and comes
+back in a new session, and that the server is told through the 'font_scale' pin.
+It then times a click on pages of growing size against the old buttons, which set the size of every element.
+Run from the repository root: python benchmarks/font_scale.py
+"""
+import json
+import subprocess
+
+from bench_setup import load_app
+
+ELEMENTS = [1_000, 10_000, 100_000]
+CLICKS = 50
+
+app = load_app()
+
+# the JavaScript the Aa+ button used to run, which read and set the size of every element
+OLD_BIGGER_FONT = '''
+    let allElements = document.querySelectorAll('p, h2, h3, h4, h5, h6,label,input,table');
+    allElements.forEach(function(element) {
+        var style = window.getComputedStyle(element, null).getPropertyValue('font-size');
+        var currentSize = parseFloat(style);
+        if (0 < 6) {
+            element.style.fontSize = (currentSize + 1) + "px";
+        } else {
+            return;
+        }
+    });
+'''
+
+# a stand-in for the parts of the DOM the scripts use, which counts the reads and writes of styles
+FAKE_DOM = '''
+var counts = {computed: 0, writes: 0};
+function makeElement(tag) {
+    var properties = {};
+    return {
+        tagName: tag, children: [], id: '', className: '', value: '', events: [],
+        style: {
+            set fontSize(value) { counts.writes += 1; properties.fontSize = value; },
+            get fontSize() { return properties.fontSize; },
+            setProperty: function (name, value) { counts.writes += 1; properties[name] = String(value); },
+            getPropertyValue: function (name) { return properties[name] || ''; }
+        },
+        appendChild: function (child) { this.children.push(child); },
+        dispatchEvent: function (event) { this.events.push(event.type); }
+    };
+}
+var storage = {};
+var localStorage = {
+    getItem: function (key) { return key in storage ? storage[key] : null; },
+    setItem: function (key, value) { storage[key] = String(value); }
+};
+function Event(type) { this.type = type; }
+var window = globalThis;
+var page = [];
+var pins = {font_scale: makeElement('input'), theme_choice: makeElement('input')};
+var document = {
+    head: makeElement('head'),
+    body: makeElement('body'),
+    documentElement: makeElement('html'),
+    getElementById: function (id) { return this.head.children.find(function (child) { return child.id === id; }); },
+    createElement: makeElement,
+    querySelector: function (selector) {
+        var match = /#pywebio-scope-(\\w+) input/.exec(selector);
+        return match ? pins[match[1]] : null;
+    },
+    querySelectorAll: function (selector) { return selector.indexOf('link') === 0 ? [] : page; }
+};
+document.body.className = 'webio-theme-default';
+window.getComputedStyle = function (element) {
+    counts.computed += 1;
+    return {getPropertyValue: function () { return element.style.fontSize || '16px'; }};
+};
+function renderPage(size) {
+    page = [];
+    for (var i = 0; i < size; i++) page.push(makeElement('p'));
+}
+function check(condition, message) {
+    if (!condition) { console.error('FAILED: ' + message); process.exit(1); }
+}
+'''
+
+
+def node(code):
+    """
+    Function to run JavaScript in node with the stand-in DOM
+    :param code: JavaScript code run after the stand-in DOM is set up
+    :return: the standard output of node
+    """
+    result = subprocess.run(['node', '-e', FAKE_DOM + code], capture_output=True, text=True)
+    if result.returncode:
+        raise SystemExit(result.stderr)
+    return result.stdout
+
+
+def check_font_scale():
+    """
+    Function to check the CSS and the behaviour of the font size buttons
+    :return:
+    """
+    assert 'html { font-size: calc(100% * var(--gbb-font-scale, 1)); }' in app.font_scale_css()
+    script = json.dumps(app.display_script())
+    node(f'''
+    eval({script});
+    check(document.getElementById('gbb-font-scale').textContent.indexOf('--gbb-font-scale') !== -1,
+          'the CSS is added to the page');
+    renderPage(1000);
+    gbbScaleFont(1);
+    check(document.documentElement.style.getPropertyValue('--gbb-font-scale') === '{1 + app.FONT_SCALE_STEP}',
+          'Aa+ sets the variable');
+    check(counts.writes === 1 && counts.computed === 0, 'one write and no style reads whatever the page size');
+    check(pins.font_scale.value === {1 + app.FONT_SCALE_STEP} && pins.font_scale.events[0] === 'input',
+          'the server is told through the pin');
+    for (var i = 0; i < 20; i++) gbbScaleFont(1);
+    check(document.documentElement.style.getPropertyValue('--gbb-font-scale') === '{app.FONT_SCALE_MAX}',
+          'Aa+ stops at the largest size');
+    for (var i = 0; i < 20; i++) gbbScaleFont(-1);
+    check(document.documentElement.style.getPropertyValue('--gbb-font-scale') === '{app.FONT_SCALE_MIN}',
+          'Aa- stops at the smallest size');
+    renderPage(10);
+    check(document.documentElement.style.getPropertyValue('--gbb-font-scale') === '{app.FONT_SCALE_MIN}',
+          'the size stays when the page is rendered again');
+    document.documentElement = makeElement('html');
+    document.head = makeElement('head');
+    eval({script});
+    check(document.documentElement.style.getPropertyValue('--gbb-font-scale') === '{app.FONT_SCALE_MIN}',
+          'the size comes back in a new session');
+    check(document.head.children.length === 1, 'the CSS is added once');
+    ''')
+    print('font scale checks passed')
+
+
+def time_clicks():
+    """
+    Function to time clicks of Aa+ with the old and the new JavaScript on pages of growing size
+    :return:
+    """
+    script = json.dumps(app.display_script())
+    print(f'{f"one Aa+ click, best of {CLICKS}":<32} {"old":>10} {"new":>10} {"old reads":>10} {"new reads":>10}')
+    for size in ELEMENTS:
+        output = node(f'''
+        eval({script});
+        renderPage({size});
+        function best(click) {{
+            var fastest = Infinity;
+            counts.computed = 0;
+            for (var i = 0; i < {CLICKS}; i++) {{
+                localStorage.setItem('gbb-font-scale', 1);
+                var start = process.hrtime.bigint();
+                click();
+                fastest = Math.min(fastest, Number(process.hrtime.bigint() - start) / 1e6);
+            }}
+            return [fastest, counts.computed / {CLICKS}];
+        }}
+        var old = best(function () {{ {OLD_BIGGER_FONT} }});
+        var now = best(function () {{ gbbScaleFont(1); }});
+        console.log(JSON.stringify([old[0], now[0], old[1], now[1]]))
+        ''')
+        old, new, old_reads, new_reads = json.loads(output)
+        print(f'{f"page of {size} elements":<32} {old:>7.3f} ms {new:>7.3f} ms {old_reads:>10.0f} {new_reads:>10.0f}')
+
+
+if __name__ == '__main__':
+    check_font_scale()
+    time_clicks()
@@ -0,0 +1,53 @@
+"""
+Benchmark of the streaming GeoJSON import of parking sites.
+Writes a FeatureCollection of 100k sites (a third drawn as polygons, 20% listed twice), then times the first import,
+a re-import which only updates the sites, and parsing the same file with json.load for comparison of memory use.
+Run from the repository root: python benchmarks/geojson_import.py
+"""
+import json
+import random
+
+from bench_setup import load_app, measure
+
+SITES = 100_000
+
+app = load_app()
+
+
+def write_geojson(path):
+    """
+    Function to write the benchmark GeoJSON file feature by feature
+    :param path: path of the file to write
+    :return:
+    """
+    random.seed(1)
+    with open(path, 'w') as geojson_file:
+        geojson_file.write('{"type": "FeatureCollection", "name": "cycle_parking", "features": [\n')
+        for i in range(int(SITES * 1.2)):
+            latitude, longitude = 54.95 + random.uniform(-0.05, 0.05), -1.6 + random.uniform(-0.1, 0.1)
+            geometry = {'type': 'Point', 'coordinates': [longitude, latitude]} if i % 3 else {
+                'type': 'Polygon', 'coordinates': [[[longitude, latitude], [longitude + 0.001, latitude],
+                                                    [longitude + 0.001, latitude + 0.001], [longitude, latitude]]]}
+            geojson_file.write(('' if i == 0 else ',\n') + json.dumps({
+                'type': 'Feature', 'id': i, 'geometry': geometry,
+                'properties': {'site_id': f'GC{i % SITES}', 'name': f'Cycle stands {i}', 'capacity': i % 20}}))
+        geojson_file.write('\n]}\n')
+
+
+def import_file():
+    with open('sites.geojson', encoding='utf-8') as geojson_file:
+        return app.import_geojson_locations(geojson_file, id_property='site_id')
+
+
+def load_whole_file():
+    with open('sites.geojson', encoding='utf-8') as geojson_file:
+        return len(json.load(geojson_file)['features'])
+
+
+if __name__ == '__main__':
+    write_geojson('sites.geojson')
+    print(f'{"step (120k features, 100k sites)":<48} {"best time":>13} {"memory":>15}')
+    measure('first import (inserts)', import_file, repeat=1)
+    measure('re-import (updates)', import_file, repeat=1)
+    measure('json.load of the whole file, no database', load_whole_file, repeat=1)
+    print(f"{len(app.get_location_cache()['names'])} locations offered by the forms")
@@ -0,0 +1,175 @@
+"""
+Benchmark of the background job runner.
+Runs three processes on one database, each with the same leased job due every second, and checks the job ran once
+per second in all and never in two processes at once. Then it checks the pool never runs more than JOB_WORKERS
+jobs, times the retries of a failing job, the cost of the lease statements around a run, and how long the runner
+takes to stop with a long job running.
+Run from the repository root: python benchmarks/job_runner.py
+"""
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+PROCESSES = 3
+SECONDS = 10
+RUN_LOG = 'job-runs.log'
+
+
+def worker(work_dir):
+    """
+    Function run in each of the processes: registers a leased job due every second which records its runs in a
+    shared log file, runs the job runner for SECONDS and stops it
+    :param work_dir: working directory of the shared database
+    :return:
+    """
+    os.chdir(work_dir)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    with contextlib.redirect_stdout(io.StringIO()):
+        import main
+    main.db.echo = main.read_db.echo = False
+
+    def record_run():
+        started = time.time()
+        time.sleep(0.2)
+        with open(RUN_LOG, 'a') as log:
+            log.write(f'{main.JOB_RUNNER_ID} {started} {time.time()}\n')
+
+    main.register_job('every-second', record_run, every=timedelta(seconds=1))
+    main.start_job_runner()
+    time.sleep(SECONDS)
+    main.stop_job_runner()
+
+
+def single_flight(app):
+    """
+    Function to run the job in PROCESSES processes at once and check its runs in the log
+    :param app: imported main module, its working directory holds the database
+    :return:
+    """
+    work_dir = os.getcwd()
+    workers = [subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker', work_dir])
+               for _ in range(PROCESSES)]
+    for process in workers:
+        process.wait()
+    with open(RUN_LOG) as log:
+        runs = sorted((float(started), float(ended), owner) for owner, started, ended in map(str.split, log))
+    overlaps = sum(started < runs[number - 1][1] for number, (started, _, _) in enumerate(runs) if number)
+    owners = {owner for _, _, owner in runs}
+    print(f'{PROCESSES} processes for {SECONDS} s: {len(runs)} runs shared by {len(owners)} processes, '
+          f'{overlaps} overlapping')
+    leftover = app.read_rows(app.sa.select(app.BackgroundJob.lease_owner)
+                             .where(app.BackgroundJob.lease_owner.is_not(None)))
+    print(f'leases still held after the processes stopped: {len(leftover)}')
+
+
+def bounded_pool(app):
+    """
+    Function to register twice as many jobs as workers, all due at once, and record how many run at the same time
+    :param app: imported main module
+    :return:
+    """
+    running, most = [0], [0]
+    lock = threading.Lock()
+
+    def sleepy():
+        with lock:
+            running[0] += 1
+            most[0] = max(most[0], running[0])
+        time.sleep(0.3)
+        with lock:
+            running[0] -= 1
+
+    for number in range(2 * app.JOB_WORKERS):
+        app.register_job(f'sleepy-{number}', sleepy, every=timedelta(hours=1), leased=False)
+    app.start_job_runner()
+    time.sleep(1.5)
+    app.stop_job_runner()
+    runs = sum(metrics['runs'] for name, metrics in app.job_metrics().items() if name.startswith('sleepy'))
+    print(f'{2 * app.JOB_WORKERS} jobs due at once: {runs} ran, at most {most[0]} at a time '
+          f'({app.JOB_WORKERS} workers)')
+    app.jobs.clear()
+
+
+def retries(app):
+    """
+    Function to run a job which fails three times before it succeeds, and record when each attempt started
+    :param app: imported main module
+    :return:
+    """
+    attempts = []
+
+    def flaky():
+        attempts.append(time.perf_counter())
+        if len(attempts) <= 3:
+            raise OSError('SMTP server not answering')
+
+    app.JOB_RETRY_SECONDS = 0.25
+    app.register_job('flaky', flaky, every=timedelta(hours=1))
+    with contextlib.redirect_stderr(io.StringIO()):
+        app.start_job_runner()
+        time.sleep(3)
+        app.stop_job_runner()
+    gaps = ', '.join(f'{(later - earlier) * 1000:.0f}' for earlier, later in zip(attempts, attempts[1:]))
+    metrics = app.job_metrics()['flaky']
+    print(f'failing job: {len(attempts)} attempts, {gaps} ms apart (backoff from {app.JOB_RETRY_SECONDS * 1000:.0f} '
+          f'ms), {metrics["failures"]} failures, last run {metrics["last_status"]}')
+    row = app.read_rows(app.sa.select(app.BackgroundJob.__table__).where(app.BackgroundJob.name == 'flaky'))[0]
+    print(f'recorded in the table: {row.run_count} runs, {row.failure_count} failed, next run at {row.next_run_at:%H:%M}')
+    app.jobs.clear()
+
+
+def lease_overhead(app):
+    """
+    Function to time taking a lease and recording a run, the database work the runner adds to each leased run
+    :param app: imported main module
+    :return:
+    """
+    app.register_job('overhead', lambda: None, every=timedelta(hours=1))
+    app.start_job_runner()
+    app.stop_job_runner()
+    count = 200
+    start = time.perf_counter()
+    for _ in range(count):
+        app.acquire_job_lease('overhead')
+        app.record_job_run('overhead', True, datetime.now(), 0.0, None, datetime.now())
+    print(f'lease taken and run recorded: {(time.perf_counter() - start) / count * 1000:.2f} ms per run')
+    app.jobs.clear()
+
+
+def shutdown(app):
+    """
+    Function to time stopping the runner while a long job runs, which checks job_runner_stopping like the digests
+    :param app: imported main module
+    :return:
+    """
+    def long_job():
+        for _ in range(600):  # a minute of batches
+            if app.job_runner_stopping.is_set():
+                return
+            time.sleep(0.1)
+
+    app.register_job('long', long_job, every=timedelta(hours=1))
+    app.start_job_runner()
+    time.sleep(0.5)
+    start = time.perf_counter()
+    app.stop_job_runner()
+    held = app.read_rows(app.sa.select(app.BackgroundJob.name).where(app.BackgroundJob.lease_owner.is_not(None)))
+    print(f'stop with a long job running: {(time.perf_counter() - start) * 1000:.0f} ms, {len(held)} leases left')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--worker']:
+        worker(sys.argv[2])
+    else:
+        from bench_setup import load_app
+        app = load_app()
+        single_flight(app)
+        bounded_pool(app)
+        retries(app)
+        lease_overhead(app)
+        shutdown(app)
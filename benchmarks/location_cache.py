@@ -0,0 +1,45 @@
+"""
+Benchmark of the versioned location cache and its prefix search.
+Seeds 100k locations, then compares shipping every name to a form field with the type-ahead suggestions,
+and times the version check on a warm cache and the reload after the locations change.
+Run from the repository root: python benchmarks/location_cache.py
+"""
+import json
+
+from bench_setup import load_app, measure
+
+ROWS = 100_000
+
+app = load_app()
+
+
+def seed():
+    """
+    Function to bulk insert the benchmark locations with a Core insert
+    :return:
+    """
+    with app.db.begin() as conn:
+        conn.execute(app.Location.__table__.insert(), [{'name': f'Cycle parking site {i}'} for i in range(ROWS)])
+
+
+def full_list():
+    # what every form did before: the whole list of names sent as select options
+    return [row.name for row in app.read_rows(app.sa.select(app.Location.name))]
+
+
+def reload_after_change():
+    with app.db.begin() as conn:
+        conn.execute(app.sa.update(app.Location).where(app.Location.id == 1).values(name='Metro Station'))
+    return app.get_location_cache()
+
+
+if __name__ == '__main__':
+    seed()
+    print(f'{"step (100k locations)":<48} {"best time":>13} {"memory":>15}')
+    measure('full list for one form field', full_list)
+    measure('warm cache, version check only', app.get_location_cache)
+    measure('prefix search, 10 suggestions', lambda: app.search_locations('cycle parking site 12'))
+    measure('exact name check', lambda: app.is_location('Cycle parking site 99999'))
+    measure('reload after a location changed', reload_after_change)
+    print(f'{"data sent per form field":<48} {len(json.dumps(full_list())) / 1024:>10.1f} KiB full list, '
+          f'{len(json.dumps(app.search_locations("cycle parking site 12"))):>6} bytes of suggestions')
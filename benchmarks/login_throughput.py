@@ -0,0 +1,71 @@
+"""
+Benchmark of login throughput with scrypt password hashing.
+A storm of concurrent logins is run twice: hashing inline on every session thread, then on the bounded
+password hashing pool. Meanwhile another "session" keeps reading the post feed, and its latency is reported.
+Run from the repository root: python benchmarks/login_throughput.py
+"""
+import statistics
+import threading
+import time
+
+from bench_setup import load_app
+
+LOGIN_THREADS = 32
+LOGINS_PER_THREAD = 4
+
+app = load_app()
+
+
+def login_storm(check):
+    """
+    Function to run the concurrent logins while timing the feed reads of another session
+    :param check: callable taking (user, password) which verifies one login
+    :return: a tuple of (logins per second, list of feed read latencies in seconds)
+    """
+    with app.Session() as sesh:
+        user = sesh.query(app.User).filter_by(username='standarduser').first()
+    user.password = app.hash_password('demouser')  # detached copy, so no upgrade writes are triggered
+    latencies = []
+    storm_running = threading.Event()
+    storm_running.set()
+
+    def read_feed():
+        while storm_running.is_set():
+            start = time.perf_counter()
+            app.read_post_cards()
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.005)
+
+    def log_in():
+        for _ in range(LOGINS_PER_THREAD):
+            assert check(user, 'demouser')
+
+    reader = threading.Thread(target=read_feed)
+    reader.start()
+    start = time.perf_counter()
+    logins = [threading.Thread(target=log_in) for _ in range(LOGIN_THREADS)]
+    for thread in logins:
+        thread.start()
+    for thread in logins:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    storm_running.clear()
+    reader.join()
+    return LOGIN_THREADS * LOGINS_PER_THREAD / elapsed, latencies
+
+
+def report(label, logins_per_second, latencies):
+    """
+    Function to print the throughput and the feed read latency percentiles of one run
+    """
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f'{label:<34} {logins_per_second:>8.1f} logins/s   feed read p50 '
+          f'{statistics.median(latencies) * 1000:>6.2f} ms  p99 {p99 * 1000:>6.2f} ms')
+
+
+if __name__ == '__main__':
+    print(f'{LOGIN_THREADS} concurrent sessions, {app.PASSWORD_HASH_WORKERS} hashing worker(s)')
+    report('inline hashing on session threads',
+           *login_storm(lambda user, password: app.check_password(user.password, password)))
+    report('bounded password hashing pool', *login_storm(app.verify_password))
@@ -0,0 +1,80 @@
+"""
+Benchmark of the moderation queue pages with 100k open content reports.
+Times the first page, deep pages (keyset cursor against the OFFSET equivalent) and sorted / filtered pages.
+Run from the repository root: python benchmarks/moderation_queue.py
+"""
+import random
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+from bench_setup import load_app, measure
+
+REPORTS = 100_000
+THREADS = 5_000
+
+app = load_app()
+
+
+def seed():
+    """
+    Function to bulk insert flagged threads and the content reports made on them
+    :return:
+    """
+    random.seed(1)
+    now = datetime.now()
+    with app.db.begin() as conn:
+        conn.execute(app.Thread.__table__.insert(), [
+            {'user_id': 1, 'title': f'Spam thread {i}', 'content': 'Buy cheap bikes', 'parent_id': None,
+             'date_time': now - timedelta(hours=i), 'up_votes': 0, 'down_votes': i % 5, 'flags': 0}
+            for i in range(THREADS)])
+        first_thread = conn.execute(sa.select(sa.func.min(app.Thread.id)).where(
+            app.Thread.title.like('Spam thread%'))).scalar()
+        reports = [{'user_id': 1 + i % 4, 'thread_id': first_thread + random.randrange(THREADS), 'comment': 'Spam',
+                    'date_time': now - timedelta(minutes=i)} for i in range(REPORTS)]
+        conn.execute(app.ContentReport.__table__.insert(), reports)
+        conn.execute(app.Thread.__table__.update().values(flags=sa.select(sa.func.count(app.ContentReport.id)).where(
+            app.ContentReport.thread_id == app.Thread.id).scalar_subquery()))
+
+
+def cursor_at(depth, **kwargs):
+    """
+    Function to walk the pages to find the cursor of the page starting after the given number of rows
+    """
+    cursor = None
+    for _ in range(depth // app.MODERATION_PAGE_SIZE):
+        cursor = app.read_content_reports(after=cursor, limit=app.MODERATION_PAGE_SIZE, **kwargs)[1]
+    return cursor
+
+
+def offset_page(depth):
+    """
+    Function to read the same deep page with LIMIT / OFFSET, for comparison
+    """
+    statement = (sa.select(app.ContentReport.id, app.Thread.title, app.User.display_name, app.ContentReport.comment,
+                           app.ContentReport.date_time)
+                 .join(app.Thread, app.Thread.id == app.ContentReport.thread_id)
+                 .outerjoin(app.User, app.User.id == app.ContentReport.user_id)
+                 .order_by(app.ContentReport.date_time.desc(), app.ContentReport.id.desc())
+                 .limit(app.MODERATION_PAGE_SIZE).offset(depth))
+    return app.read_rows(statement)
+
+
+if __name__ == '__main__':
+    seed()
+    size = app.MODERATION_PAGE_SIZE
+    deep_cursor, deeper_cursor = cursor_at(2_000), cursor_at(90_000)
+    print(f'{"moderation page (100k reports)":<48} {"best time":>13} {"memory":>15}')
+    measure('reports, first page', lambda: app.read_content_reports(limit=size))
+    measure('reports, 2,000 rows deep (keyset)', lambda: app.read_content_reports(after=deep_cursor, limit=size))
+    measure('reports, 2,000 rows deep (OFFSET)', lambda: offset_page(2_000))
+    measure('reports, 90,000 rows deep (keyset)', lambda: app.read_content_reports(after=deeper_cursor, limit=size))
+    measure('reports, 90,000 rows deep (OFFSET)', lambda: offset_page(90_000))
+    measure('reports, most flagged threads first', lambda: app.read_content_reports(
+        filters={'sort': 'most_flagged'}, limit=size))
+    measure('reports, reporter + date range filter', lambda: app.read_content_reports(filters={
+        'reporter': 'poweruser', 'date_from': (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d'),
+        'date_to': datetime.now().strftime('%Y-%m-%d')}, limit=size))
+    measure('threads, most flagged first', lambda: app.read_flagged_threads(limit=size))
+    measure('threads, min. 25 flags by reporter', lambda: app.read_flagged_threads(
+        filters={'min_flags': 25, 'reporter': 'poweruser'}, limit=size))
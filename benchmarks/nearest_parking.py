@@ -0,0 +1,52 @@
+"""
+Benchmark of the nearest parking queries through the R-tree tables.
+Seeds 100k locations and 100k posts scattered over Gateshead, then times nearest-N and within-radius searches
+against the same ranking done by scanning the whole posts table.
+Run from the repository root: python benchmarks/nearest_parking.py
+"""
+import random
+from datetime import datetime
+
+from bench_setup import load_app, measure
+
+ROWS = 100_000
+CENTRE = (54.9527, -1.6034)
+
+app = load_app()
+
+
+def seed():
+    """
+    Function to bulk insert the benchmark locations and posts with Core inserts, the triggers fill the R-trees
+    :return:
+    """
+    random.seed(1)
+    now = datetime.now()
+    points = [(CENTRE[0] + random.uniform(-0.06, 0.06), CENTRE[1] + random.uniform(-0.1, 0.1)) for _ in range(ROWS)]
+    with app.db.begin() as conn:
+        conn.execute(app.Location.__table__.insert(), [
+            {'name': f'Cycle parking site {i}', 'latitude': latitude, 'longitude': longitude}
+            for i, (latitude, longitude) in enumerate(points)])
+        conn.execute(app.ParkingPost.__table__.insert(), [
+            {'date_time': now, 'user_id': 1, 'location': f'Cycle parking site {i}', 'type': 'Rack',
+             'content': 'Stands by the entrance', 'amt_slots': i % 12, 'latitude': latitude, 'longitude': longitude}
+            for i, (latitude, longitude) in enumerate(points)])
+
+
+def scan_nearest_posts():
+    # the same ranking without the R-tree, every post with free spaces is compared
+    distance = ((app.ParkingPost.latitude - CENTRE[0]) * (app.ParkingPost.latitude - CENTRE[0]) +
+                (app.ParkingPost.longitude - CENTRE[1]) * (app.ParkingPost.longitude - CENTRE[1]) * 0.33)
+    return app.read_rows(app.sa.select(app.ParkingPost.id, app.ParkingPost.amt_slots)
+                         .where(app.ParkingPost.amt_slots > 0).order_by(distance).limit(10))
+
+
+if __name__ == '__main__':
+    seed()
+    print(f'{"query (100k locations and posts)":<48} {"best time":>13} {"memory":>15}')
+    measure('nearest 10 posts, full table scan', scan_nearest_posts)
+    measure('nearest 10 posts, R-tree', lambda: app.nearest_posts(*CENTRE, limit=10))
+    measure('posts within 1 km by spaces, R-tree', lambda: app.nearest_posts(*CENTRE, 20, 1, 'spaces'))
+    measure('posts within 5 km by spaces, R-tree', lambda: app.nearest_posts(*CENTRE, 20, 5, 'spaces'))
+    measure('nearest 10 locations, R-tree', lambda: app.nearest_locations(*CENTRE, limit=10))
+    measure('nearest 10 posts far outside the city, R-tree', lambda: app.nearest_posts(55.2, -1.6, limit=10))
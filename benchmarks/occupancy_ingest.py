@@ -0,0 +1,76 @@
+"""
+Benchmark of the live occupancy ingest.
+Seeds 10k locations, then measures readings recorded per second in-process (50 reading lines per message, as the
+simulator sends them), end to end over the UDP endpoint with the simulator in another process, and one flush.
+Run from the repository root: python benchmarks/occupancy_ingest.py
+"""
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from bench_setup import REPO_DIR, load_app, measure
+
+SITES = 10_000
+MESSAGES = 4_000
+LINES_PER_MESSAGE = 50
+
+app = load_app()
+
+
+def seed():
+    """
+    Function to bulk insert the benchmark locations with a Core insert
+    :return:
+    """
+    with app.db.begin() as conn:
+        conn.execute(app.Location.__table__.insert(), [{'name': f'Counted site {i}'} for i in range(SITES)])
+
+
+def messages():
+    """
+    Function to build the reading messages sent to the ingest
+    :return: a list of message texts
+    """
+    rng = np.random.default_rng(1)
+    sites = rng.integers(1, SITES + 1, (MESSAGES, LINES_PER_MESSAGE))
+    occupied = rng.integers(0, 40, (MESSAGES, LINES_PER_MESSAGE))
+    return ['\n'.join(f'{site},{count},40' for site, count in zip(site_row, count_row))
+            for site_row, count_row in zip(sites, occupied)]
+
+
+def ingest_all(texts):
+    start = time.perf_counter()
+    for text in texts:
+        app.ingest_occupancy(text)
+    return MESSAGES * LINES_PER_MESSAGE / (time.perf_counter() - start)
+
+
+def udp_end_to_end(rate, seconds=5):
+    """
+    Function to run the simulator in another process against the UDP endpoint of this one
+    :return: readings recorded per second by this process
+    """
+    accepted = app.occupancy_stats['accepted']
+    simulator = subprocess.run([sys.executable, os.path.join(REPO_DIR, 'main.py'), 'simulate-occupancy',
+                                '--sites', str(SITES), '--rate', str(rate), '--seconds', str(seconds)],
+                               capture_output=True, text=True)
+    time.sleep(0.5)  # lets the last datagrams be read
+    print(f'  simulator: {simulator.stdout.strip()}')
+    return (app.occupancy_stats['accepted'] - accepted) / seconds
+
+
+if __name__ == '__main__':
+    seed()
+    texts = messages()
+    app.ingest_occupancy(texts[0])  # the first readings of the sites check they exist
+    print(f'in-process ingest: {ingest_all(texts):,.0f} readings/s')
+    print(f'{"step (10k sites)":<48} {"best time":>13} {"memory":>15}')
+    measure('flush of the readings since the last flush', app.flush_occupancy, repeat=1)
+    app.threading.Thread(target=app.serve_occupancy_udp, daemon=True).start()
+    time.sleep(0.2)
+    print(f'UDP end to end at 10k/s requested: {udp_end_to_end(10_000):,.0f} readings/s recorded')
+    print(f'UDP end to end at 20k/s requested: {udp_end_to_end(20_000):,.0f} readings/s recorded')
+    measure('flush after the UDP runs', app.flush_occupancy, repeat=1)
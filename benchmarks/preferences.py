@@ -0,0 +1,101 @@
+"""
+Benchmark of the display preferences.
+Seeds preferences for 10k users, then times reading them at login, and changing a preference by queueing it for the
+background writer against writing it straight away. It also counts the queries made while changing preferences and
+how many rows one write makes out of a burst of changes from many users.
+PyWebIO's session context only exists inside a session, so a stand-in for it is used here.
+Run from the repository root: python benchmarks/preferences.py
+"""
+import random
+import time
+
+from bench_setup import load_app, measure
+
+USERS = 10_000
+BURST = 10_000
+BURST_USERS = 500
+
+app = load_app()
+
+
+class SessionContext:
+    """
+    Stand-in for pywebio.session.local, which returns None for anything not set like the real one
+    """
+    def __getattr__(self, name):
+        return None
+
+
+def seed():
+    """
+    Function to bulk insert the users and their preferences with Core inserts
+    :return: a list of the new user IDs
+    """
+    first_id = app.read_rows(app.sa.select(app.func.max(app.User.id)))[0][0] + 1
+    user_ids = list(range(first_id, first_id + USERS))
+    with app.db.begin() as conn:
+        conn.execute(app.User.__table__.insert(), [
+            {'id': user_id, 'username': f'rider{user_id}', 'display_name': f'Rider {user_id}', 'password': 'x',
+             'role_id': 1} for user_id in user_ids])
+        conn.execute(app.UserPreference.__table__.insert(), [
+            {'user_id': user_id, 'theme': app.THEMES[user_id % len(app.THEMES)],
+             'font_scale': 1 + app.FONT_SCALE_STEP * (user_id % 3)} for user_id in user_ids[::2]])
+    return user_ids
+
+
+def write_now(user_id, name, value):
+    """
+    Function to save a preference in its own transaction, to compare with queueing it
+    """
+    with app.db.begin() as conn:
+        conn.execute(app.sqlite_insert(app.UserPreference).values(user_id=user_id, **{name: value})
+                     .on_conflict_do_update(index_elements=['user_id'], set_={name: value}))
+
+
+def count_queries(function):
+    """
+    Function to count the SQL statements run by a callable
+    :return: the number of statements
+    """
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    app.sa.event.listen(app.db, 'before_cursor_execute', listener)
+    function()
+    app.sa.event.remove(app.db, 'before_cursor_execute', listener)
+    return len(statements)
+
+
+def burst(user_ids):
+    """
+    Function to change preferences BURST times, spread over BURST_USERS users, as sessions would
+    """
+    for number in range(BURST):
+        app.local.user_id = user_ids[number % BURST_USERS]
+        app.local.preferences = None
+        app.set_preference('font_scale', 1 + app.FONT_SCALE_STEP * random.randint(-5, 6))
+
+
+if __name__ == '__main__':
+    user_ids = seed()
+    app.local = SessionContext()
+    app.local.user_id = user_ids[0]
+    print(f'{"preferences of 10k users":<48} {"best time":>13} {"memory":>15}')
+    measure('read preferences at login', lambda: app.read_preferences(user_ids[0]))
+    measure('change a preference, queued', lambda: app.set_preference('theme', 'dark'))
+    measure('change a preference, written straight away', lambda: write_now(user_ids[0], 'theme', 'dark'))
+    app.write_preferences()
+    print(f'queries while changing a preference: {count_queries(lambda: app.set_preference("theme", "sketchy"))}')
+    start = time.perf_counter()
+    burst(user_ids)
+    queued = time.perf_counter() - start
+    rows = len(app.preference_writes)
+    start = time.perf_counter()
+    app.write_preferences()
+    print(f'{BURST} changes from {BURST_USERS} users: queued in {queued * 1000:.1f} ms, written as {rows} rows '
+          f'in one transaction in {(time.perf_counter() - start) * 1000:.1f} ms')
+    saved = app.read_preferences(user_ids[BURST_USERS - 1])['font_scale']
+    print(f'saved value read back: {saved}, last queued: {app.local.preferences["font_scale"]}')
+    start = time.perf_counter()
+    for number in range(BURST // 10):
+        write_now(user_ids[number % BURST_USERS], 'font_scale', 1.0)
+    print(f'{BURST // 10} changes written straight away: {(time.perf_counter() - start) * 1000:.1f} ms')
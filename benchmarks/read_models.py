@@ -0,0 +1,128 @@
+"""
+Benchmark of the read model functions against the ORM queries the pages used before.
+Seeds 100k posts, threads, content reports and crime reports, then times one page of each view.
+Run from the repository root: python benchmarks/read_models.py
+"""
+import random
+from datetime import datetime, timedelta
+
+from bench_setup import load_app, measure
+
+ROWS = 100_000
+
+app = load_app()
+
+
+def seed():
+    """
+    Function to bulk insert the benchmark rows with Core inserts
+    :return:
+    """
+    random.seed(1)
+    now = datetime.now()
+    locations = app.get_location_cache()['names']
+    with app.db.begin() as conn:
+        conn.execute(app.ParkingPost.__table__.insert(), [
+            {'date_time': now - timedelta(minutes=i), 'user_id': 1 + i % 4, 'location': random.choice(locations),
+             'type': 'Rack', 'content': 'Plenty of space near the entrance ' * 4, 'amt_slots': i % 20}
+            for i in range(ROWS)])
+        conn.execute(app.ParkingRating.__table__.insert(), [
+            {'post_id': 1 + i % ROWS, 'user_id': None, 'rating': 1 + i % 5, 'comment': ''}
+            for i in range(ROWS * 2)])
+        conn.execute(app.Thread.__table__.insert(), [
+            {'user_id': 1 + i % 4, 'title': f'Thread {i}', 'content': 'Discussion about bike parking ' * 6,
+             'parent_id': None if i % 4 == 0 else 30 + (i - i % 4), 'date_time': now, 'up_votes': i % 7,
+             'down_votes': i % 3, 'flags': i % 2}
+            for i in range(ROWS)])
+        conn.execute(app.ContentReport.__table__.insert(), [
+            {'user_id': 1 + i % 4, 'thread_id': 1 + i % 20, 'comment': 'Spam', 'date_time': now}
+            for i in range(ROWS)])
+        conn.execute(app.CrimeReport.__table__.insert(), [
+            {'user_id': 2, 'title': f'Stolen bike {i}', 'category': 'Theft', 'location': random.choice(locations),
+             'description': 'Bike taken from the rack overnight ' * 8, 'date_time': now - timedelta(hours=i),
+             'is_emergency': i % 10 == 0, 'status': 'Pending'}
+            for i in range(ROWS)])
+
+
+def orm_crime_table():
+    with app.Session() as sesh:
+        return [(c.id, c.title, c.location, c.category, c.date_time, c.status)
+                for c in sesh.query(app.CrimeReport).all()]
+
+
+def core_crime_table():
+    return [(c.id, c.title, c.location, c.category, c.date_time, c.status)
+            for c in app.read_crime_reports(limit=ROWS)[0]]
+
+
+def orm_flagged_table():
+    with app.Session() as sesh:
+        return [(t.id, t.title, t.flags, t.up_votes - t.down_votes)
+                for t in sesh.query(app.Thread).filter(app.Thread.flags > 0).order_by(app.Thread.flags.desc()).all()]
+
+
+def core_flagged_table():
+    return [(t.id, t.title, t.flags, t.up_votes - t.down_votes) for t in app.read_flagged_threads(limit=ROWS)[0]]
+
+
+def orm_reports_table():
+    # the per-row get_username() lookup is left out here, it would add one more query for each of the 100k rows
+    with app.Session() as sesh:
+        return [(r.id, r.associated_thread.title, r.comment, r.date_time)
+                for r in sesh.query(app.ContentReport).join(app.Thread).all()]
+
+
+def core_reports_table():
+    return [(r.id, r.reporter_name, r.thread_title, r.comment, r.date_time)
+            for r in app.read_content_reports(limit=ROWS)[0]]
+
+
+def orm_avg_rating(post_id):
+    # the per-post rating query the post cards made before, once for the check and once for the value
+    with app.Session() as sesh:
+        ratings = sesh.query(app.ParkingRating).filter_by(post_id=post_id).all()
+        return round(sum(rating.rating for rating in ratings) / len(ratings), 1) if ratings else None
+
+
+def orm_post_page():
+    with app.Session() as sesh:
+        posts = sesh.query(app.ParkingPost).order_by(app.ParkingPost.id.desc()).limit(10).all()
+        return [(p.location, p.amt_slots, orm_avg_rating(p.id), orm_avg_rating(p.id)) for p in posts]
+
+
+def core_post_page():
+    return [(p.location, p.amt_slots, app.post_average_rating(p)) for p in app.read_post_cards()]
+
+
+def orm_forum_page():
+    with app.Session() as sesh:
+        threads = sesh.query(app.Thread).filter_by(parent_id=None).order_by(app.Thread.id.desc()).limit(10).all()
+        page = []
+        for thread in threads:
+            comments = sesh.query(app.Thread).filter_by(parent_id=thread.id).order_by(app.Thread.id.asc()).all()
+            page.append((thread.title, app.get_username(thread.user_id)['display_name'],
+                         app.get_user_badge(thread.user_id) if app.get_role_id(thread.user_id) != 1 else '',
+                         [(c.content, app.get_username(c.user_id)['display_name']) for c in comments]))
+        return page
+
+
+def core_forum_page():
+    threads = app.read_thread_cards()
+    comments = app.read_thread_comments([thread.id for thread in threads])
+    return [(t.title, t.display_name, app.role_badge(t.role_name, t.role_color) if t.role_id != 1 else '',
+             [(c.content, c.display_name) for c in comments[t.id]]) for t in threads]
+
+
+if __name__ == '__main__':
+    seed()
+    print(f'{"view (100k rows per table)":<48} {"best time":>13} {"memory":>15}')
+    measure('crime table, ORM objects', orm_crime_table)
+    measure('crime table, read model rows', core_crime_table)
+    measure('flagged threads table, ORM objects', orm_flagged_table)
+    measure('flagged threads table, read model rows', core_flagged_table)
+    measure('content reports table, ORM objects', orm_reports_table)
+    measure('content reports table, read model rows', core_reports_table)
+    measure('post feed page, ORM + per-post ratings', orm_post_page)
+    measure('post feed page, read model rows', core_post_page)
+    measure('forum page, ORM + per-row lookups', orm_forum_page)
+    measure('forum page, read model rows', core_forum_page)
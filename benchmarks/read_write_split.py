@@ -0,0 +1,171 @@
+"""
+Benchmark of the read and write engines.
+Seeds 5k forum threads with comments, then reads forum pages in several threads while another process votes on
+threads one transaction at a time and moderates them in batches, as sessions do. The writes run in their own process
+so that the latencies show waits for the database, not for the Python interpreter. It records the latency of every
+page read, first with one engine for reads and writes on the rollback journal (the old set-up), then with the read
+engine next to the write engine on the write-ahead log. It also checks that the read engine refuses writes.
+Run from the repository root: python benchmarks/read_write_split.py
+"""
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+THREADS = 5000
+COMMENTS = 3
+READERS = 4
+SECONDS = 5
+MODERATION_EVERY = 20
+MODERATION_BATCH = 2000
+
+
+def writer(database, thread_ids_file):
+    """
+    Function run in the writing process: votes on random threads in one transaction each, and every MODERATION_EVERY
+    votes clears the flags of MODERATION_BATCH threads in one transaction, for SECONDS
+    :param database: path of the database file
+    :param thread_ids_file: file with the thread IDs, one per line
+    :return:
+    """
+    import sqlalchemy as sa
+    with open(thread_ids_file) as ids:
+        thread_ids = [int(line) for line in ids]
+    engine = sa.create_engine(f'sqlite:///{database}')
+    writes = 0
+    deadline = time.time() + SECONDS
+    while time.time() < deadline:
+        with engine.begin() as conn:
+            if writes % MODERATION_EVERY:
+                conn.exec_driver_sql('UPDATE threads SET up_votes = up_votes + 1 WHERE id = ?',
+                                     (random.choice(thread_ids),))
+            else:
+                batch = random.sample(thread_ids, MODERATION_BATCH)
+                conn.exec_driver_sql(f'UPDATE threads SET flags = 0 WHERE id IN ({",".join("?" * len(batch))})',
+                                     tuple(batch))
+        writes += 1
+    print(writes)
+
+
+def seed(app):
+    """
+    Function to bulk insert the threads and their comments with Core inserts
+    :param app: imported main module
+    :return: a list of the new thread IDs
+    """
+    now = datetime.now()
+    rows, thread_ids = [], []
+    first_id = app.read_rows(app.sa.select(app.func.max(app.Thread.id)))[0][0] + 1
+    for number in range(THREADS):
+        thread_id = first_id + number * (COMMENTS + 1)
+        thread_ids.append(thread_id)
+        rows += [{'id': thread_id + reply, 'user_id': 1 + reply % 3, 'title': f'Route {number}' if not reply else '',
+                  'content': 'Which way to the quayside?', 'parent_id': thread_id if reply else None,
+                  'date_time': now - timedelta(minutes=number, seconds=-reply), 'up_votes': 0, 'down_votes': 0,
+                  'flags': 0} for reply in range(COMMENTS + 1)]
+    with app.db.begin() as conn:
+        conn.execute(app.Thread.__table__.insert(), rows)
+    with open('thread-ids.txt', 'w') as ids:
+        ids.write('\n'.join(map(str, thread_ids)))
+    return thread_ids
+
+
+def forum_page(app):
+    """
+    Function to read what the forum page reads: the newest threads and their comments
+    :param app: imported main module
+    """
+    app.read_thread_comments([thread.id for thread in app.read_thread_cards()])
+
+
+def under_load(app, database):
+    """
+    Function to read forum pages in READERS threads while the writing process writes to the database, for SECONDS
+    :param app: imported main module
+    :param database: path of the database file the writing process writes to
+    :return: a tuple of (list of read latencies in seconds, number of writes, number of failed reads)
+    """
+    stop = threading.Event()
+    latencies, failures = [], [0]
+
+    def reader():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                forum_page(app)
+            except app.SQLAlchemyError:
+                failures[0] += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    writing = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--writer', database, 'thread-ids.txt'],
+                               stdout=subprocess.PIPE, text=True)
+    readers = [threading.Thread(target=reader) for _ in range(READERS)]
+    for thread in readers:
+        thread.start()
+    writes = int(writing.communicate()[0])
+    stop.set()
+    for thread in readers:
+        thread.join()
+    return latencies, writes, failures[0]
+
+
+def report(label, latencies, writes, failures):
+    """
+    Function to print the latency percentiles of the page reads
+    """
+    latencies = sorted(latencies)
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(f'{label:<40} {len(latencies):>7} {statistics.median(latencies) * 1000:>8.2f} ms {p99 * 1000:>8.2f} ms '
+          f'{latencies[-1] * 1000:>8.1f} ms {writes:>7} {failures:>7}')
+
+
+def old_setup(app):
+    """
+    Function to make one engine on a copy of the database with the rollback journal, used for reads and writes
+    :param app: imported main module
+    :return: the engine
+    """
+    with app.db.connect() as conn:  # the copy is of the file alone, so everything in the log goes into it first
+        conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+    shutil.copy(app.sqlite_file_name, 'single-engine.db')
+    engine = app.sa.create_engine('sqlite:///single-engine.db')
+    with engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA journal_mode = DELETE')
+    return engine
+
+
+def check_read_only(app):
+    """
+    Function to check that writes through the read engine fail
+    :param app: imported main module
+    """
+    try:
+        with app.read_db.begin() as conn:
+            conn.execute(app.sa.update(app.Thread).values(flags=1))
+    except app.SQLAlchemyError as error:
+        print(f'write through the read engine refused: {error.orig}')
+    else:
+        raise SystemExit('the read engine accepted a write')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--writer']:
+        writer(sys.argv[2], sys.argv[3])
+    else:
+        from bench_setup import load_app
+        app = load_app()
+        seed(app)
+        check_read_only(app)
+        print(f'{f"forum page reads for {SECONDS} s":<40} {"reads":>7} {"median":>11} {"p99":>11} {"max":>11} '
+              f'{"writes":>7} {"failed":>7}')
+        write_engine, read_engine = app.db, app.read_db
+        app.db = app.read_db = old_setup(app)
+        report('before: one engine, rollback journal', *under_load(app, 'single-engine.db'))
+        app.db, app.read_db = write_engine, read_engine
+        report('after: read and write engines, WAL', *under_load(app, app.sqlite_file_name))
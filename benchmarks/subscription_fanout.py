@@ -0,0 +1,51 @@
+"""
+Benchmark of matching new notifications to subscribers through the in-memory inverted index.
+Seeds 100k users with 1-3 subscriptions each over 1000 locations and the notification categories, then compares
+matching one notification by index lookups with checking every subscription, and times the delivery to feeds.
+Run from the repository root: python benchmarks/subscription_fanout.py
+"""
+import random
+from datetime import datetime
+
+from bench_setup import load_app, measure
+
+USERS = 100_000
+LOCATIONS = 1000
+
+app = load_app()
+
+
+def seed():
+    """
+    Function to bulk insert the benchmark locations and subscriptions with Core inserts
+    :return:
+    """
+    random.seed(1)
+    categories = app.NOTIFICATION_CATEGORIES + [app.CRIME_REPORT_CATEGORY, None]
+    with app.db.begin() as conn:
+        conn.execute(app.Location.__table__.insert(), [{'name': f'Site {i}'} for i in range(LOCATIONS)])
+        conn.execute(app.Subscription.__table__.insert(), [
+            {'user_id': user_id, 'location': random.choice([f'Site {random.randrange(LOCATIONS)}', None]),
+             'category': random.choice(categories)}
+            for user_id in range(10, USERS + 10) for _ in range(random.randint(1, 3))])
+
+
+def scan_subscriptions():
+    # what matching costs without the index: every subscription is checked
+    return {row.user_id for row in app.read_rows(app.sa.select(app.Subscription.user_id).where(
+        app.sa.or_(app.Subscription.location == 'Site 7', app.Subscription.location.is_(None)),
+        app.sa.or_(app.Subscription.category == 'Crime Alert', app.Subscription.category.is_(None))))}
+
+
+if __name__ == '__main__':
+    seed()
+    print(f'{"step (100k users, ~200k subscriptions)":<48} {"best time":>13} {"memory":>15}')
+    measure('load the inverted index', app.get_subscription_index, repeat=1)
+    matched = app.match_subscribers('Site 7', 'Crime Alert')
+    assert matched == scan_subscriptions()
+    print(f'{len(matched)} subscribers match Crime Alert at Site 7')
+    measure('match by checking every subscription', scan_subscriptions)
+    measure('match through the inverted index', lambda: app.match_subscribers('Site 7', 'Crime Alert'))
+    measure('deliver to the matched feeds', lambda: app.deliver_to_subscribers('Site 7', 'Crime Alert',
+                                                                              datetime.now(), notification_id=4))
+    measure('read one feed page', lambda: app.read_feed_items(next(iter(matched))))
@@ -0,0 +1,118 @@
+"""
+Benchmark of switching the theme, against a running copy of the app in this process.
+The old switch reloaded the page: the browser fetched the page again and opened a new session, which rendered the
+home page from scratch. The new switch runs in the browser: it fetches the theme stylesheet once, then only tells the
+server about the choice. This times both on the server side, from the click until the page has everything it needs,
+and counts the bytes sent. The repaint itself happens in the browser and is not included.
+Run from the repository root: python benchmarks/theme_switch.py
+"""
+import asyncio
+import json
+import threading
+import time
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.websocket import websocket_connect
+
+from bench_setup import load_app
+
+PORT = 8097
+QUIET_SECONDS = 0.5
+REPEAT = 5
+
+app = load_app()
+remembered = threading.Event()
+change_appearance = app.change_appearance
+
+
+def recording_change(theme):
+    """
+    Function standing in for change_appearance, which also records when the session has the choice
+    """
+    change_appearance(theme)
+    remembered.set()
+
+
+app.change_appearance = recording_change  # before any session renders the header and registers the pin callback
+
+
+async def read_until_quiet(connection):
+    """
+    Function to read the commands the server sends until it has been quiet for QUIET_SECONDS
+    :param connection: websocket connection of the session
+    :return: a tuple of (commands, time the last one arrived)
+    """
+    commands, last = [], time.perf_counter()
+    while True:
+        try:
+            message = await asyncio.wait_for(connection.read_message(), QUIET_SECONDS)
+        except asyncio.TimeoutError:
+            return commands, last
+        if message is None:
+            return commands, last
+        commands.append(message)
+        last = time.perf_counter()
+
+
+async def reload_switch(client):
+    """
+    Function to do what the browser did after the old switch: fetch the page again and render it in a new session
+    :param client: HTTP client
+    :return: a tuple of (seconds until the last command, bytes received, websocket connection, commands)
+    """
+    start = time.perf_counter()
+    page = await client.fetch(f'http://localhost:{PORT}/')
+    connection = await websocket_connect(f'ws://localhost:{PORT}/?app=index')
+    commands, last = await read_until_quiet(connection)
+    return last - start, len(page.body) + sum(len(command) for command in commands), connection, commands
+
+
+async def browser_switch(client, connection, commands):
+    """
+    Function to do what the browser does after the new switch: fetch the theme stylesheet the first time it is used,
+    then send the choice to the 'theme_choice' pin of the open session
+    :param client: HTTP client
+    :param connection: websocket connection of an open session
+    :param commands: commands the session sent when it rendered, to find the pin callback
+    :return: a tuple of (seconds until the stylesheet arrived, seconds until the server had the choice, bytes)
+    """
+    callback_id = [json.loads(command)['spec']['callback_id'] for command in commands
+                   if json.loads(command)['command'] == 'pin_onchange'
+                   and json.loads(command)['spec']['name'] == 'theme_choice'][-1]  # the header is rendered again
+    remembered.clear()
+    start = time.perf_counter()
+    stylesheet = await client.fetch(f'http://localhost:{PORT}/css/bs-theme/dark.min.css')
+    loaded = time.perf_counter() - start
+    start = time.perf_counter()
+    await connection.write_message(json.dumps({'event': 'callback', 'task_id': callback_id,
+                                                'data': {'name': 'theme_choice', 'value': 'dark'}}))
+    while not remembered.is_set():
+        await asyncio.sleep(0.0005)
+    return loaded, time.perf_counter() - start, len(stylesheet.body)
+
+
+async def run():
+    """
+    Function to switch the theme both ways REPEAT times and print the best times
+    """
+    client = AsyncHTTPClient()
+    reloads, loads, messages = [], [], []
+    for _ in range(REPEAT):
+        elapsed, size, connection, commands = await reload_switch(client)
+        reloads.append(elapsed)
+        loaded, message, stylesheet = await browser_switch(client, connection, commands)
+        loads.append(loaded)
+        messages.append(message)
+        connection.close()
+    print(f'{"switch theme, best of 5":<52} {"server side":>11} {"bytes":>9}')
+    print(f'{"old: reload, new session renders the home page":<52} {min(reloads) * 1000:>8.1f} ms {size:>9}')
+    print(f'{"new: first use of a theme, stylesheet download":<52} {min(loads) * 1000:>8.1f} ms {stylesheet:>9}')
+    print(f'{"new: after that, nothing to fetch":<52} {0:>8.1f} ms {0:>9}')
+    print(f'{"new: choice reaches the session (after the repaint)":<52} {min(messages) * 1000:>8.1f} ms')
+
+
+if __name__ == '__main__':
+    threading.Thread(target=lambda: app.start_server(app.main, port=PORT, auto_open_webbrowser=False),
+                     daemon=True).start()
+    time.sleep(1)
+    asyncio.run(run())
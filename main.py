@@ -1,16 +1,50 @@
 import sqlalchemy as sa
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import re
+import os
+import io
+import math
+import sys
+import glob
+import csv
+import json
+import bisect
+import heapq
+import argparse
+import threading
+import socket
+import time
+import hashlib
+import hmac
+import secrets
+import smtplib
+import sqlite3
+import queue
+import contextlib
+import textwrap
+import html
+if os.name == 'nt':  # for the locks on the write-behind log files of each process
+    import msvcrt
+else:
+    import fcntl
 from pywebio import *
 from pywebio.pin import *
 from pywebio.input import *
 from pywebio.output import *
-from pywebio.session import run_js
-from functools import partial
+from pywebio.session import run_js, eval_js, download, local, register_thread, defer_call
+from pywebio.exceptions import SessionException
+from functools import partial, wraps
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from sqlalchemy import ForeignKey, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import Mapped, mapped_column, sessionmaker, declarative_base, relationship
-from datetime import datetime
+from sqlalchemy.orm import Mapped, mapped_column, sessionmaker, declarative_base, relationship, aliased
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
 
 #### DATABASE SETUP ####
 
@@ -27,11 +61,40 @@ ratingsImport = pd.read_csv('db/ratings.csv')
 # Creating a SQLite Database 'gbb-eli.db' with SQLAlchemy
 sqlite_file_name = "gbb-eli.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
-db = sa.create_engine(sqlite_url, echo=True)
+# SQL statements are logged for the web server, but not for command line commands as it would mix into their output
+sql_echo = not (__name__ == '__main__' and len(sys.argv) > 1)
+# the write engine, for everything which changes the database
+db = sa.create_engine(sqlite_url, echo=sql_echo)
 Session = sessionmaker(bind=db)
+# the read engine, with its own pool of connections which SQLite opens read only, for the pages and reports which only
+# read: with the write-ahead log, readers see the last commit and never wait for a writer (nor a writer for them)
+read_db = sa.create_engine(f'sqlite:///file:{sqlite_file_name}?mode=ro&uri=true', echo=sql_echo)
+ReadSession = sessionmaker(bind=read_db)
 Base = declarative_base()
 
 
+@sa.event.listens_for(db, 'connect')
+def set_write_pragmas(dbapi_connection, connection_record):
+    """
+    Function to switch the database to the write-ahead log when the write engine connects, which is kept in the file
+    :param dbapi_connection: new SQLite connection
+    :param connection_record: connection record of the pool
+    :return:
+    """
+    dbapi_connection.execute('PRAGMA journal_mode = WAL')
+
+
+@sa.event.listens_for(read_db, 'connect')
+def set_read_pragmas(dbapi_connection, connection_record):
+    """
+    Function to make the connections of the read engine refuse writes, on top of the file being opened read only
+    :param dbapi_connection: new SQLite connection
+    :param connection_record: connection record of the pool
+    :return:
+    """
+    dbapi_connection.execute('PRAGMA query_only = ON')
+
+
 # Defining the User class with table name 'users'
 class User(Base):
     """
@@ -42,7 +105,9 @@ class User(Base):
     :var display_name: Display name of the user
     :var password: Password of the user
     :var role_id: Role of the user, Connect to roles table as a foreign key to the id of "roles" table
-    :var subscription_status: Subscription status of the user, default is False
+    :var email: Email address the user's digests are sent to, None if the user does not want digests
+    :var last_digest_at: End of the period covered by the last digest sent to the user, None before the first one
+    :var subscriptions: Locations and categories of notifications the user is subscribed to
     """
     __tablename__ = 'users'
 
@@ -51,7 +116,10 @@ class User(Base):
     display_name: Mapped[str]
     password: Mapped[str]
     role_id: Mapped[int] = mapped_column(ForeignKey("roles.id"))
-    # subscription_status: Mapped[bool] = mapped_column(default=False)
+    email: Mapped[str] = mapped_column(nullable=True)
+    last_digest_at: Mapped[datetime] = mapped_column(nullable=True)
+    subscriptions: Mapped[list["Subscription"]] = relationship("Subscription", back_populates="subscriber",
+                                                               cascade='all, delete')
     associated_role: Mapped[list["Role"]] = relationship("Role", back_populates="users")
     notifications: Mapped[list["Notification"]] = relationship("Notification", back_populates="creator")
 
@@ -90,11 +158,19 @@ class Location(Base):
     :param Base: Base class from SQLAlchemy to inherit from
     :var id: Location ID, the primary key of the table
     :var name: Name of the location
+    :var latitude: Latitude of the location in degrees, None if the location has no coordinates
+    :var longitude: Longitude of the location in degrees, None if the location has no coordinates
+    :var source_id: ID of the site in the GeoJSON data it was imported from, None for locations added by hand
+    :var capacity: Number of parking spaces at the site, None if unknown
     """
     __tablename__ = 'locations'
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    name: Mapped[str]
+    name: Mapped[str] = mapped_column(index=True)
+    latitude: Mapped[float] = mapped_column(nullable=True)
+    longitude: Mapped[float] = mapped_column(nullable=True)
+    source_id: Mapped[str] = mapped_column(nullable=True, index=True, unique=True)
+    capacity: Mapped[int] = mapped_column(nullable=True)
     posts: Mapped[list["ParkingPost"]] = relationship("ParkingPost", back_populates="associated_location")
     reports: Mapped[list["CrimeReport"]] = relationship("CrimeReport", back_populates="associated_location")
 
@@ -115,17 +191,21 @@ class ParkingPost(Base):
     :var type: Type of the parking spot
     :var content: Description / Content of the post
     :var amt_slots: Number of available slots
+    :var latitude: Latitude of the parking spot in degrees, copied from its location when not given
+    :var longitude: Longitude of the parking spot in degrees, copied from its location when not given
     :var ratings: List of ratings for the post, Connect to ratings table as a foreign key
     """
     __tablename__ = 'posts'
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     date_time: Mapped[datetime] = mapped_column(default=datetime.now())
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=True, index=True)
     location: Mapped[str] = mapped_column(ForeignKey("locations.name"))
     type: Mapped[str]
     content: Mapped[str]
     amt_slots: Mapped[int]
+    latitude: Mapped[float] = mapped_column(nullable=True)
+    longitude: Mapped[float] = mapped_column(nullable=True)
     ratings: Mapped[list["ParkingRating"]] = relationship("ParkingRating", back_populates="associated_post",
                                                           cascade='all, delete')
     associated_location: Mapped[list["Location"]] = relationship("Location", back_populates="posts")
@@ -148,15 +228,17 @@ class ParkingRating(Base):
     :var user_id: User ID of the user who rated the post, Connect to users table as a foreign key to the id of "users" table
     :var rating: Rating given by the user
     :var comment: Comment given by the user, default is None
+    :var date_time: Date and time of the rating, None for ratings made before it was recorded
     :var associated_post: List of posts associated with the rating, Connect to posts table as a foreign key
     """
     __tablename__ = 'ratings'
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    post_id: Mapped[int] = mapped_column(ForeignKey("posts.id"))
+    post_id: Mapped[int] = mapped_column(ForeignKey("posts.id"), index=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=True)
     rating: Mapped[int]
     comment: Mapped[str] = mapped_column(nullable=True)
+    date_time: Mapped[datetime] = mapped_column(nullable=True)
     associated_post: Mapped[list["ParkingPost"]] = relationship("ParkingPost", back_populates="ratings")
 
     def __repr__(self):
@@ -177,19 +259,22 @@ class Thread(Base):
     :var up_votes: Number of up votes for the thread
     :var down_votes: Number of down votes for the thread
     :var flags: Number of flags for the thread (i.e. reports made to the thread for inappropriate content)
+    :var is_hidden: Boolean to check if the thread is hidden from the forum by council staff, default is False
     :var reports: List of flags / reports for the thread, Connect to reports table as a foreign key
     """
     __tablename__ = 'threads'
+    __table_args__ = (sa.Index('ix_threads_flags_id', 'flags', 'id'),)  # for the most flagged threads pages
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
     title: Mapped[str]
     content: Mapped[str]
-    parent_id: Mapped[int] = mapped_column(ForeignKey("threads.id"), nullable=True)
+    parent_id: Mapped[int] = mapped_column(ForeignKey("threads.id"), nullable=True, index=True)
     date_time: Mapped[datetime] = mapped_column(default=datetime.now())
     up_votes: Mapped[int]
     down_votes: Mapped[int]
     flags: Mapped[int]
+    is_hidden: Mapped[bool] = mapped_column(default=False, server_default=sa.false())
     reports: Mapped[list["ContentReport"]] = relationship("ContentReport", back_populates="associated_thread",
                                                           cascade="all, delete")
 
@@ -210,10 +295,11 @@ class ContentReport(Base):
     :var associated_thread: List of threads associated with the report, Connect to threads table as a foreign key
     """
     __tablename__ = 'content_reports'
+    __table_args__ = (sa.Index('ix_content_reports_date_time_id', 'date_time', 'id'),)  # for the moderation queue pages
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
-    thread_id: Mapped[int] = mapped_column(ForeignKey("threads.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+    thread_id: Mapped[int] = mapped_column(ForeignKey("threads.id"), index=True)
     comment: Mapped[str]
     date_time: Mapped[datetime] = mapped_column(default=datetime.now())
     associated_thread: Mapped[list["Thread"]] = relationship("Thread", back_populates="reports")
@@ -238,6 +324,15 @@ class CrimeReport(Base):
     :var status: Status of the report, default is 'Pending'
     """
     __tablename__ = 'crime_reports'
+    # composite indexes for the crime registry pages: each filter column followed by the (date_time, id) page order
+    __table_args__ = (
+        sa.Index('ix_crime_reports_date_time_id', 'date_time', 'id'),
+        sa.Index('ix_crime_reports_status_date_time_id', 'status', 'date_time', 'id'),
+        sa.Index('ix_crime_reports_category_date_time_id', 'category', 'date_time', 'id'),
+        sa.Index('ix_crime_reports_location_date_time_id', 'location', 'date_time', 'id'),
+        sa.Index('ix_crime_reports_is_emergency_date_time_id', 'is_emergency', 'date_time', 'id'),
+        sa.Index('ix_crime_reports_user_id_date_time_id', 'user_id', 'date_time', 'id'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
@@ -267,10 +362,18 @@ class Notification(Base):
     :var content: Content of the notification
     :var date_time: Date and time of the notification, default is the current date and time
     :var category: Category of the notification (if it's an announcement, alert, etc.)
-    :var status: Status of the notification, default is 'Active'
+    :var status: Status of the notification, default is 'Active' ('Scheduled' until it is published, 'Expired' after)
+    :var location: Location the notification is about, None if it is not about one location
+    :var publish_at: Date and time a scheduled announcement is published, None once it has been published
+    :var expire_at: Date and time the announcement expires, None if it does not expire
     :var creator: For joining the users table, Connect to users table as a foreign key
     """
     __tablename__ = 'notifications'
+    __table_args__ = (
+        # for loading the announcement scheduler (see load_announcement_schedule())
+        sa.Index('ix_notifications_status_publish_at', 'status', 'publish_at'),
+        sa.Index('ix_notifications_status_expire_at', 'status', 'expire_at'),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
@@ -280,15 +383,316 @@ class Notification(Base):
     date_time: Mapped[datetime] = mapped_column(default=datetime.now())
     category: Mapped[str]
     status: Mapped[str] = mapped_column(default='Active')
+    location: Mapped[str] = mapped_column(ForeignKey("locations.name"), nullable=True)
+    publish_at: Mapped[datetime] = mapped_column(nullable=True)
+    expire_at: Mapped[datetime] = mapped_column(nullable=True)
     creator: Mapped[list["User"]] = relationship("User", back_populates="notifications")
 
     def __repr__(self):
         return f"<SiteNotification(id={self.id}, user_id={self.user_id}, title={self.title})>"
 
 
+class Subscription(Base):
+    """
+    Subscription class to define the structure of the 'subscriptions' table -- for the locations and categories
+    of notifications and crime reports users want in their feeds, e.g. Crime Alert at Bus Station
+    :param Base: Base class from SQLAlchemy to inherit from
+    :var id: Subscription ID, the primary key of the table
+    :var user_id: User ID of the subscriber, Connect to users table as a foreign key
+    :var location: Location subscribed to, None for all locations
+    :var category: Category subscribed to, None for all categories
+    :var subscriber: For joining the users table
+    """
+    __tablename__ = 'subscriptions'
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+    location: Mapped[str] = mapped_column(ForeignKey("locations.name"), nullable=True)
+    category: Mapped[str] = mapped_column(nullable=True)
+    subscriber: Mapped[list["User"]] = relationship("User", back_populates="subscriptions")
+
+    def __repr__(self):
+        return f"<Subscription(user_id={self.user_id}, location={self.location}, category={self.category})>"
+
+
+class FeedItem(Base):
+    """
+    FeedItem class to define the structure of the 'feed_items' table -- for the notifications and crime reports
+    delivered to the feeds of their subscribers when they were posted
+    :param Base: Base class from SQLAlchemy to inherit from
+    :var id: Feed item ID, the primary key of the table
+    :var user_id: User ID of the subscriber, Connect to users table as a foreign key
+    :var notification_id: Notification ID of the item, None if the item is a crime report
+    :var crime_report_id: Crime report ID of the item, None if the item is a notification
+    :var date_time: Date and time the item was posted
+    """
+    __tablename__ = 'feed_items'
+    __table_args__ = (sa.Index('ix_feed_items_user_id_id', 'user_id', 'id'),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    notification_id: Mapped[int] = mapped_column(ForeignKey("notifications.id"), nullable=True)
+    crime_report_id: Mapped[int] = mapped_column(ForeignKey("crime_reports.id"), nullable=True)
+    date_time: Mapped[datetime]
+
+    def __repr__(self):
+        return f"<FeedItem(id={self.id}, user_id={self.user_id})>"
+
+
+class CrimeMessage(Base):
+    """
+    CrimeMessage class to define the structure of the 'crime_messages' table -- for the conversation between police
+    staff and the power user who made a crime report
+    :param Base: Base class from SQLAlchemy to inherit from
+    :var id: Message ID, the primary key of the table
+    :var crime_id: Crime report ID of the conversation, Connect to crime_reports table as a foreign key
+    :var user_id: User ID of the sender, Connect to users table as a foreign key
+    :var content: Text of the message
+    :var date_time: Date and time the message was sent
+    """
+    __tablename__ = 'crime_messages'
+    __table_args__ = (sa.Index('ix_crime_messages_crime_id_id', 'crime_id', 'id'),)  # for the history pages
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    crime_id: Mapped[int] = mapped_column(ForeignKey("crime_reports.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    content: Mapped[str]
+    date_time: Mapped[datetime]
+
+    def __repr__(self):
+        return f"<CrimeMessage(id={self.id}, crime_id={self.crime_id}, user_id={self.user_id})>"
+
+
+class CrimeMessageRead(Base):
+    """
+    CrimeMessageRead class to define the structure of the 'crime_message_reads' table -- for the last message of each
+    conversation a user has read, the messages after it are unread
+    :param Base: Base class from SQLAlchemy to inherit from
+    :var crime_id: Crime report ID of the conversation, part of the primary key
+    :var user_id: User ID of the reader, part of the primary key
+    :var last_read_id: Message ID of the last message the user has read
+    """
+    __tablename__ = 'crime_message_reads'
+
+    crime_id: Mapped[int] = mapped_column(ForeignKey("crime_reports.id"), primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    last_read_id: Mapped[int] = mapped_column(default=0)
+
+    def __repr__(self):
+        return f"<CrimeMessageRead(crime_id={self.crime_id}, user_id={self.user_id}, last_read_id={self.last_read_id})>"
+
+
+class OccupancyReading(Base):
+    """
+    OccupancyReading class to define the structure of the 'occupancy_readings' table -- for the history of live
+    occupancy readings sent by counters and sensors, downsampled to one row per location and minute
+    :param Base: Base class from SQLAlchemy to inherit from
+    :var id: Reading ID, the primary key of the table
+    :var location_id: Location ID of the counted site, Connect to locations table as a foreign key
+    :var date_time: Start of the minute the readings were taken in
+    :var samples: Number of readings taken in the minute
+    :var occupied_sum: Sum of the occupied spaces of the readings, the average is occupied_sum / samples
+    :var min_occupied: Fewest occupied spaces read in the minute
+    :var max_occupied: Most occupied spaces read in the minute
+    :var capacity: Number of spaces the site reported, None if it was not reported
+    """
+    __tablename__ = 'occupancy_readings'
+    __table_args__ = (sa.Index('ix_occupancy_readings_location_id_date_time', 'location_id', 'date_time', unique=True),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    location_id: Mapped[int] = mapped_column(ForeignKey("locations.id"))
+    date_time: Mapped[datetime]
+    samples: Mapped[int]
+    occupied_sum: Mapped[int]
+    min_occupied: Mapped[int]
+    max_occupied: Mapped[int]
+    capacity: Mapped[int] = mapped_column(nullable=True)
+
+    def __repr__(self):
+        return f"<OccupancyReading(location_id={self.location_id}, date_time={self.date_time}, samples={self.samples})>"
+
+
+class DigestRun(Base):
+    """
+    DigestRun class to define the structure of the 'digest_runs' table -- for the progress of the email digest job,
+    so a run which stopped part way (e.g. the server crashed) carries on after the last user it finished
+    :param Base: Base class from SQLAlchemy to inherit from
+    :var id: Run ID, the primary key of the table
+    :var date_time: End of the period the run's digests cover
+    :var last_user_id: User ID of the last user whose digest was sent, users are processed in order of their IDs
+    :var sent_count: Number of digests sent so far
+    :var finished_at: Date and time the run finished, None while it is still running
+    """
+    __tablename__ = 'digest_runs'
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    date_time: Mapped[datetime]
+    last_user_id: Mapped[int] = mapped_column(default=0)
+    sent_count: Mapped[int] = mapped_column(default=0)
+    finished_at: Mapped[datetime] = mapped_column(nullable=True)
+
+    def __repr__(self):
+        return f"<DigestRun(id={self.id}, date_time={self.date_time}, last_user_id={self.last_user_id})>"
+
+
+class UserPreference(Base):
+    """
+    UserPreference class to define the structure of the 'user_preferences' table -- for how each user likes the pages
+    to look, loaded once when they log in. Empty columns mean the default of the app (see DEFAULT_PREFERENCES)
+    :param Base: Base class from SQLAlchemy to inherit from
+    :var user_id: User ID, the primary key of the table
+    :var theme: PyWebIO theme of the pages, one of THEMES
+    :var font_scale: Font scale of the pages, between FONT_SCALE_MIN and FONT_SCALE_MAX
+    :var feed_page_size: Number of items shown in the notification feed, one of FEED_PAGE_SIZES
+    :var collapse_comments: True to show the comments of forum threads folded away
+    """
+    __tablename__ = 'user_preferences'
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    theme: Mapped[str] = mapped_column(nullable=True)
+    font_scale: Mapped[float] = mapped_column(nullable=True)
+    feed_page_size: Mapped[int] = mapped_column(nullable=True)
+    collapse_comments: Mapped[bool] = mapped_column(nullable=True)
+
+    def __repr__(self):
+        return f"<UserPreference(user_id={self.user_id}, theme={self.theme}, font_scale={self.font_scale})>"
+
+
+class WriteBehindLog(Base):
+    """
+    WriteBehindLog class to define the structure of the 'write_behind_log' table -- for the last change of each
+    process's write-behind log file which is saved in the database, so changes replayed from the file after the
+    process stops are not applied twice (see replay_counter_log())
+    :param Base: Base class from SQLAlchemy to inherit from
+    :var log_file: Name of the log file, the primary key of the table
+    :var sequence: Sequence number of the last change saved
+    :var saved_at: Date and time the last change was saved
+    """
+    __tablename__ = 'write_behind_log'
+
+    log_file: Mapped[str] = mapped_column(primary_key=True)
+    sequence: Mapped[int]
+    saved_at: Mapped[datetime]
+
+    def __repr__(self):
+        return f"<WriteBehindLog(log_file={self.log_file}, sequence={self.sequence})>"
+
+
+class BackgroundJob(Base):
+    """
+    BackgroundJob class to define the structure of the 'background_jobs' table -- for the lease which lets one worker
+    of one process run a job at a time, when the job is next due, and how its runs have gone
+    :param Base: Base class from SQLAlchemy to inherit from
+    :var name: Job name, the primary key of the table
+    :var lease_owner: Runner ID of the process running the job, None when no one is
+    :var lease_expires_at: Date and time the lease runs out unless it is renewed, another process may take it then
+    :var next_run_at: Date and time the job is next due, shared by all processes
+    :var last_started_at: Date and time the last run started
+    :var last_duration: Seconds the last run took
+    :var last_status: Status of the last run ('Succeeded', 'Failed')
+    :var last_error: Error of the last run if it failed
+    :var run_count: Number of runs so far, in all processes
+    :var failure_count: Number of failed runs so far, in all processes
+    """
+    __tablename__ = 'background_jobs'
+
+    name: Mapped[str] = mapped_column(primary_key=True)
+    lease_owner: Mapped[str] = mapped_column(nullable=True)
+    lease_expires_at: Mapped[datetime] = mapped_column(nullable=True)
+    next_run_at: Mapped[datetime] = mapped_column(nullable=True)
+    last_started_at: Mapped[datetime] = mapped_column(nullable=True)
+    last_duration: Mapped[float] = mapped_column(nullable=True)
+    last_status: Mapped[str] = mapped_column(nullable=True)
+    last_error: Mapped[str] = mapped_column(nullable=True)
+    run_count: Mapped[int] = mapped_column(default=0)
+    failure_count: Mapped[int] = mapped_column(default=0)
+
+    def __repr__(self):
+        return f"<BackgroundJob(name={self.name}, lease_owner={self.lease_owner}, next_run_at={self.next_run_at})>"
+
+
+class ChangeVersion(Base):
+    """
+    ChangeVersion class to define the structure of the 'change_versions' table -- for the version stamps of the tables
+    of the app's data, so a cache in any process can tell it is out of date (see table_versions())
+    :param Base: Base class from SQLAlchemy to inherit from
+    :var table_name: Name of the versioned table, the primary key of the table
+    :var version: Version of the table, increased by triggers on every row inserted, updated or deleted
+    """
+    __tablename__ = 'change_versions'
+
+    table_name: Mapped[str] = mapped_column(primary_key=True)
+    version: Mapped[int] = mapped_column(default=0)
+
+    def __repr__(self):
+        return f"<ChangeVersion(table_name={self.table_name}, version={self.version})>"
+
+
+def archive_table(table, *indexes):
+    """
+    Function to define the archive table of a table, with the same columns (without their foreign keys and defaults)
+    and the date and time each row was archived. New columns of the table are added to its archive table too.
+    :param table: table whose old rows are moved to the archive table
+    :param indexes: lists of the columns of each index of the archive table
+    :return: the archive table, named after the table with '_archive'
+    """
+    return sa.Table(f'{table.name}_archive', Base.metadata,
+                    *[sa.Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+                      for column in table.columns],
+                    sa.Column('archived_at', sa.DateTime, nullable=False),
+                    *[sa.Index(f'ix_{table.name}_archive_{"_".join(columns)}', *columns) for columns in indexes])
+
+
+# closed crime reports and inactive forum threads are moved out of the tables the pages read (see run_archival())
+crime_reports_archive = archive_table(CrimeReport.__table__, ['user_id', 'date_time', 'id'], ['date_time', 'id'],
+                                      ['location'], ['category'])
+threads_archive = archive_table(Thread.__table__, ['parent_id'])
+
 # Creating the tables in the database
 Base.metadata.create_all(db)
 
+# create_all() does not change existing tables, so columns added to the models later are added here
+existing_tables = sa.inspect(db)
+with db.begin() as conn:
+    for table in Base.metadata.sorted_tables:
+        existing_columns = [column['name'] for column in existing_tables.get_columns(table.name)]
+        for column in table.columns:
+            if column.name not in existing_columns:
+                conn.execute(sa.text(f'ALTER TABLE {table.name} ADD COLUMN {sa.schema.CreateColumn(column).compile(db)}'))
+
+# create_all() only adds indexes together with new tables, so indexes added to the models later are created here
+for table in Base.metadata.sorted_tables:
+    for index in table.indexes:
+        index.create(db, checkfirst=True)
+
+# SQLite R-tree tables indexing the coordinates of locations and posts for the nearest parking queries.
+# They are kept in step with their tables by triggers, so inserts from anywhere (forms, CSV imports) are indexed.
+spatial_tables = {'location_rtree': 'locations', 'post_rtree': 'posts'}
+with db.begin() as conn:
+    for rtree_name, table_name in spatial_tables.items():
+        is_new_rtree = not sa.inspect(conn).has_table(rtree_name)
+        conn.execute(sa.text(f'CREATE VIRTUAL TABLE IF NOT EXISTS {rtree_name} '
+                             f'USING rtree(id, min_lat, max_lat, min_lon, max_lon)'))
+        conn.execute(sa.text(f'''
+            CREATE TRIGGER IF NOT EXISTS {rtree_name}_insert AFTER INSERT ON {table_name}
+            WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+                INSERT OR REPLACE INTO {rtree_name} VALUES
+                    (new.id, new.latitude, new.latitude, new.longitude, new.longitude);
+            END'''))
+        conn.execute(sa.text(f'''
+            CREATE TRIGGER IF NOT EXISTS {rtree_name}_update AFTER UPDATE OF latitude, longitude ON {table_name} BEGIN
+                DELETE FROM {rtree_name} WHERE id = old.id;
+                INSERT INTO {rtree_name} SELECT new.id, new.latitude, new.latitude, new.longitude, new.longitude
+                    WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+            END'''))
+        conn.execute(sa.text(f'''
+            CREATE TRIGGER IF NOT EXISTS {rtree_name}_delete AFTER DELETE ON {table_name} BEGIN
+                DELETE FROM {rtree_name} WHERE id = old.id;
+            END'''))
+        if is_new_rtree:  # rows with coordinates from before the triggers existed are indexed once
+            conn.execute(sa.text(f'INSERT INTO {rtree_name} SELECT id, latitude, latitude, longitude, longitude '
+                                 f'FROM {table_name} WHERE latitude IS NOT NULL AND longitude IS NOT NULL'))
+
 # Inserting default user roles and other dummy data into the respective tables if they are empty (for first run)
 with Session() as sesh:
     if sesh.query(Role).count() == 0:
@@ -310,24 +714,859 @@ with Session() as sesh:
     if sesh.query(Notification).count() == 0:
         notificationsImport.to_sql('notifications', db, if_exists='append', index=False)
 
+# triggers increasing the version stamp of a table whenever any of its rows change, on every table of the app's data
+# (not the tables the app keeps its own bookkeeping in), so caches in any process can tell when they are out of date
+unversioned_tables = ['change_versions', 'background_jobs', 'write_behind_log', 'digest_runs']
+versioned_tables = [table_name for table_name in Base.metadata.tables if table_name not in unversioned_tables]
+with db.begin() as conn:
+    for table_name in versioned_tables:
+        conn.execute(sa.text('INSERT OR IGNORE INTO change_versions (table_name, version) VALUES (:table_name, 0)'),
+                     {'table_name': table_name})
+        for event in ['INSERT', 'UPDATE', 'DELETE']:
+            conn.execute(sa.text(f'''
+                CREATE TRIGGER IF NOT EXISTS {table_name}_version_{event.lower()} AFTER {event} ON {table_name} BEGIN
+                    INSERT INTO change_versions (table_name, version) VALUES ('{table_name}', 1)
+                        ON CONFLICT (table_name) DO UPDATE SET version = version + 1;
+                END'''))
+
+# locations created before they had coordinates take them from the CSV, and posts without coordinates from their location
+with db.begin() as conn:
+    conn.execute(sa.update(Location).where(Location.name == sa.bindparam('location_name'), Location.latitude.is_(None))
+                 .values(latitude=sa.bindparam('location_latitude'), longitude=sa.bindparam('location_longitude')),
+                 [{'location_name': location.name, 'location_latitude': location.latitude,
+                   'location_longitude': location.longitude}
+                  for location in locationsImport.dropna(subset=['latitude', 'longitude']).itertuples()])
+    located = sa.select(Location.name, Location.latitude, Location.longitude).where(
+        Location.latitude.is_not(None)).subquery()
+    conn.execute(sa.update(ParkingPost).where(ParkingPost.location == located.c.name, ParkingPost.latitude.is_(None))
+                 .values(latitude=located.c.latitude, longitude=located.c.longitude))
+
+# only announcements not published yet keep their publishing time, so ones published before it was cleared on
+# publishing lose it here
+with db.begin() as conn:
+    conn.execute(sa.update(Notification).where(Notification.status.in_(['Active', 'Expired']),
+                                               Notification.publish_at.is_not(None)).values(publish_at=None))
+
 #### GLOBAL VARIABLES ####
 
-# defining global variables to keep track of font size changes
-smaller_font_clicks = 0
-bigger_font_clicks = 0
+# font scale of the page, a multiple of the browser's root font size moved by the Aa+ and Aa- buttons
+FONT_SCALE_STEP = 0.0625  # 1px of a 16px root font
+FONT_SCALE_MIN = 1 - 5 * FONT_SCALE_STEP
+FONT_SCALE_MAX = 1 + 6 * FONT_SCALE_STEP
 
-# define a global variable to store the appearance status (counter)
-appearance = 0
+# PyWebIO themes the Switch Theme button goes through, in order
+THEMES = ['default', 'dark', 'sketchy']
 
 # define a global variable to store if the user has a valid login
 valid_user = None
 
-# define a global variable to store the locations list so that session won't be necessary to query it again in form fields
-with Session() as sesh:
-    locations_list = []
-    locations = sesh.query(Location).all()
-    for location in locations:
-        locations_list.append(str(location.name))
+# scrypt cost settings for password hashes (16 MiB of memory per hash) and the number of hashes allowed to run at once
+PASSWORD_SCRYPT_N = 2 ** 14
+PASSWORD_SCRYPT_R = 8
+PASSWORD_SCRYPT_P = 1
+PASSWORD_HASH_WORKERS = max(1, (os.cpu_count() or 2) // 2)  # half of the cores, leaving the rest for sessions
+
+# rows fetched from the database cursor at a time while exporting, and the largest export offered as a browser download
+EXPORT_BATCH_SIZE = 5000
+EXPORT_DOWNLOAD_LIMIT = 50 * 1024 * 1024
+EXPORT_DIRECTORY = 'exports'
+
+# directory of the Parquet analytics snapshots and the number of rows written to one snapshot file at most
+SNAPSHOT_DIRECTORY = 'snapshots'
+SNAPSHOT_BATCH_SIZE = 100000
+
+# search radius choices of the "parking near me" view, and the first and largest radius searched for the nearest N results
+NEARBY_RADIUS_CHOICES_KM = [0.5, 1, 2, 5, 10]
+NEARBY_START_RADIUS_KM = 0.25
+NEARBY_MAX_RADIUS_KM = 50
+EARTH_RADIUS_KM = 6371.0
+
+# characters read from a GeoJSON file at a time, and the parking sites written to the database in one transaction
+GEOJSON_CHUNK_SIZE = 64 * 1024
+GEOJSON_BATCH_SIZE = 1000
+
+# local endpoints accepting live occupancy readings, the readings kept in memory per site,
+# and how often they are downsampled to one row per minute and saved to the database
+OCCUPANCY_HOST = 'localhost'
+OCCUPANCY_HTTP_PORT = 3001
+OCCUPANCY_UDP_PORT = 3002
+OCCUPANCY_BUFFER_SIZE = 256
+OCCUPANCY_BUCKET_SECONDS = 60
+OCCUPANCY_FLUSH_SECONDS = 5
+OCCUPANCY_CLOCK_SKEW_SECONDS = 3600  # how far ahead of the server's clock a reading's time may be
+
+# how often the hour-of-week availability profiles take in new posts and occupancy readings
+AVAILABILITY_REFRESH_SECONDS = 300
+AVAILABILITY_CHUNK_SIZE = 200000
+
+# number of rows shown on one page of the moderation tables and the crime registry
+MODERATION_PAGE_SIZE = 20
+CRIME_PAGE_SIZE = 20
+
+# number of suggestions offered while typing a location
+LOCATION_SUGGESTIONS = 10
+
+# define a global variable to cache the location names so they are not queried again for every form field.
+# It is reloaded when the version stamp of the 'locations' table changes (see get_location_cache())
+location_cache = {'version': None, 'keys': [], 'names': []}
+location_cache_lock = threading.Lock()
+
+# define a global variable to keep the version stamps of the tables read by this process, with the connection which
+# checks whether another connection (in this process or any other) has committed since (see table_versions())
+change_version_state = {'connection': None, 'data_version': None, 'versions': {}}
+change_version_lock = threading.Lock()
+
+# categories which can be subscribed to: the categories of police notifications and council updates,
+# and the crime reports made by power users
+NOTIFICATION_CATEGORIES = ['Emergency Alert', 'Crime Alert', 'Public Safety Announcement', 'Traffic Advisory',
+                           'Missing Vehicle Alert', 'Crime Prevention Tips', 'New Facilities', 'Other']
+CRIME_REPORT_CATEGORY = 'Crime Reports'
+
+# define a global variable to cache the subscriptions as an inverted index from (location, category) to the IDs of
+# the subscribers, reloaded when the version stamp of the 'subscriptions' table changes (see get_subscription_index())
+subscription_index = {'version': None, 'subscribers': {}}
+subscription_index_lock = threading.Lock()
+FEED_PAGE_SIZE = 50
+
+# display preferences of users who have not chosen otherwise, the feed page sizes they can choose from, and how long
+# changes are left to gather before they are written, so a few clicks in a row make one write
+DEFAULT_PREFERENCES = {'theme': 'default', 'font_scale': 1.0, 'feed_page_size': FEED_PAGE_SIZE,
+                       'collapse_comments': False}
+FEED_PAGE_SIZES = [20, 50, 100]
+PREFERENCE_WRITE_SECONDS = 1
+preference_writes = {}  # user ID to the preference changes waiting to be written
+preference_writes_lock = threading.Lock()
+preference_writes_ready = threading.Event()
+
+# votes, report flags and ratings are written behind: gathered in memory per (table, row ID, column) and written in
+# one transaction every COUNTER_FLUSH_MS or COUNTER_FLUSH_OPERATIONS changes, whichever comes first.
+# COUNTER_WRITES is what a change has been kept by when the user is told it is saved:
+#   'immediate' - the database, every change is committed in a transaction of its own (nothing is written behind)
+#   'logged' - a log file of the process, so queued changes survive the app stopping, but not the machine losing power
+#   'memory' - memory only, the changes of the last COUNTER_FLUSH_MS are lost if the app stops without a flush
+COUNTER_WRITES = 'logged'
+COUNTER_FLUSH_MS = 200
+COUNTER_FLUSH_OPERATIONS = 500
+COUNTER_LOG_PREFIX = 'counter-writes'  # each process logs to <prefix>-<JOB_RUNNER_ID>.log, see replay_counter_log()
+counter_writes = {'deltas': {}, 'rows': [], 'operations': 0,  # waiting for the next flush
+                  'flushing_deltas': {}, 'flushing_rows': [],  # taken by the flush running now, still pending
+                  'sequence': 0, 'log_file': None, 'log': None, 'lock': None, 'replayed': False}
+counter_writes_lock = threading.Lock()
+counter_flush_lock = threading.Lock()  # one flush at a time, so a flush returns once everything queued is saved
+counter_writes_ready = threading.Event()  # set by every change, the flush starts COUNTER_FLUSH_MS after the first
+counter_writes_full = threading.Event()  # set when COUNTER_FLUSH_OPERATIONS changes are waiting
+
+# categories of council updates, the most announcements published or expired in one transaction,
+# and how long the scheduler waits before trying again after a failed transaction
+COUNCIL_UPDATE_CATEGORIES = ['New Facilities', 'Public Safety Announcement', 'Traffic Advisory', 'Other']
+ANNOUNCEMENT_BATCH_SIZE = 500
+ANNOUNCEMENT_RETRY_SECONDS = 60
+
+# define a global variable for the upcoming announcement transitions, a min-heap of (due date and time, notification ID,
+# 'publish' or 'expire'), and for the sessions told about newly published announcements, one queue per session
+announcement_schedule = []
+announcement_schedule_changed = threading.Condition()
+announcement_listeners = set()
+announcement_listeners_lock = threading.Lock()
+
+# number of messages shown on one page of a crime report conversation, and how often an open conversation checks
+# that it is still on screen while no messages arrive
+CHAT_PAGE_SIZE = 30
+CHAT_CHECK_SECONDS = 5
+
+# define a global variable for the sessions which have a crime report conversation open: the crime report ID to
+# the set of queues new messages are pushed to, one queue per open conversation
+chat_listeners = {}
+chat_listeners_lock = threading.Lock()
+
+# local SMTP server the email digests are sent through, the connections kept open to it, the users whose digests are
+# built at a time, the items listed per digest section, how often digests are sent and the period the first one covers
+DIGEST_SMTP_HOST = 'localhost'
+DIGEST_SMTP_PORT = 1025
+DIGEST_SMTP_CONNECTIONS = 2
+DIGEST_SENDER = 'Gateshead By Bike <digest@gatesheadbybike.local>'
+DIGEST_USER_BATCH = 500
+DIGEST_SECTION_ITEMS = 10
+DIGEST_INTERVAL = timedelta(days=1)
+DIGEST_CHECK_SECONDS = 600
+
+# background jobs: the most jobs running at once, how long the runner sleeps at most between looking for due jobs,
+# the retries of a failed run and their backoff (doubled for each retry), how long a job lease lasts unless it is
+# renewed, the ID this process holds leases under, and when the analytics snapshots are updated (cron, 3am daily)
+JOB_WORKERS = 4
+JOB_TICK_SECONDS = 1
+JOB_RETRIES = 3
+JOB_RETRY_SECONDS = 30
+JOB_RETRY_MAX_SECONDS = 3600
+JOB_LEASE_SECONDS = 300
+JOB_RUNNER_ID = f'{socket.gethostname()}-{os.getpid()}-{secrets.token_hex(4)}'
+SNAPSHOT_CRON = '0 3 * * *'
+
+# archival of cold data: how long a forum thread has to go without new comments, the rows moved in one transaction,
+# and when the archival job runs (cron, after the snapshots)
+ARCHIVE_THREAD_AGE = timedelta(days=365)
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_CRON = '30 3 * * *'
+ARCHIVE_PAGE_SIZE = 20
+
+# online backups of the database: pages copied in each step of the backup and the pause between steps, where the
+# copies are kept, how many of the newest daily, weekly and monthly copies are kept, and when the backup job runs
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SECONDS = 0.02
+BACKUP_DIRECTORY = 'backups'
+BACKUP_RETENTION = {'daily': 7, 'weekly': 4, 'monthly': 6}
+BACKUP_CRON = '0 4 * * *'
+
+
+#### READ MODEL FUNCTIONS ####
+# Feeds and tables only need a few columns to build their HTML, so they are read with Core selects.
+# Core returns light tuple-like rows (with attribute access) instead of full ORM objects tracked by a session,
+# and the joins below replace the per-row lookups (usernames, role badges, ratings) the pages used to make.
+
+def read_rows(statement):
+    """
+    Function to run a read-only select statement on the read engine and return its rows
+    :param statement: SQLAlchemy Core select statement to execute
+    :return: a list of Row objects, the selected columns can be accessed as attributes (e.g. row.title)
+    """
+    with read_db.connect() as conn:
+        return conn.execute(statement).all()
+
+
+def read_post_cards(user_id=None, limit=10):
+    """
+    Function to read the columns needed for the parking post cards
+    :param user_id: User ID of the posts to be read, default is None which reads posts of all users
+    :param limit: maximum number of posts to read, newest first
+    :return: a list of rows with id, user_id, location, location_id, type, content, amt_slots, date_time,
+             rating_total and rating_count (the sum and number of the post's saved ratings, see post_average_rating())
+    """
+    rating_total = (sa.select(func.coalesce(func.sum(ParkingRating.rating), 0))
+                    .where(ParkingRating.post_id == ParkingPost.id)
+                    .scalar_subquery())
+    rating_count = (sa.select(func.count(ParkingRating.id))
+                    .where(ParkingRating.post_id == ParkingPost.id)
+                    .scalar_subquery())
+    location_id = sa.select(Location.id).where(Location.name == ParkingPost.location).limit(1).scalar_subquery()
+    statement = sa.select(ParkingPost.id, ParkingPost.user_id, ParkingPost.location, location_id.label('location_id'),
+                          ParkingPost.type, ParkingPost.content, ParkingPost.amt_slots, ParkingPost.date_time,
+                          rating_total.label('rating_total'), rating_count.label('rating_count'))
+    if user_id is not None:
+        statement = statement.where(ParkingPost.user_id == user_id)
+    return read_rows(statement.order_by(ParkingPost.id.desc()).limit(limit))
+
+
+def post_average_rating(post):
+    """
+    Function to get the average rating of a post card, counting the ratings still queued to be written
+    :param post: row read by read_post_cards()
+    :return: the average rating rounded to 1 decimal place, None if the post has no ratings
+    """
+    queued_ratings = [rating['rating'] for rating in pending_rows('ratings', 'post_id', post.id)]
+    ratingCount = post.rating_count + len(queued_ratings)
+    if ratingCount == 0:
+        return None
+    return round((post.rating_total + sum(queued_ratings)) / ratingCount, 1)
+
+
+def thread_author_columns():
+    """
+    Function to list the thread columns joined with the author's name and role, shared by thread cards and comments
+    :return: a list of columns to be passed to select()
+    """
+    return [Thread.id, Thread.user_id, Thread.parent_id, Thread.title, Thread.content, Thread.date_time,
+            Thread.up_votes, Thread.down_votes, Thread.is_hidden, User.display_name, User.role_id,
+            Role.name.label('role_name'), Role.color.label('role_color')]
+
+
+def read_thread_cards(user_id=None, limit=10):
+    """
+    Function to read the columns needed for the forum thread cards
+    :param user_id: User ID of the threads to be read, default is None which reads threads of all users
+    :param limit: maximum number of threads to read, newest first
+    :return: a list of rows with the thread columns and the author's display name and role
+    """
+    statement = (sa.select(*thread_author_columns())
+                 .outerjoin(User, User.id == Thread.user_id)
+                 .outerjoin(Role, Role.id == User.role_id)
+                 .where(Thread.parent_id.is_(None)))
+    if user_id is not None:
+        statement = statement.where(Thread.user_id == user_id)
+    else:  # threads hidden by council staff are only shown to their authors
+        statement = statement.where(Thread.is_hidden == False)
+    return read_rows(statement.order_by(Thread.id.desc()).limit(limit))
+
+
+def read_thread_comments(thread_ids):
+    """
+    Function to read the comments of several threads with one query
+    :param thread_ids: IDs of the parent threads
+    :return: a dictionary of parent thread ID to its list of comment rows, oldest first
+    """
+    comments = {thread_id: [] for thread_id in thread_ids}
+    if len(comments) == 0:
+        return comments
+    statement = (sa.select(*thread_author_columns())
+                 .outerjoin(User, User.id == Thread.user_id)
+                 .outerjoin(Role, Role.id == User.role_id)
+                 .where(Thread.parent_id.in_(comments.keys()))
+                 .order_by(Thread.id.asc()))
+    for comment in read_rows(statement):
+        comments[comment.parent_id].append(comment)
+    return comments
+
+
+def read_keyset_page(statement, sort_columns, descending, after=None, limit=20):
+    """
+    Function to read one page of a select statement with keyset pagination
+    Instead of skipping rows with OFFSET, the page starts right after the sort key values of the previous page's last row,
+    so reading a page costs the same however deep into the results it is.
+    :param statement: select statement with its filters applied
+    :param sort_columns: columns to sort by, ending with a unique column (e.g. the ID) to break ties
+    :param descending: True to sort all the columns in descending order, False for ascending
+    :param after: cursor returned for the previous page, default is None which reads the first page
+    :param limit: number of rows on a page
+    :return: a tuple of (rows of the page, cursor for the next page or None if this is the last page)
+    """
+    if after is not None:
+        sort_key = sa.tuple_(*sort_columns)
+        statement = statement.where(sort_key < tuple(after) if descending else sort_key > tuple(after))
+    # the sort key values are also selected under their own labels to build the cursor from the page's last row
+    statement = statement.add_columns(*[column.label(f'sort_key_{i}') for i, column in enumerate(sort_columns)])
+    statement = statement.order_by(*[column.desc() if descending else column.asc() for column in sort_columns])
+    rows = read_rows(statement.limit(limit + 1))  # one extra row tells if there is a next page
+    if len(rows) <= limit:
+        return rows, None
+    last_row = rows[limit - 1]
+    return rows[:limit], tuple(last_row._mapping[f'sort_key_{i}'] for i in range(len(sort_columns)))
+
+
+# sort options of the moderation tables, each is a tuple of (label, sort columns, descending)
+CONTENT_REPORT_SORTS = {
+    'newest': ('Newest reports first', [ContentReport.date_time, ContentReport.id], True),
+    'oldest': ('Oldest reports first', [ContentReport.date_time, ContentReport.id], False),
+    'most_flagged': ('Most flagged threads first', [Thread.flags, Thread.id, ContentReport.id], True),
+}
+FLAGGED_THREAD_SORTS = {
+    'most_flagged': ('Most flagged first', [Thread.flags, Thread.id], True),
+    'newest': ('Newest threads first', [Thread.id], True),
+    'oldest': ('Oldest threads first', [Thread.id], False),
+}
+
+
+def moderation_filters(statement, filters, date_column):
+    """
+    Function to apply the moderation table filters shared by both moderation tables
+    :param statement: select statement to filter, it must join the threads table
+    :param filters: dictionary of filters, may contain min_flags, date_from and date_to ('YYYY-MM-DD' strings)
+    :param date_column: date column the date range applies to
+    :return: the filtered statement
+    """
+    if filters.get('min_flags'):
+        statement = statement.where(Thread.flags >= int(filters['min_flags']))
+    if filters.get('date_from'):
+        statement = statement.where(date_column >= datetime.strptime(filters['date_from'], '%Y-%m-%d'))
+    if filters.get('date_to'):
+        # the end date is inclusive, so everything before the start of the next day is read
+        statement = statement.where(date_column < datetime.strptime(filters['date_to'], '%Y-%m-%d') + timedelta(days=1))
+    return statement
+
+
+def reporter_ids(reporter):
+    """
+    Function to make a subquery of the user IDs matching a reporter filter
+    :param reporter: username or display name of the reporter
+    :return: a select statement of user IDs
+    """
+    return sa.select(User.id).where(sa.or_(User.username == reporter, User.display_name == reporter))
+
+
+def content_reports_statement(thread_id=None, filters=None):
+    """
+    Function to build the select statement of the individual content reports table with its filters applied
+    :param thread_id: ID of the thread to read reports for, default is None which reads all reports
+    :param filters: dictionary of filters (min_flags, date_from, date_to, reporter), default is None
+    :return: a select statement of the rows with id, thread_id, thread_title, flags, is_hidden, reporter_name, comment
+             and date_time
+    """
+    filters = filters or {}
+    statement = (sa.select(ContentReport.id, ContentReport.thread_id, Thread.title.label('thread_title'),
+                           Thread.flags, Thread.is_hidden, User.display_name.label('reporter_name'),
+                           ContentReport.comment, ContentReport.date_time)
+                 .join(Thread, Thread.id == ContentReport.thread_id)
+                 .outerjoin(User, User.id == ContentReport.user_id))
+    if thread_id is not None:
+        statement = statement.where(ContentReport.thread_id == thread_id)
+    if filters.get('reporter'):
+        statement = statement.where(ContentReport.user_id.in_(reporter_ids(filters['reporter'])))
+    return moderation_filters(statement, filters, ContentReport.date_time)
+
+
+def read_content_reports(thread_id=None, filters=None, after=None, limit=20):
+    """
+    Function to read one page of the individual content reports table with a single joined query
+    :param thread_id: ID of the thread to read reports for, default is None which reads all reports
+    :param filters: dictionary of filters and sort order (sort, min_flags, date_from, date_to, reporter), default is None
+    :param after: cursor of the page to read, default is None which reads the first page
+    :param limit: number of reports on a page
+    :return: a tuple of (rows with id, thread_id, thread_title, flags, is_hidden, reporter_name, comment and date_time,
+             next page cursor)
+    """
+    filters = filters or {}
+    _, sort_columns, descending = CONTENT_REPORT_SORTS[filters.get('sort') or 'newest']
+    return read_keyset_page(content_reports_statement(thread_id, filters), sort_columns, descending, after, limit)
+
+
+def flagged_threads_statement(filters=None):
+    """
+    Function to build the select statement of the content reports by thread table with its filters applied
+    :param filters: dictionary of filters (min_flags, date_from, date_to, reporter), default is None
+    :return: a select statement of the rows with id, title, flags, up_votes, down_votes, date_time and is_hidden
+    """
+    filters = filters or {}
+    statement = (sa.select(Thread.id, Thread.title, Thread.flags, Thread.up_votes, Thread.down_votes,
+                           Thread.date_time, Thread.is_hidden)
+                 .where(Thread.flags > 0))
+    if filters.get('reporter'):  # threads reported at least once by the reporter
+        statement = statement.where(Thread.id.in_(
+            sa.select(ContentReport.thread_id).where(ContentReport.user_id.in_(reporter_ids(filters['reporter'])))))
+    return moderation_filters(statement, filters, Thread.date_time)
+
+
+def read_flagged_threads(filters=None, after=None, limit=20):
+    """
+    Function to read one page of the content reports by thread table with a single query
+    :param filters: dictionary of filters and sort order (sort, min_flags, date_from, date_to, reporter), default is None
+    :param after: cursor of the page to read, default is None which reads the first page
+    :param limit: number of threads on a page
+    :return: a tuple of (rows with id, title, flags, up_votes, down_votes, date_time and is_hidden, next page cursor)
+    """
+    filters = filters or {}
+    _, sort_columns, descending = FLAGGED_THREAD_SORTS[filters.get('sort') or 'most_flagged']
+    return read_keyset_page(flagged_threads_statement(filters), sort_columns, descending, after, limit)
+
+
+def count_matching(statement):
+    """
+    Function to count all the rows of a moderation table statement, on every page
+    :param statement: select statement built by content_reports_statement() or flagged_threads_statement()
+    :return: the number of rows
+    """
+    return read_rows(sa.select(func.count()).select_from(statement.subquery()))[0][0]
+
+
+def matching_ids(statement):
+    """
+    Function to read the IDs of all the rows of a moderation table statement, on every page
+    The IDs are read once before a bulk action, so the action works on what matched when it was confirmed even if the
+    action itself changes the flags or reports the filters look at.
+    :param statement: select statement built by content_reports_statement() or flagged_threads_statement()
+    :return: a list of the IDs
+    """
+    return [row.id for row in read_rows(sa.select(statement.subquery().c.id))]
+
+
+# sort options of the crime registry, each is a tuple of (label, sort columns, descending)
+CRIME_REPORT_SORTS = {
+    'newest': ('Newest first', [CrimeReport.date_time, CrimeReport.id], True),
+    'oldest': ('Oldest first', [CrimeReport.date_time, CrimeReport.id], False),
+    'emergency': ('Emergencies first', [CrimeReport.is_emergency, CrimeReport.date_time, CrimeReport.id], True),
+}
+
+
+def read_crime_reports(user_id=None, filters=None, after=None, limit=20):
+    """
+    Function to read one page of the crime registry with a single query
+    :param user_id: User ID of the reporter, default is None which reads reports of all users
+    :param filters: dictionary of filters and sort order (sort, status, category, location, emergency, date_from, date_to),
+    default is None which reads the newest reports
+    :param after: cursor of the page to read, default is None which reads the first page
+    :param limit: number of reports on a page
+    :return: a tuple of (rows with id, title, location, category, date_time, is_emergency and status, next page cursor)
+    """
+    filters = filters or {}
+    _, sort_columns, descending = CRIME_REPORT_SORTS[filters.get('sort') or 'newest']
+    statement = sa.select(CrimeReport.id, CrimeReport.title, CrimeReport.location, CrimeReport.category,
+                          CrimeReport.date_time, CrimeReport.is_emergency, CrimeReport.status)
+    if user_id is not None:
+        statement = statement.where(CrimeReport.user_id == user_id)
+    for column in ['status', 'category', 'location']:
+        if filters.get(column):
+            statement = statement.where(getattr(CrimeReport, column) == filters[column])
+    if filters.get('emergency') in ['yes', 'no']:
+        statement = statement.where(CrimeReport.is_emergency == (filters['emergency'] == 'yes'))
+    if filters.get('date_from'):
+        statement = statement.where(CrimeReport.date_time >= datetime.strptime(filters['date_from'], '%Y-%m-%d'))
+    if filters.get('date_to'):
+        statement = statement.where(
+            CrimeReport.date_time < datetime.strptime(filters['date_to'], '%Y-%m-%d') + timedelta(days=1))
+    return read_keyset_page(statement, sort_columns, descending, after, limit)
+
+
+def read_notification_cards(limit=None):
+    """
+    Function to read the columns needed for the active notification cards
+    :param limit: maximum number of notifications to read, default is None for all of them
+    :return: a list of rows with the notification columns and the creator's display name, newest first
+    """
+    statement = (sa.select(Notification.id, Notification.user_id, Notification.by_role_id, Notification.title,
+                           Notification.content, Notification.date_time, Notification.category,
+                           Notification.location, User.display_name.label('creator_name'))
+                 .outerjoin(User, User.id == Notification.user_id)
+                 .where(Notification.status == 'Active')
+                 .order_by(Notification.id.desc())
+                 .limit(limit))
+    return read_rows(statement)
+
+
+#### SPATIAL QUERY FUNCTIONS ####
+# Nearby locations and posts are found through the R-tree tables set up with the database: a bounding box around
+# the search point narrows the rows down through the R-tree, then they are ranked by an equirectangular distance,
+# which is exact enough over the few kilometres of a city. The distances shown are great-circle distances.
+
+# kept apart from Base.metadata, so create_all() never creates the R-tree tables as plain tables
+spatial_metadata = sa.MetaData()
+location_rtree = sa.Table('location_rtree', spatial_metadata, sa.Column('id', sa.Integer, primary_key=True),
+                          *[sa.Column(name, sa.Float) for name in ['min_lat', 'max_lat', 'min_lon', 'max_lon']])
+post_rtree = sa.Table('post_rtree', spatial_metadata, sa.Column('id', sa.Integer, primary_key=True),
+                      *[sa.Column(name, sa.Float) for name in ['min_lat', 'max_lat', 'min_lon', 'max_lon']])
+
+
+def distance_km(latitude, longitude, other_latitude, other_longitude):
+    """
+    Function to calculate the great-circle (haversine) distance between two points
+    :return: the distance in kilometres
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, [latitude, longitude, other_latitude, other_longitude])
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def read_nearby(model, rtree, columns, latitude, longitude, limit=10, radius_km=None, conditions=(), sort=None):
+    """
+    Function to read the rows of a table with coordinates which are near a point
+    :param model: model class of the table, with latitude and longitude columns
+    :param rtree: R-tree table indexing the coordinates of the table
+    :param columns: columns to select, the latitude and longitude of the model are added to them
+    :param latitude: latitude of the search point in degrees
+    :param longitude: longitude of the search point in degrees
+    :param limit: maximum number of rows to read
+    :param radius_km: search radius in kilometres, default is None which reads the nearest rows up to
+                      NEARBY_MAX_RADIUS_KM away, widening the search until enough rows are found
+    :param conditions: extra where clauses for the rows
+    :param sort: function taking the distance column and returning the order by columns, default is nearest first
+    :return: a list of tuples of (row, distance in kilometres)
+    """
+    # distance from the point in degrees of latitude, longitudes are scaled down as meridians meet towards the poles
+    longitude_scale = max(math.cos(math.radians(latitude)), 0.01)
+    degrees_distance = ((model.latitude - latitude) * (model.latitude - latitude) +
+                        (model.longitude - longitude) * (model.longitude - longitude) * longitude_scale ** 2)
+    search_radius = radius_km or NEARBY_START_RADIUS_KM
+    while True:
+        latitude_span = math.degrees(search_radius / EARTH_RADIUS_KM)
+        longitude_span = latitude_span / longitude_scale
+        statement = (sa.select(*columns, model.latitude, model.longitude)
+                     .select_from(rtree).join(model, model.id == rtree.c.id)
+                     .where(rtree.c.max_lat >= latitude - latitude_span, rtree.c.min_lat <= latitude + latitude_span,
+                            rtree.c.max_lon >= longitude - longitude_span,
+                            rtree.c.min_lon <= longitude + longitude_span,
+                            degrees_distance <= latitude_span ** 2, *conditions)
+                     .order_by(*(sort(degrees_distance) if sort else [degrees_distance]))
+                     .limit(limit))
+        rows = read_rows(statement)
+        if radius_km is not None or len(rows) >= limit or search_radius >= NEARBY_MAX_RADIUS_KM:
+            break
+        search_radius = min(search_radius * 4, NEARBY_MAX_RADIUS_KM)
+    return [(row, distance_km(latitude, longitude, row.latitude, row.longitude)) for row in rows]
+
+
+def nearest_locations(latitude, longitude, limit=10, radius_km=None):
+    """
+    Function to find the locations nearest to a point
+    :param latitude: latitude of the point in degrees
+    :param longitude: longitude of the point in degrees
+    :param limit: maximum number of locations to return
+    :param radius_km: search radius in kilometres, default is None which finds the nearest locations at any distance
+    :return: a list of tuples of (row with id, name, latitude and longitude, distance in kilometres), nearest first
+    """
+    return read_nearby(Location, location_rtree, [Location.id, Location.name], latitude, longitude, limit, radius_km)
+
+
+# orders of the "parking near me" view: label and a function returning the order by columns for the distance column
+NEARBY_POST_SORTS = {
+    'distance': ('Nearest first', lambda distance: [distance, ParkingPost.amt_slots.desc()]),
+    'spaces': ('Most spaces first', lambda distance: [ParkingPost.amt_slots.desc(), distance]),
+}
+
+
+def nearest_posts(latitude, longitude, limit=10, radius_km=None, sort='distance', free_only=True):
+    """
+    Function to find the parking posts nearest to a point, ranked by distance and amount of spaces
+    :param latitude: latitude of the point in degrees
+    :param longitude: longitude of the point in degrees
+    :param limit: maximum number of posts to return
+    :param radius_km: search radius in kilometres, default is None which finds the nearest posts at any distance
+    :param sort: key of NEARBY_POST_SORTS, default is 'distance' which ranks nearest first, then most spaces
+    :param free_only: True to only return posts with free spaces
+    :return: a list of tuples of (row with the post card columns, distance in kilometres)
+    """
+    if sort not in NEARBY_POST_SORTS:
+        raise ValueError(f'Unknown sort order: {sort}')
+    columns = [ParkingPost.id, ParkingPost.user_id, ParkingPost.location, ParkingPost.type, ParkingPost.content,
+               ParkingPost.amt_slots, ParkingPost.date_time]
+    return read_nearby(ParkingPost, post_rtree, columns, latitude, longitude, limit, radius_km,
+                       [ParkingPost.amt_slots > 0] if free_only else [], NEARBY_POST_SORTS[sort][1])
+
+
+def location_coordinates(location_name):
+    """
+    Function to get the coordinates of a location by its name
+    :param location_name: name of the location
+    :return: a tuple of (latitude, longitude), or (None, None) if the location has no coordinates
+    """
+    rows = read_rows(sa.select(Location.latitude, Location.longitude).where(Location.name == location_name).limit(1))
+    return (rows[0].latitude, rows[0].longitude) if rows else (None, None)
+
+
+#### CHANGE VERSION FUNCTIONS ####
+# Triggers on every table of the app's data increase its version stamp in 'change_versions' whenever a row changes,
+# whichever process makes the change. A cache keeps the versions it was built from and compares them before use.
+# The check costs one PRAGMA data_version on a connection kept for it, which changes only when another connection has
+# committed. The stamps (one small table) are only read again when it has, so a cache can check on every use.
+
+def table_versions():
+    """
+    Function to get the version stamps of all versioned tables, read again only if the database has changed since
+    :return: a dictionary of table name to version number, not to be changed by the caller
+    """
+    with change_version_lock:
+        if change_version_state['connection'] is None:
+            change_version_state['connection'] = sqlite3.connect(f'file:{sqlite_file_name}?mode=ro', uri=True,
+                                                                 check_same_thread=False)
+        connection = change_version_state['connection']
+        data_version = connection.execute('PRAGMA data_version').fetchone()[0]
+        if data_version != change_version_state['data_version']:
+            change_version_state['versions'] = dict(connection.execute('SELECT table_name, version '
+                                                                       'FROM change_versions'))
+            change_version_state['data_version'] = data_version
+        return change_version_state['versions']
+
+
+def table_version(table_name):
+    """
+    Function to get the version stamp of a table
+    :param table_name: name of a table in versioned_tables
+    :return: the version number, 0 if the table has not changed since the triggers were created
+    """
+    return table_versions().get(table_name, 0)
+
+
+def cached_by_version(*table_names):
+    """
+    Function to make a decorator which keeps the results of a function in memory by its arguments, until a table it
+    reads changes in any process. The function has to read only those tables, and its results must not be changed.
+    :param table_names: names of the tables in versioned_tables the function reads
+    :return: the decorator
+    """
+    def decorator(function):
+        cache = {'versions': None, 'results': {}}
+        cache_lock = threading.Lock()
+
+        @wraps(function)
+        def cached(*args):
+            versions = table_versions()
+            current = tuple(versions.get(table_name, 0) for table_name in table_names)
+            with cache_lock:
+                if cache['versions'] != current:  # the results of older versions are all dropped at once
+                    cache['versions'], cache['results'] = current, {}
+                elif args in cache['results']:
+                    return cache['results'][args]
+            result = function(*args)
+            with cache_lock:
+                if cache['versions'] == current:
+                    cache['results'][args] = result
+            return result
+        return cached
+    return decorator
+
+
+@cached_by_version('users', 'roles')
+def read_user_card(user_id):
+    """
+    Function to read the names and role of a user, for the author lines and badges of posts, threads and reports
+    :param user_id: User ID of the user
+    :return: a dictionary of username, display_name, role_id, role_name and role_color, None if there is no such user
+    """
+    rows = read_rows(sa.select(User.username, User.display_name, User.role_id, Role.name.label('role_name'),
+                               Role.color.label('role_color'))
+                     .outerjoin(Role, Role.id == User.role_id).where(User.id == user_id))
+    return rows[0]._asdict() if rows else None
+
+
+@cached_by_version('roles')
+def read_role(role_id):
+    """
+    Function to read the name and color of a role
+    :param role_id: Role ID of the role
+    :return: a dictionary of name and color, None if there is no such role
+    """
+    rows = read_rows(sa.select(Role.name, Role.color).where(Role.id == role_id))
+    return rows[0]._asdict() if rows else None
+
+
+#### LOCATION CACHE FUNCTIONS ####
+# Location names are kept in memory as a sorted array, so the type-ahead of the location fields is a binary search.
+# The cache checks the version stamp of the 'locations' table (see table_version()) before it is used,
+# so locations added by imports, the command line or other processes are picked up without a restart.
+
+
+def get_location_cache():
+    """
+    Function to get the cached location names, reloading them first if the 'locations' table has changed
+    :return: a dictionary of the version, the case-folded names ("keys") and the names, both sorted by the keys
+    """
+    global location_cache
+    version = table_version('locations')
+    if version != location_cache['version']:
+        with location_cache_lock:  # only one session reloads the names, the others wait for it
+            if version != location_cache['version']:
+                names = sorted((row.name for row in read_rows(sa.select(Location.name))), key=str.casefold)
+                # the dictionary is replaced rather than changed, so sessions reading the old one are not disturbed
+                location_cache = {'version': version, 'keys': [name.casefold() for name in names], 'names': names}
+    return location_cache
+
+
+def search_locations(prefix='', limit=LOCATION_SUGGESTIONS):
+    """
+    Function to find the locations whose names start with the given text, ignoring case
+    :param prefix: text typed so far
+    :param limit: maximum number of names to return
+    :return: a list of location names in alphabetical order
+    """
+    cache = get_location_cache()
+    key = prefix.strip().casefold()
+    start = bisect.bisect_left(cache['keys'], key)
+    return [name for name_key, name in zip(cache['keys'][start:start + limit], cache['names'][start:start + limit])
+            if name_key.startswith(key)]
+
+
+def is_location(name):
+    """
+    Function to check if a location with the exact name exists
+    :param name: name of the location
+    :return: True if the location exists, False if it does not
+    """
+    cache = get_location_cache()
+    index = bisect.bisect_left(cache['keys'], name.casefold())
+    while index < len(cache['keys']) and cache['keys'][index] == name.casefold():
+        if cache['names'][index] == name:
+            return True
+        index += 1
+    return False
+
+
+def location_input(label='Location', name='location', value=None, required=True):
+    """
+    Function to create a location field for input groups, suggesting matching locations as the user types
+    :param label: label of the field
+    :param name: name of the field
+    :param value: location to fill in, default is None for an empty field
+    :param required: False to allow the field to be left empty
+    :return: the input field, which only accepts names of existing locations
+    """
+    return input(label, name=name, value=value, required=required, datalist=search_locations(value or ''),
+                 placeholder='Start typing to search locations',
+                 onchange=lambda text: input_update(datalist=search_locations(text)),
+                 validate=lambda text: None if is_location(text) or (not required and text == '')
+                 else 'Please choose a location from the suggestions')
+
+
+def put_location_input(name, label='Location', value='', placeholder='All locations'):
+    """
+    Function to display a location pin field for filters, suggesting matching locations as the user types
+    :param name: name of the pin field
+    :param label: label of the field
+    :param value: location to fill in, default is '' for an empty field
+    :param placeholder: text shown while the field is empty
+    :return: the pin input field
+    """
+    pin_on_change(name, onchange=lambda text: pin_update(name, datalist=search_locations(text or '')), clear=True)
+    return put_input(name, label=label, value=value, placeholder=placeholder, datalist=search_locations(value or ''))
+
+
+#### PASSWORD HASHING FUNCTIONS ####
+# Passwords are stored as scrypt hashes in the format "scrypt$n$r$p$salt$hash".
+# scrypt is deliberately slow and memory-hard, so hashing runs on a small bounded pool of worker threads:
+# a burst of logins queues up there instead of taking every CPU core away from the other users' sessions.
+
+password_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+
+
+def hash_password(password, salt=None, n=PASSWORD_SCRYPT_N, r=PASSWORD_SCRYPT_R, p=PASSWORD_SCRYPT_P):
+    """
+    Function to hash a password with scrypt
+    :param password: plaintext password to hash
+    :param salt: salt as bytes, default is None which generates a new random salt
+    :param n: scrypt CPU / memory cost
+    :param r: scrypt block size
+    :param p: scrypt parallelisation
+    :return: the encoded hash string to store in the password column
+    """
+    if salt is None:
+        salt = secrets.token_bytes(16)
+    digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024)
+    return f'scrypt${n}${r}${p}${salt.hex()}${digest.hex()}'
+
+
+def is_password_hash(stored_password):
+    """
+    Function to check if a stored password is already a scrypt hash
+    :param stored_password: value of the password column
+    :return: True if it is a hash, False if it is a plaintext password from before hashing was added
+    """
+    return stored_password.startswith('scrypt$')
+
+
+def check_password(stored_password, password):
+    """
+    Function to check a password against the stored password, which can be a hash or a legacy plaintext password
+    :param stored_password: value of the password column
+    :param password: password entered by the user
+    :return: True if the password matches, False otherwise
+    """
+    if not is_password_hash(stored_password):
+        return hmac.compare_digest(stored_password.encode(), password.encode())
+    _, n, r, p, salt, digest = stored_password.split('$')
+    expected = hash_password(password, bytes.fromhex(salt), int(n), int(r), int(p))
+    return hmac.compare_digest(expected.split('$')[-1], digest)
+
+
+def upgrade_password(user_id, plaintext_password):
+    """
+    Function to replace a legacy plaintext password with its hash after a successful login
+    :param user_id: ID of the user to upgrade
+    :param plaintext_password: the plaintext password which has just been verified
+    :return:
+    """
+    with Session() as sesh:
+        # only replace the password if it is still the same plaintext value (it may have changed in the meantime)
+        sesh.query(User).filter_by(id=user_id, password=plaintext_password).update(
+            {User.password: hash_password(plaintext_password)})
+        sesh.commit()
+
+
+def verify_password(user, password):
+    """
+    Function to verify a login password on the password hashing pool, the calling session waits for its own result only
+    Plaintext passwords (e.g. seeded from users.csv) are upgraded to a hash in the background once they are verified
+    :param user: User object of the user logging in
+    :param password: password entered by the user
+    :return: True if the password is correct, False otherwise
+    """
+    password_matches = password_pool.submit(check_password, user.password, password).result()
+    if password_matches and not is_password_hash(user.password):
+        password_pool.submit(upgrade_password, user.id, password)
+    return password_matches
 
 
 #### USER SYSTEM FUNCTIONS ####
@@ -448,7 +1687,8 @@ def add_user(user_data):
                 toast(f'Passwords do not match', color='error')
                 add_user(user_data)
             else:
-                new_user = User(username=user_data['name'], password=registration_data['password'],
+                password_hash = password_pool.submit(hash_password, registration_data['password']).result()
+                new_user = User(username=user_data['name'], password=password_hash,
                                 display_name=registration_data['display_name'], role_id=registration_data['user_role'])
                 sesh.add(new_user)
                 sesh.commit()
@@ -473,7 +1713,7 @@ def verify_user(username, password):
     clear()
     global valid_user
     try:
-        with Session() as sesh:
+        with ReadSession() as sesh:
             valid_user = sesh.query(User).filter_by(username=username).first()  # check if the user exists
     except SQLAlchemyError:
         toast(f'An error occurred', color='error')
@@ -481,10 +1721,15 @@ def verify_user(username, password):
         if valid_user is None:  # if user does not exist
             toast(f'Invalid user', color='error')
             user_login()
-        elif valid_user.password != password:  # if password does not match with the correct one
+        elif not verify_password(valid_user, password):  # if password does not match with the correct one
+            valid_user = None  # the user was looked up but is not logged in
             toast(f'Invalid login, please check your username and password', color='error')
             user_login()
         else:
+            # the preferences are read once here and kept in the session, pages use them without querying
+            local.user_id = valid_user.id
+            local.preferences = read_preferences(valid_user.id)
+            local.preferences_applied = False
             main()
             scroll_to('ROOT', position='top')  # scroll to the top of the home page
 
@@ -499,7 +1744,7 @@ def get_user_id(username=None):
     if valid_user is not None and username is None:
         return valid_user.id
     elif username is not None:
-        with Session() as sesh:
+        with ReadSession() as sesh:
             selected_user = sesh.query(User).filter_by(username=username).first()
             return selected_user.id
     else:
@@ -514,11 +1759,8 @@ def get_username(user_id=None):
     """
     global valid_user
     if user_id is not None:
-        with Session() as sesh:
-            selected_user = sesh.query(User).filter_by(id=user_id).first()
-            username = selected_user.username
-            display_name = selected_user.display_name
-        return {'username': username, 'display_name': display_name}
+        selected_user = read_user_card(user_id)
+        return {'username': selected_user['username'], 'display_name': selected_user['display_name']}
     elif valid_user is not None and user_id is None:
         return valid_user.username
     else:
@@ -533,15 +1775,9 @@ def get_role_name(user_id=None):
     """
     global valid_user
     if valid_user is not None and user_id is None:
-        with Session() as sesh:
-            selected_user_role = sesh.query(Role).filter_by(id=valid_user.role_id).first()
-            roleName = selected_user_role.name
-        return roleName
+        return read_role(valid_user.role_id)['name']
     elif user_id is not None:
-        with Session() as sesh:
-            selected_user_role = sesh.query(Role).join(User, User.role_id == Role.id).filter_by(id=user_id).first()
-            roleName = selected_user_role.name
-        return roleName
+        return read_user_card(user_id)['role_name']
     else:
         return None
 
@@ -556,10 +1792,7 @@ def get_role_id(user_id=None):
     if valid_user is not None and user_id is None:
         return valid_user.role_id
     elif user_id is not None:
-        with Session() as sesh:
-            selected_user_role = sesh.query(User).filter_by(id=user_id).first()
-            roleId = selected_user_role.role_id
-        return roleId
+        return read_user_card(user_id)['role_id']
     else:
         return None
 
@@ -571,11 +1804,21 @@ def get_user_badge(user_id=None):
     :return:
     """
     if user_id is not None:
-        return f'<span class="badge bg-{get_role_color(get_role_id(user_id))} text-light">{get_role_name(user_id)}</span>'
+        return role_badge(get_role_name(user_id), get_role_color(get_role_id(user_id)))
     else:
         return ''
 
 
+def role_badge(role_name, role_color):
+    """
+    This function returns a role badge from a role name and color which are already known (e.g. from a joined row).
+    :param role_name: The name of the role to show in the badge.
+    :param role_color: The Bootstrap color name of the role.
+    :return:
+    """
+    return f'<span class="badge bg-{role_color} text-light">{role_name}</span>'
+
+
 def get_role_color(role_id=None):
     """
     Function to get the role color from the database
@@ -584,15 +1827,9 @@ def get_role_color(role_id=None):
     """
     global valid_user
     if valid_user is not None and role_id is None:
-        with Session() as sesh:
-            selected_user_role = sesh.query(Role).filter_by(id=valid_user.role_id).first()
-            roleColor = selected_user_role.color
-        return roleColor
+        return read_role(valid_user.role_id)['color']
     elif role_id is not None:
-        with Session() as sesh:
-            selected_user_role = sesh.query(Role).filter_by(id=role_id).first()
-            roleColor = selected_user_role.color
-        return roleColor
+        return read_role(role_id)['color']
     else:
         return None
 
@@ -605,6 +1842,7 @@ def user_logout():
     clear()
     global valid_user
     valid_user = None
+    local.user_id = None  # the page keeps its looks, but changes are no longer saved for the user
     toast(f'You have been logged out')
     main()
 
@@ -623,15 +1861,25 @@ def post_feeds():
 
     generate_header()
     generate_nav()
-    if valid_user is not None:  # if user is logged in
+    if valid_user is not None and valid_user.role_id == 4:  # council staff can also import the official sites
+        put_buttons([
+            {'label': 'Import parking sites', 'value': 'import_locations', 'color': 'warning'},
+            {'label': 'Parking near me', 'value': 'parking_near_me', 'color': 'primary'},
+            {'label': 'Create a new post', 'value': 'create_post', 'color': 'success'},
+            {'label': 'My posts', 'value': 'view_own_post', 'color': 'info'}
+        ], onclick=[import_locations_form, parking_near_me, create_post, own_post_feeds]).style(
+            'float:right; margin-top: 12px')
+    elif valid_user is not None:  # if user is logged in
         put_buttons([
+            {'label': 'Parking near me', 'value': 'parking_near_me', 'color': 'primary'},
             {'label': 'Create a new post', 'value': 'create_post', 'color': 'success'},
             {'label': 'My posts', 'value': 'view_own_post', 'color': 'info'}
-        ], onclick=[create_post, own_post_feeds]).style('float:right; margin-top: 12px')
+        ], onclick=[parking_near_me, create_post, own_post_feeds]).style('float:right; margin-top: 12px')
     elif valid_user is None:  # if user is not logged in (Guest User)
         put_buttons([
+            {'label': 'Parking near me', 'value': 'parking_near_me', 'color': 'primary'},
             {'label': 'Create a new post', 'value': 'create_post', 'color': 'success'}
-        ], onclick=[create_post]).style('float:right; margin-top: 12px')
+        ], onclick=[parking_near_me, create_post]).style('float:right; margin-top: 12px')
 
     put_html('<h2>Recent Parking Posts</h2>')
 
@@ -670,52 +1918,138 @@ def get_posts(user_id=None):
     global valid_user
     postBtnGroup = None
 
-    with Session() as sesh:
-        if user_id is not None:  # if user is logged in and wants to see their own posts
-            posts = sesh.query(ParkingPost).filter_by(user_id=user_id).order_by(ParkingPost.id.desc()).limit(10).all()
-        else:
-            posts = sesh.query(ParkingPost).order_by(ParkingPost.id.desc()).limit(10).all()
+    posts = read_post_cards(user_id)  # if user_id is given, only the user's own posts are read
+    live_occupancy = latest_occupancy({post.location_id for post in posts})
 
-        postCount = len(posts)
-        if postCount == 0:
-            put_html('<p class="lead text-center">There is no posts</p>')
-            return
+    postCount = len(posts)
+    if postCount == 0:
+        put_html('<p class="lead text-center">There is no posts</p>')
+        return
 
-        for post in posts:
-            # we use the post.id as the scope to avoid conflicts with other posts when going back after editing
-            with use_scope(f'post-{post.id}'):
-                if user_id is not None or (
-                        user_id is None and valid_user is not None and post.user_id == valid_user.id):
-                    postBtnGroup = put_buttons([
-                        {'label': 'Edit', 'value': 'edit', 'color': 'primary'},
-                        {'label': 'Delete', 'value': 'delete', 'color': 'danger'}
-                    ], onclick=[partial(edit_post, post.id), partial(delete_post, post.id)], small=True)
-
-            postDateTime = post.date_time.strftime('%I:%M%p – %d %b, %Y')
-            put_html(f'''
-            <div class="card">
-                <div class="card-header">
-                    <h3 class="card-title" style="margin: 8px 0;">{post.location}</h3>
-                    <p class="card-subtitle mt-0">Amount of Spaces: <strong>{post.amt_slots}</strong> at {postDateTime}</p>
-                </div>
-                <div class="card-body">
-                    <h4 class="card-title" style="margin: 8px 0;">Parking Slot Type: <span class="">{post.type}</span></h4>    
-                    <p style="white-space: pre-wrap;">{post.content}</p>
-                </div>
-                <div class="card-footer text-muted">
-                    <p class="mb-0">Average Rating: {get_avg_rating(post.id) if get_avg_rating(post.id) is not None else 'No ratings yet'}</p>
-                </div>
+    for post in posts:
+        # we use the post.id as the scope to avoid conflicts with other posts when going back after editing
+        with use_scope(f'post-{post.id}'):
+            if user_id is not None or (
+                    user_id is None and valid_user is not None and post.user_id == valid_user.id):
+                postBtnGroup = put_buttons([
+                    {'label': 'Edit', 'value': 'edit', 'color': 'primary'},
+                    {'label': 'Delete', 'value': 'delete', 'color': 'danger'}
+                ], onclick=[partial(edit_post, post.id), partial(delete_post, post.id)], small=True)
+
+        postDateTime = post.date_time.strftime('%I:%M%p – %d %b, %Y')
+        averageRating = post_average_rating(post)
+        liveOccupancy = ''
+        if post.location_id in live_occupancy:  # the latest reading of the site's counter, if it has one
+            occupied, capacity, readingTime = live_occupancy[post.location_id]
+            liveSpaces = (f'{max(capacity - occupied, 0)} of {capacity} spaces free' if capacity is not None
+                          else f'{occupied} spaces occupied')
+            liveOccupancy = (f'<p class="card-subtitle mt-1 text-success">Live: <strong>{liveSpaces}</strong> '
+                             f'at {readingTime.strftime("%I:%M:%S%p")}</p>')
+        usualAvailability = ''
+        expected = expected_availability(post.location)
+        if expected is not None:  # the free spaces usually at the location in this hour of the week
+            now = datetime.now()
+            usualAvailability = (f'<p class="card-subtitle mt-1 text-muted">Usually about <strong>{expected[0]:.0f} '
+                                 f'free</strong> on {WEEKDAY_NAMES[now.weekday()]} at {now.strftime("%I%p").lstrip("0")}'
+                                 f' ({expected[1]} reports)</p>')
+        put_html(f'''
+        <div class="card">
+            <div class="card-header">
+                <h3 class="card-title" style="margin: 8px 0;">{post.location}</h3>
+                <p class="card-subtitle mt-0">Amount of Spaces: <strong>{post.amt_slots}</strong> at {postDateTime}</p>
+                {liveOccupancy}
+                {usualAvailability}
             </div>
-            ''').style('margin-bottom: 10px;')
-            put_row([
-                put_column([put_buttons([
-                    {'label': 'Rate', 'value': 'add_rating', 'color': 'info'}
-                ], onclick=[partial(add_rating, post.id)], small=True)]),
-                put_column([postBtnGroup]).style('justify-content: end;')  # align the buttons to the right
-            ])
-            postBtnGroup = None
-        if postCount > 10:
-            put_html(f'<p class="text-center">View more posts</p>')
+            <div class="card-body">
+                <h4 class="card-title" style="margin: 8px 0;">Parking Slot Type: <span class="">{post.type}</span></h4>    
+                <p style="white-space: pre-wrap;">{post.content}</p>
+            </div>
+            <div class="card-footer text-muted">
+                <p class="mb-0">Average Rating: {averageRating if averageRating is not None else 'No ratings yet'}</p>
+            </div>
+        </div>
+        ''').style('margin-bottom: 10px;')
+        put_row([
+            put_column([put_buttons([
+                {'label': 'Rate', 'value': 'add_rating', 'color': 'info'}
+            ], onclick=[partial(add_rating, post.id)], small=True)]),
+            put_column([postBtnGroup]).style('justify-content: end;')  # align the buttons to the right
+        ])
+        postBtnGroup = None
+    if postCount > 10:
+        put_html(f'<p class="text-center">View more posts</p>')
+
+
+# "parking near me" screen
+@use_scope('ROOT', clear=True)
+def parking_near_me(origin=None, radius_km=1, sort='distance'):
+    """
+    Function to display the parking posts with free spaces near the user or a chosen location
+    :param origin: tuple of (latitude, longitude, label) of the search point, default is None which only shows the search
+    :param radius_km: search radius in kilometres
+    :param sort: key of NEARBY_POST_SORTS to rank the posts by
+    :return:
+    """
+    clear()
+
+    generate_header()
+    generate_nav()
+    put_buttons([
+        {'label': 'All posts', 'value': 'post_feeds', 'color': 'info'}
+    ], onclick=[post_feeds]).style('float:right; margin-top: 12px')
+    put_html('<h2>Parking Near Me</h2>')
+
+    def search():  # function to find the search point and reload the page with the posts around it
+        if pin.near_location == '':
+            # asks the browser for the user's position, resolving to null if it is refused or unavailable
+            position = eval_js('''new Promise((resolve) => {
+                if (!navigator.geolocation) { resolve(null); return; }
+                navigator.geolocation.getCurrentPosition(
+                    (p) => resolve([p.coords.latitude, p.coords.longitude]), () => resolve(null), {timeout: 10000});
+            })''')
+            if position is None:
+                toast('Your position is not available, please choose a location instead', color='warning')
+                return
+            new_origin = (position[0], position[1], 'your position')
+        else:
+            latitude, longitude = location_coordinates(pin.near_location)
+            if latitude is None:
+                toast(f'{pin.near_location} has no coordinates, please choose another location', color='warning')
+                return
+            new_origin = (latitude, longitude, pin.near_location)
+        parking_near_me(new_origin, pin.near_radius, pin.near_sort)
+
+    put_row([
+        put_location_input('near_location', label='Near', value=origin[2] if origin and is_location(origin[2]) else '',
+                           placeholder='My position'),
+        put_select('near_radius', label='Within', value=radius_km,
+                   options=[{'label': f'{radius} km', 'value': radius} for radius in NEARBY_RADIUS_CHOICES_KM]),
+        put_select('near_sort', label='Sort by', value=sort,
+                   options=[{'label': label, 'value': key} for key, (label, _) in NEARBY_POST_SORTS.items()]),
+    ]).style('gap: 10px;')
+    put_buttons([{'label': 'Search', 'value': 'search', 'color': 'primary'}], onclick=[search],
+                small=True).style('margin-bottom: 10px;')
+
+    if origin is None:
+        return
+    try:
+        posts = nearest_posts(origin[0], origin[1], limit=20, radius_km=radius_km, sort=sort)
+    except SQLAlchemyError:
+        toast('An error occurred', color='error')
+        return
+    if len(posts) == 0:
+        put_html(f'<p class="lead text-center">There are no parking spaces within {radius_km} km of {origin[2]}</p>')
+        return
+    put_html(f'<p>Parking with free spaces within {radius_km} km of {origin[2]}</p>')
+    put_table([[
+        f'{distance * 1000:.0f} m' if distance < 1 else f'{distance:.1f} km',
+        post.location,
+        post.type,
+        post.amt_slots,
+        post.date_time.strftime('%I:%M%p – %d %b, %Y'),
+        put_buttons([{'label': 'Rate', 'value': 'add_rating', 'color': 'info'}],
+                    onclick=[partial(add_rating, post.id)], small=True)
+    ] for post, distance in posts], header=['Distance', 'Location', 'Type', 'Spaces', 'Posted', 'Action'])
 
 
 def add_rating(post_id):  # post_id need to be passed here by ivy (set default 1 for testing)
@@ -756,17 +2090,11 @@ def save_rate(post_id):  # saving the rating details to the database
     else:
         user_id = valid_user.id
 
-    with Session() as sesh:
-        rating = ParkingRating(post_id=post_id,
-                               user_id=user_id,
-                               rating=rate_levels,
-                               comment=comment)
-        sesh.add(rating)
-        sesh.commit()
+    queue_counter_writes(rows=[('ratings', {'post_id': post_id, 'user_id': user_id, 'rating': rate_levels,
+                                            'comment': comment, 'date_time': datetime.now()})])
     close_popup()
     toast('Rating saved successfully!', position='center', color='#2188ff', duration=6)
 
-    # print("===============", get_avg_rating(post_id), "===============") # for testing
     main()
     scroll_to(f'post-{post_id}', position='middle')  # scroll to the post after rating
 
@@ -785,7 +2113,7 @@ def create_post():
     put_html('<h2>Create a new post</h2>')
 
     createPostFields = [
-        select('Location', options=locations_list, name='location', required=True),
+        location_input(),
         select('Type', options=[
             {'label': 'Rack', 'value': 'Rack', 'selected': True},
             {'label': 'Locker', 'value': 'Locker'},
@@ -808,9 +2136,11 @@ def create_post():
             clear()
             raise ValueError('Post creation cancelled')  # shows a custom error message
         if post_data['post_actions'] == 'create':
+            latitude, longitude = location_coordinates(post_data['location'])  # the post is placed at its location
             with Session() as sesh:
                 new_post = ParkingPost(user_id=get_user_id(), location=post_data['location'], type=post_data['type'],
-                                       amt_slots=post_data['amount'], content=post_data['content'])
+                                       amt_slots=post_data['amount'], content=post_data['content'],
+                                       latitude=latitude, longitude=longitude)
                 sesh.add(new_post)
                 sesh.commit()
     except ValueError as ve:
@@ -835,11 +2165,11 @@ def edit_post(post_id):
     generate_header()
     generate_nav()
 
-    with Session() as sesh:
+    with ReadSession() as sesh:
         post = sesh.query(ParkingPost).filter_by(
             id=post_id).first()  # get the details of post being edited from the database
         updatePostFields = [
-            select('Location', options=locations_list, name='location', required=True, value=post.location),
+            location_input(value=post.location),
             select('Type', options=[
                 {'label': 'Rack', 'value': 'Rack'},
                 {'label': 'Locker', 'value': 'Locker'},
@@ -863,6 +2193,8 @@ def edit_post(post_id):
             raise ValueError('Post not updated')
         if post_data['post_actions'] == 'update':
             with Session() as sesh:
+                if post.location != post_data['location']:  # the post moves to the coordinates of its new location
+                    post.latitude, post.longitude = location_coordinates(post_data['location'])
                 post.location = post_data['location']
                 post.type = post_data['type']
                 post.amt_slots = post_data['amount']
@@ -913,27 +2245,6 @@ def delete_post(post_id):
     ], onclick=[confirm_delete, post_feeds if valid_user.role_id == 4 else own_post_feeds])
 
 
-def get_avg_rating(post_id):
-    """
-    Function to get the average rating of a post
-    :param post_id: ID of the post to get the average rating for
-    :return: None if no rating is detected, the average rating of the post if ratings are detected
-    """
-    total_rating = 0
-    with Session() as sesh:
-        rating_post = sesh.query(ParkingRating).filter_by(post_id=post_id).all()
-        post_count = len(rating_post)
-
-        # when no rating is detected
-        if post_count == 0:
-            return None
-        else:
-            for rating in rating_post:
-                total_rating += rating.rating
-            avg_result = total_rating / post_count
-            return round(avg_result, 1)  # round the average rating to 1 decimal place
-
-
 #### FORUM FUNCTIONS by KT ####
 @use_scope('ROOT', clear=True)
 def forum_feeds():
@@ -950,13 +2261,20 @@ def forum_feeds():
         put_buttons([
             {'label': 'Create a new thread', 'value': 'create_thread', 'color': 'success'},
             {'label': 'My threads', 'value': 'view_own_threads', 'color': 'info'},
-            {'label': 'Moderate threads', 'value': 'view_all_threads', 'color': 'warning'}
-        ], onclick=[create_thread, own_forum_feeds, content_reports]).style('float:right; margin-top: 12px;')
+            {'label': 'Moderate threads', 'value': 'view_all_threads', 'color': 'warning'},
+            {'label': 'Forum archive', 'value': 'archived_threads', 'color': 'secondary'}
+        ], onclick=[create_thread, own_forum_feeds, content_reports, archived_threads]).style(
+            'float:right; margin-top: 12px;')
     elif valid_user is not None:  # if user is not a council staff / all other logged-in users
         put_buttons([
             {'label': 'Create a new thread', 'value': 'create_thread', 'color': 'success'},
-            {'label': 'My threads', 'value': 'view_own_threads', 'color': 'info'}
-        ], onclick=[create_thread, own_forum_feeds]).style('float:right; margin-top: 12px;')
+            {'label': 'My threads', 'value': 'view_own_threads', 'color': 'info'},
+            {'label': 'Forum archive', 'value': 'archived_threads', 'color': 'secondary'}
+        ], onclick=[create_thread, own_forum_feeds, archived_threads]).style('float:right; margin-top: 12px;')
+    else:
+        put_buttons([
+            {'label': 'Forum archive', 'value': 'archived_threads', 'color': 'secondary'}
+        ], onclick=[archived_threads]).style('float:right; margin-top: 12px;')
     put_html('<h2>Community Forum</h2>')
 
     get_threads()
@@ -998,79 +2316,137 @@ def get_threads(user_id=None):
     global valid_user
     threadBtnGroup = None
 
-    with Session() as sesh:
-        if user_id is not None:  # if user is logged in and wants to see their own threads
-            threads = sesh.query(Thread).filter_by(user_id=user_id, parent_id=None).order_by(Thread.id.desc()).limit(
-                10).all()
-        else:  # if user is not logged in or wants to see all threads (Community Forum)
-            threads = sesh.query(Thread).filter_by(parent_id=None).order_by(Thread.id.desc()).limit(10).all()
-
-        threadCount = len(threads)
-        if threadCount == 0:
-            put_html('<p class="lead text-center">There is no threads</p>')
-            return
+    threads = read_thread_cards(user_id)  # if user_id is given, only the user's own threads are read
 
-        for thread in threads:
-            # we use use_scope function to later scroll to the thread after adding a comment
-            # we use the thread.id as the scope to avoid conflicts with other threads
-            with use_scope(f'thread-{thread.id}'):
-                if user_id is not None or (
-                        user_id is None and valid_user is not None and thread.user_id == valid_user.id):
-                    threadBtnGroup = put_buttons([
-                        {'label': 'Edit', 'value': 'edit', 'color': 'primary'},
-                        {'label': 'Delete', 'value': 'delete', 'color': 'danger'},
-                        # won't allow users to report their own threads
-                    ], onclick=[partial(edit_thread, thread.id), partial(delete_thread, thread.id)]
-                        , small=True)
-                elif valid_user is None or (valid_user is not None and thread.user_id != valid_user.id):
-                    threadBtnGroup = put_buttons([
-                        {'label': 'Report', 'value': 'report', 'color': 'warning'}
-                    ], onclick=[partial(report_thread, thread.id)], small=True)
-
-                threadDateTime = thread.date_time.strftime('%I:%M%p – %d %b, %Y')
-                put_html(f'''
-                <div class="card">
-                    <div class="card-header">
-                        <h3 class="card-title" style="margin: 8px 0;">{thread.title}</h3>
-                        <p class="card-subtitle mt-0">By <strong>{get_username(thread.user_id)["display_name"]}</strong> {get_user_badge(thread.user_id) if get_role_id(thread.user_id) != 1 else ''} at {threadDateTime}</p>
-                    </div>
-                    <div class="card-body">
-                        <p style="white-space: pre-wrap;">{thread.content}</p>
-                    </div>
+    threadCount = len(threads)
+    if threadCount == 0:
+        put_html('<p class="lead text-center">There is no threads</p>')
+        return
+
+    # comments of every thread on the page are read together instead of one query per thread
+    thread_comments = read_thread_comments([thread.id for thread in threads])
+    collapseComments = session_preferences()['collapse_comments']
+
+    for thread in threads:
+        # we use use_scope function to later scroll to the thread after adding a comment
+        # we use the thread.id as the scope to avoid conflicts with other threads
+        with use_scope(f'thread-{thread.id}'):
+            if user_id is not None or (
+                    user_id is None and valid_user is not None and thread.user_id == valid_user.id):
+                threadBtnGroup = put_buttons([
+                    {'label': 'Edit', 'value': 'edit', 'color': 'primary'},
+                    {'label': 'Delete', 'value': 'delete', 'color': 'danger'},
+                    # won't allow users to report their own threads
+                ], onclick=[partial(edit_thread, thread.id), partial(delete_thread, thread.id)]
+                    , small=True)
+            elif valid_user is None or (valid_user is not None and thread.user_id != valid_user.id):
+                threadBtnGroup = put_buttons([
+                    {'label': 'Report', 'value': 'report', 'color': 'warning'}
+                ], onclick=[partial(report_thread, thread.id)], small=True)
+
+            threadDateTime = thread.date_time.strftime('%I:%M%p – %d %b, %Y')
+            put_html(f'''
+            <div class="card">
+                <div class="card-header">
+                    <h3 class="card-title" style="margin: 8px 0;">{thread.title} {'<span class="badge bg-secondary text-light">Hidden by moderators</span>' if thread.is_hidden else ''}</h3>
+                    <p class="card-subtitle mt-0">By <strong>{thread.display_name}</strong> {role_badge(thread.role_name, thread.role_color) if thread.role_id != 1 else ''} at {threadDateTime}</p>
                 </div>
-                ''').style('margin-bottom: 10px;')
-                put_row([
-                    put_column([put_buttons([
-                        {'label': 'Add Comment', 'value': 'add_comment', 'color': 'info'},
-                        {'label': f'Upvote {thread.up_votes}', 'value': 'upvote', 'color': 'success'},
-                        {'label': f'Downvote {thread.down_votes}', 'value': 'downvote', 'color': 'secondary'},
-                    ], onclick=[partial(add_comment, thread.id), partial(vote_thread, thread.id, 'up'),
-                                partial(vote_thread, thread.id, 'down')], small=True)]),
-                    put_column([threadBtnGroup]).style('justify-content: end;')
-                ])
-
-                comments = sesh.query(Thread).filter_by(parent_id=thread.id).order_by(Thread.id.asc()).all()
-                # print(len(comments))
-                if len(comments) != 0:  # show if there are comments in the thread
-                    put_html('<p class="h5 fw-bolder">Comments</p>')
-                    for comment in comments:
-                        commentDateTime = comment.date_time.strftime('%I:%M%p – %d %b, %Y')
-                        put_html(f'''
-                        <div class="card p-2">
-                            <div class="card-body p-2">
-                            <p class="h6 card-title m-0">
-                            <strong>{get_username(comment.user_id)['display_name']}</strong>
-                            {get_user_badge(comment.user_id) if get_role_id(comment.user_id) in [3, 4] else ''} 
-                            <small class="card-subtitle">{commentDateTime}</small>
-                            </p>
-                            <p class="card-text">{comment.content}</p>
-                            </div>
+                <div class="card-body">
+                    <p style="white-space: pre-wrap;">{thread.content}</p>
+                </div>
+            </div>
+            ''').style('margin-bottom: 10px;')
+            put_row([
+                put_column([put_buttons([
+                    {'label': 'Add Comment', 'value': 'add_comment', 'color': 'info'},
+                    {'label': f'Upvote {thread.up_votes + pending_count("threads", thread.id, "up_votes")}',
+                     'value': 'upvote', 'color': 'success'},
+                    {'label': f'Downvote {thread.down_votes + pending_count("threads", thread.id, "down_votes")}',
+                     'value': 'downvote', 'color': 'secondary'},
+                ], onclick=[partial(add_comment, thread.id), partial(vote_thread, thread.id, 'up'),
+                            partial(vote_thread, thread.id, 'down')], small=True)]),
+                put_column([threadBtnGroup]).style('justify-content: end;')
+            ])
+
+            comments = thread_comments[thread.id]
+            if len(comments) != 0:  # show if there are comments in the thread
+                commentCards = []
+                for comment in comments:
+                    commentDateTime = comment.date_time.strftime('%I:%M%p – %d %b, %Y')
+                    commentCards.append(f'''
+                    <div class="card p-2">
+                        <div class="card-body p-2">
+                        <p class="h6 card-title m-0">
+                        <strong>{comment.display_name}</strong>
+                        {role_badge(comment.role_name, comment.role_color) if comment.role_id in [3, 4] else ''} 
+                        <small class="card-subtitle">{commentDateTime}</small>
+                        </p>
+                        <p class="card-text">{comment.content}</p>
                         </div>
-                        ''').style('margin-bottom: 10px;')
-                put_html('<hr>').style('margin: 32px auto; width: 30%;')
+                    </div>
+                    ''')
+                if collapseComments:  # folded away, the user opens the comments of the threads they want to read
+                    put_collapse(f'Comments ({len(comments)})',
+                                 [put_html(card).style('margin-bottom: 10px;') for card in commentCards])
+                else:
+                    put_html('<p class="h5 fw-bolder">Comments</p>')
+                    for card in commentCards:
+                        put_html(card).style('margin-bottom: 10px;')
+            put_html('<hr>').style('margin: 32px auto; width: 30%;')
 
-        if threadCount > 10:
-            put_html(f'<p class="text-center">View more threads</p>')
+    if threadCount > 10:
+        put_html(f'<p class="text-center">View more threads</p>')
+
+
+@use_scope('ROOT', clear=True)
+def archived_threads(cursors=None):
+    """
+    Function to display a page of the archived forum threads with their comments, read only
+    :param cursors: cursors of the pages read so far, default is None which shows the first page
+    :return:
+    """
+    clear()
+    cursors = cursors or []
+
+    generate_header()
+    generate_nav()
+    put_buttons(['Back to Community Forum'], onclick=[forum_feeds]).style('float:right; margin-top: 12px;')
+    put_html('<h2>Forum Archive</h2>')
+    put_html('<p>Threads with no new comments for a long time are moved here. They can be read, but not '
+             'commented on or voted on.</p>')
+    try:
+        threads, comments, next_cursor = read_archived_threads(cursors[-1] if cursors else None)
+    except SQLAlchemyError:
+        toast('An error occurred', color='error')
+        return
+    if len(threads) == 0:
+        put_html('<p class="lead text-center">There is no archived threads</p>')
+        return
+    for thread in threads:
+        put_html(f'''
+        <div class="card">
+            <div class="card-header">
+                <h3 class="card-title" style="margin: 8px 0;">{thread.title}</h3>
+                <p class="card-subtitle mt-0">By <strong>{thread.display_name}</strong> at {thread.date_time.strftime('%I:%M%p – %d %b, %Y')}
+                – {thread.up_votes} upvotes, {thread.down_votes} downvotes</p>
+            </div>
+            <div class="card-body">
+                <p style="white-space: pre-wrap;">{thread.content}</p>
+            </div>
+        </div>
+        ''').style('margin-bottom: 10px;')
+        if comments[thread.id]:
+            put_collapse(f'Comments ({len(comments[thread.id])})', [put_html(f'''
+                <div class="card p-2">
+                    <div class="card-body p-2">
+                    <p class="h6 card-title m-0"><strong>{comment.display_name}</strong>
+                    <small class="card-subtitle">{comment.date_time.strftime('%I:%M%p – %d %b, %Y')}</small></p>
+                    <p class="card-text">{comment.content}</p>
+                    </div>
+                </div>
+                ''').style('margin-bottom: 10px;') for comment in comments[thread.id]])
+        put_html('<hr>').style('margin: 32px auto; width: 30%;')
+    put_page_buttons(cursors, next_cursor, archived_threads)
 
 
 def add_comment(parent_thread_id):
@@ -1134,14 +2510,7 @@ def vote_thread(thread_id, vote_type):
         user_login()
         return
     try:
-        with Session() as sesh:
-            thread = sesh.query(Thread).filter_by(id=thread_id).first()
-            if vote_type == 'up':
-                thread.up_votes += 1
-            elif vote_type == 'down':
-                thread.down_votes += 1
-            sesh.add(thread)
-            sesh.commit()
+        queue_counter_writes(deltas=[('threads', thread_id, f'{vote_type}_votes', 1)])
     except SQLAlchemyError:
         toast('An error occurred', color='error')
     else:
@@ -1205,7 +2574,7 @@ def edit_thread(thread_id):
     generate_header()
     generate_nav()
 
-    with Session() as sesh:
+    with ReadSession() as sesh:
         thread = sesh.query(Thread).filter_by(
             id=thread_id).first()  # get the details of thread being edited from the database
         updateThreadFields = [
@@ -1250,20 +2619,14 @@ def delete_thread(thread_id):
     generate_header()
 
     def confirm_delete():
-        with Session() as sesh:
-            thread = sesh.query(Thread).filter_by(
-                id=thread_id).first()  # get the details of thread being deleted from the database
-            sesh.delete(thread)
-            sesh.commit()
-            sesh.query(Thread).filter_by(
-                parent_id=thread_id).delete()  # delete all comments with the same parent thread
-            sesh.commit()
+        # the thread, all comments with the same parent thread and the reports on them are deleted in one transaction
+        delete_threads([thread_id])
         toast(f'Thread "{thread.title}" and its comments have been deleted', color='success')
         # routing council staff to all forum feeds and all other users to their own forum feeds
         # because councils have the permission to delete any thread
         forum_feeds() if valid_user.role_id == 4 else own_forum_feeds()
 
-    with Session() as sesh:
+    with ReadSession() as sesh:
         thread = sesh.query(Thread).filter_by(id=thread_id).first()
     put_warning(put_markdown(f'''## Warning!   
                              Are you sure you want to delete the thread: "**{thread.title}**" and its comments. This action cannot be undone.'''))
@@ -1273,11 +2636,65 @@ def delete_thread(thread_id):
     ], onclick=[confirm_delete, forum_feeds if valid_user.role_id == 4 else own_forum_feeds])
 
 
+def put_moderation_filters(sorts, filters, on_apply):
+    """
+    Function to display the sort and filter controls of the moderation tables
+    :param sorts: sort options of the table (CONTENT_REPORT_SORTS or FLAGGED_THREAD_SORTS)
+    :param filters: dictionary of the filters currently applied
+    :param on_apply: function to call with the new filters when they are applied or reset
+    :return:
+    """
+
+    def apply_filters():  # function to read the filter fields and reload the table with them
+        on_apply({
+            'sort': pin.moderation_sort,
+            'min_flags': pin.moderation_min_flags,
+            'reporter': pin.moderation_reporter.strip(),
+            'date_from': pin.moderation_date_from,
+            'date_to': pin.moderation_date_to
+        })
+
+    put_row([
+        put_select('moderation_sort', label='Sort by', value=filters.get('sort') or next(iter(sorts)),
+                   options=[{'label': label, 'value': key} for key, (label, _, _) in sorts.items()]),
+        put_input('moderation_min_flags', type=NUMBER, label='Min. flags', value=filters.get('min_flags')),
+        put_input('moderation_reporter', label='Reporter', value=filters.get('reporter', ''),
+                  placeholder='Username or display name'),
+        put_input('moderation_date_from', type=DATE, label='From', value=filters.get('date_from', '')),
+        put_input('moderation_date_to', type=DATE, label='To', value=filters.get('date_to', ''))
+    ]).style('gap: 10px;')
+    put_buttons([
+        {'label': 'Apply', 'value': 'apply', 'color': 'primary'},
+        {'label': 'Reset', 'value': 'reset', 'color': 'secondary'}
+    ], onclick=[apply_filters, partial(on_apply, {})], small=True).style('margin-bottom: 10px;')
+
+
+def put_page_buttons(cursors, next_cursor, on_page):
+    """
+    Function to display the previous / next page buttons of a keyset paginated table
+    :param cursors: cursors of the pages read so far, the last one is the cursor of the current page
+    :param next_cursor: cursor of the next page, None if the current page is the last one
+    :param on_page: function to call with the cursors list of the page to go to
+    :return:
+    """
+    pageButtons, pageActions = [], []
+    if len(cursors) > 0:
+        pageButtons.append({'label': 'Previous page', 'value': 'previous', 'color': 'secondary'})
+        pageActions.append(partial(on_page, cursors[:-1]))
+    if next_cursor is not None:
+        pageButtons.append({'label': 'Next page', 'value': 'next', 'color': 'secondary'})
+        pageActions.append(partial(on_page, cursors + [next_cursor]))
+    if len(pageButtons) > 0:
+        put_buttons(pageButtons, onclick=pageActions).style('text-align: center;')
+
+
 @use_scope('ROOT', clear=True)
-def content_reports(thread_id=None):
+def content_reports(thread_id=None, filters=None, cursors=None):
     """
-    Function to display all the content reports for threads in the database or for a specific thread (for council staff)
+    Function to display a page of the content reports for threads in the database or for a specific thread (for council staff)
     :param thread_id: ID of the thread to view reports for, default is None which retrieves all reports
+    :param filters: dictionary of the sort order and filters to apply, default is None which shows the newest reports
+    :param cursors: cursors of the pages read so far, default is None which shows the first page
     :return:
     """
     clear()
@@ -1286,54 +2703,79 @@ def content_reports(thread_id=None):
         toast('You do not have permission to view this page', color='warning')
         main()
         return
+    filters, cursors = filters or {}, cursors or []
 
     generate_header()
     generate_nav()
     put_buttons([
         {'label': 'Reports by Thread', 'value': 'reports_thread', 'color': 'secondary'},
-    ], onclick=[content_reports_by_thread]).style('float:right; margin-top: 12px;')
+        {'label': 'Export', 'value': 'export', 'color': 'info'},
+    ], onclick=[content_reports_by_thread, partial(export_popup, ['content_reports', 'threads'])]).style(
+        'float:right; margin-top: 12px;')
     put_html('<h2>Individual Content Reports</h2>')
+    put_moderation_filters(CONTENT_REPORT_SORTS, filters, partial(content_reports, thread_id))
 
     report_table_data = []  # table data to store columns for the reports
-    with Session() as sesh:
-        if thread_id is not None:  # if a specific thread is selected
-            reports = sesh.query(ContentReport).join(Thread).filter(
-                ContentReport.thread_id == thread_id).all()  # get reports for the specific thread
-        else:  # if all reports are selected
-            reports = sesh.query(ContentReport).join(Thread).filter(
-                ContentReport.thread_id == Thread.id).all()  # get all reports
-        reportCount = len(reports)
-        if reportCount == 0:
-            put_html('<p class="lead text-center">There is no reports</p>')
-            return
+    # only the visible page is read, for the specific thread if thread_id is given, else for all reports
+    reports, next_cursor = read_content_reports(thread_id, filters, cursors[-1] if cursors else None,
+                                                MODERATION_PAGE_SIZE)
+    reportCount = len(reports)
+    if reportCount == 0:
+        put_html('<p class="lead text-center">There is no reports</p>')
+        return
 
-        for report in reports:
-            reportDateTime = report.date_time.strftime('%d %b, %Y')
-            report_table_data.append([
-                report.id,
-                get_username(report.user_id)['display_name'],
-                report.associated_thread.title,
-                report.comment,
-                reportDateTime,
-                put_buttons([
-                    {'label': 'View', 'value': 'view_thread', 'color': 'info'},
-                    {'label': 'Delete', 'value': 'delete_thread', 'color': 'danger'},
-                ], onclick=[partial(view_thread, report.associated_thread.id),
-                            partial(delete_thread, report.associated_thread.id)]
-                ).style('display: flex; justify-content: start; flex-direction: column; gap: 5px;')])
-        put_table(report_table_data, header=[
-            'ID',
-            'Made by',
-            'Reported Thread',
-            'Reason',
-            'Reported Date',
-            'Actions'
-        ])
+    for report in reports:
+        reportDateTime = report.date_time.strftime('%d %b, %Y')
+        report_table_data.append([
+            put_select_checkbox(report.id),
+            report.id,
+            report.reporter_name,
+            f'{report.thread_title} (hidden)' if report.is_hidden else report.thread_title,
+            report.flags + pending_count('threads', report.thread_id, 'flags'),
+            report.comment,
+            reportDateTime,
+            put_buttons([
+                {'label': 'View', 'value': 'view_thread', 'color': 'info'},
+                {'label': 'Delete', 'value': 'delete_thread', 'color': 'danger'},
+            ], onclick=[partial(view_thread, report.thread_id),
+                        partial(delete_thread, report.thread_id)]
+            ).style('display: flex; justify-content: start; flex-direction: column; gap: 5px;')])
+    reload_page = partial(content_reports, thread_id, filters, cursors)
+    statement = content_reports_statement(thread_id, filters)
+    put_all_matching_checkbox(count_matching(statement))
+    put_buttons([
+        {'label': 'Dismiss selected reports', 'value': 'dismiss', 'color': 'secondary'},
+        {'label': 'Hide reported threads', 'value': 'hide', 'color': 'warning'},
+        {'label': 'Delete reported threads', 'value': 'delete', 'color': 'danger'}
+    ], onclick=[
+        partial(run_bulk_action, lambda ids: f'{dismiss_reports(ids)} report(s) dismissed', reload_page,
+                statement=statement),
+        partial(run_bulk_action, lambda ids: f'{hide_threads(reported_thread_ids(ids))} thread(s) hidden',
+                reload_page, statement=statement),
+        partial(run_bulk_action,
+                lambda ids: f'{delete_threads(reported_thread_ids(ids))} thread(s) and their comments deleted',
+                reload_page, 'Delete the threads reported by the **{count}** selected report(s) and their comments? '
+                             'This action cannot be undone.', statement)
+    ], small=True)
+    put_table(report_table_data, header=[
+        put_select_all_checkbox(),
+        'ID',
+        'Made by',
+        'Reported Thread',
+        'Thread Flags',
+        'Reason',
+        'Reported Date',
+        'Actions'
+    ])
+    put_page_buttons(cursors, next_cursor, partial(content_reports, thread_id, filters))
 
 
-def content_reports_by_thread():
+@use_scope('ROOT', clear=True)
+def content_reports_by_thread(filters=None, cursors=None):
     """
-    Function to display all the threads with that have been reported in the database
+    Function to display a page of the threads that have been reported in the database
+    :param filters: dictionary of the sort order and filters to apply, default is None which shows the most flagged threads
+    :param cursors: cursors of the pages read so far, default is None which shows the first page
     :return:
     """
     clear()
@@ -1342,48 +2784,76 @@ def content_reports_by_thread():
         toast('You do not have permission to view this page', color='warning')
         main()
         return
+    filters, cursors = filters or {}, cursors or []
 
     generate_header()
     generate_nav()
     put_buttons([
         {'label': 'Individual Reports', 'value': 'reports_each', 'color': 'secondary'},
-    ], onclick=[content_reports]).style('float:right; margin-top: 12px;')
+        {'label': 'Export', 'value': 'export', 'color': 'info'},
+    ], onclick=[content_reports, partial(export_popup, ['threads', 'content_reports'])]).style(
+        'float:right; margin-top: 12px;')
     put_html('<h2>Content Reports by Thread</h2>')
+    put_moderation_filters(FLAGGED_THREAD_SORTS, filters, content_reports_by_thread)
 
     report_table_data = []
-    with Session() as sesh:
-        threads = sesh.query(Thread).filter(Thread.flags > 0).order_by(
-            Thread.flags.desc()).all()  # get threads with reports / flags
-        threadCount = len(threads)
-        if threadCount == 0:
-            put_html('<p class="lead text-center">There is no threads with reports</p>')
-            return
+    # get the visible page of threads with reports / flags
+    threads, next_cursor = read_flagged_threads(filters, cursors[-1] if cursors else None, MODERATION_PAGE_SIZE)
+    threadCount = len(threads)
+    if threadCount == 0:
+        put_html('<p class="lead text-center">There is no threads with reports</p>')
+        return
 
-        serialNum = 1
-        for thread in threads:
-            credibility = thread.up_votes - thread.down_votes
-            report_table_data.append([
-                serialNum,
-                thread.title,
-                thread.flags,
-                credibility,
-                put_buttons([
-                    {'label': 'View Thread', 'value': 'view_thread', 'color': 'info'},
-                    {'label': 'Delete Thread', 'value': 'delete_thread', 'color': 'danger'},
-                    {'label': 'View Reports', 'value': 'view_reports', 'color': 'warning'}
-                ], onclick=[partial(view_thread, thread.id),
-                            partial(delete_thread, thread.id),
-                            partial(content_reports, thread.id)], group=True
-                )])
-            serialNum += 1
-
-        put_table(report_table_data, header=[
-            'No',
-            'Reported Thread',
-            'Reported Count',
-            'Credibility',
-            'Actions'
-        ])
+    serialNum = len(cursors) * MODERATION_PAGE_SIZE + 1  # numbering continues from the previous pages
+    for thread in threads:
+        credibility = (thread.up_votes + pending_count('threads', thread.id, 'up_votes') - thread.down_votes -
+                       pending_count('threads', thread.id, 'down_votes'))
+        report_table_data.append([
+            put_select_checkbox(thread.id),
+            serialNum,
+            f'{thread.title} (hidden)' if thread.is_hidden else thread.title,
+            thread.flags + pending_count('threads', thread.id, 'flags'),
+            credibility,
+            thread.date_time.strftime('%d %b, %Y'),
+            put_buttons([
+                {'label': 'View Thread', 'value': 'view_thread', 'color': 'info'},
+                {'label': 'Delete Thread', 'value': 'delete_thread', 'color': 'danger'},
+                {'label': 'View Reports', 'value': 'view_reports', 'color': 'warning'}
+            ], onclick=[partial(view_thread, thread.id),
+                        partial(delete_thread, thread.id),
+                        partial(content_reports, thread.id)], group=True
+            )])
+        serialNum += 1
+
+    reload_page = partial(content_reports_by_thread, filters, cursors)
+    statement = flagged_threads_statement(filters)
+    put_all_matching_checkbox(count_matching(statement))
+    put_buttons([
+        {'label': 'Hide selected', 'value': 'hide', 'color': 'warning'},
+        {'label': 'Unhide selected', 'value': 'unhide', 'color': 'info'},
+        {'label': 'Clear flags', 'value': 'clear_flags', 'color': 'secondary'},
+        {'label': 'Delete selected', 'value': 'delete', 'color': 'danger'}
+    ], onclick=[
+        partial(run_bulk_action, lambda ids: f'{hide_threads(ids)} thread(s) hidden', reload_page,
+                statement=statement),
+        partial(run_bulk_action, lambda ids: f'{hide_threads(ids, hidden=False)} thread(s) shown again', reload_page,
+                statement=statement),
+        partial(run_bulk_action, lambda ids: f'Flags and reports cleared on {clear_thread_flags(ids)} thread(s)',
+                reload_page, statement=statement),
+        partial(run_bulk_action, lambda ids: f'{delete_threads(ids)} thread(s) and their comments deleted',
+                reload_page, 'Delete the **{count}** selected thread(s) and their comments? '
+                             'This action cannot be undone.', statement)
+    ], small=True)
+    put_table(report_table_data, header=[
+        put_select_all_checkbox(),
+        'No',
+        'Reported Thread',
+        'Reported Count',
+        'Credibility',
+        'Posted Date',
+        'Actions'
+    ])
+    put_page_buttons(cursors, next_cursor, partial(content_reports_by_thread, filters))
 
 
 def view_thread(thread_id):
@@ -1400,7 +2870,7 @@ def view_thread(thread_id):
     put_buttons(['Back to Content Reports'], onclick=[content_reports]).style('float:right; margin-top: 12px;')
     put_html('<h2>View Reported Thread</h2>')
 
-    with Session() as sesh:
+    with ReadSession() as sesh:
         thread = sesh.query(Thread).filter_by(id=thread_id).first()
         threadDateTime = thread.date_time.strftime('%I:%M%p – %d %b, %Y')
         put_html(f'''
@@ -1446,14 +2916,10 @@ def report_thread(thread_id):
         if report_data == '':
             toast('Reason cannot be empty', color='warning')
             return
-        try:
-            with Session() as sesh:
-                thread = sesh.query(Thread).filter_by(id=thread_id).first()
-                new_report = ContentReport(user_id=valid_user.id, thread_id=thread_id, comment=report_data,
-                                           date_time=datetime.now())
-                thread.flags += 1  # increment the flags of the thread
-                sesh.add(new_report)
-                sesh.commit()
+        try:  # the report and the flag of the thread are written together
+            queue_counter_writes(deltas=[('threads', thread_id, 'flags', 1)],
+                                 rows=[('content_reports', {'user_id': valid_user.id, 'thread_id': thread_id,
+                                                            'comment': report_data, 'date_time': datetime.now()})])
         except SQLAlchemyError:
             toast('An error occurred', color='error')
         else:
@@ -1468,7 +2934,7 @@ def report_thread(thread_id):
         toast(f'You need to login to report threads', color='warning')
         user_login()
     elif valid_user.id is not None:
-        with Session() as sesh:
+        with ReadSession() as sesh:
             thread = sesh.query(Thread).filter_by(id=thread_id).first()
             # if thread.user_id == valid_user.id:
             #     toast(f'Silly, let\'s not report your own thread :)', color='warning')
@@ -1487,25 +2953,243 @@ def report_thread(thread_id):
             )
 
 
+#### BULK MODERATION FUNCTIONS ####
+# Each bulk action is one set-based statement per table (DELETE / UPDATE ... WHERE id IN (...)) committed as one
+# transaction, so hundreds of items are handled as quickly as one and a failure leaves nothing half done.
+# Queued reports and flags are written first (see flush_counter_writes()), so the actions work on what is shown.
+
+def delete_threads(thread_ids):
+    """
+    Function to delete threads together with their comments and all content reports on them, in one transaction
+    :param thread_ids: IDs of the threads to be deleted
+    :return: the number of threads deleted (not counting comments)
+    """
+    flush_counter_writes()
+    comment_ids = sa.select(Thread.id).where(Thread.parent_id.in_(thread_ids))
+    with Session() as sesh:
+        sesh.execute(sa.delete(ContentReport).where(
+            sa.or_(ContentReport.thread_id.in_(thread_ids), ContentReport.thread_id.in_(comment_ids))
+        ).execution_options(synchronize_session=False))
+        sesh.execute(sa.delete(Thread).where(Thread.parent_id.in_(thread_ids))
+                     .execution_options(synchronize_session=False))
+        deleted = sesh.execute(sa.delete(Thread).where(Thread.id.in_(thread_ids))
+                               .execution_options(synchronize_session=False)).rowcount
+        sesh.commit()
+    return deleted
+
+
+def hide_threads(thread_ids, hidden=True):
+    """
+    Function to hide threads from the forum (or show them again), in one transaction
+    :param thread_ids: IDs of the threads to be hidden or shown
+    :param hidden: True to hide the threads, False to show them again
+    :return: the number of threads updated
+    """
+    with Session() as sesh:
+        updated = sesh.execute(sa.update(Thread).where(Thread.id.in_(thread_ids)).values(is_hidden=hidden)
+                               .execution_options(synchronize_session=False)).rowcount
+        sesh.commit()
+    return updated
+
+
+def clear_thread_flags(thread_ids):
+    """
+    Function to clear the flags of threads and remove all the content reports made on them, in one transaction
+    :param thread_ids: IDs of the threads to be cleared
+    :return: the number of threads cleared
+    """
+    flush_counter_writes()
+    with Session() as sesh:
+        sesh.execute(sa.delete(ContentReport).where(ContentReport.thread_id.in_(thread_ids))
+                     .execution_options(synchronize_session=False))
+        cleared = sesh.execute(sa.update(Thread).where(Thread.id.in_(thread_ids)).values(flags=0)
+                               .execution_options(synchronize_session=False)).rowcount
+        sesh.commit()
+    return cleared
+
+
+def dismiss_reports(report_ids):
+    """
+    Function to dismiss content reports, the flags of the reported threads go down by the number of reports dismissed
+    :param report_ids: IDs of the content reports to be dismissed
+    :return: the number of reports dismissed
+    """
+    flush_counter_writes()
+    # number of dismissed reports per thread, joined into the UPDATE (UPDATE ... FROM) to lower each thread's flags
+    dismissed_counts = (sa.select(ContentReport.thread_id, func.count(ContentReport.id).label('dismissed'))
+                        .where(ContentReport.id.in_(report_ids))
+                        .group_by(ContentReport.thread_id)
+                        .subquery())
+    with Session() as sesh:
+        sesh.execute(sa.update(Thread)
+                     .where(Thread.id == dismissed_counts.c.thread_id)
+                     .values(flags=func.max(Thread.flags - dismissed_counts.c.dismissed, 0))
+                     .execution_options(synchronize_session=False))
+        dismissed = sesh.execute(sa.delete(ContentReport).where(ContentReport.id.in_(report_ids))
+                                 .execution_options(synchronize_session=False)).rowcount
+        sesh.commit()
+    return dismissed
+
+
+def reported_thread_ids(report_ids):
+    """
+    Function to get the IDs of the threads reported by a set of content reports
+    :param report_ids: IDs of the content reports
+    :return: a list of distinct thread IDs
+    """
+    return [row.thread_id for row in read_rows(
+        sa.select(ContentReport.thread_id).where(ContentReport.id.in_(report_ids)).distinct())]
+
+
+def put_select_checkbox(item_id):
+    """
+    Function to display the checkbox of a row in a moderation table, the checked rows are read by get_selected_ids()
+    :param item_id: ID of the report or thread in the row
+    :return:
+    """
+    return put_html(f'<input type="checkbox" class="form-check-input" name="moderation-select" value="{item_id}">')
+
+
+def put_select_all_checkbox():
+    """
+    Function to display the header checkbox which checks or unchecks every row on the page
+    :return:
+    """
+    return put_html('''<input type="checkbox" class="form-check-input" title="Select all on this page"
+        onclick="document.querySelectorAll('input[name=moderation-select]').forEach(box => box.checked = this.checked)">''')
+
+
+def put_all_matching_checkbox(matchCount):
+    """
+    Function to display the checkbox which makes the bulk actions apply to every row matching the current filters,
+    on all pages, instead of the rows checked on this page
+    :param matchCount: number of rows matching the current filters
+    :return:
+    """
+    put_checkbox('moderation_all_matching', options=[
+        {'label': f'Apply to all {matchCount} matching the current filters, on every page', 'value': True}])
+
+
+def get_selected_ids():
+    """
+    Function to read the IDs of the checked rows of a moderation table from the browser in one round trip
+    :return: a list of the selected IDs
+    """
+    return eval_js("Array.from(document.querySelectorAll('input[name=moderation-select]:checked'))"
+                   ".map(box => parseInt(box.value))")
+
+
+def run_bulk_action(action, on_done, confirm_message=None, statement=None):
+    """
+    Function to run a bulk moderation action on the selected rows of a moderation table, or on every row matching its
+    filters when the "apply to all matching" box is ticked
+    :param action: function taking the list of selected IDs and returning a result message
+    :param on_done: function to call to reload the moderation table afterwards
+    :param confirm_message: message to confirm before running the action (for deletions), default is None for no confirmation
+    :param statement: filtered select statement of the table, read for the IDs when the box is ticked
+    :return:
+    """
+    if statement is not None and pin.moderation_all_matching:
+        selected_ids = matching_ids(statement)
+        # acting on rows the moderator has not seen is always confirmed first
+        confirm_message = confirm_message or 'Apply this action to all **{count}** matching row(s)?'
+    else:
+        selected_ids = get_selected_ids()
+    if len(selected_ids) == 0:
+        toast('Select at least one row first', color='warning')
+        return
+
+    def confirm_action():  # function to run the action once confirmed and reload the table
+        close_popup()
+        try:
+            result_message = action(selected_ids)
+        except SQLAlchemyError:
+            toast('An error occurred, no changes have been made', color='error')
+        else:
+            toast(result_message, color='success')
+        finally:
+            on_done()
+
+    if confirm_message is None:
+        confirm_action()
+        return
+    popup('Please confirm', [
+        put_markdown(confirm_message.format(count=len(selected_ids))),
+        put_buttons([
+            {'label': 'Yes, confirm', 'value': 'confirm', 'color': 'danger'},
+            {'label': 'Cancel', 'value': 'cancel', 'color': 'secondary'}
+        ], onclick=[confirm_action, close_popup])
+    ], closable=True)
+
+
 #### CRIME REPORT FUNCTIONS by KT and IVY ####
+def put_crime_filters(filters, on_apply):
+    """
+    Function to display the sort and filter controls of the crime registry
+    :param filters: dictionary of the filters currently applied
+    :param on_apply: function to call with the new filters when they are applied or reset
+    :return:
+    """
+
+    def apply_filters():  # function to read the filter fields and reload the registry with them
+        on_apply({
+            'sort': pin.crime_sort,
+            'status': pin.crime_status,
+            'category': pin.crime_category,
+            'location': pin.crime_location,
+            'emergency': pin.crime_emergency,
+            'date_from': pin.crime_date_from,
+            'date_to': pin.crime_date_to
+        })
+
+    put_row([
+        put_select('crime_sort', label='Sort by', value=filters.get('sort') or 'newest',
+                   options=[{'label': label, 'value': key} for key, (label, _, _) in CRIME_REPORT_SORTS.items()]),
+        put_select('crime_status', label='Status', value=filters.get('status', ''),
+                   options=[{'label': 'All', 'value': ''}, 'Pending', 'Under Investigation', 'Action Taken', 'Closed']),
+        put_select('crime_category', label='Nature', value=filters.get('category', ''),
+                   options=[{'label': 'All', 'value': ''}, 'Theft', 'Assault', 'Vandalism', 'Other']),
+        put_location_input('crime_location', value=filters.get('location', '')),
+    ]).style('gap: 10px;')
+    put_row([
+        put_select('crime_emergency', label='Emergency', value=filters.get('emergency', ''),
+                   options=[{'label': 'All', 'value': ''}, {'label': 'Yes', 'value': 'yes'},
+                            {'label': 'No', 'value': 'no'}]),
+        put_input('crime_date_from', type=DATE, label='From', value=filters.get('date_from', '')),
+        put_input('crime_date_to', type=DATE, label='To', value=filters.get('date_to', ''))
+    ]).style('gap: 10px;')
+    put_buttons([
+        {'label': 'Apply', 'value': 'apply', 'color': 'primary'},
+        {'label': 'Reset', 'value': 'reset', 'color': 'secondary'}
+    ], onclick=[apply_filters, partial(on_apply, {})], small=True).style('margin-bottom: 10px;')
+
+
 @use_scope('ROOT', clear=True)
-def crime_report_feeds(view='all'):
+def crime_report_feeds(view='all', filters=None, cursors=None):
     """
-    This function will display all the police reports made by the user.
-    If the user is a police staff, it will display all the police reports made by all users.
+    This function will display a page of the police reports made by the user.
+    If the user is a police staff, it will display the police reports made by all users.
+    Both use the same paginated registry with server-side filters and sorting.
     :param view: The view of the police reports to be displayed, default is 'all' which displays all police reports
+    :param filters: dictionary of the sort order and filters to apply, default is None which shows the newest reports
+    :param cursors: cursors of the pages read so far, default is None which shows the first page
     """
     clear()
     global valid_user
+    if filters is None:  # the emergency view starts with the emergency filter applied
+        filters = {'emergency': 'yes'} if view == 'emergency' else {}
+    cursors = cursors or []
 
     generate_header()
     generate_nav()
-    if valid_user is not None and valid_user.id == 3:  # police staff
+    if valid_user is not None and valid_user.role_id == 3:  # police staff
         if view == 'all':
             put_buttons([
                 {'label': 'Emergency Crime Reports', 'value': 'crime_report_feeds_by_emergency', 'color': 'danger'},
-                {'label': 'Crime Statistics', 'value': 'crime_stats', 'color': 'warning'}
-            ], onclick=[partial(crime_report_feeds, 'emergency'), crime_stats]).style('float:right; margin-top: 12px;')
+                {'label': 'Crime Statistics', 'value': 'crime_stats', 'color': 'warning'},
+                {'label': 'Archived Reports', 'value': 'archived_crime_reports', 'color': 'secondary'}
+            ], onclick=[partial(crime_report_feeds, 'emergency'), crime_stats, archived_crime_reports]).style(
+                'float:right; margin-top: 12px;')
             put_html('<h2>All Crime Reports</h2>')
         elif view == 'emergency':
             put_buttons([
@@ -1515,56 +3199,52 @@ def crime_report_feeds(view='all'):
             put_html('<h2>Emergency Crime Reports</h2>')
     else:  # power users
         put_buttons([
-            {'label': 'Report a Crime', 'value': 'report_crime', 'color': 'success'}
-        ], onclick=[report_crime]).style('float:right; margin-top: 12px;')
+            {'label': 'Report a Crime', 'value': 'report_crime', 'color': 'success'},
+            {'label': 'Archived Reports', 'value': 'archived_crime_reports', 'color': 'secondary'}
+        ], onclick=[report_crime, archived_crime_reports]).style('float:right; margin-top: 12px;')
         put_html('<h2>My Police Reports</h2>')
 
     # initialise the crime table data
     crime_table_data = []
-    seriesNum = 1  # for numbering the rows
+    seriesNum = len(cursors) * CRIME_PAGE_SIZE + 1  # for numbering the rows, continuing from the previous pages
     try:
         if valid_user is None:
             raise ValueError('You need to login to view police reports')
         elif valid_user is not None and valid_user.role_id not in [2, 3]:  # if not power user or police staff
             raise ValueError('You do not have permission to view police reports')
-        elif valid_user.id == 3:  # police staff
-            with Session() as sesh:
-                if view == 'all':
-                    crimes = sesh.query(CrimeReport).all()
-                    crimeCount = len(crimes)
-                    if crimeCount == 0:
-                        put_html('<p class="lead text-center">There is no police reports</p>')
-                        return
-                elif view == 'emergency':
-                    crimes = sesh.query(CrimeReport).filter(CrimeReport.is_emergency == True).all()
-                    crimeCount = len(crimes)
-                    if crimeCount == 0:
-                        put_html('<p class="lead text-center">There is no emergency police reports</p>')
-                        return
-        else:  # power user
-            with Session() as sesh:
-                crimes = sesh.query(CrimeReport).filter_by(user_id=valid_user.id).all()
-                crimeCount = len(crimes)
-                if crimeCount == 0:
-                    put_html('<p class="lead text-center">There is no police reports</p>')
-                    return
+        put_crime_filters(filters, partial(crime_report_feeds, view))
+        # police staff read the reports of all users, power users only their own reports
+        crimes, next_cursor = read_crime_reports(None if valid_user.role_id == 3 else valid_user.id, filters,
+                                                 cursors[-1] if cursors else None, CRIME_PAGE_SIZE)
+        crimeCount = len(crimes)
+        if crimeCount == 0:
+            put_html('<p class="lead text-center">There is no police reports</p>')
+            return
+    except ValueError as ve:
+        toast(f'{str(ve)}', color='warning')
     except SQLAlchemyError:
         toast('An error occurred', color='error')
     else:
+        unread_counts = unread_message_counts([crime.id for crime in crimes], valid_user.id)
         for crime in crimes:
             crimeDateTime = crime.date_time.strftime('%d %b, %Y')  # format the date
             row = [
                 seriesNum,
                 crime.id,
-                crime.title,
+                put_html(f'{crime.title} <span class="badge bg-primary text-light">{unread_counts[crime.id]} new '
+                         f'message{"s" if unread_counts[crime.id] > 1 else ""}</span>')
+                if crime.id in unread_counts else crime.title,
                 crime.location,
                 crime.category,
                 crimeDateTime,
-                crime.status,
+                put_html(f'{crime.status} <span class="badge bg-danger text-light">Emergency</span>')
+                if crime.is_emergency else crime.status,
                 put_buttons([
                     {'label': 'View', 'value': 'view', 'color': 'primary'},
+                    {'label': 'Messages', 'value': 'messages', 'color': 'info'},
                     {'label': 'Delete', 'value': 'delete', 'color': 'danger'}
-                ], onclick=[partial(view_crime, crime.id), partial(delete_crime, crime.id)]).style(
+                ], onclick=[partial(view_crime, crime.id), partial(respond_chat, crime.id),
+                            partial(delete_crime, crime.id)]).style(
                     'display: flex; justify-content: start; gap: 5px; flex-direction: column;')
             ]
 
@@ -1583,6 +3263,7 @@ def crime_report_feeds(view='all'):
         ]
 
         put_table(crime_table_data, header=header)
+        put_page_buttons(cursors, next_cursor, partial(crime_report_feeds, view, filters))
 
 
 def report_crime():
@@ -1611,7 +3292,7 @@ def report_crime():
                                                required=False) if c == 'Other' else input_update('other', hidden=True)),
         # if "Other" is selected, show an input field for specifying the nature of the crime
         input('', name='other', required=False, hidden=True, maxlength=20),
-        select('Location', locations_list, name='location', required=True),
+        location_input(),
         textarea('Description', name='content', required=True, wrap='hard',
                  help_text='Please provide as much detail as possible including the exact location'),
         checkbox('Is this an emergency?', name='emergency', options=[{'label': 'Yes - Notify Police', 'value': True}]),
@@ -1645,6 +3326,8 @@ def report_crime():
                                         date_time=datetime.now(), status='Pending')
                 sesh.add(new_crime)
                 sesh.commit()
+                deliver_to_subscribers(new_crime.location, CRIME_REPORT_CATEGORY, new_crime.date_time,
+                                       crime_report_id=new_crime.id)
     except ValueError as ve:
         toast(f'{str(ve)}', color='error')
     except SQLAlchemyError:
@@ -1700,7 +3383,7 @@ def view_crime(crime_id):
     put_buttons(['Back to My Police Reports'], onclick=[crime_report_feeds]).style('float:right; margin-top: 12px;')
     put_html('<h2>Report Detail</h2>')
 
-    with Session() as sesh:
+    with ReadSession() as sesh:
         crime = sesh.query(CrimeReport).filter_by(id=crime_id).first()
         current_crime_status = crime.status  # store the current status of the crime report to be used outside the session
         crimeDateTime = crime.date_time.strftime('%I:%M%p – %d %b, %Y')
@@ -1719,12 +3402,18 @@ def view_crime(crime_id):
                 f'''<p class="h3">{crime.title} {f'<span class="fw-bolder badge bg-danger text-light"> EMERGENCY </span>' if crime.is_emergency else ''}</p>'''),
                 col=2)])
 
+        unreadCount = unread_message_counts([crime_id], valid_user.id).get(crime_id, 0) if valid_user else 0
+        messagesLabel = f'Messages ({unreadCount} new)' if unreadCount else 'Messages'
         if get_role_id() == 3:  # if the user is a police staff, show the change status button
             put_buttons([
                 {'label': 'Change Status', 'value': 'edit', 'color': 'primary'},
-                {'label': 'Respond', 'value': 'delete', 'color': 'info'},
+                {'label': messagesLabel, 'value': 'respond', 'color': 'info'},
                 {'label': 'Delete', 'value': 'delete', 'color': 'danger'}
             ], onclick=[change_crime_status, partial(respond_chat, crime_id), partial(delete_crime, crime.id)])
+        elif valid_user is not None and crime.user_id == valid_user.id:  # the power user who made the report
+            put_buttons([
+                {'label': messagesLabel, 'value': 'respond', 'color': 'info'}
+            ], onclick=[partial(respond_chat, crime_id)])
 
 
 @use_scope('ROOT', clear=True)
@@ -1754,205 +3443,2879 @@ def delete_crime(crime_id):
 
 
 @use_scope('ROOT', clear=True)
-def crime_stats(view='location'):
+def archived_crime_reports(cursors=None):
     """
-    This function will display the statistics of the crime reports.
+    This function will display a page of the archived (closed) crime reports, read only.
+    Police staff see the reports of all users, power users their own reports.
+    :param cursors: cursors of the pages read so far, default is None which shows the first page
     """
     clear()
     global valid_user
+    cursors = cursors or []
 
     generate_header()
     generate_nav()
-    if valid_user is None and valid_user.id not in [3, 4]:  # police and council staff
-        toast('You do not have permission to view this page', color='warning')
+    put_buttons(['Back to Crime Reports'], onclick=[crime_report_feeds]).style('float:right; margin-top: 12px;')
+    put_html('<h2>Archived Crime Reports</h2>')
+    put_html('<p>Closed cases are moved here. They can be read, but no longer changed.</p>')
+
+    if valid_user is None or valid_user.role_id not in [2, 3]:  # if not power user or police staff
+        toast('You do not have permission to view police reports', color='warning')
         return
-    if view == 'category':
-        put_buttons([
-            {'label': 'Reports by Crime Location', 'value': 'home', 'color': 'secondary'},
-        ], onclick=[partial(crime_stats, 'location')]).style('float:right; margin-top: 12px;')
-        put_html('<h2>Crime Statistics by Category</h2>')
-    elif view == 'location':
+    try:
+        crimes, next_cursor = read_archived_crime_reports(None if valid_user.role_id == 3 else valid_user.id,
+                                                          cursors[-1] if cursors else None)
+    except SQLAlchemyError:
+        toast('An error occurred', color='error')
+        return
+    if len(crimes) == 0:
+        put_html('<p class="lead text-center">There is no archived police reports</p>')
+        return
+    seriesNum = len(cursors) * ARCHIVE_PAGE_SIZE + 1  # numbering continues from the previous pages
+    crime_table_data = []
+    for crime in crimes:
+        crime_table_data.append([
+            seriesNum,
+            crime.id,
+            put_html(f'{crime.title} <span class="badge bg-danger text-light">Emergency</span>')
+            if crime.is_emergency else crime.title,
+            crime.location,
+            crime.category,
+            crime.date_time.strftime('%d %b, %Y'),
+            crime.archived_at.strftime('%d %b, %Y'),
+            put_buttons([{'label': 'View', 'value': 'view', 'color': 'primary'}],
+                        onclick=[partial(view_archived_crime, crime.id)])
+        ])
+        seriesNum += 1
+    put_table(crime_table_data, header=['No', 'Ref ID', 'Title', 'Location', 'Nature', 'Date', 'Archived', 'Action'])
+    put_page_buttons(cursors, next_cursor, archived_crime_reports)
+
+
+@use_scope('ROOT', clear=True)
+def view_archived_crime(crime_id):
+    """
+    This function will display an archived crime report with its conversation, read only.
+    :param crime_id: The ID of the archived crime report.
+    """
+    clear()
+    global valid_user
+
+    generate_header()
+    generate_nav()
+    put_buttons(['Back to Archived Reports'], onclick=[archived_crime_reports]).style(
+        'float:right; margin-top: 12px;')
+    put_html('<h2>Archived Report Detail</h2>')
+
+    archive = crime_reports_archive.c
+    rows = read_rows(sa.select(crime_reports_archive, User.display_name)
+                     .outerjoin(User, User.id == archive.user_id).where(archive.id == crime_id))
+    if not rows or valid_user is None or (valid_user.role_id != 3 and rows[0].user_id != valid_user.id):
+        toast('This report cannot be found in the archive', color='warning')
+        return
+    crime = rows[0]
+    put_table([
+        ['Reference ID', crime.id],
+        ['Date and Time', crime.date_time.strftime('%I:%M%p – %d %b, %Y')],
+        ['By', crime.display_name],
+        ['Emergency', 'Yes' if crime.is_emergency else 'No'],
+        ['Description', crime.description],
+        ['Location', crime.location],
+        ['Nature of Crime', crime.category],
+        ['Status', crime.status],
+        ['Archived', crime.archived_at.strftime('%I:%M%p – %d %b, %Y')]
+    ], header=[span(put_html(f'<p class="h3">{crime.title}</p>'), col=2)])
+
+    messages = read_crime_messages(crime_id)
+    if messages:
+        put_html(f'<p class="h5 fw-bolder">Messages{" (the latest " + str(CHAT_PAGE_SIZE) + ")" if len(messages) == CHAT_PAGE_SIZE else ""}</p>')
+        for message in messages:
+            put_crime_message(message, valid_user.id)
+
+
+@use_scope('ROOT', clear=True)
+def crime_stats(view='location'):
+    """
+    This function will display the statistics of the crime reports.
+    """
+    clear()
+    global valid_user
+
+    generate_header()
+    generate_nav()
+    if valid_user is None or valid_user.role_id not in [3, 4]:  # police and council staff
+        toast('You do not have permission to view this page', color='warning')
+        return
+    if view == 'category':
+        put_buttons([
+            {'label': 'Reports by Crime Location', 'value': 'home', 'color': 'secondary'},
+            {'label': 'Export', 'value': 'export', 'color': 'info'},
+        ], onclick=[partial(crime_stats, 'location'), partial(export_popup, ['crime_reports', 'posts'])]).style(
+            'float:right; margin-top: 12px;')
+        put_html('<h2>Crime Statistics by Category</h2>')
+    elif view == 'location':
         put_buttons([
             {'label': 'Reports by Crime Category', 'value': 'home', 'color': 'secondary'},
-        ], onclick=[partial(crime_stats, 'category')]).style('float:right; margin-top: 12px;')
+            {'label': 'Export', 'value': 'export', 'color': 'info'},
+        ], onclick=[partial(crime_stats, 'category'), partial(export_popup, ['crime_reports', 'posts'])]).style(
+            'float:right; margin-top: 12px;')
         put_html('<h2>Crime Statistics by Location</h2>')
 
-    with Session() as sesh:
-        crime_reports = sesh.query(CrimeReport).all()
-        crimeCount = len(crime_reports)
-        if crimeCount == 0:
-            put_html('<p class="lead text-center">There is no crime reports</p>')
-            return
+    archived_counts = read_archived_crime_counts(view)  # archived reports are all closed cases
+    with ReadSession() as sesh:
+        crimeCount = sesh.query(func.count(CrimeReport.id)).scalar()  # only the count is needed, not the reports
+        if crimeCount + sum(archived_counts.values()) == 0:
+            put_html('<p class="lead text-center">There is no crime reports</p>')
+            return
+
+        data_table = []
+
+        if view == 'location':
+            result = sesh.query(
+                CrimeReport.location,
+                func.count(CrimeReport.id),
+                func.count(CrimeReport.id).filter(CrimeReport.status == "Pending"),
+                func.count(CrimeReport.id).filter(CrimeReport.status == "Under Investigation"),
+                func.count(CrimeReport.id).filter(CrimeReport.status == "Action Taken"),
+                func.count(CrimeReport.id).filter(CrimeReport.status == "Closed")).group_by(
+                CrimeReport.location).order_by((func.count(CrimeReport.id) - func.count(CrimeReport.id).filter(
+                CrimeReport.status == "Closed")).desc()).all()
+            for location, count, new_cases, investigation_cases, resolved_cases, closed_cases in result:
+                data_table.append(
+                    [location, count - closed_cases, new_cases, investigation_cases, resolved_cases,
+                     closed_cases + archived_counts.pop(location, 0)])
+            data_table += [[location, 0, 0, 0, 0, closed_cases] for location, closed_cases in archived_counts.items()]
+
+            put_table(data_table,
+                      header=['Crime Location', 'Open Cases', 'New Cases', 'Under Investigation',
+                              'Resolved Cases',
+                              'Closed Cases'])
+
+        elif view == 'category':
+            result = sesh.query(
+                CrimeReport.category, func.count(CrimeReport.id),
+                func.count(CrimeReport.id).filter(CrimeReport.status == "Pending"),
+                func.count(CrimeReport.id).filter(CrimeReport.status == "Under Investigation"),
+                func.count(CrimeReport.id).filter(CrimeReport.status == "Action Taken"),
+                func.count(CrimeReport.id).filter(CrimeReport.status == "Closed")).group_by(
+                CrimeReport.category).order_by((func.count(CrimeReport.id) - func.count(CrimeReport.id).filter(
+                CrimeReport.status == "Closed")).desc()).all()
+            for category, count, new_cases, investigation_cases, resolved_cases, closed_cases in result:
+                data_table.append(
+                    [category, count - closed_cases, new_cases, investigation_cases, resolved_cases,
+                     closed_cases + archived_counts.pop(category, 0)])
+            data_table += [[category, 0, 0, 0, 0, closed_cases] for category, closed_cases in archived_counts.items()]
+
+            put_table(data_table,
+                      header=['Crime Category', 'Open Cases', 'New Cases', 'Under Investigation',
+                              'Resolved Cases',
+                              'Closed Cases'])
+
+
+#### ANNOUNCEMENT SCHEDULER FUNCTIONS ####
+# Council staff can write announcements ahead of time, to be published and to expire at given times.
+# The upcoming transitions are kept in memory in a min-heap, loaded once from the (status, publish_at) and
+# (status, expire_at) indexes, so the scheduler never polls the notifications table. A thread sleeps until the earliest
+# transition is due (or a new one is added), then flips every due announcement in one transaction per batch.
+# Heap entries can go stale when an announcement is edited or deleted, so the updates check the status and the time
+# again and skip rows which no longer match.
+
+def load_announcement_schedule():
+    """
+    Function to fill the heap with the transitions of the scheduled announcements and the active ones which expire
+    :return:
+    """
+    scheduled = read_rows(sa.select(Notification.publish_at, Notification.id)
+                          .where(Notification.status == 'Scheduled', Notification.publish_at.is_not(None)))
+    expiring = read_rows(sa.select(Notification.expire_at, Notification.id)
+                         .where(Notification.status == 'Active', Notification.expire_at.is_not(None)))
+    with announcement_schedule_changed:
+        announcement_schedule[:] = ([(row.publish_at, row.id, 'publish') for row in scheduled] +
+                                    [(row.expire_at, row.id, 'expire') for row in expiring])
+        heapq.heapify(announcement_schedule)
+        announcement_schedule_changed.notify()
+
+
+def schedule_announcement(notification_id, publish_at=None, expire_at=None):
+    """
+    Function to add the transitions of an announcement to the heap, waking the scheduler if one is due sooner
+    :param notification_id: Notification ID of the announcement
+    :param publish_at: date and time to publish it, None if it is already published
+    :param expire_at: date and time it expires, None if it does not expire
+    :return:
+    """
+    with announcement_schedule_changed:
+        if publish_at is not None:
+            heapq.heappush(announcement_schedule, (publish_at, notification_id, 'publish'))
+        if expire_at is not None:
+            heapq.heappush(announcement_schedule, (expire_at, notification_id, 'expire'))
+        announcement_schedule_changed.notify()
+
+
+def apply_announcement_transitions(due):
+    """
+    Function to publish and expire announcements in one transaction, then deliver the published ones to their
+    subscribers and to the live sessions
+    :param due: list of heap entries which are due
+    :return: a tuple of (number of announcements published, number expired)
+    """
+    now = datetime.now()
+    publish_ids = [notification_id for _, notification_id, transition in due if transition == 'publish']
+    expire_ids = [notification_id for _, notification_id, transition in due if transition == 'expire']
+    published, expired = [], []
+    with db.begin() as conn:
+        if publish_ids:
+            published = conn.execute(
+                sa.update(Notification)
+                .where(Notification.id.in_(publish_ids), Notification.status == 'Scheduled',
+                       Notification.publish_at <= now)
+                .values(status='Active', date_time=Notification.publish_at, publish_at=None)
+                .returning(Notification.id, Notification.title, Notification.category, Notification.location,
+                           Notification.date_time, Notification.expire_at)).all()
+        if expire_ids:
+            expired = conn.execute(
+                sa.update(Notification)
+                .where(Notification.id.in_(expire_ids), Notification.status == 'Active',
+                       Notification.expire_at <= now)
+                .values(status='Expired')
+                .returning(Notification.id)).all()
+    for announcement in published:
+        deliver_to_subscribers(announcement.location, announcement.category, announcement.date_time,
+                               notification_id=announcement.id)
+        schedule_announcement(announcement.id, expire_at=announcement.expire_at)
+    if published:
+        with announcement_listeners_lock:
+            listeners = list(announcement_listeners)
+        for listener in listeners:
+            listener.put(published)
+    return len(published), len(expired)
+
+
+def run_announcement_scheduler():
+    """
+    Function to load the heap and apply the transitions as they come due, sleeping in between
+    :return:
+    """
+    load_announcement_schedule()
+    while True:
+        with announcement_schedule_changed:
+            while not announcement_schedule or announcement_schedule[0][0] > datetime.now():
+                # sleeps until the earliest transition is due, or until schedule_announcement() adds one
+                announcement_schedule_changed.wait(
+                    (announcement_schedule[0][0] - datetime.now()).total_seconds() if announcement_schedule else None)
+            now = datetime.now()
+            due = []
+            while announcement_schedule and announcement_schedule[0][0] <= now and len(due) < ANNOUNCEMENT_BATCH_SIZE:
+                due.append(heapq.heappop(announcement_schedule))
+        try:
+            apply_announcement_transitions(due)
+        except SQLAlchemyError as error:
+            print(f'Announcement transitions failed, trying again later: {error}', file=sys.stderr)
+            retry_at = datetime.now() + timedelta(seconds=ANNOUNCEMENT_RETRY_SECONDS)
+            with announcement_schedule_changed:
+                for _, notification_id, transition in due:
+                    heapq.heappush(announcement_schedule, (retry_at, notification_id, transition))
+
+
+def listen_for_announcements():
+    """
+    Function to show a toast in the current session whenever announcements are published, started once per session
+    :return:
+    """
+    if local.announcement_listener is not None:
+        return
+    listener = queue.Queue()
+    local.announcement_listener = listener
+    with announcement_listeners_lock:
+        announcement_listeners.add(listener)
+    defer_call(partial(listener.put, None))  # wakes the thread when the browser is closed
+
+    def show_announcements():  # function run in a thread of the session
+        try:
+            while (published := listener.get()) is not None:
+                for announcement in published:
+                    toast(f'New announcement – {announcement.category}: {announcement.title}', duration=10,
+                          onclick=notification_feeds)
+        except SessionException:  # the browser was closed while a toast was shown
+            pass
+        finally:
+            with announcement_listeners_lock:
+                announcement_listeners.discard(listener)
+
+    listener_thread = threading.Thread(target=show_announcements, daemon=True)
+    register_thread(listener_thread)
+    listener_thread.start()
+
+
+#### CRIME REPORT MESSAGING FUNCTIONS ####
+# Police staff and the power user who made a crime report talk in a conversation on the report (see respond_chat()).
+# Messages are read by keyset on the (crime_id, id) index, the newest CHAT_PAGE_SIZE first and earlier pages on request,
+# so a conversation opens as fast with thousands of messages as with ten. Unread counts use the same index, counting
+# from the last message each user has read. New messages are pushed to the sessions which have the conversation open
+# through an in-process publish/subscribe: each open conversation has a queue, which a thread of its session empties.
+
+def read_crime_messages(crime_id, before=None, limit=CHAT_PAGE_SIZE):
+    """
+    Function to read a page of the messages of a crime report conversation
+    :param crime_id: Crime report ID of the conversation
+    :param before: Message ID to read the messages before, default is None for the newest messages
+    :param limit: number of messages to read
+    :return: a list of rows of id, user_id, display_name, role_id, content and date_time, in the order they were sent
+    """
+    statement = (sa.select(CrimeMessage.id, CrimeMessage.user_id, User.display_name, User.role_id,
+                           CrimeMessage.content, CrimeMessage.date_time)
+                 .join(User, User.id == CrimeMessage.user_id)
+                 .where(CrimeMessage.crime_id == crime_id)
+                 .order_by(CrimeMessage.id.desc())
+                 .limit(limit))
+    if before is not None:
+        statement = statement.where(CrimeMessage.id < before)
+    return read_rows(statement)[::-1]
+
+
+def mark_messages_read(crime_id, user_id, message_id):
+    """
+    Function to save the last message of a conversation a user has read
+    :param crime_id: Crime report ID of the conversation
+    :param user_id: User ID of the reader
+    :param message_id: Message ID of the newest message read
+    :return:
+    """
+    statement = sqlite_insert(CrimeMessageRead).values(crime_id=crime_id, user_id=user_id, last_read_id=message_id)
+    with db.begin() as conn:
+        conn.execute(statement.on_conflict_do_update(
+            index_elements=['crime_id', 'user_id'],
+            set_={'last_read_id': func.max(CrimeMessageRead.last_read_id, statement.excluded.last_read_id)}))
+
+
+def unread_message_counts(crime_ids, user_id):
+    """
+    Function to count the messages from others a user has not read in each of some conversations.
+    Each count is a range scan of the (crime_id, id) index after the user's last read message.
+    :param crime_ids: list of Crime report IDs
+    :param user_id: User ID of the reader
+    :return: a dictionary of Crime report ID to the number of unread messages, reports without any are left out
+    """
+    statement = (sa.select(CrimeReport.id, func.count(CrimeMessage.id).label('unread'))
+                 .outerjoin(CrimeMessageRead, sa.and_(CrimeMessageRead.crime_id == CrimeReport.id,
+                                                      CrimeMessageRead.user_id == user_id))
+                 .join(CrimeMessage, sa.and_(CrimeMessage.crime_id == CrimeReport.id,
+                                             CrimeMessage.id > func.coalesce(CrimeMessageRead.last_read_id, 0)))
+                 .where(CrimeReport.id.in_(crime_ids), CrimeMessage.user_id != user_id)
+                 .group_by(CrimeReport.id))
+    return {row.id: row.unread for row in read_rows(statement)}
+
+
+def subscribe_to_chat(crime_id):
+    """
+    Function to start receiving the new messages of a conversation
+    :param crime_id: Crime report ID of the conversation
+    :return: a queue the new messages are put in, as rows like the ones of read_crime_messages()
+    """
+    listener = queue.Queue()
+    with chat_listeners_lock:
+        chat_listeners.setdefault(crime_id, set()).add(listener)
+    return listener
+
+
+def unsubscribe_from_chat(crime_id, listener):
+    """
+    Function to stop receiving the new messages of a conversation
+    :param crime_id: Crime report ID of the conversation
+    :param listener: queue returned by subscribe_to_chat()
+    :return:
+    """
+    with chat_listeners_lock:
+        listeners = chat_listeners.get(crime_id, set())
+        listeners.discard(listener)
+        if not listeners:
+            chat_listeners.pop(crime_id, None)
+
+
+def send_crime_message(crime_id, user_id, content):
+    """
+    Function to save a new message of a conversation and push it to the sessions which have the conversation open
+    :param crime_id: Crime report ID of the conversation
+    :param user_id: User ID of the sender
+    :param content: text of the message
+    :return: the new message, as a row like the ones of read_crime_messages()
+    """
+    with Session() as sesh:
+        message = CrimeMessage(crime_id=crime_id, user_id=user_id, content=content, date_time=datetime.now())
+        sesh.add(message)
+        sesh.commit()
+        message_id = message.id
+    mark_messages_read(crime_id, user_id, message_id)  # the sender has read their own message
+    message = read_crime_messages(crime_id, before=message_id + 1, limit=1)[0]
+    with chat_listeners_lock:
+        listeners = list(chat_listeners.get(crime_id, ()))
+    for listener in listeners:
+        listener.put(message)
+    return message
+
+
+def put_crime_message(message, user_id, position=OutputPosition.BOTTOM):
+    """
+    Function to display a message of a crime report conversation, the user's own messages on the right
+    :param message: row of the message
+    :param user_id: User ID of the user looking at the conversation
+    :param position: where to put the message in the current scope, default is after the messages shown
+    :return:
+    """
+    messageDateTime = message.date_time.strftime('%I:%M%p – %d %b, %Y')
+    police_badge = '<span class="badge bg-primary text-light">Police</span>' if message.role_id == 3 else ''
+    put_html(f'''
+        <div class="card mb-2" style="max-width: 75%; {'margin-left: auto;' if message.user_id == user_id else ''}">
+            <div class="card-body p-2">
+            <p class="card-subtitle mb-1"><small>{html.escape(message.display_name)} {police_badge} – {messageDateTime}</small></p>
+            <p class="card-text" style="white-space: pre-wrap;">{html.escape(message.content)}</p>
+            </div>
+        </div>
+        ''', position=position)
+
+
+#### NOTIFICATION FUNCTIONS by KT and MTK ####
+@use_scope('ROOT', clear=True)
+def notification_feeds():
+    """
+    This function will display the notifications feeds for the user.
+    Only council member and police users will be able to create and manage their notifications.
+    Council members will be able to see the name of council members who created council notifications / updates.
+    Police users will be able to see the name of police members who created police notifications.
+    """
+    clear()
+    global valid_user
+
+    generate_header()
+    generate_nav()
+    if valid_user is not None and valid_user.role_id == 4:  # if the user is valid and is a council staff
+        put_buttons([
+            {'label': 'Announce an Update', 'value': 'create', 'color': 'primary'},
+            {'label': 'My Announcements', 'value': 'manage', 'color': 'secondary'}
+        ], onclick=[council_create_update, council_manage_updates]).style('float:right; margin-top: 12px;')
+    elif valid_user is not None and valid_user.role_id == 3:  # if the user is valid and is a police staff
+        put_buttons([
+            {'label': 'Post a Notification', 'value': 'create', 'color': 'primary'},
+            {'label': 'My Notifications', 'value': 'manage', 'color': 'secondary'}
+        ], onclick=[police_create_notification, police_manage_notifications]).style('float:right; margin-top: 12px;')
+    elif valid_user is not None:  # other users can choose what their feed shows
+        put_buttons([
+            {'label': 'My Subscriptions', 'value': 'subscriptions', 'color': 'secondary'}
+        ], onclick=[manage_subscriptions]).style('float:right; margin-top: 12px;')
+    put_html('<h2>Notifications</h2>')
+
+    # subscribed users only see what they are subscribed to, everyone else sees all active notifications
+    if valid_user is not None and valid_user.role_id in [1, 2] and is_subscribed(valid_user.id):
+        notifications = read_feed_items(valid_user.id, session_preferences()['feed_page_size'])
+    else:
+        notifications = read_notification_cards(session_preferences()['feed_page_size'])
+    notificationCount = len(notifications)
+    if notificationCount == 0:
+        put_html('<p class="lead text-center">There is no notifications</p>')
+        return
+    for notification in notifications:
+        notificationDateTime = notification.date_time.strftime('%I:%M%p – %d %b, %Y')  # format the date
+        if getattr(notification, 'crime_report_id', None) is not None:  # a crime report delivered to a subscriber
+            put_warning(put_html(f'''
+            <div class="card p-2">
+                <div class="card-body p-2">
+                <h4 class="card-title m-0">Crime reported at {notification.crime_location}: {notification.crime_title}</h4>
+                <p class="card-subtitle mb-2"><small>{notification.crime_category} – {notificationDateTime}</small>
+                </div>
+            </div>
+            '''), closable=True).style('margin-bottom: 10px;')
+            continue
+        # if the user is a council staff, show the council badge or police badge for police staff
+        # police staff and council staff will see the names of the members who created the notifications from their own role
+        put_info(
+            put_html(f'''
+            <div class="card p-2">
+                <div class="card-body p-2">
+                <h4 class="card-title m-0">
+                {notification.category}: {notification.title} 
+                {f'<strong class="badge bg-primary text-light">Northumbria Police</strong>' if notification.by_role_id == 3 else f'<strong class="badge bg-info text-light">Gateshead Council</strong>'} 
+                </h4>
+                {f'<p class="mb-0">By Police Member: {notification.creator_name}</p>' if valid_user is not None and valid_user.role_id == 3 and notification.by_role_id == 3 else ''}
+                {f'<p class="mb-0">By Council Member: {notification.creator_name}</p>' if valid_user is not None and valid_user.role_id == 4 and notification.by_role_id == 4 else ''}
+                
+                <p class="card-subtitle mb-2"><small>{notificationDateTime}{f' – {notification.location}' if notification.location else ''}</small>
+                <p class="card-text">{notification.content}</p>
+                </div>
+            </div>
+            '''), closable=True
+        ).style('margin-bottom: 10px;')
+
+
+#### SUBSCRIPTION FUNCTIONS ####
+# Users subscribe to a location, a category or both (e.g. Crime Alert at Bus Station).
+# The subscriptions are held in memory as an inverted index from (location, category) to subscriber IDs, with None
+# standing for "all", so a new notification or crime report finds its subscribers by looking up the four keys which
+# can match it, however many users there are. It is then delivered to their feeds as rows of the feed_items table.
+
+def get_subscription_index():
+    """
+    Function to get the inverted index of the subscriptions, reloading it first if the 'subscriptions' table has changed
+    :return: a dictionary of (location, category) to the set of IDs of the users subscribed to it
+    """
+    global subscription_index
+    version = table_version('subscriptions')
+    if version != subscription_index['version']:
+        with subscription_index_lock:
+            if version != subscription_index['version']:
+                subscribers = {}
+                for row in read_rows(sa.select(Subscription.user_id, Subscription.location, Subscription.category)):
+                    subscribers.setdefault((row.location, row.category), set()).add(row.user_id)
+                subscription_index = {'version': version, 'subscribers': subscribers}
+    return subscription_index['subscribers']
+
+
+def match_subscribers(location, category):
+    """
+    Function to find the users subscribed to an item at a location in a category
+    :param location: location of the item, None if it is not about one location
+    :param category: category of the item
+    :return: a set of user IDs
+    """
+    subscribers = get_subscription_index()
+    matched = set()
+    for key in {(location, category), (location, None), (None, category), (None, None)}:
+        matched.update(subscribers.get(key, ()))
+    return matched
+
+
+def deliver_to_subscribers(location, category, date_time, notification_id=None, crime_report_id=None):
+    """
+    Function to add a new notification or crime report to the feeds of the users subscribed to it
+    :param location: location of the item
+    :param category: category of the item, CRIME_REPORT_CATEGORY for crime reports
+    :param date_time: date and time the item was posted
+    :param notification_id: Notification ID, if the item is a notification
+    :param crime_report_id: Crime report ID, if the item is a crime report
+    :return: the number of feeds the item was delivered to
+    """
+    user_ids = match_subscribers(location, category)
+    if user_ids:
+        with db.begin() as conn:
+            conn.execute(sa.insert(FeedItem), [
+                {'user_id': user_id, 'notification_id': notification_id, 'crime_report_id': crime_report_id,
+                 'date_time': date_time} for user_id in user_ids])
+    return len(user_ids)
+
+
+def is_subscribed(user_id):
+    """
+    Function to check if a user has any subscriptions
+    :param user_id: User ID of the user
+    :return: True if the user has subscriptions, False if the user has none
+    """
+    return bool(read_rows(sa.select(Subscription.id).where(Subscription.user_id == user_id).limit(1)))
+
+
+def read_feed_items(user_id, limit=FEED_PAGE_SIZE):
+    """
+    Function to read the notifications and crime reports delivered to a user's feed, newest first.
+    Notifications which have been archived since and crime reports moved to the archive are left out.
+    :param user_id: User ID of the subscriber
+    :param limit: maximum number of items to read
+    :return: a list of rows with the notification card columns, or the crime report columns prefixed with "crime_"
+    """
+    statement = (sa.select(FeedItem.id.label('feed_item_id'), FeedItem.crime_report_id, Notification.id,
+                           Notification.by_role_id, Notification.title, Notification.content, Notification.category,
+                           Notification.location, User.display_name.label('creator_name'), FeedItem.date_time,
+                           CrimeReport.title.label('crime_title'), CrimeReport.category.label('crime_category'),
+                           CrimeReport.location.label('crime_location'))
+                 .outerjoin(Notification, Notification.id == FeedItem.notification_id)
+                 .outerjoin(User, User.id == Notification.user_id)
+                 .outerjoin(CrimeReport, CrimeReport.id == FeedItem.crime_report_id)
+                 .where(FeedItem.user_id == user_id,
+                        sa.or_(Notification.status == 'Active', CrimeReport.id.is_not(None)))
+                 .order_by(FeedItem.id.desc())
+                 .limit(limit))
+    return read_rows(statement)
+
+
+@use_scope('ROOT', clear=True)
+def manage_subscriptions():
+    """
+    Function to let users see, add and remove their subscriptions
+    :return:
+    """
+    clear()
+    global valid_user
+
+    generate_header()
+    generate_nav()
+    put_buttons([
+        {'label': 'Notifications', 'value': 'notification_feeds', 'color': 'secondary'}
+    ], onclick=[notification_feeds]).style('float:right; margin-top: 12px;')
+    put_html('<h2>My Subscriptions</h2>')
+    if valid_user is None:
+        put_html('<p class="lead text-center">Please login to subscribe to notifications</p>')
+        return
+
+    def add_subscription():  # function to save the location and category chosen as a new subscription
+        location = pin.subscription_location.strip() or None
+        category = pin.subscription_category or None
+        if location is not None and not is_location(location):
+            toast('Please choose a location from the suggestions', color='warning')
+            return
+        with Session() as sesh:
+            if sesh.query(Subscription).filter_by(user_id=valid_user.id, location=location,
+                                                  category=category).count() == 0:
+                sesh.add(Subscription(user_id=valid_user.id, location=location, category=category))
+                sesh.commit()
+        toast('Subscribed', color='success')
+        manage_subscriptions()
+
+    def remove_subscription(subscription_id):  # function to delete one of the user's subscriptions
+        with Session() as sesh:
+            sesh.query(Subscription).filter_by(id=subscription_id, user_id=valid_user.id).delete()
+            sesh.commit()
+        manage_subscriptions()
+
+    put_html('<p>Your notifications feed only shows the notifications and crime reports you are subscribed to. '
+             'Leave the location or the category empty to subscribe to all of them.</p>')
+    put_row([
+        put_location_input('subscription_location', placeholder='All locations'),
+        put_select('subscription_category', label='Category', options=[{'label': 'All categories', 'value': ''}] +
+                   NOTIFICATION_CATEGORIES + [CRIME_REPORT_CATEGORY]),
+    ]).style('gap: 10px;')
+    put_buttons([{'label': 'Subscribe', 'value': 'subscribe', 'color': 'primary'}], onclick=[add_subscription],
+                small=True).style('margin-bottom: 10px;')
+
+    def save_digest_email():  # function to save the address the user's email digests are sent to
+        email = pin.digest_email.strip() or None
+        if email is not None and not re.fullmatch(r'[^@\s]+@[^@\s]+\.[^@\s]+', email):
+            toast('Please enter a valid email address', color='warning')
+            return
+        with Session() as sesh:
+            sesh.query(User).filter_by(id=valid_user.id).update({'email': email})
+            sesh.commit()
+        toast('Digest email saved' if email is not None else 'Email digests turned off', color='success')
+
+    current_email = read_rows(sa.select(User.email).where(User.id == valid_user.id))[0].email
+    put_row([
+        put_input('digest_email', label='Email for a daily digest of what you missed (leave empty for none)',
+                  value=current_email or '', placeholder='name@example.com'),
+        put_buttons([{'label': 'Save', 'value': 'save', 'color': 'secondary'}], onclick=[save_digest_email],
+                    small=True).style('margin-top: 32px;'),
+    ], size='1fr auto').style('gap: 10px;')
+
+    subscriptions = read_rows(sa.select(Subscription.id, Subscription.location, Subscription.category)
+                              .where(Subscription.user_id == valid_user.id).order_by(Subscription.id))
+    if len(subscriptions) == 0:
+        put_html('<p class="lead text-center">You have no subscriptions, so your feed shows all notifications</p>')
+        return
+    put_table([[
+        subscription.category or 'All categories',
+        subscription.location or 'All locations',
+        put_buttons([{'label': 'Unsubscribe', 'value': 'remove', 'color': 'danger'}],
+                    onclick=[partial(remove_subscription, subscription.id)], small=True)
+    ] for subscription in subscriptions], header=['Category', 'Location', 'Action'])
+
+
+#### EMAIL DIGEST FUNCTIONS ####
+# Subscribed users with an email address are sent a digest of what they missed since their last one: the notifications
+# and crime reports delivered to their feed, and the new comments on their threads and ratings of their posts.
+# A run goes through the users in order of their IDs, DIGEST_USER_BATCH at a time, reading each batch's items with
+# three set-based queries, so only one batch is held in memory however many users there are. The emails are sent
+# through a small pool of SMTP connections which stay open between batches. Once a batch is sent, the users'
+# last_digest_at and the run's last_user_id are saved together, so a run which stopped (e.g. the server crashed)
+# carries on after the last batch saved. A batch sent but not saved yet when it stopped is sent again.
+
+smtp_pool = queue.LifoQueue()
+smtp_executor = ThreadPoolExecutor(max_workers=DIGEST_SMTP_CONNECTIONS)
+digest_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def smtp_connection():
+    """
+    Function to borrow an open connection to the SMTP server from the pool, opening a new one if none is free.
+    Pooled connections the server has closed in the meantime are replaced, and a connection which fails is dropped.
+    :return: a context manager giving an smtplib.SMTP connection, which goes back to the pool afterwards
+    """
+    connection = None
+    while connection is None:
+        try:
+            connection = smtp_pool.get_nowait()
+        except queue.Empty:
+            connection = smtplib.SMTP(DIGEST_SMTP_HOST, DIGEST_SMTP_PORT, timeout=30)
+            break
+        try:
+            connection.noop()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+            connection = None
+    try:
+        yield connection
+    except BaseException:
+        connection.close()
+        raise
+    smtp_pool.put(connection)
+
+
+def close_smtp_pool():
+    """
+    Function to close the pooled SMTP connections, used when a digest run ends
+    :return:
+    """
+    while True:
+        try:
+            connection = smtp_pool.get_nowait()
+        except queue.Empty:
+            return
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+
+def send_messages(messages):
+    """
+    Function to send emails through the pooled SMTP connections, split between DIGEST_SMTP_CONNECTIONS threads
+    :param messages: list of MIMEText messages
+    :return:
+    """
+    def send_share(share):  # internal function sending one thread's share of the messages over one connection
+        with smtp_connection() as connection:
+            for message in share:
+                connection.send_message(message)
+
+    shares = [messages[start::DIGEST_SMTP_CONNECTIONS] for start in range(DIGEST_SMTP_CONNECTIONS)]
+    for future in [smtp_executor.submit(send_share, share) for share in shares if share]:
+        future.result()  # raises the first failure, so the batch is not saved as sent
+
+
+def digest_from(until):
+    """
+    Function to get the start of the period a user's digest covers, as a SQL expression on the users table
+    :param until: end of the period
+    :return: the user's last_digest_at, or DIGEST_INTERVAL before the end for the first digest
+    """
+    return func.coalesce(User.last_digest_at, until - DIGEST_INTERVAL)
+
+
+def read_digest_users(after_user_id, until, limit=DIGEST_USER_BATCH):
+    """
+    Function to read the next batch of users who get digests: users with an email address and a subscription
+    :param after_user_id: User ID of the last user of the previous batch
+    :param until: end of the period the digests cover
+    :param limit: number of users to read
+    :return: a list of rows of id, display_name, email and digest_from (the start of the period)
+    """
+    subscribed = sa.select(Subscription.id).where(Subscription.user_id == User.id).exists()
+    return read_rows(sa.select(User.id, User.display_name, User.email, digest_from(until).label('digest_from'))
+                     .where(User.id > after_user_id, User.email.is_not(None), subscribed)
+                     .order_by(User.id)
+                     .limit(limit))
+
+
+def newest_per_user(statement, order_column):
+    """
+    Function to keep the newest DIGEST_SECTION_ITEMS rows of each user from a digest section query
+    :param statement: select with a 'user_id' column
+    :param order_column: column the rows are ordered by, newest first
+    :return: a list of rows with the statement's columns and item_count, the number of the user's rows before the limit
+    """
+    user_id = statement.selected_columns.user_id
+    numbered = statement.add_columns(
+        func.row_number().over(partition_by=user_id, order_by=order_column.desc()).label('item_number'),
+        func.count().over(partition_by=user_id).label('item_count')).subquery()
+    return read_rows(sa.select(numbered).where(numbered.c.item_number <= DIGEST_SECTION_ITEMS)
+                     .order_by(numbered.c.user_id, numbered.c.item_number))
+
+
+def read_digest_items(user_ids, until):
+    """
+    Function to read the items of the digests of a batch of users, each user's period starting at their digest_from
+    :param user_ids: list of User IDs
+    :param until: end of the period the digests cover
+    :return: a dictionary of User ID to a dictionary of section name ('alerts', 'comments', 'ratings') to rows
+    """
+    def in_period(column):  # internal function for the condition of a date column being in the user's period
+        return sa.and_(column > digest_from(until), column <= until)
+
+    alerts = (sa.select(FeedItem.user_id, CrimeReport.id.is_not(None).label('is_crime'),
+                        func.coalesce(Notification.title, CrimeReport.title).label('title'),
+                        func.coalesce(Notification.category, CrimeReport.category).label('category'),
+                        func.coalesce(Notification.location, CrimeReport.location).label('location'),
+                        FeedItem.date_time)
+              .join(User, User.id == FeedItem.user_id)
+              .outerjoin(Notification, Notification.id == FeedItem.notification_id)
+              .outerjoin(CrimeReport, CrimeReport.id == FeedItem.crime_report_id)
+              .where(FeedItem.user_id.in_(user_ids), in_period(FeedItem.date_time),
+                     sa.or_(Notification.status == 'Active', CrimeReport.id.is_not(None))))
+    parent = aliased(Thread)
+    commenter = aliased(User)
+    comments = (sa.select(parent.user_id, parent.title, commenter.display_name, Thread.content, Thread.date_time)
+                .join(parent, parent.id == Thread.parent_id)
+                .join(User, User.id == parent.user_id)
+                .join(commenter, commenter.id == Thread.user_id)
+                .where(parent.user_id.in_(user_ids), Thread.user_id != parent.user_id, in_period(Thread.date_time),
+                       Thread.is_hidden == sa.false(), parent.is_hidden == sa.false()))
+    ratings = (sa.select(ParkingPost.user_id, ParkingPost.location, ParkingRating.rating, ParkingRating.comment,
+                         ParkingRating.date_time)
+               .join(ParkingPost, ParkingPost.id == ParkingRating.post_id)
+               .join(User, User.id == ParkingPost.user_id)
+               .where(ParkingPost.user_id.in_(user_ids), in_period(ParkingRating.date_time),
+                      sa.or_(ParkingRating.user_id.is_(None), ParkingRating.user_id != ParkingPost.user_id)))
+    items = {}
+    for section, statement, order_column in [('alerts', alerts, FeedItem.id), ('comments', comments, Thread.id),
+                                             ('ratings', ratings, ParkingRating.id)]:
+        for row in newest_per_user(statement, order_column):
+            items.setdefault(row.user_id, {}).setdefault(section, []).append(row)
+    return items
+
+
+def render_digest(user, items):
+    """
+    Function to write the digest email of a user
+    :param user: row of the user from read_digest_users()
+    :param items: dictionary of section name to rows from read_digest_items(), None if the user has no new items
+    :return: a MIMEText message, or None if there is nothing new to send
+    """
+    if not items:
+        return None
+    sections = [
+        ('alerts', 'Alerts for your subscriptions',
+         lambda row: f'{"Crime report" if row.is_crime else row.category}: {row.title}'
+                     f'{f" at {row.location}" if row.location else ""} ({row.date_time:%d %b %H:%M})'),
+        ('comments', 'New comments on your threads',
+         lambda row: f'{row.display_name} on "{row.title}": {textwrap.shorten(row.content, 100, placeholder="...")}'),
+        ('ratings', 'New ratings of your posts',
+         lambda row: f'{row.rating}/5 for your post at {row.location}{f": {row.comment}" if row.comment else ""}'),
+    ]
+    itemCount = 0
+    lines = [f'Hi {user.display_name},', '',
+             f'Here is what happened on Gateshead By Bike since {user.digest_from:%d %b %Y %H:%M}.', '']
+    for section, title, describe in sections:
+        rows = items.get(section)
+        if rows:
+            itemCount += rows[0].item_count
+            lines.append(f'{title} ({rows[0].item_count})')
+            lines.extend(f'- {describe(row)}' for row in rows)
+            if rows[0].item_count > len(rows):
+                lines.append(f'  ...and {rows[0].item_count - len(rows)} more')
+            lines.append('')
+    lines.append('You get this digest because you subscribed to notifications. '
+                 'Clear your email address on the My Subscriptions page to stop it.')
+    # MIMEText builds about 20 times faster than email.message.EmailMessage, which parses every header it is given
+    message = MIMEText('\n'.join(lines), 'plain', 'utf-8')
+    message['From'] = DIGEST_SENDER
+    message['To'] = user.email
+    message['Subject'] = f'Your Gateshead By Bike digest: {itemCount} new'
+    return message
+
+
+def run_digests(until=None, stop=None):
+    """
+    Function to send the digests of all users who get them, carrying on with the last run if it did not finish
+    :param until: end of the period the digests cover, default is now (a run which is carried on keeps its own)
+    :param stop: threading.Event which ends the run after the batch being sent, the run is carried on next time
+    :return: a tuple of (end of the period, number of digests sent by the run)
+    """
+    with digest_lock:
+        with Session() as sesh:
+            run = sesh.query(DigestRun).filter(DigestRun.finished_at.is_(None)).order_by(DigestRun.id).first()
+            if run is None:
+                run = DigestRun(date_time=until or datetime.now(), last_user_id=0, sent_count=0)
+                sesh.add(run)
+                sesh.commit()
+            run_id, until, last_user_id, sentCount = run.id, run.date_time, run.last_user_id, run.sent_count
+        try:
+            while users := read_digest_users(last_user_id, until, DIGEST_USER_BATCH):
+                user_ids = [user.id for user in users]
+                items = read_digest_items(user_ids, until)
+                messages = [message for message in (render_digest(user, items.get(user.id)) for user in users)
+                            if message is not None]
+                send_messages(messages)
+                last_user_id = user_ids[-1]
+                sentCount += len(messages)
+                with db.begin() as conn:
+                    conn.execute(sa.update(User).where(User.id.in_(user_ids)).values(last_digest_at=until))
+                    conn.execute(sa.update(DigestRun).where(DigestRun.id == run_id)
+                                 .values(last_user_id=last_user_id, sent_count=sentCount))
+                if stop is not None and stop.is_set():
+                    return until, sentCount
+            with db.begin() as conn:
+                conn.execute(sa.update(DigestRun).where(DigestRun.id == run_id).values(finished_at=datetime.now()))
+        finally:
+            close_smtp_pool()
+    return until, sentCount
+
+
+def send_due_digests():
+    """
+    Function to start a digest run when DIGEST_INTERVAL has passed since the last one, run as a background job every
+    DIGEST_CHECK_SECONDS. A run which did not finish is carried on, and stops early when the job runner stops.
+    :return: the number of digests sent, or None if no run was due
+    """
+    latest = read_rows(sa.select(DigestRun.date_time, DigestRun.finished_at).order_by(DigestRun.id.desc()).limit(1))
+    if not latest or latest[0].finished_at is None or latest[0].date_time + DIGEST_INTERVAL <= datetime.now():
+        return run_digests(stop=job_runner_stopping)[1]
+    return None
+
+
+#### DATA EXPORT FUNCTIONS ####
+# Exports stream rows from a server-side cursor in batches (yield_per) and write each row as soon as it is read,
+# so memory use stays the same however many rows are exported.
+
+# tables which can be exported, and the date and location columns they can be filtered by (None if not available)
+EXPORT_TABLES = {
+    'crime_reports': (CrimeReport, CrimeReport.date_time, CrimeReport.location),
+    'posts': (ParkingPost, ParkingPost.date_time, ParkingPost.location),
+    'threads': (Thread, Thread.date_time, None),
+    'content_reports': (ContentReport, ContentReport.date_time, None),
+}
+EXPORT_FORMATS = ['csv', 'ndjson']
+
+
+def iter_export_rows(table_name, date_from=None, date_to=None, location=None):
+    """
+    Function to stream the rows of a table for exporting
+    :param table_name: name of the table to export, one of EXPORT_TABLES
+    :param date_from: earliest date to export as a 'YYYY-MM-DD' string, default is None for no lower limit
+    :param date_to: latest date to export (inclusive) as a 'YYYY-MM-DD' string, default is None for no upper limit
+    :param location: location name to export, default is None for all locations
+    :return: a generator of the column names followed by one tuple per row
+    """
+    if table_name not in EXPORT_TABLES:
+        raise ValueError(f'Unknown table "{table_name}", choose from: {", ".join(EXPORT_TABLES)}')
+    model, date_column, location_column = EXPORT_TABLES[table_name]
+    statement = sa.select(model.__table__).order_by(model.__table__.c.id)
+    if date_from:
+        statement = statement.where(date_column >= datetime.strptime(date_from, '%Y-%m-%d'))
+    if date_to:
+        statement = statement.where(date_column < datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1))
+    if location:
+        if location_column is None:
+            raise ValueError(f'The {table_name} table cannot be filtered by location')
+        statement = statement.where(location_column == location)
+
+    yield [column.name for column in model.__table__.columns]
+    with read_db.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE).execute(statement)
+        for row in result:
+            yield tuple(row)
+
+
+def export_value(value):
+    """
+    Function to convert a database value to the form written to export files
+    :param value: value read from the database
+    :return: dates as ISO 8601 strings, everything else unchanged
+    """
+    return value.isoformat(sep=' ') if isinstance(value, datetime) else value
+
+
+def write_export(table_name, output_file, file_format='csv', date_from=None, date_to=None, location=None):
+    """
+    Function to stream an export of a table into an open text file
+    :param table_name: name of the table to export, one of EXPORT_TABLES
+    :param output_file: text file object to write to (e.g. an open file or sys.stdout)
+    :param file_format: 'csv' for comma separated values with a header row, or 'ndjson' for one JSON object per line
+    :param date_from: earliest date to export as a 'YYYY-MM-DD' string, default is None for no lower limit
+    :param date_to: latest date to export (inclusive) as a 'YYYY-MM-DD' string, default is None for no upper limit
+    :param location: location name to export, default is None for all locations
+    :return: the number of rows written
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown format "{file_format}", choose from: {", ".join(EXPORT_FORMATS)}')
+    rows = iter_export_rows(table_name, date_from, date_to, location)
+    column_names = next(rows)
+    rowCount = 0
+    if file_format == 'csv':
+        writer = csv.writer(output_file)
+        writer.writerow(column_names)
+        for row in rows:
+            writer.writerow([export_value(value) for value in row])
+            rowCount += 1
+    else:
+        for row in rows:
+            output_file.write(json.dumps(dict(zip(column_names, map(export_value, row))), ensure_ascii=False) + '\n')
+            rowCount += 1
+    return rowCount
+
+
+def export_popup(table_names):
+    """
+    Function to show the export form for police and council staff and offer the finished export as a download
+    The export is streamed into a file in the exports directory first, which is then downloaded if it is not too large.
+    :param table_names: names of the tables which can be exported from the current view
+    :return:
+    """
+
+    def run_export():  # function to stream the export to a file and offer it to the browser
+        global valid_user
+        if valid_user is None or valid_user.role_id not in [3, 4]:  # if the user is not a police or council staff
+            toast('You do not have permission to export data', color='warning')
+            return
+        table_name, file_format = pin.export_table, pin.export_format
+        if table_name not in table_names:  # only the tables offered by the current view
+            toast('This table cannot be exported here', color='warning')
+            return
+        os.makedirs(EXPORT_DIRECTORY, exist_ok=True)
+        file_name = f'{table_name}-{datetime.now().strftime("%Y%m%d-%H%M%S")}.{file_format}'
+        file_path = os.path.join(EXPORT_DIRECTORY, file_name)
+        try:
+            with open(file_path, 'w', newline='', encoding='utf-8') as export_file:
+                rowCount = write_export(table_name, export_file, file_format, pin.export_date_from,
+                                        pin.export_date_to, pin.export_location or None)
+        except ValueError as ve:
+            toast(f'{str(ve)}', color='error')
+            return
+        except SQLAlchemyError:
+            toast('An error occurred', color='error')
+            return
+        close_popup()
+        if os.path.getsize(file_path) > EXPORT_DOWNLOAD_LIMIT:
+            toast(f'{rowCount} rows exported to {file_path} on the server, the file is too large to download here. '
+                  f'Use the command line export for large extracts.', color='warning', duration=10)
+        else:
+            with open(file_path, 'rb') as export_file:
+                download(file_name, export_file.read())
+            toast(f'{rowCount} rows exported', color='success')
+
+    popup('Export Data', [
+        put_select('export_table', label='Table', options=table_names),
+        put_select('export_format', label='Format', options=[
+            {'label': 'CSV', 'value': 'csv'}, {'label': 'NDJSON (one JSON object per line)', 'value': 'ndjson'}]),
+        put_row([
+            put_input('export_date_from', type=DATE, label='From'),
+            put_input('export_date_to', type=DATE, label='To')
+        ]).style('gap: 10px;'),
+        put_location_input('export_location', label='Location (crime reports and posts only)'),
+        put_buttons([
+            {'label': 'Export', 'value': 'export', 'color': 'primary'},
+            {'label': 'Cancel', 'value': 'cancel', 'color': 'secondary'}
+        ], onclick=[run_export, close_popup])
+    ], closable=True)
+
+
+#### ANALYTICS SNAPSHOT FUNCTIONS ####
+# Analytical questions are answered from Parquet snapshots instead of the live database serving users.
+# Each table is written to snapshots/<table>/month=YYYY-MM/ files, partitioned by the month of its date.
+# Runs after the first one only append rows with an ID above the last run's high-water mark (kept in _state.json),
+# so rows are snapshotted as they were when first seen and later edits to them (e.g. status changes) are not picked up.
+
+# tables which are snapshotted: the select to read, its ID column and the name of the date column to partition by
+SNAPSHOT_TABLES = {
+    'crime_reports': (sa.select(CrimeReport.__table__), CrimeReport.id, 'date_time'),
+    'posts': (sa.select(ParkingPost.__table__), ParkingPost.id, 'date_time'),
+    'threads': (sa.select(Thread.__table__), Thread.id, 'date_time'),
+    'content_reports': (sa.select(ContentReport.__table__), ContentReport.id, 'date_time'),
+    # ratings are partitioned by the date of the rated post: ratings made before their own date_time was recorded
+    # have none, and rating_distribution() selects the months of the rated posts
+    'ratings': (sa.select(ParkingRating.__table__, ParkingPost.location.label('post_location'),
+                          ParkingPost.date_time.label('post_date_time'))
+                .join(ParkingPost, ParkingPost.id == ParkingRating.post_id), ParkingRating.id, 'post_date_time'),
+}
+
+
+def arrow_type(column_type):
+    """
+    Function to choose the Parquet (Arrow) type of a database column, so every snapshot file has the same schema
+    :param column_type: SQLAlchemy type of the column
+    :return: the matching pyarrow data type
+    """
+    if isinstance(column_type, sa.Boolean):
+        return pa.bool_()
+    if isinstance(column_type, sa.Integer):
+        return pa.int64()
+    if isinstance(column_type, sa.DateTime):
+        return pa.timestamp('us')
+    if isinstance(column_type, sa.Float):
+        return pa.float64()
+    return pa.string()
+
+
+def read_snapshot_state():
+    """
+    Function to read the high-water IDs of the last snapshot run
+    :return: a dictionary of table name to the highest ID already snapshotted
+    """
+    state_path = os.path.join(SNAPSHOT_DIRECTORY, '_state.json')
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path) as state_file:
+        return json.load(state_file)
+
+
+def write_snapshot_state(state):
+    """
+    Function to save the high-water IDs, replacing the previous file in one step so a crash never leaves it half written
+    :param state: dictionary of table name to the highest ID snapshotted
+    :return:
+    """
+    os.makedirs(SNAPSHOT_DIRECTORY, exist_ok=True)
+    state_path = os.path.join(SNAPSHOT_DIRECTORY, '_state.json')
+    with open(state_path + '.tmp', 'w') as state_file:
+        json.dump(state, state_file)
+    os.replace(state_path + '.tmp', state_path)
+
+
+def snapshot_part_ids(part_path):
+    """
+    Function to read the ID range of a snapshot file from its name (part-<first id>-<last id>.parquet)
+    :param part_path: path of the snapshot file
+    :return: a tuple of (first ID, last ID)
+    """
+    first_id, last_id = os.path.basename(part_path)[len('part-'):-len('.parquet')].split('-')
+    return int(first_id), int(last_id)
+
+
+def run_snapshot(table_names=None):
+    """
+    Function to append the rows added since the last run to the Parquet snapshots
+    :param table_names: names of the tables to snapshot, default is None for all of SNAPSHOT_TABLES
+    :return: a dictionary of table name to the number of rows appended
+    """
+    state = read_snapshot_state()
+    appended = {}
+    for table_name in table_names or SNAPSHOT_TABLES:
+        if table_name not in SNAPSHOT_TABLES:
+            raise ValueError(f'Unknown snapshot table: {table_name}')
+        statement, id_column, date_column = SNAPSHOT_TABLES[table_name]
+        high_water = state.get(table_name, 0)
+        # files above the high-water mark were left by a run which crashed before saving its state, so they are redone
+        for part_path in glob.glob(os.path.join(SNAPSHOT_DIRECTORY, table_name, 'month=*', 'part-*.parquet')):
+            if snapshot_part_ids(part_path)[0] > high_water:
+                os.remove(part_path)
+
+        schema = pa.schema([(column.name, arrow_type(column.type)) for column in statement.selected_columns])
+        rowCount = 0
+        with read_db.connect() as conn:
+            result = (conn.execution_options(stream_results=True, yield_per=SNAPSHOT_BATCH_SIZE)
+                      .execute(statement.where(id_column > high_water).order_by(id_column)))
+            for batch in result.partitions():
+                frame = pd.DataFrame(batch, columns=schema.names)
+                frame[date_column] = pd.to_datetime(frame[date_column])
+                for month, month_frame in frame.groupby(frame[date_column].dt.strftime('%Y-%m')):
+                    month_directory = os.path.join(SNAPSHOT_DIRECTORY, table_name, f'month={month}')
+                    os.makedirs(month_directory, exist_ok=True)
+                    part_name = f'part-{month_frame["id"].iloc[0]:012d}-{month_frame["id"].iloc[-1]:012d}.parquet'
+                    # written under a hidden name first (ignored by readers), then renamed into place
+                    pq.write_table(pa.Table.from_pandas(month_frame, schema=schema, preserve_index=False),
+                                   os.path.join(month_directory, '.' + part_name))
+                    os.replace(os.path.join(month_directory, '.' + part_name),
+                               os.path.join(month_directory, part_name))
+                rowCount += len(frame)
+                high_water = int(frame['id'].iloc[-1])
+        state[table_name] = high_water
+        write_snapshot_state(state)
+        appended[table_name] = rowCount
+    return appended
+
+
+def load_snapshot(table_name, columns=None, months=None):
+    """
+    Function to load a table's snapshot into a pandas DataFrame, only reading the columns and months asked for
+    :param table_name: name of the snapshotted table
+    :param columns: list of the columns to load, default is None for all columns
+    :param months: list of 'YYYY-MM' months to load, default is None for all months
+    :return: a DataFrame with the snapshot rows and a "month" column, empty if there is no snapshot yet
+    """
+    table_directory = os.path.join(SNAPSHOT_DIRECTORY, table_name)
+    if not glob.glob(os.path.join(table_directory, 'month=*', 'part-*.parquet')):
+        return pd.DataFrame(columns=columns or [])
+    return pd.read_parquet(table_directory, columns=columns,
+                           filters=[('month', 'in', list(months))] if months else None)
+
+
+def crimes_per_location_hour(months=None):
+    """
+    Function to count the crime reports at each location by hour of the day, from the snapshots
+    :param months: list of 'YYYY-MM' months to include, default is None for all months
+    :return: a DataFrame with a row per location and a column per hour (0-23)
+    """
+    crimes = load_snapshot('crime_reports', ['location', 'date_time'], months)
+    return (crimes.assign(hour=pd.to_datetime(crimes['date_time']).dt.hour)
+            .pivot_table(index='location', columns='hour', values='date_time', aggfunc='count', fill_value=0)
+            .reindex(columns=range(24), fill_value=0))
+
+
+def rating_distribution(months=None):
+    """
+    Function to count the ratings of each score (1-5) given to the posts at each location, from the snapshots
+    :param months: list of 'YYYY-MM' months of the rated posts to include, default is None for all months
+    :return: a DataFrame with a row per location, a column per score and the average rating
+    """
+    ratings = load_snapshot('ratings', ['post_location', 'rating'], months)
+    distribution = pd.crosstab(ratings['post_location'], ratings['rating']).reindex(columns=range(1, 6), fill_value=0)
+    distribution['average'] = ratings.groupby('post_location')['rating'].mean().round(2)
+    return distribution
+
+
+def forum_engagement(months=None):
+    """
+    Function to summarise the forum activity of each month, from the snapshots
+    :param months: list of 'YYYY-MM' months to include, default is None for all months
+    :return: a DataFrame with a row per month: threads, comments, up votes, down votes and flags
+    """
+    threads = load_snapshot('threads', ['parent_id', 'up_votes', 'down_votes', 'flags', 'month'], months)
+    return threads.assign(is_comment=threads['parent_id'].notna()).groupby('month', observed=True).agg(
+        threads=('is_comment', lambda is_comment: int((~is_comment).sum())),
+        comments=('is_comment', 'sum'),
+        up_votes=('up_votes', 'sum'),
+        down_votes=('down_votes', 'sum'),
+        flags=('flags', 'sum'))
+
+
+# reports which can be printed with "python main.py analytics <report>"
+ANALYTICS_REPORTS = {
+    'crimes-per-location-hour': crimes_per_location_hour,
+    'rating-distribution': rating_distribution,
+    'forum-engagement': forum_engagement,
+}
+
+
+#### PARKING SITE IMPORT FUNCTIONS ####
+# The council publishes its cycle parking sites as GeoJSON FeatureCollections of thousands of features.
+# The file is parsed one feature at a time, so only a feature and a read chunk are held in memory however big it is,
+# and the sites are upserted into the locations table in batches, matched to earlier imports by their source ID.
+
+def iter_geojson_features(geojson_file):
+    """
+    Function to stream the features of a GeoJSON FeatureCollection without loading the whole document
+    :param geojson_file: text file object to read the GeoJSON from
+    :return: a generator of the features as dictionaries
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    is_end_of_file = False
+
+    def read_more():  # function to drop the parsed part of the buffer and append the next chunk of the file
+        nonlocal buffer, position, is_end_of_file
+        chunk = geojson_file.read(GEOJSON_CHUNK_SIZE)
+        if not chunk:
+            is_end_of_file = True
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def next_char(separators=''):  # function to skip whitespace and separators, returning the next character
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n' + separators:
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if is_end_of_file:
+                raise ValueError('The GeoJSON file ended unexpectedly')
+            read_more()
+
+    def next_value():  # function to decode the JSON value at the position, reading more until it is complete
+        nonlocal position
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if is_end_of_file:
+                    raise ValueError('The GeoJSON file is not valid JSON')
+                read_more()
+                continue
+            if end == len(buffer) and not is_end_of_file:  # a number may continue in the next chunk
+                read_more()
+                continue
+            position = end
+            return value
+
+    if next_char() != '{':
+        raise ValueError('The GeoJSON file is not a FeatureCollection')
+    position += 1
+    while next_char(',') != '}':
+        member = next_value()
+        next_char(':')
+        if member != 'features':
+            next_value()  # other members such as "type", "name" and "crs" are skipped
+            continue
+        if next_char() != '[':
+            raise ValueError('The "features" of the GeoJSON file are not a list')
+        position += 1
+        while next_char(',') != ']':
+            yield next_value()
+        position += 1
+
+
+def geometry_point(geometry):
+    """
+    Function to get a single point for a GeoJSON geometry, sites drawn as areas or lines are placed at their centre
+    :param geometry: GeoJSON geometry dictionary
+    :return: a tuple of (latitude, longitude), or None if the geometry has no coordinates
+    """
+    if not geometry:
+        return None
+    if geometry.get('type') == 'GeometryCollection':
+        points = [geometry_point(part) for part in geometry.get('geometries', [])]
+        points = [point for point in points if point is not None]
+        if not points:
+            return None
+        return sum(point[0] for point in points) / len(points), sum(point[1] for point in points) / len(points)
+
+    positions = []
+    nested = [geometry.get('coordinates') or []]
+    while nested:  # collect the [longitude, latitude] positions from any depth of nested lists
+        coordinates = nested.pop()
+        if coordinates and isinstance(coordinates[0], (int, float)):
+            positions.append(coordinates)
+        else:
+            nested.extend(coordinates)
+    if not positions:
+        return None
+    return (sum(position[1] for position in positions) / len(positions),
+            sum(position[0] for position in positions) / len(positions))
+
+
+def geojson_location(feature, id_property='id', name_property='name', capacity_property='capacity'):
+    """
+    Function to turn a GeoJSON feature into the columns of a location
+    :param feature: GeoJSON feature dictionary
+    :param id_property: property holding the site's ID, the feature's own "id" is used if it has no such property
+    :param name_property: property holding the site's name
+    :param capacity_property: property holding the number of parking spaces
+    :return: a dictionary of location columns, or None if the feature has no ID or no coordinates
+    """
+    properties = feature.get('properties') or {}
+    source_id = properties.get(id_property, feature.get('id'))
+    point = geometry_point(feature.get('geometry'))
+    if source_id is None or point is None:
+        return None
+    try:
+        capacity = int(properties.get(capacity_property))
+    except (TypeError, ValueError):
+        capacity = None
+    return {'source_id': str(source_id), 'name': str(properties.get(name_property) or f'Cycle parking {source_id}'),
+            'latitude': point[0], 'longitude': point[1], 'capacity': capacity}
+
+
+def unique_site_names(conn, sites):
+    """
+    Function to give new parking sites a name no other location has, by adding the site's source ID to a name already
+    taken (council datasets often repeat names like "Bus Station")
+    :param conn: connection of the import transaction
+    :param sites: list of dictionaries of location columns with unique source IDs, their names are changed in place
+    :return:
+    """
+    names = {site['name'] for site in sites} | {f"{site['name']} ({site['source_id']})" for site in sites}
+    takenNames = set(conn.execute(sa.select(Location.name).where(Location.name.in_(names))).scalars())
+    knownIds = set(conn.execute(sa.select(Location.source_id)
+                                .where(Location.source_id.in_([site['source_id'] for site in sites]))).scalars())
+    for site in sites:
+        if site['source_id'] in knownIds:  # imported before, its name is not updated
+            continue
+        if site['name'] in takenNames:
+            site['name'] = f"{site['name']} ({site['source_id']})"
+        takenNames.add(site['name'])
+
+
+def upsert_locations(sites):
+    """
+    Function to insert parking sites, or update the coordinates and capacity of the ones imported before.
+    Names are only set by the first import, as posts and crime reports refer to their location by name, and are made
+    unique by unique_site_names().
+    :param sites: list of dictionaries of location columns with unique source IDs
+    :return:
+    """
+    statement = sqlite_insert(Location)
+    statement = statement.on_conflict_do_update(index_elements=[Location.source_id], set_={
+        'latitude': statement.excluded.latitude,
+        'longitude': statement.excluded.longitude,
+        'capacity': statement.excluded.capacity
+    })
+    with db.begin() as conn:
+        unique_site_names(conn, sites)
+        conn.execute(statement, sites)  # one statement run for every site, instead of compiling a statement per batch
+
+
+def import_geojson_locations(geojson_file, id_property='id', name_property='name', capacity_property='capacity'):
+    """
+    Function to import the parking sites of a GeoJSON file into the locations table
+    :param geojson_file: text file object to read the GeoJSON from
+    :param id_property: property holding the site's ID
+    :param name_property: property holding the site's name
+    :param capacity_property: property holding the number of parking spaces
+    :return: a tuple of (number of sites imported, number of features skipped without an ID or coordinates)
+    """
+    importedCount = 0
+    skippedCount = 0
+    batch = {}
+    for feature in iter_geojson_features(geojson_file):
+        site = geojson_location(feature, id_property, name_property, capacity_property)
+        if site is None:
+            skippedCount += 1
+            continue
+        batch[site['source_id']] = site  # a site listed twice keeps its last version
+        if len(batch) >= GEOJSON_BATCH_SIZE:
+            upsert_locations(list(batch.values()))
+            importedCount += len(batch)
+            batch = {}
+    if batch:
+        upsert_locations(list(batch.values()))
+        importedCount += len(batch)
+    return importedCount, skippedCount
+
+
+def import_locations_form():
+    """
+    Function to let council staff import parking sites from an uploaded GeoJSON file
+    :return:
+    """
+    global valid_user
+    if valid_user is None or valid_user.role_id != 4:
+        toast('You do not have permission to import parking sites', color='warning')
+        return
+
+    import_data = input_group('Import parking sites', [
+        file_upload('GeoJSON file', name='geojson', accept=['.geojson', '.json'], max_size='100M', required=True),
+        input('ID property', name='id_property', value='id', required=True),
+        input('Name property', name='name_property', value='name', required=True),
+        input('Capacity property', name='capacity_property', value='capacity', required=True)
+    ], cancelable=True)
+    if import_data is None:
+        post_feeds()
+        return
+    try:
+        geojson_file = io.TextIOWrapper(io.BytesIO(import_data['geojson']['content']), encoding='utf-8')
+        importedCount, skippedCount = import_geojson_locations(geojson_file, import_data['id_property'],
+                                                               import_data['name_property'],
+                                                               import_data['capacity_property'])
+    except (ValueError, UnicodeDecodeError) as error:
+        toast(f'{str(error)}', color='error')
+    except SQLAlchemyError:
+        toast('An error occurred', color='error')
+    else:
+        toast(f'{importedCount} parking sites imported, {skippedCount} features skipped', color='success')
+    finally:
+        post_feeds()
+
+
+#### LIVE OCCUPANCY FUNCTIONS ####
+# Counters and sensors at parking sites send readings of "location_id,occupied[,capacity[,unix time]]" lines,
+# as UDP datagrams or the body of an HTTP POST to /occupancy. The last OCCUPANCY_BUFFER_SIZE readings of every site
+# are kept in NumPy ring buffers (one row per site), which the post cards read the latest occupancy from.
+# Every OCCUPANCY_FLUSH_SECONDS the readings since the last flush are downsampled to one row per site and minute
+# and merged into the occupancy_readings table in a single transaction.
+
+occupancy_lock = threading.Lock()
+occupancy_rows = {}  # location ID to its row in the buffers
+occupancy_times = np.zeros((0, OCCUPANCY_BUFFER_SIZE))  # unix time of each reading
+occupancy_values = np.zeros((0, OCCUPANCY_BUFFER_SIZE), dtype=np.int32)  # occupied spaces of each reading
+occupancy_capacities = np.zeros(0, dtype=np.int32)  # last capacity reported by each site, -1 if none was reported
+occupancy_counts = np.zeros(0, dtype=np.int64)  # readings taken by each site, the next one is written at count % size
+occupancy_flushed = np.zeros(0, dtype=np.int64)  # readings of each site already saved to the database
+occupancy_stats = {'accepted': 0, 'rejected': 0}
+
+
+def add_occupancy_row(location_id):
+    """
+    Function to give a site a row in the ring buffers, doubling the buffers when they are full.
+    Must be called with occupancy_lock held.
+    :param location_id: Location ID of the site
+    :return: the index of the site's row
+    """
+    global occupancy_times, occupancy_values, occupancy_capacities, occupancy_counts, occupancy_flushed
+    row = len(occupancy_rows)
+    if row == len(occupancy_counts):
+        size = max(64, row * 2)
+        occupancy_times = np.resize(occupancy_times, (size, OCCUPANCY_BUFFER_SIZE))
+        occupancy_values = np.resize(occupancy_values, (size, OCCUPANCY_BUFFER_SIZE))
+        occupancy_capacities = np.concatenate([occupancy_capacities, np.full(size - row, -1, dtype=np.int32)])
+        occupancy_counts = np.concatenate([occupancy_counts, np.zeros(size - row, dtype=np.int64)])
+        occupancy_flushed = np.concatenate([occupancy_flushed, np.zeros(size - row, dtype=np.int64)])
+    occupancy_rows[location_id] = row
+    return row
+
+
+def parse_occupancy_lines(text):
+    """
+    Function to parse occupancy reading lines, skipping lines which are not valid readings
+    :param text: lines of "location_id,occupied[,capacity[,unix time]]"
+    :return: a tuple of (list of (location_id, occupied, capacity or None, unix time) tuples, number of invalid lines)
+    """
+    readings = []
+    invalidCount = 0
+    now = time.time()
+    countLimit = np.iinfo(np.int32).max  # the buffers hold occupied spaces and capacities as 32-bit integers
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            fields = line.split(',')
+            location_id, occupied, capacity, timestamp = (
+                int(fields[0]), int(fields[1]), int(fields[2]) if len(fields) > 2 and fields[2].strip() else None,
+                float(fields[3]) if len(fields) > 3 else now)
+            # out of range values would break the buffers, the post cards and every later flush, so they are
+            # rejected here (the time comparisons are also False for nan and inf)
+            if not (0 < location_id <= np.iinfo(np.int64).max and 0 <= occupied <= countLimit
+                    and (capacity is None or 0 <= capacity <= countLimit)
+                    and 0 <= timestamp <= now + OCCUPANCY_CLOCK_SKEW_SECONDS):
+                raise ValueError(f'reading out of range: {line}')
+            readings.append((location_id, occupied, capacity, timestamp))
+        except (ValueError, IndexError):
+            invalidCount += 1
+    return readings, invalidCount
+
+
+def record_occupancy(readings):
+    """
+    Function to write occupancy readings into the ring buffers of their sites
+    :param readings: list of (location_id, occupied, capacity or None, unix time) tuples
+    :return: the number of readings recorded, readings of unknown locations are left out
+    """
+    new_ids = {reading[0] for reading in readings} - occupancy_rows.keys()
+    known_ids = set()
+    if new_ids:  # a site's first reading checks that the location exists, later ones only look up its row
+        known_ids = {row.id for row in read_rows(sa.select(Location.id).where(Location.id.in_(new_ids)))}
+    recordedCount = 0
+    with occupancy_lock:
+        for location_id, occupied, capacity, timestamp in readings:
+            row = occupancy_rows.get(location_id)
+            if row is None:
+                if location_id not in known_ids:
+                    continue
+                row = add_occupancy_row(location_id)
+            index = occupancy_counts[row] % OCCUPANCY_BUFFER_SIZE
+            occupancy_times[row, index] = timestamp
+            occupancy_values[row, index] = occupied
+            if capacity is not None:
+                occupancy_capacities[row] = capacity
+            occupancy_counts[row] += 1
+            recordedCount += 1
+        occupancy_stats['accepted'] += recordedCount
+        occupancy_stats['rejected'] += len(readings) - recordedCount
+    return recordedCount
+
+
+def ingest_occupancy(text):
+    """
+    Function to parse and record a message of occupancy reading lines from an endpoint
+    :param text: lines of "location_id,occupied[,capacity[,unix time]]"
+    :return: a tuple of (number of readings recorded, number of lines rejected)
+    """
+    readings, invalidCount = parse_occupancy_lines(text)
+    recordedCount = record_occupancy(readings)
+    if invalidCount:
+        with occupancy_lock:
+            occupancy_stats['rejected'] += invalidCount
+    return recordedCount, invalidCount + len(readings) - recordedCount
+
+
+def latest_occupancy(location_ids):
+    """
+    Function to get the latest occupancy reading of sites
+    :param location_ids: Location IDs of the sites
+    :return: a dictionary of location ID to (occupied, capacity or None, datetime of the reading),
+             sites without readings since the server started are left out
+    """
+    latest = {}
+    with occupancy_lock:
+        for location_id in location_ids:
+            row = occupancy_rows.get(location_id)
+            if row is None:
+                continue
+            index = (occupancy_counts[row] - 1) % OCCUPANCY_BUFFER_SIZE
+            capacity = int(occupancy_capacities[row])
+            latest[location_id] = (int(occupancy_values[row, index]), capacity if capacity >= 0 else None,
+                                   datetime.fromtimestamp(occupancy_times[row, index]))
+    return latest
+
+
+def flush_occupancy():
+    """
+    Function to downsample the readings taken since the last flush to one row per site and minute,
+    and merge them into the occupancy_readings table
+    :return: the number of minute rows written
+    """
+    with occupancy_lock:  # only the new readings are copied out, so ingest is not held up by the database write
+        counts = occupancy_counts[:len(occupancy_rows)].copy()
+        new_counts = np.minimum(counts - occupancy_flushed[:len(counts)], OCCUPANCY_BUFFER_SIZE)
+        rows = np.nonzero(new_counts)[0]
+        offsets = np.arange(OCCUPANCY_BUFFER_SIZE)
+        is_new = offsets < new_counts[rows, None]
+        columns = (counts[rows, None] - 1 - offsets) % OCCUPANCY_BUFFER_SIZE
+        times = occupancy_times[rows[:, None], columns][is_new]
+        values = occupancy_values[rows[:, None], columns][is_new].astype(np.int64)
+        capacities = occupancy_capacities[rows]
+        location_ids = np.array(list(occupancy_rows), dtype=np.int64)[rows]
+    if len(times) == 0:
+        return 0
+
+    # group the readings by site and minute: sort by both, then reduce each run of equal keys
+    sites = np.repeat(np.arange(len(rows)), new_counts[rows])
+    buckets = (times // OCCUPANCY_BUCKET_SECONDS).astype(np.int64)
+    order = np.lexsort((buckets, sites))
+    sites, buckets, values = sites[order], buckets[order], values[order]
+    starts = np.flatnonzero(np.r_[True, (sites[1:] != sites[:-1]) | (buckets[1:] != buckets[:-1])])
+    minutes = [{
+        'location_id': int(location_ids[site]),
+        'date_time': datetime.fromtimestamp(bucket * OCCUPANCY_BUCKET_SECONDS),
+        'samples': int(samples), 'occupied_sum': int(occupied_sum),
+        'min_occupied': int(min_occupied), 'max_occupied': int(max_occupied),
+        'capacity': int(capacities[site]) if capacities[site] >= 0 else None
+    } for site, bucket, samples, occupied_sum, min_occupied, max_occupied in zip(
+        sites[starts], buckets[starts], np.diff(np.r_[starts, len(sites)]), np.add.reduceat(values, starts),
+        np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts))]
+
+    # a minute split over two flushes is merged into the row saved by the first one
+    statement = sqlite_insert(OccupancyReading)
+    statement = statement.on_conflict_do_update(index_elements=[OccupancyReading.location_id,
+                                                                OccupancyReading.date_time], set_={
+        'samples': OccupancyReading.samples + statement.excluded.samples,
+        'occupied_sum': OccupancyReading.occupied_sum + statement.excluded.occupied_sum,
+        'min_occupied': func.min(OccupancyReading.min_occupied, statement.excluded.min_occupied),
+        'max_occupied': func.max(OccupancyReading.max_occupied, statement.excluded.max_occupied),
+        'capacity': func.coalesce(statement.excluded.capacity, OccupancyReading.capacity)
+    })
+    with db.begin() as conn:
+        conn.execute(statement, minutes)
+    with occupancy_lock:  # moved on only once saved, so readings of a failed flush are saved by the next one
+        occupancy_flushed[:len(counts)] = counts
+    return len(minutes)
+
+
+class OccupancyRequestHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the HTTP occupancy endpoint, readings are POSTed to /occupancy as lines in the body
+    """
+
+    def do_POST(self):
+        if self.path != '/occupancy':
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        recordedCount, rejectedCount = ingest_occupancy(body.decode('utf-8', errors='replace'))
+        response = json.dumps({'accepted': recordedCount, 'rejected': rejectedCount}).encode()
+        self.send_response(202)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):  # readings arrive many times a second, so requests are not logged
+        pass
+
+
+def serve_occupancy_udp():
+    """
+    Function to receive occupancy readings as UDP datagrams, each holding one or more reading lines
+    :return:
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_socket:
+        udp_socket.bind((OCCUPANCY_HOST, OCCUPANCY_UDP_PORT))
+        while True:
+            datagram = udp_socket.recv(65535)
+            try:
+                ingest_occupancy(datagram.decode('utf-8', errors='replace'))
+            except Exception as exception:  # one bad datagram must not stop the endpoint for every site
+                print(f'Occupancy datagram dropped: {exception!r}', file=sys.stderr)
+
+
+def start_occupancy_ingest():
+    """
+    Function to start the occupancy endpoints in background threads, used when the server starts.
+    The readings are flushed by the 'occupancy-flush' background job.
+    :return:
+    """
+    http_server = ThreadingHTTPServer((OCCUPANCY_HOST, OCCUPANCY_HTTP_PORT), OccupancyRequestHandler)
+    for target in [http_server.serve_forever, serve_occupancy_udp]:
+        threading.Thread(target=target, daemon=True).start()
+
+
+#### AVAILABILITY PROFILE FUNCTIONS ####
+# Every location has an hour-of-week profile (168 hours, Monday 0am first) of the free spaces usually there,
+# from the amounts given in parking posts and the minutes of live occupancy readings of sites reporting a capacity.
+# The profiles are kept in memory as running sums and counts, and are updated by a background thread which only
+# reads the posts and readings added since its last run, so a refresh costs as much as the new history.
+
+availability_lock = threading.Lock()
+availability_profiles = {
+    'post_id': 0,  # posts up to this ID are counted
+    'reading_id': 0,  # occupancy readings up to this ID are counted
+    'locations': {},  # location name to its row in the arrays
+    'sums': np.zeros((0, 168)),  # sum of the free spaces observed in each hour of the week
+    'counts': np.zeros((0, 168)),  # number of observations in each hour of the week
+}
+WEEKDAY_NAMES = ['Mondays', 'Tuesdays', 'Wednesdays', 'Thursdays', 'Fridays', 'Saturdays', 'Sundays']
+
+
+def hour_of_week_column(date_column):
+    """
+    Function to calculate the hour of the week of a date column in SQLite, with Monday 0am as hour 0
+    :param date_column: date and time column
+    :return: an SQL expression of the hour of the week (0-167)
+    """
+    weekday = (sa.cast(func.strftime('%w', date_column), sa.Integer) + 6) % 7  # %w counts from Sunday
+    return weekday * 24 + sa.cast(func.strftime('%H', date_column), sa.Integer)
+
+
+def new_availability_statements(post_id, reading_id):
+    """
+    Function to build the selects of the free spaces observed since the last profile update
+    :param post_id: highest post ID already counted
+    :param reading_id: highest occupancy reading ID already counted
+    :return: a tuple of (list of selects of location, hour_of_week and free columns, new post ID, new reading ID)
+    """
+    # minutes still being filled by the occupancy flush are left for the next update, from the first such row on
+    cutoff = datetime.now() - timedelta(seconds=2 * OCCUPANCY_BUCKET_SECONDS)
+    with read_db.connect() as conn:
+        new_post_id = conn.execute(sa.select(func.max(ParkingPost.id))).scalar() or post_id
+        first_open_id = conn.execute(sa.select(func.min(OccupancyReading.id)).where(
+            OccupancyReading.id > reading_id, OccupancyReading.date_time >= cutoff)).scalar()
+        new_reading_id = (first_open_id - 1 if first_open_id is not None
+                          else conn.execute(sa.select(func.max(OccupancyReading.id))).scalar() or reading_id)
+    posts = (sa.select(ParkingPost.location, hour_of_week_column(ParkingPost.date_time).label('hour_of_week'),
+                       ParkingPost.amt_slots.label('free'))
+             .where(ParkingPost.id > post_id, ParkingPost.id <= new_post_id))
+    readings = (sa.select(Location.name.label('location'),
+                          hour_of_week_column(OccupancyReading.date_time).label('hour_of_week'),
+                          (OccupancyReading.capacity - sa.cast(OccupancyReading.occupied_sum, sa.Float)
+                           / OccupancyReading.samples).label('free'))
+                .join(Location, Location.id == OccupancyReading.location_id)
+                .where(OccupancyReading.id > reading_id, OccupancyReading.id <= new_reading_id,
+                       OccupancyReading.capacity.is_not(None)))
+    return [posts, readings], new_post_id, new_reading_id
+
+
+def update_availability_profiles():
+    """
+    Function to add the posts and occupancy readings since the last update to the availability profiles
+    :return: the number of observations added
+    """
+    global availability_profiles
+    profiles = availability_profiles
+    statements, new_post_id, new_reading_id = new_availability_statements(profiles['post_id'], profiles['reading_id'])
+    locations = dict(profiles['locations'])
+    sums = profiles['sums'].copy()
+    counts = profiles['counts'].copy()
+    observationCount = 0
+
+    with read_db.connect() as conn:
+        for statement in statements:
+            # read in chunks, so memory stays flat however much history there is
+            for observations in pd.read_sql(statement, conn, chunksize=AVAILABILITY_CHUNK_SIZE):
+                codes, names = pd.factorize(observations['location'])
+                for name in names:
+                    locations.setdefault(name, len(locations))
+                if len(locations) > len(sums):
+                    sums = np.vstack([sums, np.zeros((len(locations) - len(sums), 168))])
+                    counts = np.vstack([counts, np.zeros((len(locations) - len(counts), 168))])
+                rows = np.array([locations[name] for name in names], dtype=np.int64)[codes]
+                cells = rows * 168 + observations['hour_of_week'].to_numpy(dtype=np.int64)
+                # one bincount per array sums the observations of every location and hour of the chunk at once
+                sums += np.bincount(cells, weights=observations['free'].to_numpy(dtype=np.float64),
+                                    minlength=sums.size).reshape(-1, 168)
+                counts += np.bincount(cells, minlength=counts.size).reshape(-1, 168)
+                observationCount += len(observations)
+
+    with availability_lock:  # replaced as a whole, so readers always see arrays and IDs which belong together
+        availability_profiles = {'post_id': new_post_id, 'reading_id': new_reading_id, 'locations': locations,
+                                 'sums': sums, 'counts': counts}
+    return observationCount
+
+
+def expected_availability(location, when=None):
+    """
+    Function to get the free spaces usually at a location in an hour of the week
+    :param location: name of the location
+    :param when: date and time to look up, default is None for now
+    :return: a tuple of (average free spaces, number of observations), or None if there are no observations
+    """
+    when = when or datetime.now()
+    profiles = availability_profiles
+    row = profiles['locations'].get(location)
+    hour = when.weekday() * 24 + when.hour
+    if row is None or profiles['counts'][row, hour] == 0:
+        return None
+    return profiles['sums'][row, hour] / profiles['counts'][row, hour], int(profiles['counts'][row, hour])
+
+
+#### ARCHIVAL FUNCTIONS ####
+# Closed crime reports and forum threads with no new comments for ARCHIVE_THREAD_AGE are moved from the tables the
+# pages read ("hot") to their archive tables ("cold"), ARCHIVE_BATCH_SIZE rows per transaction, so the registry,
+# the statistics and the forum only scan the cases and discussions which are still alive. Archived items are read on
+# the archive pages. Conversations of crime reports stay in 'crime_messages', they are only read by report ID.
+# SQLite gives a new row the largest ID in the table plus one, so the row with the largest ID always stays hot:
+# otherwise an archived ID could be given again, and a new report would pick up the conversation of an old one.
+
+def table_sizes(table_names):
+    """
+    Function to measure tables with their indexes, from SQLite's dbstat table
+    :param table_names: names of the tables
+    :return: a dictionary of table name to a dictionary of its number of rows and bytes used
+    """
+    sizes = {}
+    with read_db.connect() as conn:
+        for table_name in table_names:
+            rowCount = conn.execute(sa.select(func.count()).select_from(sa.table(table_name))).scalar()
+            byteCount = conn.execute(sa.text('SELECT SUM(dbstat.pgsize) FROM dbstat '
+                                             'JOIN sqlite_master ON sqlite_master.name = dbstat.name '
+                                             'WHERE sqlite_master.tbl_name = :table_name'),
+                                     {'table_name': table_name}).scalar()
+            sizes[table_name] = {'rows': rowCount, 'bytes': byteCount or 0}
+    return sizes
+
+
+def move_to_archive(conn, table, archive, ids, archived_at):
+    """
+    Function to copy rows to the archive table and delete them from their table, within the caller's transaction
+    :param conn: connection of the transaction
+    :param table: table the rows are in
+    :param archive: archive table of the table
+    :param ids: IDs of the rows to be moved
+    :param archived_at: date and time the rows are archived
+    :return:
+    """
+    conn.execute(archive.insert().from_select([column.name for column in table.columns] + ['archived_at'],
+                                              sa.select(*table.columns, sa.literal(archived_at, sa.DateTime))
+                                              .where(table.c.id.in_(ids))))
+    conn.execute(table.delete().where(table.c.id.in_(ids)))
+
+
+def archive_closed_crime_reports(batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Function to move the closed crime reports to the archive, one transaction per batch
+    :param batch_size: number of reports moved in one transaction
+    :return: the number of reports archived
+    """
+    movedCount = 0
+    newest_id = read_rows(sa.select(func.max(CrimeReport.id)))[0][0] or 0
+    while crime_ids := [row.id for row in read_rows(
+            sa.select(CrimeReport.id).where(CrimeReport.status == 'Closed', CrimeReport.id < newest_id)
+            .order_by(CrimeReport.id).limit(batch_size))]:
+        with db.begin() as conn:
+            move_to_archive(conn, CrimeReport.__table__, crime_reports_archive, crime_ids, datetime.now())
+        movedCount += len(crime_ids)
+    return movedCount
+
+
+def archive_inactive_threads(inactive_since, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Function to move the forum threads with no activity since a date to the archive together with their comments,
+    one transaction per batch. Threads with content reports waiting for moderation stay.
+    Queued votes and content reports are written before each batch (see flush_counter_writes()), so none of them is
+    lost on a thread which has moved or saved for it once it is gone.
+    :param inactive_since: date and time after which the thread and its comments were not posted
+    :param batch_size: number of threads moved in one transaction
+    :return: a tuple of (number of threads archived, number of comments archived with them)
+    """
+    comment = aliased(Thread)
+    threadCount = commentCount = 0
+    newest_id = read_rows(sa.select(func.max(Thread.id)))[0][0] or 0
+    statement = (sa.select(Thread.id)
+                 .where(Thread.parent_id.is_(None), Thread.date_time < inactive_since, Thread.id < newest_id,
+                        ~sa.select(comment.id).where(comment.parent_id == Thread.id,
+                                                     sa.or_(comment.date_time >= inactive_since,
+                                                            comment.id == newest_id)).exists(),
+                        ~sa.select(ContentReport.id).where(ContentReport.thread_id == Thread.id).exists(),
+                        ~sa.select(ContentReport.id).join(comment, comment.id == ContentReport.thread_id)
+                        .where(comment.parent_id == Thread.id).exists())
+                 .order_by(Thread.id).limit(batch_size))
+    while True:
+        flush_counter_writes()
+        thread_ids = [row.id for row in read_rows(statement)]
+        if not thread_ids:
+            break
+        with db.begin() as conn:
+            comment_ids = conn.execute(sa.select(Thread.id).where(Thread.parent_id.in_(thread_ids))).scalars().all()
+            move_to_archive(conn, Thread.__table__, threads_archive, thread_ids + comment_ids, datetime.now())
+        threadCount += len(thread_ids)
+        commentCount += len(comment_ids)
+    return threadCount, commentCount
+
+
+def run_archival(thread_age=ARCHIVE_THREAD_AGE, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Function to archive the closed crime reports and the inactive threads, run as a background job and by the
+    'archive' command. The snapshots of both tables are brought up to date first, so every row is in the analytics
+    snapshots before it leaves its table.
+    :param thread_age: time a thread has to go without new comments to be archived
+    :param batch_size: number of rows moved in one transaction
+    :return: a tuple of (dictionary of the numbers of rows archived, table sizes before, table sizes after)
+    """
+    hot_tables = ['crime_reports', 'threads']
+    before = table_sizes(hot_tables)
+    run_snapshot(hot_tables)
+    threadCount, commentCount = archive_inactive_threads(datetime.now() - thread_age, batch_size)
+    archived = {'crime_reports': archive_closed_crime_reports(batch_size), 'threads': threadCount,
+                'comments': commentCount}
+    return archived, before, table_sizes(hot_tables)
+
+
+def read_archived_crime_reports(user_id=None, after=None, limit=ARCHIVE_PAGE_SIZE):
+    """
+    Function to read one page of the archived crime reports, newest first
+    :param user_id: User ID of the reporter, default is None which reads reports of all users
+    :param after: cursor of the page to read, default is None which reads the first page
+    :param limit: number of reports on a page
+    :return: a tuple of (rows of the report columns, next page cursor)
+    """
+    archive = crime_reports_archive.c
+    statement = sa.select(archive.id, archive.title, archive.location, archive.category, archive.date_time,
+                          archive.is_emergency, archive.archived_at)
+    if user_id is not None:
+        statement = statement.where(archive.user_id == user_id)
+    return read_keyset_page(statement, [archive.date_time, archive.id], True, after, limit)
+
+
+def read_archived_crime_counts(column_name):
+    """
+    Function to count the archived crime reports (all closed) by a column, for the crime statistics
+    :param column_name: 'location' or 'category'
+    :return: a dictionary of the column value to its number of archived reports
+    """
+    column = crime_reports_archive.c[column_name]
+    return dict(read_rows(sa.select(column, func.count()).group_by(column)))
+
+
+def read_archived_threads(after=None, limit=ARCHIVE_PAGE_SIZE):
+    """
+    Function to read one page of the archived forum threads with their comments, newest first.
+    Threads and comments hidden by council staff are left out.
+    :param after: cursor of the page to read, default is None which reads the first page
+    :param limit: number of threads on a page
+    :return: a tuple of (rows of the threads, dictionary of thread ID to its comment rows, next page cursor)
+    """
+    archive = threads_archive.c
+    columns = [archive.id, archive.parent_id, archive.title, archive.content, archive.date_time, archive.up_votes,
+               archive.down_votes, User.display_name]
+    threads, next_cursor = read_keyset_page(
+        sa.select(*columns).outerjoin(User, User.id == archive.user_id)
+        .where(archive.parent_id.is_(None), archive.is_hidden == sa.false()),
+        [archive.id], True, after, limit)
+    comments = {thread.id: [] for thread in threads}
+    if comments:
+        for comment in read_rows(sa.select(*columns).outerjoin(User, User.id == archive.user_id)
+                                 .where(archive.parent_id.in_(comments.keys()), archive.is_hidden == sa.false())
+                                 .order_by(archive.id)):
+            comments[comment.parent_id].append(comment)
+    return threads, comments, next_cursor
+
+
+#### BACKUP FUNCTIONS ####
+# Copying gbb-eli.db while the app runs can catch a write half done, so backups use SQLite's online backup API, which
+# copies the pages through SQLite's own locks. BACKUP_PAGES_PER_STEP pages are copied at a time with a pause of
+# BACKUP_STEP_SECONDS in between, so the pages keep most of the disk and the interpreter while a backup runs.
+# The copy holds one read transaction from start to end: with the write-ahead log it is a copy of that moment while
+# writers carry on. Without it, every commit made during the copy would start the backup again from the first page.
+# Each copy is checked with PRAGMA integrity_check before it is kept, then older copies are thinned out to the newest
+# of each of the last days, weeks and months in BACKUP_RETENTION.
+
+BACKUP_PERIODS = {'daily': lambda when: when.date(), 'weekly': lambda when: when.isocalendar()[:2],
+                  'monthly': lambda when: (when.year, when.month)}
+
+
+def list_backups():
+    """
+    Function to list the backups in BACKUP_DIRECTORY, named after the database and the time they were taken
+    :return: a list of tuples of (date and time of the backup, path), newest first
+    """
+    prefix = os.path.splitext(sqlite_file_name)[0]
+    backups = []
+    for backup_path in glob.glob(os.path.join(glob.escape(BACKUP_DIRECTORY), f'{prefix}-*.db')):
+        try:
+            taken_at = datetime.strptime(os.path.basename(backup_path)[len(prefix) + 1:-3], '%Y%m%d-%H%M%S')
+        except ValueError:  # not a backup made here
+            continue
+        backups.append((taken_at, backup_path))
+    return sorted(backups, reverse=True)
+
+
+def prune_backups(retention=None):
+    """
+    Function to delete the backups no retention period keeps: for each period in the retention, the newest backup of
+    each of the latest days, weeks or months with a backup
+    :param retention: dictionary of period ('daily', 'weekly' or 'monthly') to the number kept, default is
+    BACKUP_RETENTION
+    :return: a list of the paths deleted
+    """
+    backups = list_backups()
+    kept = set()
+    for period, keepCount in (retention or BACKUP_RETENTION).items():
+        periods = set()
+        for taken_at, backup_path in backups:  # newest first, so each period keeps its newest backup
+            key = BACKUP_PERIODS[period](taken_at)
+            if key not in periods:
+                if len(periods) == keepCount:
+                    break
+                periods.add(key)
+                kept.add(backup_path)
+    deleted = [backup_path for _, backup_path in backups if backup_path not in kept]
+    for backup_path in deleted:
+        os.remove(backup_path)
+    return deleted
+
+
+def run_backup(pages=BACKUP_PAGES_PER_STEP, step_seconds=BACKUP_STEP_SECONDS, stop=None):
+    """
+    Function to back up the database to BACKUP_DIRECTORY while the app runs, check the copy and prune older ones.
+    The copy is written to a '.part' file, which only gets its name once the integrity check passes.
+    :param pages: number of pages copied in each step
+    :param step_seconds: seconds to pause between steps
+    :param stop: event which stops the backup after the current step when set, default is None
+    :return: a dictionary of path, pages, steps, seconds, bytes and pruned (paths deleted), or None if it was stopped
+    """
+    os.makedirs(BACKUP_DIRECTORY, exist_ok=True)
+    started_at = datetime.now()
+    backup_path = os.path.join(BACKUP_DIRECTORY,
+                               f'{os.path.splitext(sqlite_file_name)[0]}-{started_at:%Y%m%d-%H%M%S}.db')
+    part_path = f'{backup_path}.part'
+    stepCount = 0
+
+    def after_step(status, remaining, total):  # called by SQLite after each step
+        nonlocal stepCount
+        stepCount += 1
+        if stop is not None and stop.is_set():
+            raise InterruptedError('The backup was stopped')
+        if remaining:
+            time.sleep(step_seconds)
+
+    start = time.perf_counter()
+    try:
+        with contextlib.closing(sqlite3.connect(f'file:{sqlite_file_name}?mode=ro', uri=True)) as source, \
+                contextlib.closing(sqlite3.connect(part_path)) as target:
+            source.execute('BEGIN')
+            source.execute('SELECT COUNT(*) FROM sqlite_master').fetchall()  # the read transaction the copy is of
+            source.backup(target, pages=pages, progress=after_step)
+            source.rollback()
+            target.execute('PRAGMA journal_mode = DELETE')  # the copy is one file, without a write-ahead log
+            problems = [row[0] for row in target.execute('PRAGMA integrity_check')]
+            pageCount = target.execute('PRAGMA page_count').fetchone()[0]
+        if problems != ['ok']:
+            raise ValueError(f'The backup failed its integrity check: {"; ".join(problems[:5])}')
+        os.replace(part_path, backup_path)
+    except InterruptedError:
+        os.remove(part_path)
+        return None
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return {'path': backup_path, 'pages': pageCount, 'steps': stepCount, 'seconds': time.perf_counter() - start,
+            'bytes': os.path.getsize(backup_path), 'pruned': prune_backups()}
+
+
+#### BACKGROUND JOB FUNCTIONS ####
+# Maintenance work runs as jobs of an in-process runner. A scheduler thread hands the jobs which are due to a bounded
+# pool of JOB_WORKERS threads. Leased jobs first take their row of the 'background_jobs' table, so only one worker of
+# one process runs them at a time, and the row keeps when the job is next due, so all processes agree on it.
+# Jobs working on memory of their own process (e.g. the occupancy buffers) are not leased. A failed run is retried
+# with exponential backoff. Every run is counted in the table and in job_metrics() of the process.
+
+jobs = {}  # job name to its function, schedule, state and metrics
+jobs_lock = threading.Lock()
+job_runner_wake = threading.Event()  # set when a job finishes or the runner stops, so the scheduler looks again
+job_runner_stopping = threading.Event()
+job_runner = {'executor': None, 'scheduler': None, 'leases_renewed_at': 0.0}
+
+# lowest and highest values of the fields of a cron expression: minute, hour, day of month, month, day of week
+CRON_FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+
+def parse_cron(expression):
+    """
+    Function to parse a cron expression of five fields: minute, hour, day of month, month and day of week (Sunday is
+    0 or 7). A field is '*', a number, a range 'a-b' or a list 'a,b,c', each with an optional step '/n'.
+    :param expression: cron expression, e.g. '0 3 * * *' for 3am every day
+    :return: a dictionary of the sorted values each field matches, and whether the day fields were '*'
+    """
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError(f'A cron expression has five fields: {expression}')
+    values = []
+    for field, (low, high) in zip(fields, CRON_FIELDS):
+        matched = set()
+        for part in field.split(','):
+            part_range, _, step = part.partition('/')
+            try:
+                if part_range == '*':
+                    first, last = low, high
+                elif '-' in part_range:
+                    first, last = map(int, part_range.split('-'))
+                else:
+                    first = last = int(part_range)
+                    last = high if step else last  # '5/15' is every 15 from 5
+                step = int(step) if step else 1
+            except ValueError:
+                raise ValueError(f'Invalid cron field: {field}')
+            if not low <= first <= last <= high or step < 1:
+                raise ValueError(f'Invalid cron field: {field}')
+            matched.update(range(first, last + 1, step))
+        values.append(sorted(matched))
+    return {'minutes': values[0], 'hours': values[1], 'days': values[2], 'months': values[3],
+            'weekdays': sorted({weekday % 7 for weekday in values[4]}),
+            'any_day': fields[2] == '*', 'any_weekday': fields[4] == '*'}
+
+
+def next_cron_time(cron, after):
+    """
+    Function to find the first minute after a time which a parsed cron expression matches
+    :param cron: cron expression parsed by parse_cron()
+    :param after: date and time to start from
+    :return: date and time of the next match
+    """
+    day = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    for _ in range(5 * 366):  # a day like 30 February never comes, so the search gives up after five years
+        weekday = (day.weekday() + 1) % 7  # cron counts the days of the week from Sunday
+        # like cron, if both day fields are given, a day matching either of them will do
+        if cron['any_day'] or cron['any_weekday']:
+            dayMatches = day.day in cron['days'] and weekday in cron['weekdays']
+        else:
+            dayMatches = day.day in cron['days'] or weekday in cron['weekdays']
+        if day.month in cron['months'] and dayMatches:
+            for hour in cron['hours']:
+                for minute in cron['minutes']:
+                    if (hour, minute) >= (day.hour, day.minute):
+                        return day.replace(hour=hour, minute=minute)
+        day = (day + timedelta(days=1)).replace(hour=0, minute=0)
+    raise ValueError('The cron expression never matches')
+
+
+def register_job(name, function, every=None, cron=None, leased=True, retries=JOB_RETRIES):
+    """
+    Function to add a job to the runner, to run every so often or on a cron schedule
+    :param name: unique name of the job, also the key of its row in the 'background_jobs' table
+    :param function: function run with no arguments, an exception fails the run
+    :param every: timedelta between the runs, the first run is straight away
+    :param cron: cron expression of when the job runs (see parse_cron())
+    :param leased: True if only one process at a time runs the job, False for jobs on the memory of their process
+    :param retries: number of times a failed run is retried before the job waits for its next scheduled run
+    :return:
+    """
+    if (every is None) == (cron is None):
+        raise ValueError(f'Job {name} needs either an interval or a cron schedule')
+    schedule = parse_cron(cron) if cron is not None else None
+    with jobs_lock:
+        jobs[name] = {'function': function, 'every': every, 'cron': schedule, 'leased': leased, 'retries': retries,
+                      'next_run': datetime.now() if every is not None else next_cron_time(schedule, datetime.now()),
+                      'attempt': 0, 'running': False,
+                      'metrics': {'runs': 0, 'failures': 0, 'retries': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+                                  'last_seconds': None, 'last_started_at': None, 'last_status': None,
+                                  'last_error': None}}
+
+
+def scheduled_run_after(job, started_at):
+    """
+    Function to work out when a job is next due after a run
+    :param job: job from the jobs dictionary
+    :param started_at: date and time the run started
+    :return: date and time of the next run
+    """
+    if job['every'] is not None:
+        return max(started_at + job['every'], datetime.now())  # a run longer than the interval is not caught up
+    return next_cron_time(job['cron'], datetime.now())
+
+
+def acquire_job_lease(name):
+    """
+    Function to take the lease of a job, if no process holds it and the job is due
+    :param name: name of the job
+    :return: a tuple of (True if this process now holds the lease, date and time to try again otherwise)
+    """
+    now = datetime.now()
+    statement = sqlite_insert(BackgroundJob).values(name=name, lease_owner=JOB_RUNNER_ID,
+                                                    lease_expires_at=now + timedelta(seconds=JOB_LEASE_SECONDS))
+    statement = statement.on_conflict_do_update(
+        index_elements=['name'],
+        set_={'lease_owner': statement.excluded.lease_owner, 'lease_expires_at': statement.excluded.lease_expires_at},
+        where=sa.and_(sa.or_(BackgroundJob.lease_expires_at.is_(None), BackgroundJob.lease_expires_at <= now),
+                      sa.or_(BackgroundJob.next_run_at.is_(None), BackgroundJob.next_run_at <= now)))
+    with db.begin() as conn:
+        if conn.execute(statement.returning(BackgroundJob.name)).first() is not None:
+            return True, None
+        row = conn.execute(sa.select(BackgroundJob.lease_expires_at, BackgroundJob.next_run_at)
+                           .where(BackgroundJob.name == name)).first()
+    # another process runs the job now or has run it already, so it is tried again when it is next due
+    return False, max([value for value in row if value is not None] + [now + timedelta(seconds=JOB_TICK_SECONDS)])
+
+
+def renew_job_leases():
+    """
+    Function to extend the leases of the jobs this process is running, every third of JOB_LEASE_SECONDS
+    :return:
+    """
+    if time.monotonic() - job_runner['leases_renewed_at'] < JOB_LEASE_SECONDS / 3:
+        return
+    with jobs_lock:
+        names = [name for name, job in jobs.items() if job['running'] and job['leased']]
+    if names:
+        with db.begin() as conn:
+            conn.execute(sa.update(BackgroundJob)
+                         .where(BackgroundJob.name.in_(names), BackgroundJob.lease_owner == JOB_RUNNER_ID)
+                         .values(lease_expires_at=datetime.now() + timedelta(seconds=JOB_LEASE_SECONDS)))
+    job_runner['leases_renewed_at'] = time.monotonic()
+
+
+def record_job_run(name, leased, started_at, seconds, error, next_run):
+    """
+    Function to count a run of a job in its row of the 'background_jobs' table, and give up its lease
+    :param name: name of the job
+    :param leased: True if the job was run under a lease
+    :param started_at: date and time the run started
+    :param seconds: seconds the run took
+    :param error: exception the run failed with, None if it succeeded
+    :param next_run: date and time the job is next due
+    :return:
+    """
+    values = {'last_started_at': started_at, 'last_duration': seconds,
+              'last_status': 'Succeeded' if error is None else 'Failed',
+              'last_error': None if error is None else repr(error)[:500],
+              'run_count': BackgroundJob.run_count + 1,
+              'failure_count': BackgroundJob.failure_count + (0 if error is None else 1)}
+    statement = sa.update(BackgroundJob).where(BackgroundJob.name == name)
+    if leased:
+        values.update(lease_owner=None, lease_expires_at=None, next_run_at=next_run)
+        statement = statement.where(BackgroundJob.lease_owner == JOB_RUNNER_ID)
+    with db.begin() as conn:
+        conn.execute(statement.values(**values))
+
+
+def run_job(name):
+    """
+    Function to run a job once on a worker of the pool, then work out when it runs next
+    :param name: name of the job
+    :return:
+    """
+    job = jobs[name]
+    started_at, start = datetime.now(), time.perf_counter()
+    error = None
+    try:
+        job['function']()
+    except Exception as exception:  # whatever a job fails with, the worker carries on and the run is retried
+        error = exception
+    seconds = time.perf_counter() - start
+    with jobs_lock:
+        metrics = job['metrics']
+        metrics['runs'] += 1
+        metrics['total_seconds'] += seconds
+        metrics['max_seconds'] = max(metrics['max_seconds'], seconds)
+        metrics['last_seconds'], metrics['last_started_at'] = seconds, started_at
+        metrics['last_status'] = 'Succeeded' if error is None else 'Failed'
+        metrics['last_error'] = None if error is None else repr(error)
+        next_run = scheduled_run_after(job, started_at)
+        if error is not None:
+            metrics['failures'] += 1
+            if job['attempt'] < job['retries']:
+                job['attempt'] += 1
+                metrics['retries'] += 1
+                backoff = min(JOB_RETRY_MAX_SECONDS, JOB_RETRY_SECONDS * 2 ** (job['attempt'] - 1))
+                next_run = min(next_run, datetime.now() + timedelta(seconds=backoff))
+            else:
+                job['attempt'] = 0
+        else:
+            job['attempt'] = 0
+        job['next_run'] = next_run
+    if error is not None:
+        print(f'Job {name} failed, next run at {next_run:%H:%M:%S}: {error!r}', file=sys.stderr)
+    try:
+        record_job_run(name, job['leased'], started_at, seconds, error, next_run)
+    except SQLAlchemyError as record_error:  # the lease runs out by itself if it could not be given up
+        print(f'Recording the run of job {name} failed: {record_error}', file=sys.stderr)
+    finally:
+        with jobs_lock:
+            job['running'] = False
+        job_runner_wake.set()
+
+
+def run_job_scheduler():
+    """
+    Function to start the jobs which are due on the worker pool, until the runner stops
+    :return:
+    """
+    while not job_runner_stopping.is_set():
+        now = datetime.now()
+        with jobs_lock:
+            running = sum(job['running'] for job in jobs.values())
+            due = sorted((job['next_run'], name) for name, job in jobs.items()
+                         if not job['running'] and job['next_run'] <= now)
+        for _, name in due[:JOB_WORKERS - running]:  # the other due jobs wait for a free worker
+            job = jobs[name]
+            if job['leased']:
+                try:
+                    acquired, retry_at = acquire_job_lease(name)
+                except SQLAlchemyError as error:
+                    print(f'Taking the lease of job {name} failed: {error}', file=sys.stderr)
+                    continue
+                if not acquired:
+                    job['next_run'] = retry_at
+                    continue
+            job['running'] = True
+            job_runner['executor'].submit(run_job, name)
+        try:
+            renew_job_leases()
+        except SQLAlchemyError as error:
+            print(f'Renewing job leases failed: {error}', file=sys.stderr)
+        with jobs_lock:
+            waiting = [job['next_run'] for job in jobs.values() if not job['running']]
+            full = sum(job['running'] for job in jobs.values()) >= JOB_WORKERS
+        timeout = JOB_TICK_SECONDS
+        if waiting and not full:
+            timeout = min(timeout, max(0.0, (min(waiting) - datetime.now()).total_seconds()))
+        job_runner_wake.wait(timeout)
+        job_runner_wake.clear()
+
+
+def job_metrics():
+    """
+    Function to get the runtime metrics of the jobs run by this process
+    :return: a dictionary of job name to its metrics, with the average seconds per run and when it is next due
+    """
+    with jobs_lock:
+        return {name: {**job['metrics'], 'next_run': job['next_run'], 'running': job['running'],
+                       'average_seconds': job['metrics']['total_seconds'] / job['metrics']['runs']
+                       if job['metrics']['runs'] else None}
+                for name, job in jobs.items()}
+
+
+def start_job_runner():
+    """
+    Function to start the worker pool and the scheduler of the registered jobs
+    :return:
+    """
+    with db.begin() as conn:  # every job has a row, so the lease statements always find one
+        conn.execute(sqlite_insert(BackgroundJob).on_conflict_do_nothing(index_elements=['name']),
+                     [{'name': name} for name in jobs])
+    job_runner_stopping.clear()
+    job_runner['executor'] = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+    job_runner['scheduler'] = threading.Thread(target=run_job_scheduler, name='job-scheduler', daemon=True)
+    job_runner['scheduler'].start()
+
+
+def stop_job_runner():
+    """
+    Function to stop the runner: no more jobs are started, the running ones are waited for (long jobs check
+    job_runner_stopping and end early) and the leases this process still holds are given up
+    :return:
+    """
+    job_runner_stopping.set()
+    job_runner_wake.set()
+    if job_runner['scheduler'] is not None:
+        job_runner['scheduler'].join()
+        job_runner['executor'].shutdown(wait=True, cancel_futures=True)
+    with db.begin() as conn:
+        conn.execute(sa.update(BackgroundJob).where(BackgroundJob.lease_owner == JOB_RUNNER_ID)
+                     .values(lease_owner=None, lease_expires_at=None))
+    job_runner['executor'] = job_runner['scheduler'] = None
+
+
+def start_background_threads():
+    """
+    Function to start the work the server runs in the background: the occupancy endpoints, the background jobs (the
+    occupancy flush, the availability profiles, the email digests, the analytics snapshots, the archival and the
+    backups), the announcement scheduler, the preference writes and the counter writes. The last three wait for events
+    rather than run on a schedule, so they keep threads of their own. Counter changes left in the log by the last run
+    are saved first.
+    :return:
+    """
+    start_occupancy_ingest()
+    register_job('occupancy-flush', flush_occupancy, every=timedelta(seconds=OCCUPANCY_FLUSH_SECONDS), leased=False)
+    register_job('availability-refresh', update_availability_profiles,
+                 every=timedelta(seconds=AVAILABILITY_REFRESH_SECONDS), leased=False)
+    register_job('email-digests', send_due_digests, every=timedelta(seconds=DIGEST_CHECK_SECONDS))
+    register_job('analytics-snapshot', run_snapshot, cron=SNAPSHOT_CRON)
+    register_job('cold-data-archival', run_archival, cron=ARCHIVE_CRON)
+    register_job('database-backup', partial(run_backup, stop=job_runner_stopping), cron=BACKUP_CRON)
+    start_job_runner()
+    threading.Thread(target=run_announcement_scheduler, daemon=True).start()
+    threading.Thread(target=write_preferences_forever, daemon=True).start()
+    replay_counter_log()
+    threading.Thread(target=write_counters_forever, daemon=True).start()
+
+
+def stop_background_threads():
+    """
+    Function to stop the background jobs when the server stops, and save what is still only in memory: the occupancy
+    readings since the last flush, the queued preference changes and the queued counter changes
+    :return:
+    """
+    stop_job_runner()
+    flush_occupancy()
+    write_preferences()
+    flush_counter_writes()
+
+
+#### WRITE-BEHIND COUNTER FUNCTIONS ####
+# Votes, report flags and ratings used to be committed one by one, each waiting for the disk and for SQLite's single
+# writer. They are queued here instead: counter changes add up per (table, row ID, column) and new rows are listed,
+# and a background thread writes everything queued in one transaction (see COUNTER_WRITES for what a change survives).
+# Pages add the queued changes to what they read, so users see their own votes straight away.
+
+def apply_counter_writes(conn, deltas, rows, sequence=None, log_file=None):
+    """
+    Function to write counter changes and new rows within the caller's transaction, one executemany per table and
+    column
+    :param conn: connection of the transaction
+    :param deltas: dictionary of (table name, row ID, column name) to the change of the counter
+    :param rows: list of (table name, dictionary of column values) of the new rows
+    :param sequence: sequence number of the last change of the log file written, None if they were not logged
+    :param log_file: name of the log file the sequence number is of, default is None for this process's log file
+    :return:
+    """
+    columns = {}
+    for (table_name, row_id, column_name), delta in deltas.items():
+        columns.setdefault((table_name, column_name), []).append({'row_id': row_id, 'delta': delta})
+    for (table_name, column_name), changes in columns.items():
+        table = Base.metadata.tables[table_name]
+        conn.execute(table.update().where(table.c.id == sa.bindparam('row_id'))
+                     .values({column_name: table.c[column_name] + sa.bindparam('delta')}), changes)
+    tables = {}
+    for table_name, values in rows:
+        tables.setdefault(table_name, []).append(values)
+    for table_name, table_rows in tables.items():
+        conn.execute(Base.metadata.tables[table_name].insert(), table_rows)
+    if sequence is not None:
+        conn.execute(sqlite_insert(WriteBehindLog).values(log_file=log_file or counter_writes['log_file'],
+                                                          sequence=sequence, saved_at=datetime.now())
+                     .on_conflict_do_update(index_elements=['log_file'],
+                                            set_={'sequence': sequence, 'saved_at': datetime.now()}))
+
+
+def try_lock_file(lock_file):
+    """
+    Function to take the lock on an open file without waiting, the operating system releases it when the process ends
+    :param lock_file: file object opened for appending
+    :return: True if the lock was taken, False if another process holds it
+    """
+    try:
+        if os.name == 'nt':
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
 
-        data_table = []
+def counter_log_owner(path):
+    """
+    Function to get the name of the log file a write-behind file belongs to, from its own name
+    :param path: path of a log file, of one renamed by a flush (<log>.<sequence>) or of a lock file (<name>.lock)
+    :return: the name of the log file, None if the path is not one of these files
+    """
+    match = re.fullmatch(rf'({re.escape(COUNTER_LOG_PREFIX)}.*?)(\.log(\.\d+)?|\.lock)', path)
+    return f'{match[1]}.log' if match else None
 
-        if view == 'location':
-            result = sesh.query(
-                CrimeReport.location,
-                func.count(CrimeReport.id),
-                func.count(CrimeReport.id).filter(CrimeReport.status == "Pending"),
-                func.count(CrimeReport.id).filter(CrimeReport.status == "Under Investigation"),
-                func.count(CrimeReport.id).filter(CrimeReport.status == "Action Taken"),
-                func.count(CrimeReport.id).filter(CrimeReport.status == "Closed")).group_by(
-                CrimeReport.location).order_by((func.count(CrimeReport.id) - func.count(CrimeReport.id).filter(
-                CrimeReport.status == "Closed")).desc()).all()
-            for location, count, new_cases, investigation_cases, resolved_cases, closed_cases in result:
-                data_table.append(
-                    [location, count - closed_cases, new_cases, investigation_cases, resolved_cases,
-                     closed_cases])
 
-            put_table(data_table,
-                      header=['Crime Location', 'Open Cases', 'New Cases', 'Under Investigation',
-                              'Resolved Cases',
-                              'Closed Cases'])
+def replay_stopped_log(log_file):
+    """
+    Function to save the changes left in the log files of a process which has stopped, then remove its files and its
+    row of 'write_behind_log'. Changes already saved (up to the sequence number in that row) are skipped, and so is a
+    last line cut off by the process stopping while it was written.
+    :param log_file: name of the process's log file
+    :return: the number of changes saved, 0 if the process is still running
+    """
+    lock_path = f'{log_file[:-len(".log")]}.lock'
+    with open(lock_path, 'a') as lock:
+        if not try_lock_file(lock):  # still running, or being replayed by another process starting at the same time
+            return 0
+        saved = read_rows(sa.select(WriteBehindLog.sequence).where(WriteBehindLog.log_file == log_file))
+        sequence = saved[0].sequence if saved else 0
+        lastSequence = sequence
+        deltas, rows = {}, []
+        log_paths = glob.glob(f'{glob.escape(log_file)}*')
+        for log_path in log_paths:
+            with open(log_path) as log:
+                for line in log:
+                    try:
+                        change = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if change['sequence'] <= sequence:
+                        continue
+                    if 'row' in change:
+                        if change['row'].get('date_time') is not None:
+                            change['row']['date_time'] = datetime.fromisoformat(change['row']['date_time'])
+                        rows.append((change['table'], change['row']))
+                    else:
+                        key = (change['table'], change['id'], change['column'])
+                        deltas[key] = deltas.get(key, 0) + change['delta']
+                    lastSequence = max(lastSequence, change['sequence'])
+        if deltas or rows:
+            with db.begin() as conn:
+                apply_counter_writes(conn, deltas, rows, lastSequence, log_file)
+        for log_path in log_paths:
+            os.remove(log_path)
+        # the row goes only once the files are gone, so a replay cut short is finished by the next start
+        with db.begin() as conn:
+            conn.execute(sa.delete(WriteBehindLog).where(WriteBehindLog.log_file == log_file))
+    with contextlib.suppress(OSError):
+        os.remove(lock_path)
+    return len(deltas) + len(rows)
+
+
+def replay_counter_log():
+    """
+    Function to give this process a log file of its own, and save the changes left in the log files of processes
+    which have stopped, once per run before anything new is logged.
+    Every process holds the lock on its <log>.lock file while it runs, so the logs of the others still running (and
+    writing to the same database) are left alone.
+    :return: the number of changes saved
+    """
+    with counter_writes_lock:
+        if counter_writes['replayed']:
+            return 0
+        counter_writes['log_file'] = f'{COUNTER_LOG_PREFIX}-{JOB_RUNNER_ID}.log'
+        counter_writes['lock'] = open(f'{COUNTER_LOG_PREFIX}-{JOB_RUNNER_ID}.lock', 'a')
+        try_lock_file(counter_writes['lock'])  # the name is new, so no other process holds it
+        owners = {counter_log_owner(path) for path in glob.glob(f'{glob.escape(COUNTER_LOG_PREFIX)}*')}
+        owners -= {None, counter_writes['log_file']}
+        savedCount = sum(replay_stopped_log(log_file) for log_file in sorted(owners))
+        counter_writes['replayed'] = True
+    return savedCount
+
+
+def log_counter_writes(deltas, rows):
+    """
+    Function to append changes to the log file, called with counter_writes_lock held
+    :param deltas: list of (table name, row ID, column name, change) of counters
+    :param rows: list of (table name, dictionary of column values) of new rows
+    :return:
+    """
+    if counter_writes['log'] is None:
+        counter_writes['log'] = open(counter_writes['log_file'], 'a')
+    lines = []
+    for table_name, row_id, column_name, delta in deltas:
+        counter_writes['sequence'] += 1
+        lines.append(json.dumps({'sequence': counter_writes['sequence'], 'table': table_name, 'id': row_id,
+                                 'column': column_name, 'delta': delta}))
+    for table_name, values in rows:
+        counter_writes['sequence'] += 1
+        lines.append(json.dumps({'sequence': counter_writes['sequence'], 'table': table_name, 'row': values},
+                                default=datetime.isoformat))
+    counter_writes['log'].write('\n'.join(lines) + '\n')
+    counter_writes['log'].flush()  # to the operating system, which keeps it if the app stops
+
+
+def queue_counter_writes(deltas=(), rows=()):
+    """
+    Function to queue counter changes and new rows to be written behind, or to write them straight away when
+    COUNTER_WRITES is 'immediate'
+    :param deltas: list of (table name, row ID, column name, change) of counters, e.g. ('threads', 5, 'up_votes', 1)
+    :param rows: list of (table name, dictionary of column values) of new rows
+    :return:
+    """
+    if COUNTER_WRITES == 'immediate':
+        with db.begin() as conn:
+            apply_counter_writes(conn, {(table_name, row_id, column_name): delta
+                                        for table_name, row_id, column_name, delta in deltas}, list(rows))
+        return
+    if COUNTER_WRITES == 'logged':
+        replay_counter_log()
+    with counter_writes_lock:
+        if COUNTER_WRITES == 'logged':
+            log_counter_writes(deltas, rows)
+        for table_name, row_id, column_name, delta in deltas:
+            key = (table_name, row_id, column_name)
+            counter_writes['deltas'][key] = counter_writes['deltas'].get(key, 0) + delta
+        counter_writes['rows'] += rows
+        counter_writes['operations'] += len(deltas) + len(rows)
+        if counter_writes['operations'] >= COUNTER_FLUSH_OPERATIONS:
+            counter_writes_full.set()
+    counter_writes_ready.set()
+
+
+def flush_counter_writes():
+    """
+    Function to write the queued counter changes and rows in one transaction. The log file is closed and renamed
+    first, so changes queued meanwhile go to a new one, and is removed once its changes are saved.
+    If the transaction fails the changes are queued again, and the renamed file stays until a later flush saves them.
+    :return: the number of counters and rows written
+    """
+    with counter_flush_lock:
+        return flush_queued_counter_writes()
 
-        elif view == 'category':
-            result = sesh.query(
-                CrimeReport.category, func.count(CrimeReport.id),
-                func.count(CrimeReport.id).filter(CrimeReport.status == "Pending"),
-                func.count(CrimeReport.id).filter(CrimeReport.status == "Under Investigation"),
-                func.count(CrimeReport.id).filter(CrimeReport.status == "Action Taken"),
-                func.count(CrimeReport.id).filter(CrimeReport.status == "Closed")).group_by(
-                CrimeReport.category).order_by((func.count(CrimeReport.id) - func.count(CrimeReport.id).filter(
-                CrimeReport.status == "Closed")).desc()).all()
-            for category, count, new_cases, investigation_cases, resolved_cases, closed_cases in result:
-                data_table.append(
-                    [category, count - closed_cases, new_cases, investigation_cases, resolved_cases,
-                     closed_cases])
 
-            put_table(data_table,
-                      header=['Crime Category', 'Open Cases', 'New Cases', 'Under Investigation',
-                              'Resolved Cases',
-                              'Closed Cases'])
+def flush_queued_counter_writes():
+    """
+    Function to write the queued counter changes and rows, called with counter_flush_lock held
+    :return: the number of counters and rows written
+    """
+    with counter_writes_lock:
+        deltas, rows = counter_writes['deltas'], counter_writes['rows']
+        if not deltas and not rows:
+            return 0
+        counter_writes['deltas'], counter_writes['rows'], counter_writes['operations'] = {}, [], 0
+        counter_writes['flushing_deltas'], counter_writes['flushing_rows'] = deltas, rows
+        # every logged change up to here is in this flush or saved before, including the changes of a failed flush
+        # queued again, whose log file was already renamed
+        sequence = counter_writes['sequence'] if COUNTER_WRITES == 'logged' else None
+        if counter_writes['log'] is not None:
+            counter_writes['log'].close()
+            counter_writes['log'] = None
+            os.replace(counter_writes['log_file'], f'{counter_writes["log_file"]}.{sequence}')
+    try:
+        with db.begin() as conn:
+            apply_counter_writes(conn, deltas, rows, sequence)
+    except SQLAlchemyError:
+        with counter_writes_lock:
+            for key, delta in deltas.items():
+                counter_writes['deltas'][key] = counter_writes['deltas'].get(key, 0) + delta
+            counter_writes['rows'][:0] = rows
+            counter_writes['operations'] += len(deltas) + len(rows)
+            counter_writes['flushing_deltas'], counter_writes['flushing_rows'] = {}, []
+        counter_writes_ready.set()
+        raise
+    with counter_writes_lock:
+        counter_writes['flushing_deltas'], counter_writes['flushing_rows'] = {}, []
+    if sequence is not None:  # files of failed flushes are saved by this one too
+        for log_path in glob.glob(f'{glob.escape(counter_writes["log_file"])}.*'):
+            if int(log_path.rsplit('.', 1)[1]) <= sequence:
+                os.remove(log_path)
+    return len(deltas) + len(rows)
+
+
+def write_counters_forever():
+    """
+    Function to write the queued counter changes in the background, COUNTER_FLUSH_MS after the first of them or as
+    soon as COUNTER_FLUSH_OPERATIONS are waiting
+    :return:
+    """
+    while True:
+        counter_writes_ready.wait()
+        counter_writes_full.wait(COUNTER_FLUSH_MS / 1000)  # changes made meanwhile go in the same transaction
+        counter_writes_ready.clear()
+        counter_writes_full.clear()
+        try:
+            flush_counter_writes()
+        except SQLAlchemyError as error:
+            print(f'Saving votes, reports and ratings failed: {error}', file=sys.stderr)
 
 
-#### NOTIFICATION FUNCTIONS by KT and MTK ####
-@use_scope('ROOT', clear=True)
-def notification_feeds():
+def pending_count(table_name, row_id, column_name):
     """
-    This function will display the notifications feeds for the user.
-    Only council member and police users will be able to create and manage their notifications.
-    Council members will be able to see the name of council members who created council notifications / updates.
-    Police users will be able to see the name of police members who created police notifications.
+    Function to get the queued change of a counter, to be added to the value read from the database
+    :param table_name: name of the table
+    :param row_id: ID of the row
+    :param column_name: name of the counter column
+    :return: the change not yet saved, 0 if there is none
     """
-    clear()
-    global valid_user
+    key = (table_name, row_id, column_name)
+    with counter_writes_lock:
+        return counter_writes['deltas'].get(key, 0) + counter_writes['flushing_deltas'].get(key, 0)
 
-    generate_header()
-    generate_nav()
-    if valid_user is not None and valid_user.role_id == 4:  # if the user is valid and is a council staff
-        put_buttons([
-            {'label': 'Announce an Update', 'value': 'create', 'color': 'primary'},
-            {'label': 'My Announcements', 'value': 'manage', 'color': 'secondary'}
-        ], onclick=[council_create_update, council_manage_updates]).style('float:right; margin-top: 12px;')
-    elif valid_user is not None and valid_user.role_id == 3:  # if the user is valid and is a police staff
-        put_buttons([
-            {'label': 'Post a Notification', 'value': 'create', 'color': 'primary'},
-            {'label': 'My Notifications', 'value': 'manage', 'color': 'secondary'}
-        ], onclick=[police_create_notification, police_manage_notifications]).style('float:right; margin-top: 12px;')
-    put_html('<h2>Notifications</h2>')
 
-    with Session() as sesh:
-        notifications = sesh.query(Notification).order_by(Notification.id.desc()).filter_by(status="Active").all()
-        notificationCount = len(notifications)
-        if notificationCount == 0:
-            put_html('<p class="lead text-center">There is no notifications</p>')
-            return
-        for notification in notifications:
-            notificationDateTime = notification.date_time.strftime('%I:%M%p – %d %b, %Y')  # format the date
-            # if the user is a council staff, show the council badge or police badge for police staff
-            # police staff and council staff will see the names of the members who created the notifications from their own role
-            put_info(
-                put_html(f'''
-                <div class="card p-2">
-                    <div class="card-body p-2">
-                    <h4 class="card-title m-0">
-                    {notification.category}: {notification.title} 
-                    {f'<strong class="badge bg-primary text-light">Northumbria Police</strong>' if notification.by_role_id == 3 else f'<strong class="badge bg-info text-light">Gateshead Council</strong>'} 
-                    </h4>
-                    {f'<p class="mb-0">By Police Member: {get_username(notification.user_id)["display_name"]}</p>' if valid_user is not None and valid_user.role_id == 3 and notification.by_role_id == 3 else ''}
-                    {f'<p class="mb-0">By Council Member: {get_username(notification.user_id)["display_name"]}</p>' if valid_user is not None and valid_user.role_id == 4 and notification.by_role_id == 4 else ''}
-                    
-                    <p class="card-subtitle mb-2"><small>{notificationDateTime}</small>
-                    <p class="card-text">{notification.content}</p>
-                    </div>
-                </div>
-                '''), closable=True
-            ).style('margin-bottom: 10px;')
+def pending_rows(table_name, column_name, value):
+    """
+    Function to get the queued new rows of a table with a value in a column, to be added to the rows read from the
+    database
+    :param table_name: name of the table
+    :param column_name: name of the column to match
+    :param value: value of the column
+    :return: a list of dictionaries of column values
+    """
+    with counter_writes_lock:
+        return [values for row_table, values in counter_writes['flushing_rows'] + counter_writes['rows']
+                if row_table == table_name and values.get(column_name) == value]
 
 
-#### ACCESSIBILITY GUI FUNCTIONS by KT ####
-def change_appearance():
+#### DISPLAY PREFERENCE FUNCTIONS ####
+# The preferences of a user are read once when they log in and kept in the session (local.preferences), so pages
+# apply them without a query. Changes are made to the session straight away and queued for a background thread,
+# which writes them a moment later, so changing a preference never waits for the database.
+
+def read_preferences(user_id):
+    """
+    Function to read the display preferences of a user, with the defaults for anything they have not chosen
+    :param user_id: User ID of the user
+    :return: a dictionary of theme, font_scale, feed_page_size and collapse_comments
+    """
+    rows = read_rows(sa.select(UserPreference.theme, UserPreference.font_scale, UserPreference.feed_page_size,
+                               UserPreference.collapse_comments).where(UserPreference.user_id == user_id))
+    preferences = dict(DEFAULT_PREFERENCES)
+    if rows:
+        preferences.update({name: value for name, value in rows[0]._mapping.items() if value is not None})
+    return preferences
+
+
+def session_preferences():
     """
-    This function toggles between dark and light mode
-    by using the pywebio config function to change the theme.
+    Function to get the display preferences of the session, those of the logged in user or the defaults for guests
+    :return: a dictionary of theme, font_scale, feed_page_size and collapse_comments
+    """
+    if local.preferences is None:
+        local.preferences = dict(DEFAULT_PREFERENCES)
+    return local.preferences
+
+
+def set_preference(name, value):
+    """
+    Function to change a display preference of the session and queue it to be saved for the logged in user
+    :param name: name of the preference, a key of DEFAULT_PREFERENCES
+    :param value: new value of the preference
     :return:
     """
-    global appearance
-    appearance += 1
-    if appearance == 0:
-        config(theme='default')
-    elif appearance == 1:
-        config(theme='dark')
-    elif appearance == 2:
-        config(theme='sketchy')
-    else:
-        appearance = 0
-        config(theme='default')
-    run_js('window.location.reload()')
+    session_preferences()[name] = value
+    if local.user_id is not None:
+        with preference_writes_lock:
+            preference_writes.setdefault(local.user_id, {})[name] = value
+        preference_writes_ready.set()
+
+
+def write_preferences():
+    """
+    Function to save the queued preference changes, one upsert per user in one transaction.
+    If the transaction fails the changes are queued again, under any newer changes made meanwhile.
+    :return: the number of users whose preferences were saved
+    """
+    global preference_writes
+    with preference_writes_lock:
+        writes, preference_writes = preference_writes, {}
+    if not writes:
+        return 0
+    try:
+        with db.begin() as conn:
+            for user_id, values in writes.items():
+                conn.execute(sqlite_insert(UserPreference).values(user_id=user_id, **values)
+                             .on_conflict_do_update(index_elements=['user_id'], set_=values))
+    except SQLAlchemyError:
+        with preference_writes_lock:
+            for user_id, values in writes.items():
+                preference_writes[user_id] = {**values, **preference_writes.get(user_id, {})}
+        preference_writes_ready.set()
+        raise
+    return len(writes)
+
+
+def write_preferences_forever():
+    """
+    Function to write the preference changes in the background, PREFERENCE_WRITE_SECONDS after the first of them
+    :return:
+    """
+    while True:
+        preference_writes_ready.wait()
+        time.sleep(PREFERENCE_WRITE_SECONDS)  # changes made meanwhile go in the same write
+        preference_writes_ready.clear()
+        try:
+            write_preferences()
+        except SQLAlchemyError as error:
+            print(f'Saving preferences failed: {error}', file=sys.stderr)
 
 
-def smaller_font():
+def show_preferences():
     """
-    This function decreases the font size of the text on the page
-    by using the run_js function of pywebio.session module to run JavaScript code that decreases the font size.
+    Function to let a logged in user change the feed page size and whether comments are folded away.
+    The theme and the font size are changed with the buttons in the header.
     :return:
     """
-    global smaller_font_clicks, bigger_font_clicks
-    js_code = f'''
-        let allElements = document.querySelectorAll('p,h2,h3,h4,h5,h6,label,input,table');
-        allElements.forEach(function(element) {{
-            var style = window.getComputedStyle(element, null).getPropertyValue('font-size');
-            var currentSize = parseFloat(style);
-            if ({smaller_font_clicks} < 5) {{
-                element.style.fontSize = (currentSize - 1) + "px";
-            }} else {{
-                return;
+    preferences = session_preferences()
+    popup('Display Preferences', [
+        put_select('feed_page_size', label='Notifications shown in the feed',
+                   options=[{'label': str(size), 'value': size} for size in FEED_PAGE_SIZES],
+                   value=preferences['feed_page_size']),
+        put_checkbox('collapse_comments', options=[{'label': 'Fold away the comments of forum threads',
+                                                    'value': True}],
+                     value=[True] if preferences['collapse_comments'] else []),
+    ], closable=True)
+    pin_on_change('feed_page_size', onchange=partial(set_preference, 'feed_page_size'), clear=True)
+    pin_on_change('collapse_comments', onchange=lambda value: set_preference('collapse_comments', bool(value)),
+                  clear=True)
+
+
+#### ACCESSIBILITY GUI FUNCTIONS by KT ####
+def font_scale_css():
+    """
+    Function to write the CSS which sizes the page from the --gbb-font-scale variable on the root element.
+    Bootstrap sizes text in rem, so scaling the root font scales all of it, whatever the size of the page.
+    :return: the CSS code
+    """
+    return '''
+        html { font-size: calc(100% * var(--gbb-font-scale, 1)); }
+        body, .table, .form-control, .btn, .custom-select, .input-group-text { font-size: 1rem; }
+    '''
+
+
+def display_script(themes=THEMES):
+    """
+    Function to write the JavaScript which changes the theme and the font size in the browser, run once per session.
+    gbbSwitchTheme(theme) loads the PyWebIO theme stylesheet next to the current one and removes the old one once the
+    new one has loaded, so the page is never unstyled and does not need reloading. gbbCycleTheme() is what the Switch
+    Theme button calls to go to the next theme. gbbScaleFont(steps) sets the one CSS variable the font sizes derive
+    from, which stays on the root element when pages are rendered again.
+    Choices are kept in localStorage, applied again when a new session starts and told to the server through the
+    hidden 'theme_choice' and 'font_scale' pins.
+    :param themes: theme names in the order the Switch Theme button goes through them
+    :return: the JavaScript code
+    """
+    return f'''
+        if (!document.getElementById('gbb-font-scale')) {{
+            var style = document.createElement('style');
+            style.id = 'gbb-font-scale';
+            style.textContent = {json.dumps(font_scale_css())};
+            document.head.appendChild(style);
+        }}
+        window.gbbTellServer = function (name, value) {{
+            var input = document.querySelector('#pywebio-scope-' + name + ' input');
+            if (input) {{
+                input.value = value;
+                input.dispatchEvent(new Event('input'));
+            }}
+        }};
+        window.gbbThemes = {json.dumps(themes)};
+        window.gbbSwitchTheme = function (theme) {{
+            var useTheme = function () {{
+                document.body.className = document.body.className.replace(/webio-theme-[\\w-]+/, 'webio-theme-' + theme);
+            }};
+            var links = document.querySelectorAll('link[href*="css/bs-theme/"]');
+            var current = links[links.length - 1];
+            localStorage.setItem('gbb-theme', theme);
+            if (current.href.indexOf('bs-theme/' + theme + '.min.css') !== -1) {{
+                return useTheme();
             }}
-        }});
+            var next = current.cloneNode();
+            next.href = current.href.replace(/bs-theme\\/[\\w-]+\\.min\\.css/, 'bs-theme/' + theme + '.min.css');
+            next.onload = function () {{
+                document.querySelectorAll('link[href*="css/bs-theme/"]').forEach(function (link) {{
+                    if (link !== next) link.remove();
+                }});
+                useTheme();
+            }};
+            current.after(next);
+        }};
+        window.gbbCycleTheme = function () {{
+            var current = (document.body.className.match(/webio-theme-([\\w-]+)/) || [])[1];
+            var theme = gbbThemes[(gbbThemes.indexOf(current) + 1) % gbbThemes.length];
+            gbbSwitchTheme(theme);
+            gbbTellServer('theme_choice', theme);
+        }};
+        window.gbbSetFontScale = function (scale) {{
+            scale = Math.min({FONT_SCALE_MAX}, Math.max({FONT_SCALE_MIN}, scale));
+            document.documentElement.style.setProperty('--gbb-font-scale', scale);
+            localStorage.setItem('gbb-font-scale', scale);
+            return scale;
+        }};
+        window.gbbScaleFont = function (steps) {{
+            var current = parseFloat(localStorage.getItem('gbb-font-scale')) || 1;
+            gbbTellServer('font_scale', gbbSetFontScale(current + steps * {FONT_SCALE_STEP}));
+        }};
+        if (gbbThemes.indexOf(localStorage.getItem('gbb-theme')) !== -1) {{
+            gbbSwitchTheme(localStorage.getItem('gbb-theme'));
+        }}
+        if (localStorage.getItem('gbb-font-scale')) {{
+            gbbSetFontScale(parseFloat(localStorage.getItem('gbb-font-scale')) || 1);
+        }}
     '''
-    # allow the user to decrease the font size only 5 times smaller than the original size
-    if smaller_font_clicks < 5:
-        smaller_font_clicks += 1
-        bigger_font_clicks -= 1
-    run_js(js_code)
-    print(smaller_font_clicks, bigger_font_clicks)
-
-
-def bigger_font():
-    """
-    This function increases the font size of the text on the page
-    by using the run_js function of pywebio.session module to run JavaScript code that increases the font size.
-    """
-    global smaller_font_clicks, bigger_font_clicks
-    js_code = f'''
-            let allElements = document.querySelectorAll('p, h2, h3, h4, h5, h6,label,input,table');
-            allElements.forEach(function(element) {{
-                var style = window.getComputedStyle(element, null).getPropertyValue('font-size');
-                var currentSize = parseFloat(style);
-                if ({bigger_font_clicks} < 6) {{
-                    element.style.fontSize = (currentSize + 1) + "px";
-                }} else {{
-                    return;
-                }}
-            }});
-        '''
-    # allow the user to increase the font size only 6 times bigger than the original size
-    if bigger_font_clicks < 6:
-        bigger_font_clicks += 1
-        smaller_font_clicks -= 1
-    run_js(js_code)
-    print(smaller_font_clicks, bigger_font_clicks)
+
+
+def change_appearance(theme):
+    """
+    Function to remember the theme the user switched to in the browser, for the session and the user.
+    The switch itself happens in the browser without a reload (see display_script), so this is not on the way of it.
+    :param theme: name of the theme, one of THEMES
+    :return:
+    """
+    if theme in THEMES:
+        set_preference('theme', theme)
+
+
+def change_font_scale(scale):
+    """
+    Function to remember the font scale the user set in the browser, for the session and the user.
+    :param scale: font scale as sent by the browser
+    :return:
+    """
+    try:
+        set_preference('font_scale', min(FONT_SCALE_MAX, max(FONT_SCALE_MIN, float(scale))))
+    except ValueError:
+        pass
 
 
 #### GENERATIVE HEADERS AND NAVIGATIONS FUNCTIONS by KT ####
@@ -1961,14 +6324,27 @@ def generate_header():
     This function generates the header of the page.
     The function can be used to structure a consistent header for every page.
     """
-    global smaller_font_clicks, bigger_font_clicks
-    smaller_font_clicks, bigger_font_clicks = 0, 0  # initialise the font size click counters
-    put_buttons([
-        {'label': 'Aa+', 'value': 'bigger', 'color': 'primary'},
-        {'label': 'Aa-', 'value': 'smaller', 'color': 'info'},
-        {'label': 'Switch Theme', 'value': 'switch_theme', 'color': 'dark'}
-    ], onclick=[bigger_font, smaller_font, change_appearance], group=True).style(
-        'float:right')
+    local.chat_listener = None  # a crime report conversation left open stops listening for new messages
+    listen_for_announcements()
+    if local.display_script_loaded is None:  # the display functions stay on the page for the whole session
+        run_js(display_script())
+        local.display_script_loaded = True
+    if local.preferences_applied is False:  # once after logging in, from the preferences read at login
+        preferences = session_preferences()
+        run_js(f"gbbSwitchTheme({json.dumps(preferences['theme'])}); gbbSetFontScale({preferences['font_scale']});")
+        local.preferences_applied = True
+    # the font size and the theme are changed by the browser alone, the server only hears about them through pins
+    put_html('''
+        <div class="btn-group" role="group">
+        <button class="btn btn-primary" onclick="gbbScaleFont(1)">Aa+</button>
+        <button class="btn btn-info" onclick="gbbScaleFont(-1)">Aa-</button>
+        <button class="btn btn-dark" onclick="gbbCycleTheme()">Switch Theme</button>
+        </div>
+        ''').style('float:right')
+    put_scope('theme_choice', put_input('theme_choice')).style('display:none;')
+    put_scope('font_scale', put_input('font_scale')).style('display:none;')
+    pin_on_change('theme_choice', onchange=change_appearance, clear=True)
+    pin_on_change('font_scale', onchange=change_font_scale, clear=True)
     put_html(f'''
         <h1>
         Welcome to Gateshead By Bike
@@ -1991,8 +6367,9 @@ def generate_nav():
         put_html(f'<p class="lead">Hello, <span class="font-weight-bold">Guest User</span></p>').style('float:right;')
     else:  # if the user is logged in (all registered users)
         put_buttons([
+            {'label': 'Preferences', 'value': 'preferences', 'color': 'secondary'},
             {'label': 'Logout', 'value': 'login', 'color': 'danger'},
-        ], onclick=[user_logout]).style("float:right; margin-left:20px;")
+        ], onclick=[show_preferences, user_logout]).style("float:right; margin-left:20px;")
         put_html(
             f'''
             <p class="lead mb-n2">Hello, <span class="font-weight-bold">{valid_user.display_name}</span></p>
@@ -2044,10 +6421,86 @@ Edit the functions as needed, but do not change the function names unless necess
 
 
 # KYI SIN LIN LATT'S IMPLEMENTATION STARTS HERE
+@use_scope('ROOT', clear=True)
 def respond_chat(crime_id):
+    """
+    This function displays the conversation on a crime report between police staff and the power user who made it.
+    New messages appear straight away while the conversation is open, and earlier messages are loaded on request.
+    :param crime_id: The ID of the crime report.
+    """
     clear()
-    scroll_to('ROOT', position='top')
-    put_html('<p class="lead center">This part can be found in Kyi Sin Lin Latt\'s Individual Implementation Code.</p>')
+    global valid_user
+
+    generate_header()
+    generate_nav()
+    put_buttons([
+        {'label': 'Back to Report', 'value': 'view_crime', 'color': 'secondary'}
+    ], onclick=[partial(view_crime, crime_id)]).style('float:right; margin-top: 12px;')
+
+    crime = read_rows(sa.select(CrimeReport.title, CrimeReport.user_id).where(CrimeReport.id == crime_id))
+    if valid_user is None or not crime or (get_role_id() != 3 and crime[0].user_id != valid_user.id):
+        toast('Only police staff and the reporter can see the messages of a crime report', color='warning')
+        crime_report_feeds()
+        return
+    put_html(f'<h2>Messages: {crime[0].title}</h2>')
+    user_id = valid_user.id
+
+    def load_earlier(before):  # function to show the page of messages before the earliest one shown
+        messages = read_crime_messages(crime_id, before)
+        with use_scope('chat_messages'):
+            for message in reversed(messages):
+                put_crime_message(message, user_id, position=OutputPosition.TOP)
+        put_earlier_button(messages)
+
+    def put_earlier_button(messages):  # function to offer the earlier messages while a full page was read
+        with use_scope('chat_earlier', clear=True):
+            if len(messages) == CHAT_PAGE_SIZE:
+                put_buttons([{'label': 'Load earlier messages', 'value': 'earlier', 'color': 'secondary'}],
+                            onclick=[partial(load_earlier, messages[0].id)], small=True)
+
+    def send():  # function to send the message typed, it is shown when it comes back from the listener
+        content = (pin.chat_message or '').strip()
+        if content:
+            send_crime_message(crime_id, user_id, content)
+            pin.chat_message = ''
+
+    def push_messages():  # function run in a thread of the session, showing new messages until the page changes
+        try:
+            while local.chat_listener is listener:
+                try:
+                    message = listener.get(timeout=CHAT_CHECK_SECONDS)
+                except queue.Empty:
+                    continue
+                if message is None:  # the browser was closed
+                    break
+                if message.id > shown_id and local.chat_listener is listener:  # not already read with the history
+                    with use_scope('chat_messages'):
+                        put_crime_message(message, user_id)
+                    mark_messages_read(crime_id, user_id, message.id)
+        except SessionException:  # the browser was closed while a message was shown
+            pass
+        finally:
+            unsubscribe_from_chat(crime_id, listener)
+
+    # listening starts before the history is read, so no message is missed in between
+    listener = subscribe_to_chat(crime_id)
+    local.chat_listener = listener  # generate_header() clears it when another page is shown
+    defer_call(partial(listener.put, None))
+    messages = read_crime_messages(crime_id)
+    shown_id = messages[-1].id if messages else 0
+    put_scope('chat_earlier')
+    put_scope('chat_messages')
+    put_earlier_button(messages)
+    if messages:
+        with use_scope('chat_messages'):
+            for message in messages:
+                put_crime_message(message, user_id)
+        mark_messages_read(crime_id, user_id, messages[-1].id)
+    put_textarea('chat_message', rows=2, placeholder='Write a message')
+    put_buttons([{'label': 'Send', 'value': 'send', 'color': 'primary'}], onclick=[send], small=True)
+    pusher = threading.Thread(target=push_messages, daemon=True)
+    register_thread(pusher)
+    pusher.start()
 
 
 # all other code of KS should be placed here
@@ -2073,9 +6526,12 @@ def police_create_notification(pre_data=None):
                                                 category=notification_data['category'].strip(),
                                                 content=notification_data['content'].strip(),
                                                 date_time=datetime.now(), by_role_id=3,
-                                                status=notification_data['status'])
+                                                status=notification_data['status'],
+                                                location=notification_data['location'] or None)
                 sesh.add(new_notification)
                 sesh.commit()
+                deliver_to_subscribers(new_notification.location, new_notification.category,
+                                       new_notification.date_time, notification_id=new_notification.id)
         except SQLAlchemyError:
             toast('An error occurred', color='error')
         else:
@@ -2113,6 +6569,8 @@ def police_create_notification(pre_data=None):
         input('', name='other', required=False, hidden=True, placeholder='Please specify',
               validate=lambda c: f'No more then 30 characters. {len(c.strip())}/30' if len(c.strip()) > 30 else None,
               value=pre_data["category"] if pre_data is not None and pre_data['other'] is not None else None),
+        location_input('Location (optional, for alerts about one location)', required=False,
+                       value=pre_data["location"] if pre_data is not None else None),
         textarea('Content', name='content', required=True, wrap='hard', rows=5,
                  value=pre_data["content"] if pre_data is not None else ""),
         select('Status', ['Active', 'Archived'], name='status', required=True,
@@ -2237,7 +6695,7 @@ def police_manage_notifications():
     put_html('<h2>My Notification</h2>')
 
     notification_table_data = []  # initialise the notification table data
-    with Session() as sesh:
+    with ReadSession() as sesh:
         notifications = sesh.query(Notification).order_by(Notification.id.desc()).filter_by(user_id=valid_user.id).all()
         notificationCount = len(notifications)
         if notificationCount == 0:  # if there is no notification
@@ -2278,15 +6736,151 @@ def police_manage_notifications():
 # MYAT THIRI KHANT'S IMPLEMENTATION STARTS HERE
 
 def council_create_update():
+    """
+    Function to allow council staff to announce updates, straight away or scheduled to be published later,
+    and optionally to expire at a given time
+    :return:
+    """
     clear()
-    scroll_to('ROOT', position='top')
-    put_html('<p class="lead center">This part can be found in Myat Thiri Khant\'s Individual Implementation Code.</p>')
+    global valid_user
+    if valid_user is None or valid_user.role_id != 4:  # if the user is not a council staff
+        toast('You do not have permission to announce updates', color='warning')
+        main()
+        return
+
+    generate_header()
+    generate_nav()
+    put_html('<h2>Announce an Update</h2>')
+
+    def parse_datetime_local(value):  # the datetime-local input gives e.g. '2024-05-27T09:30', or '' when empty
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M') if value else None
+
+    def validate_schedule(data):  # function to check the expiry comes after the publishing time
+        publish_at = parse_datetime_local(data['publish_at']) or datetime.now()
+        expire_at = parse_datetime_local(data['expire_at'])
+        if expire_at is not None and expire_at <= publish_at:
+            return 'expire_at', 'The update must expire after it is published'
+
+    update_data = input_group('Announce an Update', [
+        input('Title', name='title', required=True, maxlength=50,
+              validate=lambda c: 'Must be between 4 and 50 characters' if not 4 <= len(c.strip()) <= 50 else None),
+        select('Category', COUNCIL_UPDATE_CATEGORIES, name='category', required=True),
+        location_input('Location (optional, for updates about one location)', required=False),
+        textarea('Content', name='content', required=True, wrap='hard', rows=5),
+        input('Publish at', type=DATETIME_LOCAL, name='publish_at',
+              help_text='Leave empty to publish straight away'),
+        input('Expire at', type=DATETIME_LOCAL, name='expire_at',
+              help_text='Leave empty to keep the update until you archive it'),
+        actions('', [
+            {'label': 'Announce', 'value': 'announce', 'type': 'submit'},
+            {'label': 'Cancel', 'value': 'cancel', 'type': 'cancel', 'color': 'warning'}
+        ], name='update_actions')
+    ], validate=validate_schedule, cancelable=True)
+
+    if update_data is None or update_data['update_actions'] == 'cancel':
+        notification_feeds()
+        return
+    publish_at = parse_datetime_local(update_data['publish_at'])
+    expire_at = parse_datetime_local(update_data['expire_at'])
+    is_scheduled = publish_at is not None and publish_at > datetime.now()
+    try:
+        with Session() as sesh:
+            new_update = Notification(user_id=valid_user.id, by_role_id=4, title=update_data['title'].strip(),
+                                      category=update_data['category'], content=update_data['content'].strip(),
+                                      location=update_data['location'] or None,
+                                      date_time=publish_at if is_scheduled else datetime.now(),
+                                      status='Scheduled' if is_scheduled else 'Active',
+                                      publish_at=publish_at if is_scheduled else None, expire_at=expire_at)
+            sesh.add(new_update)
+            sesh.commit()
+            if not is_scheduled:
+                deliver_to_subscribers(new_update.location, new_update.category, new_update.date_time,
+                                       notification_id=new_update.id)
+            schedule_announcement(new_update.id, new_update.publish_at, expire_at)
+    except SQLAlchemyError:
+        toast('An error occurred', color='error')
+    else:
+        toast(f'Update scheduled for {publish_at:%I:%M%p – %d %b, %Y}' if is_scheduled else 'Update announced',
+              color='success')
+    council_manage_updates()
 
 
 def council_manage_updates():
+    """
+    Function to allow council staff to see their updates with their schedules, and to archive, restore or delete them
+    :return:
+    """
     clear()
-    scroll_to('ROOT', position='top')
-    put_html('<p class="lead center">This part can be found in Myat Thiri Khant\'s Individual Implementation Code.</p>')
+    global valid_user
+    if valid_user is None or valid_user.role_id != 4:  # if the user is not a council staff
+        toast('You do not have permission to manage updates', color='warning')
+        main()
+        return
+
+    def change_update_status(notification_id, status):  # function to archive an update, or to restore an archived one
+        with Session() as sesh:
+            selected_update = sesh.query(Notification).filter_by(id=notification_id, user_id=valid_user.id).first()
+            if selected_update is None:
+                toast('This update no longer exists', color='warning')
+                council_manage_updates()
+                return
+            if status == 'Archived':
+                selected_update.status = 'Archived'
+            elif selected_update.publish_at is not None:
+                # archived before it was published, so the scheduler publishes and delivers it, straight away if its
+                # publishing time has passed
+                selected_update.status = 'Scheduled'
+            else:
+                selected_update.status = 'Active'
+            sesh.commit()
+            schedule_announcement(selected_update.id, selected_update.publish_at
+                                  if selected_update.status == 'Scheduled' else None, selected_update.expire_at)
+            toast(f'Update status has been changed to "{selected_update.status}"', color='success')
+        council_manage_updates()
+
+    def delete_update(notification_id):  # function to delete an update
+        with Session() as sesh:
+            sesh.query(FeedItem).filter_by(notification_id=notification_id).delete()
+            sesh.query(Notification).filter_by(id=notification_id, user_id=valid_user.id).delete()
+            sesh.commit()
+        toast('Update deleted', color='success')
+        council_manage_updates()
+
+    generate_header()
+    generate_nav()
+    put_button('Announce an Update', onclick=council_create_update).style('float:right; margin-top: 12px;')
+    put_html('<h2>My Announcements</h2>')
+
+    updates = read_rows(sa.select(Notification.id, Notification.category, Notification.title, Notification.date_time,
+                                  Notification.expire_at, Notification.status)
+                        .where(Notification.user_id == valid_user.id)
+                        .order_by(Notification.id.desc()))
+    if len(updates) == 0:
+        put_html('<p class="lead text-center">You have not announced any updates</p>')
+        return
+    now = datetime.now()
+    update_table_data = []
+    for update in updates:
+        updateButtons = [{'label': 'Delete', 'value': 'delete', 'color': 'danger'}]
+        updateActions = [partial(delete_update, update.id)]
+        if update.status in ['Active', 'Scheduled']:
+            updateButtons.insert(0, {'label': 'Archive', 'value': 'Archived', 'color': 'info'})
+            updateActions.insert(0, partial(change_update_status, update.id, 'Archived'))
+        elif update.status == 'Archived' and (update.expire_at is None or update.expire_at > now):
+            # expired updates are not restored, they would only expire again straight away
+            updateButtons.insert(0, {'label': 'Restore', 'value': 'Active', 'color': 'info'})
+            updateActions.insert(0, partial(change_update_status, update.id, 'Active'))
+        update_table_data.append([
+            update.id,
+            update.category,
+            update.title,
+            update.date_time.strftime('%I:%M%p – %d %b, %Y'),
+            update.expire_at.strftime('%I:%M%p – %d %b, %Y') if update.expire_at else '',
+            update.status,
+            put_buttons(updateButtons, onclick=updateActions).style(
+                "display: flex; justify-content: start; gap: 5px; flex-direction: column;")
+        ])
+    put_table(update_table_data, header=['Ref ID', 'Category', 'Title', 'Publish at', 'Expire at', 'Status', 'Action'])
 
 
 # all other code of MTK code should be placed here
@@ -2307,5 +6901,227 @@ def main():
     post_feeds()
 
 
+#### COMMAND LINE FUNCTIONS ####
+# Maintenance tasks can be run from the command line, e.g. "python main.py export crime_reports --format ndjson".
+# Running main.py without a command starts the web server as before.
+
+def cli_export(args):
+    """
+    Function to run an export from the command line
+    :param args: parsed command line arguments
+    :return:
+    """
+    if args.output == '-':
+        rowCount = write_export(args.table, sys.stdout, args.format, args.date_from, args.date_to, args.location)
+    else:
+        with open(args.output, 'w', newline='', encoding='utf-8') as export_file:
+            rowCount = write_export(args.table, export_file, args.format, args.date_from, args.date_to, args.location)
+    print(f'{rowCount} rows exported', file=sys.stderr)  # stderr, so the count is not mixed into exports to stdout
+
+
+def cli_snapshot(args):
+    """
+    Function to run the analytics snapshot from the command line
+    :param args: parsed command line arguments
+    :return:
+    """
+    for table_name, rowCount in run_snapshot(args.tables or None).items():
+        print(f'{table_name}: {rowCount} new rows')
+
+
+def cli_import_locations(args):
+    """
+    Function to import parking sites from a GeoJSON file on the command line
+    :param args: parsed command line arguments
+    :return:
+    """
+    with open(args.path, encoding='utf-8') as geojson_file:
+        importedCount, skippedCount = import_geojson_locations(geojson_file, args.id_property, args.name_property,
+                                                               args.capacity_property)
+    print(f'{importedCount} parking sites imported, {skippedCount} features skipped')
+
+
+def cli_analytics(args):
+    """
+    Function to print an analytics report computed from the snapshots
+    :param args: parsed command line arguments
+    :return:
+    """
+    print(ANALYTICS_REPORTS[args.report](args.months or None).to_string())
+
+
+def cli_simulate_occupancy(args):
+    """
+    Function to simulate the parking counters of sites, sending readings to the UDP occupancy endpoint
+    :param args: parsed command line arguments
+    :return:
+    """
+    location_ids = [row.id for row in read_rows(sa.select(Location.id).order_by(Location.id).limit(args.sites))]
+    if not location_ids:
+        raise ValueError('There are no locations to simulate')
+    rng = np.random.default_rng()
+    capacities = rng.integers(5, 60, len(location_ids))
+    occupied = rng.integers(0, capacities + 1)
+    sentCount = 0
+    start = time.perf_counter()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_socket:
+        while time.perf_counter() - start < args.seconds:
+            # each site's occupancy drifts by a bike or two, and each datagram carries a batch of readings
+            sites = rng.integers(0, len(location_ids), args.batch)
+            occupied[sites] = np.clip(occupied[sites] + rng.integers(-2, 3, args.batch), 0, capacities[sites])
+            udp_socket.sendto('\n'.join(f'{location_ids[site]},{occupied[site]},{capacities[site]}'
+                                         for site in sites).encode(), (OCCUPANCY_HOST, OCCUPANCY_UDP_PORT))
+            sentCount += args.batch
+            # sleeps while ahead of the requested rate
+            time.sleep(max(0.0, sentCount / args.rate - (time.perf_counter() - start)))
+    print(f'{sentCount} readings sent at {sentCount / (time.perf_counter() - start):.0f} readings/s')
+
+
+def cli_digest(args):
+    """
+    Function to send the email digests from the command line, carrying on with the last run if it did not finish
+    :param args: parsed command line arguments
+    :return:
+    """
+    until, sentCount = run_digests()
+    print(f'{sentCount} digests sent for the period up to {until:%Y-%m-%d %H:%M}')
+
+
+def cli_archive(args):
+    """
+    Function to archive the closed crime reports and the inactive threads from the command line
+    :param args: parsed command line arguments
+    :return:
+    """
+    archived, before, after = run_archival(timedelta(days=args.thread_age_days), args.batch)
+    print(f'archived {archived["crime_reports"]} closed crime reports, {archived["threads"]} threads and '
+          f'{archived["comments"]} comments')
+    print(f'{"hot table":<16} {"rows before":>12} {"rows after":>12} {"KiB before":>12} {"KiB after":>12}')
+    for table_name in before:
+        print(f'{table_name:<16} {before[table_name]["rows"]:>12} {after[table_name]["rows"]:>12} '
+              f'{before[table_name]["bytes"] / 1024:>12.0f} {after[table_name]["bytes"] / 1024:>12.0f}')
+
+
+def cli_backup(args):
+    """
+    Function to back up the database from the command line, or list the backups kept
+    :param args: parsed command line arguments
+    :return:
+    """
+    if not args.list:
+        backup = run_backup(args.pages, args.sleep_ms / 1000)
+        print(f'{backup["path"]}: {backup["pages"]} pages ({backup["bytes"] / 1024 / 1024:.1f} MiB) copied in '
+              f'{backup["steps"]} steps in {backup["seconds"]:.2f} s, integrity check ok')
+        for backup_path in backup['pruned']:
+            print(f'deleted {backup_path}')
+    for taken_at, backup_path in list_backups():
+        print(f'{taken_at:%Y-%m-%d %H:%M:%S}  {os.path.getsize(backup_path) / 1024 / 1024:>8.1f} MiB  {backup_path}')
+
+
+def cli_jobs(args):
+    """
+    Function to print the background jobs with their leases and how their runs have gone, across all processes
+    :param args: parsed command line arguments
+    :return:
+    """
+    jobRows = read_rows(sa.select(BackgroundJob.__table__).order_by(BackgroundJob.name))
+    print(f'{"job":<22} {"next run":<20} {"running in":<28} {"last run":<10} {"seconds":>9} {"runs":>7} {"failed":>7}')
+    for job in jobRows:
+        print(f'{job.name:<22} {f"{job.next_run_at:%Y-%m-%d %H:%M:%S}" if job.next_run_at else "-":<20} '
+              f'{job.lease_owner or "-":<28} {job.last_status or "-":<10} '
+              f'{f"{job.last_duration:.2f}" if job.last_duration is not None else "-":>9} '
+              f'{job.run_count:>7} {job.failure_count:>7}')
+        if job.last_status == 'Failed':
+            print(f'    last error: {job.last_error}')
+
+
+def build_cli_parser():
+    """
+    Function to define the command line commands and their options
+    :return: an argparse parser, each command sets the function to run as "handler"
+    """
+    parser = argparse.ArgumentParser(prog='main.py', description='Gateshead By Bike maintenance commands. '
+                                                                 'Run without a command to start the web server.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='stream a table to CSV or NDJSON')
+    export_parser.add_argument('table', choices=list(EXPORT_TABLES))
+    export_parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    export_parser.add_argument('--from', dest='date_from', metavar='YYYY-MM-DD', help='earliest date to export')
+    export_parser.add_argument('--to', dest='date_to', metavar='YYYY-MM-DD', help='latest date to export (inclusive)')
+    export_parser.add_argument('--location', help='only export rows at this location (crime_reports and posts)')
+    export_parser.add_argument('--output', default='-', help='file to write to, default is "-" for stdout')
+    export_parser.set_defaults(handler=cli_export)
+
+    snapshot_parser = commands.add_parser('snapshot', help='append new rows to the Parquet analytics snapshots')
+    snapshot_parser.add_argument('tables', nargs='*', metavar='table',
+                                 help=f'tables to snapshot ({", ".join(SNAPSHOT_TABLES)}), default is all of them')
+    snapshot_parser.set_defaults(handler=cli_snapshot)
+
+    analytics_parser = commands.add_parser('analytics', help='print a report computed from the snapshots')
+    analytics_parser.add_argument('report', choices=list(ANALYTICS_REPORTS))
+    analytics_parser.add_argument('--month', dest='months', action='append', metavar='YYYY-MM',
+                                  help='only include this month, can be given more than once')
+    analytics_parser.set_defaults(handler=cli_analytics)
+
+    import_parser = commands.add_parser('import-locations', help='import parking sites from a GeoJSON file')
+    import_parser.add_argument('path', help='GeoJSON FeatureCollection file')
+    import_parser.add_argument('--id-property', default='id', help='property holding the site ID')
+    import_parser.add_argument('--name-property', default='name', help='property holding the site name')
+    import_parser.add_argument('--capacity-property', default='capacity', help='property holding the capacity')
+    import_parser.set_defaults(handler=cli_import_locations)
+
+    simulate_parser = commands.add_parser('simulate-occupancy',
+                                          help='send simulated parking counter readings to the running server')
+    simulate_parser.add_argument('--sites', type=int, default=100, help='number of locations to simulate')
+    simulate_parser.add_argument('--rate', type=int, default=1000, help='readings sent per second')
+    simulate_parser.add_argument('--seconds', type=float, default=10, help='how long to run for')
+    simulate_parser.add_argument('--batch', type=int, default=50, help='readings sent in each UDP datagram')
+    simulate_parser.set_defaults(handler=cli_simulate_occupancy)
+
+    digest_parser = commands.add_parser('digest', help=f'send the email digests through the SMTP server at '
+                                                       f'{DIGEST_SMTP_HOST}:{DIGEST_SMTP_PORT}')
+    digest_parser.set_defaults(handler=cli_digest)
+
+    archive_parser = commands.add_parser('archive', help='move closed crime reports and inactive threads to the '
+                                                         'archive tables')
+    archive_parser.add_argument('--thread-age-days', type=int, default=ARCHIVE_THREAD_AGE.days,
+                                help='days a thread has to go without new comments to be archived')
+    archive_parser.add_argument('--batch', type=int, default=ARCHIVE_BATCH_SIZE, help='rows moved in one transaction')
+    archive_parser.set_defaults(handler=cli_archive)
+
+    backup_parser = commands.add_parser('backup', help=f'back up the database to {BACKUP_DIRECTORY}/ while the '
+                                                       f'server runs, and check the copy')
+    backup_parser.add_argument('--pages', type=int, default=BACKUP_PAGES_PER_STEP, help='pages copied in each step')
+    backup_parser.add_argument('--sleep-ms', type=float, default=BACKUP_STEP_SECONDS * 1000,
+                               help='pause between steps, in milliseconds')
+    backup_parser.add_argument('--list', action='store_true', help='only list the backups kept')
+    backup_parser.set_defaults(handler=cli_backup)
+
+    jobs_parser = commands.add_parser('jobs', help='show the background jobs and how their runs have gone')
+    jobs_parser.set_defaults(handler=cli_jobs)
+    return parser
+
+
+def run_cli(argv):
+    """
+    Function to run a command line command
+    :param argv: command line arguments after the script name
+    :return:
+    """
+    args = build_cli_parser().parse_args(argv)
+    try:
+        args.handler(args)
+    except ValueError as ve:
+        sys.exit(f'Error: {ve}')
+
+
 if __name__ == '__main__':
-    start_server(main, port=3000, host='localhost', debug=True)
+    if len(sys.argv) > 1:
+        run_cli(sys.argv[1:])
+    else:
+        start_background_threads()
+        try:
+            start_server(main, port=3000, host='localhost', debug=True)
+        finally:
+            stop_background_threads()